@@ -0,0 +1,401 @@
+"""
+Load driver for the assistant (main.py or async_main.py).
+
+Simulates many agents talking at the same time. Each agent opens the page
+(getting its own session cookie) and replays a conversation the way
+script.js does with the Web Speech API: interim results grow word by word,
+an analysis is requested once the interim text is stable for a second, and
+every finalized utterance is appended and analyzed. Questions and a final
+summary are sent too. With --mode ws the agents use the /ws session channel
+instead of the HTTP endpoints.
+
+Reports p50/p95/p99 latency and errors per route, throughput, upstream calls
+per session-minute (read from the mock OpenAI server) and memory per session,
+and can compare the run with a previous JSON report.
+
+Run with: python benchmarks/load_test.py --agents 100 --duration 120 --output run.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+from collections import defaultdict
+from typing import Any, Dict, List, Optional
+
+import aiohttp
+
+# Frases de una llamada comercial típica, con las que se generan las conversaciones
+UTTERANCES = [
+    "buenos días le llamo de parte de la compañía para informarle de una nueva oferta",
+    "sí dígame de qué se trata porque ahora mismo tengo un poco de prisa",
+    "es una tarifa de fibra y móvil con un descuento durante el primer año",
+    "ya tengo fibra con otra compañía y la verdad es que estoy bastante contento",
+    "entiendo perfectamente y cuánto está pagando ahora mismo al mes",
+    "unos cuarenta y cinco euros más o menos con dos líneas de móvil",
+    "con nosotros serían treinta y dos euros con las dos líneas y más velocidad",
+    "y eso tiene permanencia porque no quiero quedarme atado otra vez",
+    "la permanencia es de doce meses pero el router y la instalación son gratis",
+    "no sé tendría que hablarlo con mi mujer antes de decidir nada",
+    "por supuesto si quiere le envío la oferta por correo y le llamo mañana",
+    "vale mándemela y ya lo miramos con calma esta tarde",
+    "me confirma su dirección de correo electrónico por favor",
+    "y qué pasa si me cambio y luego no me funciona bien el servicio",
+    "tiene catorce días para cancelar sin coste y soporte técnico las veinticuatro horas",
+    "la última vez que cambié de compañía estuve una semana sin internet",
+    "lo entiendo la portabilidad se hace sin cortes y le avisamos de cada paso",
+]
+
+QUESTIONS = [
+    "¿Qué descuentos puedo ofrecer a un cliente que ya tiene fibra?",
+    "¿Cómo respondo si el cliente dice que la permanencia es demasiado larga?",
+    "¿Cuánto tarda normalmente una portabilidad de fibra?",
+]
+
+
+class Recorder:
+    """Latencies and outcomes of the requests of a run, per route."""
+
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Dict[str, int] = defaultdict(int)
+        self.superseded: Dict[str, int] = defaultdict(int)
+
+    def record(self, route: str, seconds: float, ok: bool, superseded: bool = False) -> None:
+        self.latencies[route].append(seconds)
+        if superseded:
+            self.superseded[route] += 1
+        elif not ok:
+            self.errors[route] += 1
+
+    def report(self, elapsed: float) -> Dict[str, Any]:
+        routes = {}
+        for route, values in sorted(self.latencies.items()):
+            values = sorted(values)
+            routes[route] = {
+                'requests': len(values),
+                'errors': self.errors[route],
+                'superseded': self.superseded[route],
+                'throughput': len(values) / elapsed if elapsed else 0.0,
+                'p50_ms': percentile(values, 50) * 1000,
+                'p95_ms': percentile(values, 95) * 1000,
+                'p99_ms': percentile(values, 99) * 1000,
+                'max_ms': values[-1] * 1000,
+            }
+        return routes
+
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, -(-len(sorted_values) * pct // 100))
+    return sorted_values[int(rank) - 1]
+
+
+class Agent:
+    """One simulated agent: a browser session replaying a conversation."""
+
+    def __init__(self, index: int, args: argparse.Namespace, recorder: Recorder, deadline: float):
+        self.index = index
+        self.args = args
+        self.recorder = recorder
+        self.deadline = deadline
+        self.rng = random.Random(args.seed * 100003 + index)
+        self.seq = 0
+        self.pending_analysis: Optional[asyncio.Task] = None
+        self.requests: List[asyncio.Task] = []
+        self.channel = None
+        self.last_change = 0.0
+        self.summary_sent = 0.0
+
+    async def run(self) -> None:
+        # Cookies por agente; unsafe=True acepta cookies de direcciones IP como 127.0.0.1
+        jar = aiohttp.CookieJar(unsafe=True)
+        timeout = aiohttp.ClientTimeout(total=self.args.request_timeout)
+        async with aiohttp.ClientSession(self.args.base_url, cookie_jar=jar, timeout=timeout) as http:
+            self.http = http
+            self.summary_received = asyncio.Event()
+            if not await self._call('GET', '/', route='page'):
+                return
+            if self.args.mode == 'ws':
+                self.channel = await http.ws_connect('/ws')
+                await self.channel.send_json({'type': 'language', 'language': self.args.language})
+                listener = asyncio.ensure_future(self._listen())
+
+            next_question = time.time() + self._question_delay()
+            while time.time() < self.deadline:
+                await self._speak(self.rng.choice(UTTERANCES))
+                if time.time() >= next_question:
+                    self._spawn(self._call('POST', '/ask-question', {'question': self.rng.choice(QUESTIONS)}))
+                    next_question = time.time() + self._question_delay()
+                # Pausa entre turnos de palabra
+                await asyncio.sleep(self.rng.uniform(*self.args.turn_pause))
+
+            if self.pending_analysis:
+                self.pending_analysis.cancel()
+            if self.args.summary:
+                if self.channel is not None:
+                    self.summary_sent = time.time()
+                    await self.channel.send_json({'type': 'summary'})
+                else:
+                    self._spawn(self._call('POST', '/generate-summary', {}))
+            await asyncio.gather(*self.requests, return_exceptions=True)
+
+            if self.channel is not None:
+                # Esperar el resumen antes de cerrar el canal
+                if self.args.summary:
+                    try:
+                        await asyncio.wait_for(self.summary_received.wait(), self.args.request_timeout)
+                    except asyncio.TimeoutError:
+                        self.recorder.record('ws:summary', time.time() - self.summary_sent, False)
+                await self.channel.close()
+                listener.cancel()
+
+    async def _speak(self, utterance: str) -> None:
+        """Emit interim results word by word, then the final result (like recognition.onresult)."""
+        words = utterance.split()
+        for i in range(1, len(words) + 1):
+            await asyncio.sleep(self.rng.expovariate(self.args.words_per_second))
+            if self.rng.random() < self.args.hesitation:
+                # Titubeo: el texto provisional deja de cambiar y salta el debounce
+                await asyncio.sleep(self.rng.uniform(1.0, 2.5))
+            self._interim(' '.join(words[:i]))
+        self._final(utterance)
+
+    def _interim(self, text: str) -> None:
+        if self.channel is not None:
+            self.last_change = time.time()
+            self._spawn(self.channel.send_json({'type': 'interim', 'text': text}))
+            return
+        if self.pending_analysis:
+            self.pending_analysis.cancel()
+        self.pending_analysis = asyncio.ensure_future(self._debounced_analysis(text))
+
+    def _final(self, text: str) -> None:
+        seq, reset = self.seq, self.seq == 0
+        self.seq += 1
+        if self.channel is not None:
+            self.last_change = time.time()
+            self._spawn(self.channel.send_json({'type': 'segment', 'seq': seq, 'text': text, 'reset': reset}))
+            return
+        if self.pending_analysis:
+            self.pending_analysis.cancel()
+            self.pending_analysis = None
+        self._spawn(self._append_and_analyze(seq, text, reset))
+
+    async def _debounced_analysis(self, interim: str) -> None:
+        await asyncio.sleep(self.args.debounce)
+        self._spawn(self._call('POST', '/analyze-conversation', {'interim': interim, 'language': self.args.language}))
+
+    async def _append_and_analyze(self, seq: int, text: str, reset: bool) -> None:
+        await self._call('POST', '/append-transcript', {'segments': [{'seq': seq, 'text': text}], 'reset': reset})
+        await self._call('POST', '/analyze-conversation', {'interim': '', 'language': self.args.language})
+
+    async def _listen(self) -> None:
+        """Record the analyses and summaries pushed on the session channel."""
+        async for message in self.channel:
+            if message.type != aiohttp.WSMsgType.TEXT:
+                continue
+            data = json.loads(message.data)
+            if data.get('type') == 'analysis':
+                # Tiempo desde el último cambio de la transcripción hasta el análisis
+                self.recorder.record('ws:analysis', time.time() - self.last_change, data.get('success', False))
+            elif data.get('type') == 'summary':
+                self.recorder.record('ws:summary', time.time() - self.summary_sent, data.get('success', False))
+                self.summary_received.set()
+            elif data.get('type') == 'error':
+                self.recorder.record('ws:error', 0.0, False)
+
+    async def _call(self, method: str, path: str, payload: Optional[Dict[str, Any]] = None,
+                    route: Optional[str] = None) -> bool:
+        route = route or path
+        start = time.time()
+        try:
+            async with self.http.request(method, path, json=payload) as response:
+                if response.content_type == 'application/json':
+                    data = await response.json()
+                else:
+                    await response.read()
+                    data = {'success': response.status == 200}
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            self.recorder.record(route, time.time() - start, False)
+            return False
+        ok = response.status == 200 and data.get('success', False)
+        self.recorder.record(route, time.time() - start, ok, superseded=bool(data.get('superseded')))
+        return ok
+
+    def _spawn(self, coro) -> None:
+        """Fire a request without waiting for it (the page does not block on responses)."""
+        self.requests.append(asyncio.ensure_future(coro))
+
+    def _question_delay(self) -> float:
+        if self.args.questions_per_minute <= 0:
+            return float('inf')
+        return self.rng.expovariate(self.args.questions_per_minute / 60)
+
+
+async def fetch_json(url: str) -> Optional[Dict[str, Any]]:
+    """GET a JSON document, or None if the server does not answer."""
+    try:
+        async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=10)) as http:
+            async with http.get(url) as response:
+                return await response.json(content_type=None)
+    except (aiohttp.ClientError, asyncio.TimeoutError, ValueError):
+        return None
+
+
+async def reset_mock(url: str) -> None:
+    try:
+        async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=10)) as http:
+            await http.post(url.rstrip('/') + '/stats/reset')
+    except (aiohttp.ClientError, asyncio.TimeoutError):
+        pass
+
+
+def process_rss(pid: Optional[int]) -> Optional[int]:
+    """Resident memory of a process in bytes (Linux only), or None."""
+    if not pid:
+        return None
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        return None
+    return None
+
+
+async def run(args: argparse.Namespace) -> Dict[str, Any]:
+    if args.mock_url:
+        await reset_mock(args.mock_url)
+    rss_before = process_rss(args.server_pid)
+
+    recorder = Recorder()
+    start = time.time()
+    deadline = start + args.ramp_up + args.duration
+    agents = []
+    for index in range(args.agents):
+        # Incorporación progresiva de agentes durante el ramp-up
+        delay = args.ramp_up * index / args.agents if args.agents else 0
+        agents.append(asyncio.ensure_future(_start_later(delay, Agent(index, args, recorder, deadline))))
+    await asyncio.gather(*agents)
+    elapsed = time.time() - start
+
+    report: Dict[str, Any] = {
+        'config': {key: value for key, value in vars(args).items() if key not in ('output', 'baseline')},
+        'elapsed': elapsed,
+        'routes': recorder.report(elapsed),
+    }
+    total = sum(route['requests'] for route in report['routes'].values())
+    report['throughput'] = total / elapsed if elapsed else 0.0
+
+    if args.mock_url:
+        upstream = await fetch_json(args.mock_url.rstrip('/') + '/stats')
+        if upstream:
+            session_minutes = args.agents * elapsed / 60
+            report['upstream'] = {
+                'calls': upstream['calls'],
+                'calls_per_session_minute': upstream['calls'] / session_minutes if session_minutes else 0.0,
+                'by_status': upstream['by_status'],
+                'max_in_flight': upstream['max_in_flight'],
+                'prompt_tokens': upstream['prompt_tokens'],
+                'completion_tokens': upstream['completion_tokens'],
+            }
+
+    sessions = await fetch_json(args.base_url.rstrip('/') + '/session-stats')
+    memory: Dict[str, Any] = {}
+    if sessions and sessions.get('success'):
+        stats = sessions['sessions']
+        memory['store_bytes_per_session'] = stats['bytes'] / stats['sessions'] if stats['sessions'] else 0
+    rss_after = process_rss(args.server_pid)
+    if rss_before is not None and rss_after is not None and args.agents:
+        memory['rss_bytes'] = rss_after
+        memory['rss_bytes_per_session'] = (rss_after - rss_before) / args.agents
+    report['memory'] = memory
+    return report
+
+
+async def _start_later(delay: float, agent: Agent) -> None:
+    await asyncio.sleep(delay)
+    try:
+        await agent.run()
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        agent.recorder.record('agent', 0.0, False)
+        print(f"Agent {agent.index} failed: {e}", file=sys.stderr)
+
+
+def print_report(report: Dict[str, Any], baseline: Optional[Dict[str, Any]] = None) -> None:
+    """Print the report as a table, with the change against a baseline report if given."""
+    def delta(current: float, previous: Optional[float]) -> str:
+        if previous in (None, 0):
+            return ''
+        return f" ({(current - previous) / previous * 100:+.0f}%)"
+
+    base_routes = (baseline or {}).get('routes', {})
+    print(f"{'route':<28}{'reqs':>7}{'err':>6}{'sup':>6}{'p50 ms':>16}{'p95 ms':>16}{'p99 ms':>16}")
+    for route, stats in report['routes'].items():
+        base = base_routes.get(route, {})
+        print(f"{route:<28}{stats['requests']:>7}{stats['errors']:>6}{stats['superseded']:>6}"
+              + ''.join(f"{stats[key]:>9.0f}{delta(stats[key], base.get(key)):>7}"
+                        for key in ('p50_ms', 'p95_ms', 'p99_ms')))
+
+    print(f"\nthroughput: {report['throughput']:.1f} req/s"
+          f"{delta(report['throughput'], (baseline or {}).get('throughput'))}")
+    upstream = report.get('upstream')
+    if upstream:
+        base = (baseline or {}).get('upstream', {})
+        print(f"upstream calls per session-minute: {upstream['calls_per_session_minute']:.2f}"
+              f"{delta(upstream['calls_per_session_minute'], base.get('calls_per_session_minute'))}"
+              f"  (calls: {upstream['calls']}, statuses: {upstream['by_status']})")
+    base_memory = (baseline or {}).get('memory', {})
+    for key, value in report['memory'].items():
+        print(f"{key}: {value:,.0f}{delta(value, base_memory.get(key))}")
+
+
+def parse_range(value: str) -> tuple:
+    low, _, high = value.partition(',')
+    return float(low), float(high or low)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Load test of the assistant with simulated agents")
+    parser.add_argument('--base-url', default='http://127.0.0.1:5000', help="URL of the assistant")
+    parser.add_argument('--mock-url', default='http://127.0.0.1:9911',
+                        help="URL of mock_openai_server.py, to count upstream calls ('' to skip)")
+    parser.add_argument('--server-pid', type=int, help="PID of the assistant, to measure its memory")
+    parser.add_argument('--agents', type=int, default=50)
+    parser.add_argument('--duration', type=float, default=60, help="Seconds of conversation after the ramp-up")
+    parser.add_argument('--ramp-up', type=float, default=10, help="Seconds to start all the agents")
+    parser.add_argument('--mode', choices=('http', 'ws'), default='http',
+                        help="HTTP endpoints or the /ws session channel")
+    parser.add_argument('--language', default='es-ES')
+    parser.add_argument('--words-per-second', type=float, default=2.5)
+    parser.add_argument('--hesitation', type=float, default=0.05,
+                        help="Probability of a pause after a word (stable interim text)")
+    parser.add_argument('--turn-pause', type=parse_range, default=(0.5, 2.0), help="MIN,MAX seconds between utterances")
+    parser.add_argument('--debounce', type=float, default=1.0, help="Interim analysis debounce of script.js")
+    parser.add_argument('--questions-per-minute', type=float, default=0.5)
+    parser.add_argument('--no-summary', dest='summary', action='store_false', help="Do not request a final summary")
+    parser.add_argument('--request-timeout', type=float, default=60)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help="Write the JSON report to this file")
+    parser.add_argument('--baseline', help="JSON report of a previous run to compare with")
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+    baseline = None
+    if args.baseline and os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    print_report(report, baseline)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,322 @@
+"""
+Local stand-in for the OpenAI API, for load tests and latency benchmarks.
+
+Serves the chat completion (plain and streaming), batched completion and
+embedding endpoints used by the assistant, with configurable latency
+distributions per model and injected 429/5xx errors, and counts every
+upstream call so the load driver can report calls per session-minute. Point the assistant at it with:
+
+    OPENAI_API_KEY=bench OPENAI_API_BASE=http://127.0.0.1:9911/v1 python src/main.py
+
+Run with: python benchmarks/mock_openai_server.py --latency lognormal:600,0.4
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import math
+import random
+import time
+from collections import Counter
+from typing import Any, Callable, Dict, List
+
+from aiohttp import web
+
+# Frases con las que se construyen las respuestas de texto
+FILLER_WORDS = (
+    "el cliente muestra interés en la oferta y pregunta por las condiciones del contrato "
+    "conviene confirmar sus datos explicar los plazos de entrega y ofrecer una alternativa "
+    "más económica si el precio le parece alto"
+).split()
+
+SENTIMENTS = ('negative', 'neutral', 'positive', 'very_positive')
+INTEREST_LEVELS = ('low', 'medium', 'high')
+
+
+def parse_distribution(spec: str) -> Callable[[random.Random], float]:
+    """
+    Parse a latency distribution, in milliseconds.
+
+    Supported forms:
+        fixed:MS
+        uniform:MIN,MAX
+        normal:MEAN,STDDEV          (truncated at 0)
+        lognormal:MEDIAN,SIGMA      (heavy tail, closest to real API latency)
+
+    Returns:
+        A function that draws a latency in seconds from a random generator
+
+    Raises:
+        ValueError: If the specification is not valid
+    """
+    kind, _, raw_params = spec.partition(':')
+    try:
+        params = [float(p) for p in raw_params.split(',')] if raw_params else []
+    except ValueError as e:
+        raise ValueError(f"Invalid latency distribution: {spec}") from e
+
+    if kind == 'fixed' and len(params) == 1:
+        return lambda rng: params[0] / 1000
+    if kind == 'uniform' and len(params) == 2:
+        return lambda rng: rng.uniform(params[0], params[1]) / 1000
+    if kind == 'normal' and len(params) == 2:
+        return lambda rng: max(0.0, rng.gauss(params[0], params[1])) / 1000
+    if kind == 'lognormal' and len(params) == 2 and params[0] > 0:
+        mu = math.log(params[0])
+        return lambda rng: rng.lognormvariate(mu, params[1]) / 1000
+    raise ValueError(f"Invalid latency distribution: {spec}")
+
+
+class MockOpenAI:
+    """State and handlers of the mock server."""
+
+    def __init__(self, latency: Dict[str, Callable[[random.Random], float]], token_interval: float,
+                 rate_429: float, rate_5xx: float, embedding_dim: int, seed: int = 0):
+        """
+        Initialize the mock.
+
+        Args:
+            latency: Latency distribution per model ('*' for the default); for
+                streaming responses it is the time to the first token
+            token_interval: Seconds between two streamed tokens
+            rate_429: Probability of answering 429 (rate limited)
+            rate_5xx: Probability of answering 500/502/503
+            embedding_dim: Size of the returned embedding vectors
+            seed: Seed of the random generator (same seed, same run)
+        """
+        self.latency = latency
+        self.token_interval = token_interval
+        self.rate_429 = rate_429
+        self.rate_5xx = rate_5xx
+        self.embedding_dim = embedding_dim
+        self.rng = random.Random(seed)
+        self.reset()
+
+    def reset(self) -> None:
+        """Clear the call counters."""
+        self.started = time.time()
+        self.calls = Counter()
+        self.statuses = Counter()
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    def stats(self) -> Dict[str, Any]:
+        """Return the call counters since the last reset."""
+        return {
+            'since': self.started,
+            'elapsed': time.time() - self.started,
+            'calls': sum(self.calls.values()),
+            'by_endpoint_model': dict(self.calls),
+            'by_status': {str(status): count for status, count in self.statuses.items()},
+            'prompt_tokens': self.prompt_tokens,
+            'completion_tokens': self.completion_tokens,
+            'in_flight': self.in_flight,
+            'max_in_flight': self.max_in_flight,
+        }
+
+    async def chat_completions(self, request: web.Request) -> web.StreamResponse:
+        body = await request.json()
+        model = body.get('model', 'gpt-4')
+        messages = body.get('messages') or []
+        prompt_tokens = sum(_count_tokens(m.get('content') or '') + 4 for m in messages)
+        return await self._serve('chat', model, prompt_tokens, lambda: self._chat_reply(request, body, prompt_tokens))
+
+    async def completions(self, request: web.Request) -> web.StreamResponse:
+        body = await request.json()
+        model = body.get('model', 'gpt-4')
+        prompts = body.get('prompt')
+        # El servidor local envía los lotes como una lista de prompts ya formateados con la plantilla de chat
+        prompts = [prompts] if isinstance(prompts, str) else list(prompts or [])
+        prompt_tokens = sum(_count_tokens(prompt) for prompt in prompts)
+
+        async def reply():
+            texts = [self._completion_text(prompt, body.get('max_tokens') or 256) for prompt in prompts]
+            completion_tokens = sum(_count_tokens(text) for text in texts)
+            self.completion_tokens += completion_tokens
+            return web.json_response({
+                'id': f'cmpl-mock-{self.rng.getrandbits(32):08x}',
+                'object': 'text_completion',
+                'created': int(time.time()),
+                'model': model,
+                'choices': [{'index': i, 'text': text, 'finish_reason': 'stop'} for i, text in enumerate(texts)],
+                'usage': {
+                    'prompt_tokens': prompt_tokens,
+                    'completion_tokens': completion_tokens,
+                    'total_tokens': prompt_tokens + completion_tokens
+                }
+            })
+        return await self._serve('completions', model, prompt_tokens, reply)
+
+    async def embeddings(self, request: web.Request) -> web.StreamResponse:
+        body = await request.json()
+        model = body.get('model', 'text-embedding-ada-002')
+        inputs = body.get('input')
+        inputs = [inputs] if isinstance(inputs, str) else list(inputs or [])
+        prompt_tokens = sum(_count_tokens(text) for text in inputs)
+        data = [
+            {'object': 'embedding', 'index': i, 'embedding': _embedding(text, self.embedding_dim)}
+            for i, text in enumerate(inputs)
+        ]
+
+        async def reply():
+            return web.json_response({
+                'object': 'list', 'data': data, 'model': model,
+                'usage': {'prompt_tokens': prompt_tokens, 'total_tokens': prompt_tokens}
+            })
+        return await self._serve('embeddings', model, prompt_tokens, reply)
+
+    async def get_stats(self, request: web.Request) -> web.Response:
+        return web.json_response(self.stats())
+
+    async def reset_stats(self, request: web.Request) -> web.Response:
+        self.reset()
+        return web.json_response({'success': True})
+
+    async def _serve(self, endpoint: str, model: str, prompt_tokens: int, reply) -> web.StreamResponse:
+        """Count the call, wait the model latency and answer (or fail) it."""
+        self.calls[f'{endpoint}:{model}'] += 1
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            distribution = self.latency.get(model) or self.latency['*']
+            await asyncio.sleep(distribution(self.rng))
+
+            draw = self.rng.random()
+            if draw < self.rate_429:
+                return self._error(429, 'rate_limit_exceeded', 'Rate limit reached (mock)', {'Retry-After': '1'})
+            if draw < self.rate_429 + self.rate_5xx:
+                return self._error(self.rng.choice((500, 502, 503)), 'server_error', 'Upstream error (mock)')
+
+            self.prompt_tokens += prompt_tokens
+            response = await reply()
+            self.statuses[response.status] += 1
+            return response
+        finally:
+            self.in_flight -= 1
+
+    def _error(self, status: int, error_type: str, message: str, headers=None) -> web.Response:
+        self.statuses[status] += 1
+        return web.json_response(
+            {'error': {'message': message, 'type': error_type, 'code': error_type}},
+            status=status, headers=headers
+        )
+
+    async def _chat_reply(self, request: web.Request, body: Dict[str, Any], prompt_tokens: int) -> web.StreamResponse:
+        model = body.get('model', 'gpt-4')
+        messages = body.get('messages') or []
+        system = messages[0].get('content', '') if messages else ''
+        text = self._completion_text(system, body.get('max_tokens') or 256)
+        completion_tokens = _count_tokens(text)
+        self.completion_tokens += completion_tokens
+
+        if not body.get('stream'):
+            return web.json_response({
+                'id': f'chatcmpl-mock-{self.rng.getrandbits(32):08x}',
+                'object': 'chat.completion',
+                'created': int(time.time()),
+                'model': model,
+                'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': text}, 'finish_reason': 'stop'}],
+                'usage': {
+                    'prompt_tokens': prompt_tokens,
+                    'completion_tokens': completion_tokens,
+                    'total_tokens': prompt_tokens + completion_tokens
+                }
+            })
+
+        response = web.StreamResponse(headers={'Content-Type': 'text/event-stream', 'Cache-Control': 'no-cache'})
+        await response.prepare(request)
+        tokens = text.split(' ')
+        for i, token in enumerate(tokens):
+            delta = {'content': token if i == len(tokens) - 1 else token + ' '}
+            await response.write(_stream_chunk(model, delta, None))
+            await asyncio.sleep(self.token_interval)
+        await response.write(_stream_chunk(model, {}, 'stop'))
+        await response.write(b'data: [DONE]\n\n')
+        await response.write_eof()
+        return response
+
+    def _completion_text(self, system: str, max_tokens: int) -> str:
+        """Build a plausible completion for the prompt."""
+        if '"suggested_response"' in system:
+            # Prompt del análisis combinado: devolver JSON que cumple el esquema
+            return json.dumps({
+                'interpretation': self._sentence(20),
+                'suggested_response': self._sentence(30),
+                'sentiment': {
+                    'overall': self.rng.choice(SENTIMENTS),
+                    'emotions': ['interés'],
+                    'interest_level': self.rng.choice(INTEREST_LEVELS),
+                    'concerns': ['precio'],
+                    'recommendation': self._sentence(15)
+                }
+            }, ensure_ascii=False)
+        return self._sentence(min(max_tokens, 120) * 3 // 4)
+
+    def _sentence(self, words: int) -> str:
+        return ' '.join(self.rng.choice(FILLER_WORDS) for _ in range(max(1, words)))
+
+
+def _count_tokens(text: str) -> int:
+    """Rough token count (about 4 characters per token)."""
+    return max(1, len(text) // 4)
+
+
+def _embedding(text: str, dim: int) -> List[float]:
+    """Deterministic unit vector derived from the text (same text, same vector)."""
+    rng = random.Random(hashlib.sha256(text.encode('utf-8')).digest())
+    vector = [rng.gauss(0, 1) for _ in range(dim)]
+    norm = math.sqrt(sum(v * v for v in vector)) or 1.0
+    return [v / norm for v in vector]
+
+
+def _stream_chunk(model: str, delta: Dict[str, str], finish_reason) -> bytes:
+    chunk = {
+        'id': 'chatcmpl-mock',
+        'object': 'chat.completion.chunk',
+        'created': int(time.time()),
+        'model': model,
+        'choices': [{'index': 0, 'delta': delta, 'finish_reason': finish_reason}]
+    }
+    return f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode('utf-8')
+
+
+def create_app(mock: MockOpenAI) -> web.Application:
+    app = web.Application(client_max_size=32 * 1024 * 1024)
+    app.router.add_post('/v1/chat/completions', mock.chat_completions)
+    app.router.add_post('/v1/completions', mock.completions)
+    app.router.add_post('/v1/embeddings', mock.embeddings)
+    app.router.add_get('/stats', mock.get_stats)
+    app.router.add_post('/stats/reset', mock.reset_stats)
+    return app
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Mock OpenAI-compatible server for load tests")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=9911)
+    parser.add_argument('--latency', default='lognormal:600,0.4',
+                        help="Default latency distribution in ms (fixed:MS, uniform:MIN,MAX, "
+                             "normal:MEAN,STD, lognormal:MEDIAN,SIGMA)")
+    parser.add_argument('--model-latency', action='append', default=[], metavar='MODEL=DIST',
+                        help="Latency distribution of one model, e.g. gpt-4=lognormal:900,0.5 (repeatable)")
+    parser.add_argument('--token-interval', type=float, default=20, help="Ms between streamed tokens")
+    parser.add_argument('--rate-429', type=float, default=0.0, help="Probability of a 429 response")
+    parser.add_argument('--rate-5xx', type=float, default=0.0, help="Probability of a 5xx response")
+    parser.add_argument('--embedding-dim', type=int, default=256)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    latency = {'*': parse_distribution(args.latency)}
+    for item in args.model_latency:
+        model, _, spec = item.partition('=')
+        latency[model] = parse_distribution(spec)
+
+    mock = MockOpenAI(latency, args.token_interval / 1000, args.rate_429, args.rate_5xx,
+                      args.embedding_dim, args.seed)
+    web.run_app(create_app(mock), host=args.host, port=args.port, print=None)
+
+
+if __name__ == '__main__':
+    main()
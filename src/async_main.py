@@ -0,0 +1,1177 @@
+"""
+Asyncio serving path for the assistant.
+
+Serves the same page and JSON API as main.py on top of aiohttp, using
+AsyncOpenAIService. Pending LLM calls are coroutines instead of blocked
+worker threads, so a single process can hold hundreds of concurrent agent
+sessions. Run with: python src/async_main.py
+"""
+import asyncio
+import contextvars
+import functools
+import hmac
+import json
+import logging
+import os
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime
+
+import jinja2
+from aiohttp import WSMsgType, web
+from dotenv import load_dotenv
+
+from services.async_openai_service import AsyncOpenAIService
+from services.audio_transcription import (
+    DEFAULT_SAMPLE_RATE, AudioTranscriber, TranscriberBusyError, create_asr_backend, wav_to_pcm
+)
+from services.context_window import ConversationContextManager
+from services.call_search import CallSearchIndex
+from services.event_bus import BusEvent, SessionEventBus
+from services.knowledge_index import META_FILE, KnowledgeIndex, KnowledgeRetriever
+from services.llm_backend import create_llm_backend
+from services.metrics import Metrics
+from services.request_coordinator import RequestCoordinator, RequestSupersededError
+from services.response_cache import ResponseCache
+from services.rolling_summary import AsyncBackgroundSummarizer, RollingSummaries
+from services.semantic_cache import SemanticAnswerCache
+from services.sentiment_scorer import SentimentScorer, SessionSentiment
+from services.session_channel import AnalysisSchedule, ChannelMessageError, parse_message
+from services.session_store import create_session_store
+from services.tracing import Tracer, span
+from services.transcript_log import SessionTranscripts, TranscriptLog, TranscriptSegments, parse_segments
+from services.upstream_scheduler import UpstreamScheduler, current_session
+
+# Configurar logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+# Load environment variables
+load_dotenv()
+
+# Directorio de los datos que genera la aplicación (sesiones, llamadas, transcripciones, trazas, índice RAG)
+DATA_DIR = os.getenv("DATA_DIR", "data")
+os.makedirs(DATA_DIR, exist_ok=True)
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+SESSION_COOKIE = 'session_id'
+
+# Almacenamiento para las sesiones de conversación (mismo backend y configuración que main.py)
+session_store = create_session_store(
+    os.getenv("SESSION_STORE", "memory"),
+    db_path=os.getenv("SESSION_STORE_PATH", os.path.join(DATA_DIR, "sessions.db")),
+    idle_ttl=float(os.getenv("SESSION_IDLE_TTL", "3600")),
+    max_bytes=int(os.getenv("SESSION_MAX_MEMORY_MB", "256")) * 1024 * 1024
+)
+
+# Eventos en vivo de las sesiones para los paneles de supervisión (por proceso)
+event_bus = SessionEventBus(max_queue=int(os.getenv("EVENT_QUEUE_SIZE", "256")))
+
+# Índice de búsqueda de las llamadas pasadas (transcripciones y resúmenes), persistido en disco
+call_index = None
+if os.getenv("SEARCH_INDEX", "true").lower() == "true":
+    call_index = CallSearchIndex(
+        os.getenv("SEARCH_INDEX_PATH", os.path.join(DATA_DIR, "calls.db")),
+        flush_interval=float(os.getenv("SEARCH_FLUSH_INTERVAL", "2")),
+        default_language=os.getenv("SEARCH_DEFAULT_LANGUAGE", "es"),
+        max_candidates=int(os.getenv("SEARCH_MAX_CANDIDATES", "500")),
+        reindex_interval=float(os.getenv("SEARCH_REINDEX_INTERVAL", "60"))
+    )
+
+transcripts = SessionTranscripts(
+    session_store,
+    TranscriptSegments(max_sessions=int(os.getenv("TRANSCRIPT_MAX_SESSIONS", "1000"))),
+    TranscriptLog(os.getenv("TRANSCRIPT_LOG_DIR", os.path.join(DATA_DIR, "transcripts"))),
+    events=event_bus,
+    search_index=call_index
+)
+
+response_cache = ResponseCache(
+    max_entries=int(os.getenv("RESPONSE_CACHE_SIZE", "1000")),
+    db_path=os.getenv("RESPONSE_CACHE_PATH") or None
+)
+
+# Métricas Prometheus (expuestas en /metrics si prometheus_client está instalado)
+metrics = Metrics()
+
+# Trazas por petición (misma configuración que main.py; cProfile solo se usa en la versión con hilos)
+tracer = Tracer(
+    slow_ms=float(os.getenv("TRACE_SLOW_MS", "3000")),
+    profile_dir=os.getenv("TRACE_PROFILE_DIR", os.path.join(DATA_DIR, "profiles")) or None,
+    sample_interval=float(os.getenv("TRACE_SAMPLE_INTERVAL_MS", "50")) / 1000
+)
+# Conexiones que duran toda la llamada: no se trazan enteras (serían siempre "lentas"), sino mensaje a mensaje
+UNTRACED_ROUTES = {'/ws', '/supervisor/ws', '/supervisor/events'}
+
+# Base de conocimiento local para fundamentar las respuestas a preguntas (RAG)
+knowledge_retriever = None
+knowledge_index_dir = os.getenv("KNOWLEDGE_INDEX_DIR", os.path.join(DATA_DIR, "knowledge_index"))
+if os.path.exists(os.path.join(knowledge_index_dir, META_FILE)):
+    knowledge_retriever = KnowledgeRetriever(
+        KnowledgeIndex(knowledge_index_dir),
+        top_k=int(os.getenv("RAG_TOP_K", "3")),
+        min_score=float(os.getenv("RAG_MIN_SCORE")) if os.getenv("RAG_MIN_SCORE") else None
+    )
+    logger.info(f"Knowledge index loaded: {len(knowledge_retriever.index)} passages")
+
+# Caché semántica de respuestas a preguntas, compartida por todos los agentes del proceso
+answer_cache = None
+if os.getenv("SEMANTIC_CACHE", "true").lower() == "true":
+    answer_cache = SemanticAnswerCache(
+        embedder=knowledge_retriever.embedder if knowledge_retriever else None,
+        threshold=float(os.getenv("SEMANTIC_CACHE_THRESHOLD")) if os.getenv("SEMANTIC_CACHE_THRESHOLD") else None,
+        max_entries=int(os.getenv("SEMANTIC_CACHE_SIZE", "2000")),
+        ttl=float(os.getenv("SEMANTIC_CACHE_TTL", "3600"))
+    )
+
+metrics.register_stores(session_store, response_cache, answer_cache)
+
+# Initialize services
+# Admisión de las peticiones al modelo: límites de la cuenta y prioridad por tipo de petición
+upstream_scheduler = UpstreamScheduler(
+    rpm=float(os.getenv("UPSTREAM_RPM", "0")) or None,
+    tpm=float(os.getenv("UPSTREAM_TPM", "0")) or None,
+    max_retries=int(os.getenv("UPSTREAM_MAX_RETRIES", "3"))
+)
+
+openai_service = None
+try:
+    openai_service = AsyncOpenAIService(
+        cache=response_cache,
+        metrics=metrics,
+        retriever=knowledge_retriever,
+        answer_cache=answer_cache,
+        scheduler=upstream_scheduler,
+        max_concurrency=int(os.getenv("OPENAI_MAX_CONCURRENCY", "50")),
+        pool_size=int(os.getenv("OPENAI_POOL_SIZE", "100")),
+        # Backend de las completions: la API de OpenAI o un servidor compatible propio (LLM_BACKEND=local)
+        backend=create_llm_backend(
+            os.getenv("LLM_BACKEND", "openai"),
+            base_url=os.getenv("LOCAL_LLM_URL"),
+            api_key=os.getenv("LOCAL_LLM_API_KEY"),
+            chat_template=os.getenv("LOCAL_LLM_CHAT_TEMPLATE", "chatml"),
+            batch_size=int(os.getenv("LLM_BATCH_SIZE", "8")),
+            batch_wait=float(os.getenv("LLM_BATCH_WAIT_MS", "20")) / 1000,
+            max_in_flight=int(os.getenv("LLM_BATCH_IN_FLIGHT", "2"))
+        ),
+        models=os.getenv("LLM_MODELS").split(',') if os.getenv("LLM_MODELS") else None
+    )
+    logger.info("Async OpenAI service initialized successfully")
+except ValueError as e:
+    logger.warning(f"OpenAI service initialization failed: {e}")
+    logger.warning("The application will run without OpenAI integration")
+
+# Transcripción de audio en el servidor (VAD + ASR local en CPU)
+audio_transcriber = None
+try:
+    audio_transcriber = AudioTranscriber(
+        create_asr_backend(
+            os.getenv("ASR_BACKEND", "stub"),
+            model=os.getenv("ASR_MODEL", "base"),
+            cpu_threads=int(os.getenv("ASR_CPU_THREADS", "0"))
+        ),
+        max_workers=int(os.getenv("ASR_WORKERS", "2")),
+        max_pending=int(os.getenv("ASR_MAX_PENDING", "8"))
+    )
+except ValueError as e:
+    logger.warning(f"Audio transcription initialization failed: {e}")
+
+# Sin digest por LLM: condensar el contexto no debe bloquear el bucle de eventos
+context_manager = ConversationContextManager(
+    token_budget=int(os.getenv("CONTEXT_TOKEN_BUDGET", "1500")),
+    digest_max_tokens=int(os.getenv("CONTEXT_DIGEST_TOKENS", "250")),
+    digest_refresh_tokens=int(os.getenv("CONTEXT_DIGEST_REFRESH_TOKENS", "400"))
+)
+
+# Sentimiento estimado localmente por sesión; el LLM solo se consulta si cambia
+session_sentiment = SessionSentiment(
+    session_store,
+    SentimentScorer(half_life_words=int(os.getenv("SENTIMENT_HALF_LIFE_WORDS", "40"))),
+    shift=float(os.getenv("SENTIMENT_SHIFT", "0.3")),
+    cooldown=float(os.getenv("SENTIMENT_COOLDOWN", "5"))
+)
+
+# Resumen de cada llamada mantenido en segundo plano mientras dura, para que
+# al colgar solo quede por fusionar el último tramo
+rolling_summaries = None
+background_summarizer = None
+if openai_service and os.getenv("ROLLING_SUMMARY", "true").lower() == "true":
+    rolling_summaries = RollingSummaries(
+        session_store,
+        transcripts,
+        refresh_tokens=int(os.getenv("ROLLING_SUMMARY_TOKENS", "400")),
+        min_interval=float(os.getenv("ROLLING_SUMMARY_INTERVAL", "30")),
+        max_tokens=openai_service.summary_chunk_tokens()
+    )
+    background_summarizer = AsyncBackgroundSummarizer(
+        rolling_summaries,
+        openai_service.update_call_summary,
+        max_workers=int(os.getenv("ROLLING_SUMMARY_WORKERS", "1"))
+    )
+
+templates = jinja2.Environment(
+    loader=jinja2.FileSystemLoader(os.path.join(BASE_DIR, 'templates')),
+    autoescape=True
+)
+templates.globals['url_for'] = lambda endpoint, filename='': f"/static/{filename}"
+
+
+# Una única llamada en curso por (sesión, endpoint); la más reciente gana
+request_coordinator = RequestCoordinator()
+
+SUPERSEDED_RESPONSE = {
+    'success': False,
+    'superseded': True,
+    'error': 'Solicitud reemplazada por otra más reciente'
+}
+
+
+async def _in_thread(fn, *args, **kwargs):
+    """Run blocking store or log I/O in the default executor, keeping the context (session, trace) of the caller."""
+    call = functools.partial(contextvars.copy_context().run, fn, *args, **kwargs)
+    return await asyncio.get_running_loop().run_in_executor(None, call)
+
+
+async def _coordinated(session_id, endpoint: str, request_key, fn) -> dict:
+    """Run an LLM call (a coroutine function) under per-session single-flight coordination."""
+    try:
+        return await request_coordinator.arun(session_id, endpoint, request_key, fn)
+    except RequestSupersededError:
+        logger.info(f"Discarding superseded {endpoint} result for session {session_id}")
+        return dict(SUPERSEDED_RESPONSE)
+
+
+async def _coordinated_stream(session_id, endpoint: str, request_key, events):
+    """Relay an async stream of events, aborting it when a newer request supersedes it."""
+    ticket = request_coordinator.start(session_id, endpoint, request_key)
+    try:
+        async for event in events:
+            if ticket.is_cancelled:
+                logger.info(f"Aborting superseded {endpoint} stream for session {session_id}")
+                yield dict(SUPERSEDED_RESPONSE, type='superseded')
+                return
+            yield event
+    finally:
+        # Cerrar el generador detiene la lectura de la respuesta del modelo
+        await events.aclose()
+        request_coordinator.release(session_id, endpoint, ticket)
+
+
+def _create_session() -> tuple:
+    """Create a new conversation session in the store and return (session_id, start_time)."""
+    session_id = str(uuid.uuid4())
+    start_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    session_store.create(session_id, {
+        'transcript': '',
+        'start_time': start_time,
+        'client_info': {}
+    })
+    return session_id, start_time
+
+
+async def _new_session() -> tuple:
+    """Create a new conversation session and return (session_id, start_time)."""
+    session_id, start_time = await _in_thread(_create_session)
+    event_bus.publish(session_id, 'session', {'start_time': start_time})
+    return session_id, start_time
+
+
+async def _session_id(request: web.Request):
+    """Return the session id of the request if it refers to a known session."""
+    session_id = request.cookies.get(SESSION_COOKIE)
+    if not session_id:
+        return None
+    return session_id if await _in_thread(session_store.__contains__, session_id) else None
+
+
+def _build_prompt_context(session_id, text: str, language: str = 'es-ES') -> str:
+    """Return the conversation text to send to the LLM for the given session."""
+    with span('context'):
+        session_data = session_store.get(session_id) if session_id else None
+        if session_data is None:
+            return text
+        context = context_manager.build_context(session_data, text, language)
+        session_store.update(session_id, {'context': session_data['context']})
+        return context
+
+
+async def _prompt_context(session_id, text: str, language: str = 'es-ES') -> str:
+    """Return the conversation text to send to the LLM, reading and updating the session in a thread."""
+    return await _in_thread(_build_prompt_context, session_id, text, language)
+
+
+async def _request_text(session_id, data: dict) -> str:
+    """Return the conversation text of a request: the full 'text' or the session transcript plus 'interim'."""
+    if 'text' in data:
+        text = data.get('text') or ''
+        if session_id:
+            # Sustituye también los segmentos ya enviados, que si no seguirían ganando en transcripts.text()
+            await _in_thread(transcripts.replace, session_id, text)
+        return text
+    interim = (data.get('interim') or '').strip()
+    event_bus.publish(session_id, 'interim', {'text': interim})
+    stored = await _in_thread(transcripts.text, session_id)
+    return ' '.join(part for part in (stored, interim) if part)
+
+
+def _store_summary(session_id, summary: str) -> None:
+    """Keep the call summary in the session and queue it for indexing in the call search."""
+    session_store.update(session_id, {'summary': summary})
+    if call_index:
+        call_index.set_summary(session_id, summary)
+
+
+def _publish(session_id, event_type: str, result: dict) -> dict:
+    """Publish a successful result of the session to the supervisors and return it unchanged."""
+    if result.get('success'):
+        event_bus.publish(session_id, event_type, result)
+    return result
+
+
+async def _published_stream(session_id, event_type: str, field: str, events):
+    """Relay an async stream of events, publishing the full text under field once it is done."""
+    tokens = []
+    try:
+        async for event in events:
+            if event.get('type') == 'token':
+                tokens.append(event['content'])
+            elif event.get('type') == 'done':
+                _publish(session_id, event_type, dict(event, **{field: ''.join(tokens)}))
+            yield event
+    finally:
+        await events.aclose()
+
+
+async def index(request: web.Request) -> web.Response:
+    """Render the main page of the application."""
+    session_id = request.cookies.get(SESSION_COOKIE)
+    session_data = await _in_thread(session_store.get, session_id) if session_id else None
+    if session_data:
+        start_time = session_data['start_time']
+    else:
+        session_id, start_time = await _new_session()
+
+    html = templates.get_template('index.html').render(session_id=session_id, start_time=start_time)
+    response = web.Response(text=html, content_type='text/html')
+    response.set_cookie(SESSION_COOKIE, session_id, httponly=True)
+    return response
+
+
+async def new_session(request: web.Request) -> web.Response:
+    """Create a new conversation session."""
+    old_session_id = await _session_id(request)
+    if old_session_id:
+        logger.info(f"Storing previous session: {old_session_id}")
+        if call_index:
+            # La llamada anterior ha terminado: sus últimos segmentos pasan ya al índice de búsqueda
+            call_index.finish(old_session_id)
+
+    session_id, start_time = await _new_session()
+    logger.info(f"Created new session: {session_id}")
+    response = web.json_response({
+        'success': True,
+        'session_id': session_id,
+        'start_time': start_time
+    })
+    response.set_cookie(SESSION_COOKIE, session_id, httponly=True)
+    return response
+
+
+@web.middleware
+async def observe_request(request: web.Request, handler):
+    """Record the latency of the request per route (time to the response headers for streams)."""
+    started = time.time()
+    # Las peticiones al modelo de esta ruta (y de las tareas que lance) cuentan para su sesión
+    current_session.set(request.cookies.get(SESSION_COOKIE))
+    resource = request.match_info.route.resource
+    route = resource.canonical if resource else 'unmatched'
+    trace = None
+    if route not in UNTRACED_ROUTES:
+        request['trace'] = trace = tracer.start(route, request.headers.get('X-Request-ID'), started)
+    status = 500
+    try:
+        response = await handler(request)
+        status = response.status
+    except web.HTTPException as e:
+        status = e.status
+        metrics.observe_request(route, request.method, e.status, time.time() - started)
+        raise
+    finally:
+        if trace is not None:
+            _finish_trace(trace, status)
+    metrics.observe_request(route, request.method, response.status, time.time() - started)
+    return response
+
+
+def _finish_trace(trace, status: int) -> None:
+    duration = tracer.finish(trace, status)
+    if duration >= tracer.slow_ms:
+        client = f", client id {trace.client_id}" if trace.client_id else ""
+        logger.warning(f"Slow request {trace.root.name}: {duration:.0f} ms (trace {trace.trace_id}{client})")
+
+
+@contextmanager
+def _channel_trace(name: str):
+    """Trace one unit of work of a long-lived channel (e.g. a WebSocket message) as its own request."""
+    trace = tracer.start(name)
+    status = 500
+    try:
+        yield trace
+        status = 200
+    finally:
+        _finish_trace(trace, status)
+
+
+async def _trace_headers(request: web.Request, response: web.StreamResponse) -> None:
+    """Return the correlation id (and the timing of the spans finished so far) with the response headers."""
+    trace = request.get('trace')
+    if trace is not None:
+        response.headers['X-Request-ID'] = trace.trace_id
+        timing = trace.server_timing()
+        if timing:
+            response.headers['Server-Timing'] = timing
+
+
+async def metrics_endpoint(request: web.Request) -> web.Response:
+    """Expose the Prometheus metrics."""
+    if not metrics.enabled:
+        return web.json_response(
+            {'success': False, 'error': 'Métricas no disponibles: instala prometheus_client'}, status=503
+        )
+    body, content_type = metrics.exposition()
+    # prometheus_client incluye el charset en el content type
+    return web.Response(body=body, headers={'Content-Type': content_type})
+
+
+async def cache_stats(request: web.Request) -> web.Response:
+    """Return hit/miss statistics of the LLM response cache and the semantic answer cache."""
+    return web.json_response({
+        'success': True,
+        'cache': response_cache.get_stats(),
+        'semantic_cache': answer_cache.get_stats() if answer_cache else None
+    })
+
+
+async def model_stats(request: web.Request) -> web.Response:
+    """Return rolling latency, error rate and circuit state per model, and the backend counters."""
+    if not openai_service:
+        return web.json_response({'success': False, 'error': 'Servicio de OpenAI no disponible'})
+    return web.json_response({
+        'success': True,
+        'models': openai_service.router.get_stats(),
+        'backend': openai_service.backend.get_stats()
+    })
+
+
+async def session_stats(request: web.Request) -> web.Response:
+    """Return the size and eviction counters of the session store."""
+    return web.json_response({'success': True, 'sessions': await _in_thread(session_store.get_stats)})
+
+
+async def sentiment_stats(request: web.Request) -> web.Response:
+    """Return how many sentiment requests were answered locally and escalated to the LLM."""
+    return web.json_response({'success': True, 'sentiment': session_sentiment.get_stats()})
+
+
+async def upstream_stats(request: web.Request) -> web.Response:
+    """Return the admissions, sheds and queueing time per priority class of the upstream scheduler."""
+    return web.json_response({'success': True, 'upstream': upstream_scheduler.get_stats()})
+
+
+async def summary_stats(request: web.Request) -> web.Response:
+    """Return the background updates of the rolling call summaries and how often they were served complete."""
+    if not rolling_summaries:
+        return web.json_response({'success': False, 'error': 'Resumen en segundo plano no disponible'})
+    return web.json_response({'success': True, 'summaries': rolling_summaries.get_stats()})
+
+
+async def event_stats(request: web.Request) -> web.Response:
+    """Return the events published and delivered to the supervisors, and the subscribers dropped for lagging."""
+    return web.json_response({'success': True, 'events': event_bus.get_stats()})
+
+
+async def trace_stats(request: web.Request) -> web.Response:
+    """Return the traced and slow requests, and the latest slow ones with their trace ids."""
+    if not _supervisor_authorized(request):
+        return web.json_response({'success': False, 'error': 'No autorizado'}, status=403)
+    return web.json_response({'success': True, 'tracing': tracer.get_stats()})
+
+
+async def get_trace(request: web.Request) -> web.Response:
+    """Return the span tree of a recent request by its trace id (the X-Request-ID header of its response)."""
+    if not _supervisor_authorized(request):
+        return web.json_response({'success': False, 'error': 'No autorizado'}, status=403)
+    trace = tracer.get(request.match_info['trace_id'])
+    if trace is None:
+        return web.json_response({'success': False, 'error': 'Traza no encontrada'}, status=404)
+    return web.json_response({'success': True, 'trace': trace})
+
+
+async def transcription_stats(request: web.Request) -> web.Response:
+    """Return the ASR backend, worker pool occupancy and counters of the audio transcription."""
+    if not audio_transcriber:
+        return web.json_response({'success': False, 'error': 'Transcripción de audio no disponible'})
+    return web.json_response({'success': True, 'transcription': audio_transcriber.get_stats()})
+
+
+async def transcribe(request: web.Request) -> web.Response:
+    """
+    Transcribe the next chunk of the session's audio on the server.
+
+    Same contract as main.py: 16-bit mono PCM (?sample_rate=) or WAV body,
+    chunks sent in order, ?final=1 at the end of the audio.
+    """
+    session_id = await _session_id(request)
+    if not audio_transcriber:
+        return web.json_response({'success': False, 'error': 'Transcripción de audio no disponible'})
+    if not session_id:
+        logger.warning("Session ID not found when transcribing audio")
+        return web.json_response({'success': False, 'error': 'Sesión no encontrada'})
+
+    language = request.query.get('language', 'es-ES')
+    final = request.query.get('final', '').lower() in ('1', 'true')
+    body = await request.read()
+    try:
+        if request.content_type in ('audio/wav', 'audio/x-wav'):
+            pcm, sample_rate = wav_to_pcm(body)
+        else:
+            pcm, sample_rate = body, int(request.query.get('sample_rate', DEFAULT_SAMPLE_RATE))
+        # La detección de voz recorre todo el fragmento: fuera del bucle de eventos
+        jobs = await asyncio.get_running_loop().run_in_executor(
+            None, audio_transcriber.feed, session_id, pcm, sample_rate, language, final
+        )
+    except TranscriberBusyError as e:
+        # El fragmento no se ha procesado: el cliente debe reenviarlo
+        logger.warning(f"Audio transcription busy: {e}")
+        return web.json_response({'success': False, 'busy': True, 'error': str(e)}, status=503)
+    except ValueError as e:
+        return web.json_response({'success': False, 'error': f'Audio no válido: {e}'})
+
+    try:
+        result = await asyncio.wait_for(jobs.aresult(), float(os.getenv("ASR_TIMEOUT", "60")))
+    except Exception as e:
+        logger.error(f"Exception transcribing audio: {str(e)}")
+        return web.json_response({'success': False, 'error': f'Error al transcribir el audio: {str(e)}'})
+
+    segments = []
+    if result['segments']:
+        appended = await _in_thread(transcripts.append_texts, session_id, result['segments'])
+        segments = [{'seq': seq, 'text': text} for seq, text in (appended or {}).get('accepted', [])]
+        logger.info(f"Transcribed {len(segments)} audio segments for session {session_id}")
+        await _refresh_summary(session_id)
+    return web.json_response({
+        'success': True,
+        'text': ' '.join(segment['text'] for segment in segments),
+        'segments': segments,
+        'partial': result['partial']
+    })
+
+
+async def update_transcript(request: web.Request) -> web.Response:
+    """Update the stored transcript for the current session."""
+    session_id = request.cookies.get(SESSION_COOKIE)
+    data = await request.json()
+    if not await _in_thread(transcripts.replace, session_id, data.get('text', '')):
+        logger.warning("Session ID not found when updating transcript")
+        return web.json_response({'success': False, 'error': 'Sesión no encontrada'})
+
+    await _refresh_summary(session_id)
+    return web.json_response({'success': True})
+
+
+async def append_transcript(request: web.Request) -> web.Response:
+    """Append new finalized transcript segments to the current session."""
+    data = await request.json()
+    segments = parse_segments(data.get('segments'))
+    if segments is None:
+        return web.json_response({
+            'success': False,
+            'error': 'Segmentos no válidos: se esperaba una lista de {seq, text}'
+        })
+
+    session_id = request.cookies.get(SESSION_COOKIE)
+    result = await _in_thread(transcripts.append, session_id, segments, reset=bool(data.get('reset')))
+    if result is None:
+        logger.warning("Session ID not found when appending transcript")
+        return web.json_response({'success': False, 'error': 'Sesión no encontrada'})
+
+    await _refresh_summary(session_id)
+    return web.json_response({
+        'success': True,
+        'accepted': len(result['accepted']),
+        'duplicates': result['duplicates'],
+        'next_seq': result['next_seq']
+    })
+
+
+async def get_suggestions(request: web.Request) -> web.Response:
+    """Endpoint to get suggestions from the LLM based on transcribed text."""
+    data = await request.json()
+    session_id = await _session_id(request)
+    text = await _request_text(session_id, data)
+    language = data.get('language', 'es-ES')
+
+    if not text:
+        return web.json_response({'success': False, 'error': 'No text provided'})
+
+    if not openai_service:
+        return web.json_response({
+            'success': True,
+            'suggestions': f'⚠️ [MODO DEMO] Sugerencia basada en: {text[:50]}... Para obtener sugerencias reales, configura la API de OpenAI.'
+        })
+
+    async def call():
+        return await openai_service.get_suggestions(await _prompt_context(session_id, text, language), language)
+
+    result = await _coordinated(session_id, 'suggestions', (text, language), call)
+    if result.get('superseded'):
+        return web.json_response(result)
+    _log_result('suggestions', result)
+    return web.json_response(_publish(session_id, 'suggestions', result))
+
+
+async def stream_suggestions(request: web.Request) -> web.StreamResponse:
+    """Stream suggestions token by token as Server-Sent Events."""
+    data = await request.json()
+    session_id = await _session_id(request)
+    text = await _request_text(session_id, data)
+    language = data.get('language', 'es-ES')
+
+    if not text:
+        return web.json_response({'success': False, 'error': 'No text provided'})
+
+    if not openai_service:
+        return await _sse_response(request, _demo_stream(
+            f'⚠️ [MODO DEMO] Sugerencia basada en: {text[:50]}... Para obtener sugerencias reales, configura la API de OpenAI.'
+        ))
+
+    prompt_text = await _prompt_context(session_id, text, language)
+    events = _published_stream(session_id, 'suggestions', 'suggestions',
+                               openai_service.stream_suggestions(prompt_text, language))
+    return await _sse_response(request, _coordinated_stream(session_id, 'suggestions-stream', (text, language), events))
+
+
+async def ask_question(request: web.Request) -> web.Response:
+    """Endpoint to get answers to direct questions from the LLM."""
+    data = await request.json()
+    question = data.get('question', '')
+    if not question:
+        return web.json_response({'success': False, 'error': 'No se ha proporcionado ninguna pregunta'})
+
+    if not openai_service:
+        return web.json_response({
+            'success': True,
+            'answer': f'⚠️ [MODO DEMO] Respuesta a tu pregunta: "{question}". Para obtener respuestas reales, configura la API de OpenAI.'
+        })
+
+    result = await openai_service.get_answer_to_question(question)
+    _log_result('answer', result)
+    return web.json_response(result)
+
+
+async def stream_ask_question(request: web.Request) -> web.StreamResponse:
+    """Stream the answer to a direct question token by token as Server-Sent Events."""
+    data = await request.json()
+    question = data.get('question', '')
+    if not question:
+        return web.json_response({'success': False, 'error': 'No se ha proporcionado ninguna pregunta'})
+
+    if not openai_service:
+        return await _sse_response(request, _demo_stream(
+            f'⚠️ [MODO DEMO] Respuesta a tu pregunta: "{question}". Para obtener respuestas reales, configura la API de OpenAI.'
+        ))
+
+    return await _sse_response(request, openai_service.stream_answer_to_question(question))
+
+
+async def analyze_sentiment(request: web.Request) -> web.Response:
+    """Endpoint to analyze customer sentiment; the LLM runs only when the local estimate changes (see main.py)."""
+    data = await request.json()
+    session_id = await _session_id(request)
+    text = await _request_text(session_id, data)
+    language = data.get('language', 'es-ES')
+    if not text:
+        return web.json_response({'success': False, 'error': 'No se ha proporcionado texto para análisis'})
+
+    interim = '' if 'text' in data else (data.get('interim') or '').strip()
+    final_text = text[:len(text) - len(interim)].rstrip()
+    estimate, reason = await _in_thread(session_sentiment.observe, session_id, final_text, interim,
+                                        force=bool(data.get('force')))
+    if not openai_service or not reason:
+        local = await _in_thread(session_sentiment.local_result, session_id, estimate)
+        return web.json_response(_publish(session_id, 'sentiment', local))
+
+    async def call():
+        return await openai_service.analyze_sentiment(await _prompt_context(session_id, text, language))
+
+    result = await _coordinated(session_id, 'sentiment', (text, language), call)
+    if result.get('superseded'):
+        return web.json_response(result)
+    _log_result('sentiment analysis', result)
+    if not result.get('success'):
+        local = await _in_thread(session_sentiment.local_result, session_id, estimate)
+        return web.json_response(dict(local, error=result.get('error')))
+    await _in_thread(session_sentiment.record_analysis, session_id, estimate, result)
+    return web.json_response(_publish(session_id, 'sentiment',
+                                      dict(result, local_sentiment=estimate, escalated=True, escalation_reason=reason)))
+
+
+async def analyze_conversation(request: web.Request) -> web.Response:
+    """Endpoint to get suggestions and sentiment analysis from a single LLM call."""
+    data = await request.json()
+    session_id = await _session_id(request)
+    text = await _request_text(session_id, data)
+    language = data.get('language', 'es-ES')
+
+    if not text:
+        return web.json_response({'success': False, 'error': 'No se ha proporcionado texto para análisis'})
+
+    if not openai_service:
+        return web.json_response({
+            'success': True,
+            'analysis': None,
+            'suggestions': f'⚠️ [MODO DEMO] Sugerencia basada en: {text[:50]}... Para obtener sugerencias reales, configura la API de OpenAI.',
+            'sentiment_analysis': '⚠️ [MODO DEMO] Análisis de sentimiento para el texto proporcionado. Configure la API de OpenAI para análisis real.'
+        })
+
+    async def call():
+        return await openai_service.analyze_conversation(await _prompt_context(session_id, text, language), language)
+
+    result = await _coordinated(session_id, 'analysis', (text, language), call)
+    if result.get('superseded'):
+        return web.json_response(result)
+    _log_result('conversation analysis', result)
+    return web.json_response(_publish(session_id, 'analysis', result))
+
+
+async def _refresh_summary(session_id, final: bool = False) -> None:
+    """Start a background update of the session's rolling summary if one is due."""
+    if background_summarizer and session_id:
+        await background_summarizer.schedule(session_id, final)
+
+
+async def _precomputed_summary(session_id, wait: bool):
+    """Async version of main._precomputed_summary."""
+    snapshot = await _in_thread(rolling_summaries.snapshot, session_id) if rolling_summaries and session_id else None
+    if snapshot is None or snapshot['freshness']['complete']:
+        return snapshot
+    await _refresh_summary(session_id, final=True)
+    if wait:
+        if not await background_summarizer.wait(session_id, timeout=float(os.getenv("ROLLING_SUMMARY_WAIT", "30"))):
+            return None
+        snapshot = await _in_thread(rolling_summaries.snapshot, session_id)
+        return snapshot if snapshot and snapshot['freshness']['complete'] else None
+    snapshot['freshness']['updating'] = rolling_summaries.is_updating(session_id)
+    return snapshot
+
+
+async def generate_summary(request: web.Request) -> web.Response:
+    """
+    Endpoint to generate a call summary from conversation text.
+
+    Without text, the precomputed summary is returned at once with its
+    'freshness' (same contract as main.py, including 'wait': true).
+    """
+    data = await request.json()
+    text = data.get('text', '')
+    session_id = await _session_id(request)
+    if not text and session_id:
+        snapshot = await _precomputed_summary(session_id, wait=bool(data.get('wait')))
+        if snapshot is not None:
+            rolling_summaries.record_served(snapshot)
+            await _in_thread(_store_summary, session_id, snapshot['call_summary'])
+            return web.json_response(_publish(session_id, 'summary', dict(snapshot, success=True, precomputed=True)))
+        text = await _in_thread(transcripts.text, session_id)
+
+    if not text:
+        return web.json_response({'success': False, 'error': 'No hay texto de conversación para resumir'})
+
+    if not openai_service:
+        return web.json_response({
+            'success': True,
+            'call_summary': '⚠️ [MODO DEMO] Resumen de la llamada. Configure la API de OpenAI para resúmenes reales.'
+        })
+
+    result = await openai_service.generate_call_summary(text)
+    _log_result('summary', result)
+    if result.get('success') and session_id:
+        await _in_thread(_store_summary, session_id, result.get('call_summary'))
+    return web.json_response(_publish(session_id, 'summary', result))
+
+
+async def _channel_analysis(session_id, interim: str, language: str):
+    """Run the live analysis of a session channel on the stored transcript plus the interim text."""
+    stored = await _in_thread(transcripts.text, session_id)
+    text = ' '.join(part for part in (stored, interim) if part)
+    if not text:
+        return None
+    if not openai_service:
+        return {
+            'success': True,
+            'analysis': None,
+            'suggestions': f'⚠️ [MODO DEMO] Sugerencia basada en: {text[:50]}... Para obtener sugerencias reales, configura la API de OpenAI.',
+            'sentiment_analysis': '⚠️ [MODO DEMO] Análisis de sentimiento para el texto proporcionado. Configure la API de OpenAI para análisis real.'
+        }
+    return await openai_service.analyze_conversation(await _prompt_context(session_id, text, language), language)
+
+
+async def _channel_summary(session_id) -> dict:
+    """Generate and store the call summary of a session channel (the precomputed one once up to date)."""
+    snapshot = await _precomputed_summary(session_id, wait=True)
+    if snapshot is not None:
+        rolling_summaries.record_served(snapshot)
+        await _in_thread(_store_summary, session_id, snapshot['call_summary'])
+        return dict(snapshot, success=True, precomputed=True)
+    text = await _in_thread(transcripts.text, session_id)
+    if not text:
+        return {'success': False, 'error': 'No hay texto de conversación para resumir'}
+    if not openai_service:
+        return {
+            'success': True,
+            'call_summary': '⚠️ [MODO DEMO] Resumen de la llamada. Configure la API de OpenAI para resúmenes reales.'
+        }
+    result = await openai_service.generate_call_summary(text)
+    if result.get('success'):
+        await _in_thread(_store_summary, session_id, result.get('call_summary'))
+    return result
+
+
+async def session_channel(request: web.Request) -> web.WebSocketResponse:
+    """
+    WebSocket channel of the current session.
+
+    The browser sends transcript segments, interim text and control messages;
+    the server decides when to run the live analysis and pushes analyses and
+    summaries as they become ready. Analyses and summaries run as tasks, so
+    messages keep being received while one is in flight; a summary requested
+    while another is being generated is answered by that one.
+    """
+    ws = web.WebSocketResponse(heartbeat=30)
+    await ws.prepare(request)
+    session_id = await _session_id(request)
+    if not session_id:
+        await ws.send_json({'type': 'error', 'error': 'Sesión no encontrada'})
+        await ws.close()
+        return ws
+
+    logger.info(f"Session channel opened for session {session_id}")
+    loop = asyncio.get_running_loop()
+    schedule = AnalysisSchedule()
+    state = {'interim': '', 'language': 'es-ES'}
+
+    async def run_analysis():
+        try:
+            with _channel_trace('/ws analysis'):
+                result = await _channel_analysis(session_id, state['interim'], state['language'])
+        finally:
+            schedule.finish()
+        if result is not None:
+            _publish(session_id, 'analysis', result)
+            if not ws.closed:
+                await ws.send_json(dict(result, type='analysis'))
+
+    async def run_summary():
+        with _channel_trace('/ws summary'):
+            result = _publish(session_id, 'summary', await _channel_summary(session_id))
+        if not ws.closed:
+            await ws.send_json(dict(result, type='summary'))
+
+    async def handle(message: dict):
+        nonlocal summary
+        if message['type'] == 'segment':
+            with _channel_trace('/ws segment'):
+                result = await _in_thread(
+                    transcripts.append, session_id, [(message['seq'], message['text'].strip())],
+                    reset=bool(message.get('reset'))
+                )
+                state['interim'] = ''
+                schedule.changed(loop.time(), final=True)
+                await _refresh_summary(session_id)
+            await ws.send_json({
+                'type': 'ack',
+                'seq': message['seq'],
+                'duplicates': result['duplicates'] if result else [],
+                'next_seq': result['next_seq'] if result else None
+            })
+        elif message['type'] == 'interim':
+            if message['text'].strip() != state['interim']:
+                state['interim'] = message['text'].strip()
+                schedule.changed(loop.time(), final=False)
+                event_bus.publish(session_id, 'interim', {'text': state['interim']})
+        elif message['type'] == 'language':
+            state['language'] = message['language']
+        elif message['type'] == 'summary':
+            if summary is None:
+                summary = asyncio.ensure_future(run_summary())
+        elif message['type'] == 'ping':
+            await ws.send_json({'type': 'pong'})
+
+    receiving = asyncio.ensure_future(ws.receive())
+    analysis = summary = None
+    try:
+        while True:
+            # Esperar al siguiente mensaje, al fin del análisis o resumen en curso o a que toque analizar
+            waiting = {receiving} | {task for task in (analysis, summary) if task}
+            await asyncio.wait(waiting, timeout=schedule.due_in(loop.time()), return_when=asyncio.FIRST_COMPLETED)
+
+            if analysis and analysis.done():
+                if not analysis.cancelled() and analysis.exception():
+                    logger.error(f"Error in session channel analysis: {analysis.exception()}")
+                analysis = None
+            if summary and summary.done():
+                if not summary.cancelled() and summary.exception():
+                    logger.error(f"Error in session channel summary: {summary.exception()}")
+                summary = None
+
+            if receiving.done():
+                msg = receiving.result()
+                if msg.type in (WSMsgType.CLOSE, WSMsgType.CLOSING, WSMsgType.CLOSED, WSMsgType.ERROR):
+                    break
+                if msg.type == WSMsgType.TEXT:
+                    try:
+                        await handle(parse_message(msg.data))
+                    except ChannelMessageError as e:
+                        await ws.send_json({'type': 'error', 'error': str(e)})
+                receiving = asyncio.ensure_future(ws.receive())
+
+            if schedule.due_in(loop.time()) == 0:
+                schedule.start(loop.time())
+                analysis = asyncio.ensure_future(run_analysis())
+    finally:
+        for task in (receiving, analysis, summary):
+            if task and not task.done():
+                task.cancel()
+    return ws
+
+
+def _supervisor_authorized(request: web.Request) -> bool:
+    """Whether the request carries the supervisor token (without SUPERVISOR_TOKEN, only if SUPERVISOR_OPEN=true)."""
+    token = os.getenv("SUPERVISOR_TOKEN")
+    if not token:
+        # Sin token las transcripciones quedan cerradas salvo que se abran a propósito (p. ej. en desarrollo)
+        return os.getenv("SUPERVISOR_OPEN", "false").lower() == "true"
+    given = request.query.get('token') or request.headers.get('Authorization', '').replace('Bearer ', '', 1)
+    return hmac.compare_digest(given.encode(), token.encode())
+
+
+def _supervised_sessions(request: web.Request):
+    """Session ids requested in ?session= (repeated or comma-separated), or None for every session."""
+    session_ids = [session_id for value in request.query.getall('session', []) for session_id in value.split(',') if session_id]
+    return session_ids or None
+
+
+def _supervisor_snapshot(session_ids, subscription) -> list:
+    """The full transcript and latest events of the watched sessions, sent first to a supervisor connecting mid-call."""
+    return [
+        BusEvent(session_id, 'transcript', {'text': transcripts.text(session_id), 'reset': True})
+        for session_id in session_ids or () if session_id in session_store
+    ] + subscription.snapshot
+
+
+SUPERVISOR_DROPPED = {'type': 'dropped', 'error': 'Demasiados eventos pendientes: vuelve a conectar'}
+
+
+async def supervisor_events(request: web.Request) -> web.StreamResponse:
+    """Stream the live events of some sessions (?session=, every session by default) as Server-Sent Events (see main.py)."""
+    if not _supervisor_authorized(request):
+        return web.json_response({'success': False, 'error': 'No autorizado'}, status=403)
+    session_ids = _supervised_sessions(request)
+    subscription = event_bus.subscribe(session_ids, loop=asyncio.get_running_loop())
+    heartbeat = float(os.getenv("SUPERVISOR_HEARTBEAT", "15"))
+    try:
+        response = web.StreamResponse(headers={
+            'Content-Type': 'text/event-stream',
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no'
+        })
+        await response.prepare(request)
+        for event in await _in_thread(_supervisor_snapshot, session_ids, subscription):
+            await response.write(event.sse.encode('utf-8'))
+        while True:
+            events = await subscription.aget(timeout=heartbeat)
+            if subscription.dropped:
+                payload = json.dumps(SUPERVISOR_DROPPED, ensure_ascii=False)
+                await response.write(f"event: dropped\ndata: {payload}\n\n".encode('utf-8'))
+                break
+            # Un comentario SSE mantiene viva la conexión a través de los proxies
+            frames = ''.join(event.sse for event in events) if events else ': ping\n\n'
+            await response.write(frames.encode('utf-8'))
+        await response.write_eof()
+        return response
+    finally:
+        event_bus.unsubscribe(subscription)
+
+
+async def supervisor_channel(request: web.Request) -> web.WebSocketResponse:
+    """WebSocket version of /supervisor/events: each event is sent as a JSON message."""
+    ws = web.WebSocketResponse(heartbeat=30)
+    await ws.prepare(request)
+    if not _supervisor_authorized(request):
+        await ws.send_json({'type': 'error', 'error': 'No autorizado'})
+        await ws.close()
+        return ws
+
+    session_ids = _supervised_sessions(request)
+    subscription = event_bus.subscribe(session_ids, loop=asyncio.get_running_loop())
+    heartbeat = float(os.getenv("SUPERVISOR_HEARTBEAT", "15"))
+    # Leer los mensajes del cliente para detectar el cierre de la conexión
+    receiving = asyncio.ensure_future(ws.receive())
+    getting = None
+    try:
+        for event in await _in_thread(_supervisor_snapshot, session_ids, subscription):
+            await ws.send_str(event.data)
+        while True:
+            if getting is None or getting.done():
+                getting = asyncio.ensure_future(subscription.aget(timeout=heartbeat))
+            await asyncio.wait({receiving, getting}, return_when=asyncio.FIRST_COMPLETED)
+            if getting.done():
+                events = getting.result()
+                if subscription.dropped:
+                    await ws.send_json(SUPERVISOR_DROPPED)
+                    break
+                for event in events:
+                    await ws.send_str(event.data)
+                if not events:
+                    await ws.send_json({'type': 'ping'})
+            if receiving.done():
+                if receiving.result().type in (WSMsgType.CLOSE, WSMsgType.CLOSING, WSMsgType.CLOSED, WSMsgType.ERROR):
+                    break
+                receiving = asyncio.ensure_future(ws.receive())
+    finally:
+        for task in (receiving, getting):
+            if task and not task.done():
+                task.cancel()
+        event_bus.unsubscribe(subscription)
+    await ws.close()
+    return ws
+
+
+async def _sse_response(request: web.Request, events) -> web.StreamResponse:
+    """Write an async iterator of events as a Server-Sent-Events response."""
+    response = web.StreamResponse(headers={
+        'Content-Type': 'text/event-stream',
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+    await response.prepare(request)
+    async for event in events:
+        payload = json.dumps(event, ensure_ascii=False)
+        await response.write(f"event: {event.get('type', 'message')}\ndata: {payload}\n\n".encode('utf-8'))
+    await response.write_eof()
+    return response
+
+
+async def _demo_stream(field_text: str):
+    """Yield a single-token stream for demo mode (no OpenAI service)."""
+    yield {'type': 'token', 'content': field_text}
+    yield {'type': 'done', 'success': True, 'model': None, 'finish_reason': 'stop', 'usage': None}
+
+
+def _log_result(operation: str, result: dict) -> None:
+    """Log the outcome of an LLM call."""
+    if not result.get('success'):
+        logger.error(f"Error getting {operation}: {result.get('error')}")
+    else:
+        logger.info(f"Successfully got {operation} using model: {result.get('model')}")
+
+
+async def _close_service(app: web.Application) -> None:
+    """Close the pooled HTTP session on shutdown."""
+    if openai_service:
+        await openai_service.close()
+
+
+def _query_int(request: web.Request, name: str, default: int) -> int:
+    """An integer query parameter, or its default if missing or malformed."""
+    try:
+        return int(request.query.get(name, default))
+    except ValueError:
+        return default
+
+
+async def search_calls(request: web.Request) -> web.Response:
+    """Search past calls by their transcript and summary (see main.py)."""
+    if not _supervisor_authorized(request):
+        return web.json_response({'success': False, 'error': 'No autorizado'}, status=403)
+    if not call_index:
+        return web.json_response({'success': False, 'error': 'Búsqueda de llamadas no disponible'})
+    query = request.query.get('q', '').strip()
+    if not query:
+        return web.json_response({'success': False, 'error': 'Falta el texto a buscar (q)'}, status=400)
+    search = functools.partial(
+        call_index.search,
+        query,
+        language=request.query.get('lang'),
+        field=request.query.get('field'),
+        page=_query_int(request, 'page', 1),
+        per_page=_query_int(request, 'per_page', 20)
+    )
+    with span('search'):
+        # SQLite bloquea: la consulta va a un hilo para no detener el bucle de eventos
+        result = await asyncio.get_running_loop().run_in_executor(None, search)
+    return web.json_response(dict(result, success=True))
+
+
+async def get_call(request: web.Request) -> web.Response:
+    """Return the stored transcript and summary of a past call."""
+    if not _supervisor_authorized(request):
+        return web.json_response({'success': False, 'error': 'No autorizado'}, status=403)
+    call = None
+    if call_index:
+        call = await asyncio.get_running_loop().run_in_executor(None, call_index.get, request.match_info['session_id'])
+    if call is None:
+        return web.json_response({'success': False, 'error': 'Llamada no encontrada'}, status=404)
+    return web.json_response({'success': True, 'call': call})
+
+
+async def search_stats(request: web.Request) -> web.Response:
+    """Return the indexed calls, the indexing backlog and the search latency."""
+    if not call_index:
+        return web.json_response({'success': False, 'error': 'Búsqueda de llamadas no disponible'})
+    return web.json_response({'success': True, 'search': call_index.get_stats()})
+
+
+def create_app() -> web.Application:
+    """Build the aiohttp application."""
+    app = web.Application(middlewares=[observe_request])
+    app.router.add_get('/', index)
+    app.router.add_get('/metrics', metrics_endpoint)
+    app.router.add_get('/ws', session_channel)
+    app.router.add_get('/supervisor/ws', supervisor_channel)
+    app.router.add_get('/supervisor/events', supervisor_events)
+    app.router.add_post('/new-session', new_session)
+    app.router.add_get('/cache-stats', cache_stats)
+    app.router.add_get('/model-stats', model_stats)
+    app.router.add_get('/session-stats', session_stats)
+    app.router.add_get('/sentiment-stats', sentiment_stats)
+    app.router.add_get('/summary-stats', summary_stats)
+    app.router.add_get('/upstream-stats', upstream_stats)
+    app.router.add_get('/event-stats', event_stats)
+    app.router.add_get('/trace-stats', trace_stats)
+    app.router.add_get('/traces/{trace_id}', get_trace)
+    app.router.add_get('/search', search_calls)
+    app.router.add_get('/search-stats', search_stats)
+    app.router.add_get('/calls/{session_id}', get_call)
+    app.router.add_get('/transcription-stats', transcription_stats)
+    app.router.add_post('/transcribe', transcribe)
+    app.router.add_post('/update-transcript', update_transcript)
+    app.router.add_post('/append-transcript', append_transcript)
+    app.router.add_post('/get-suggestions', get_suggestions)
+    app.router.add_post('/get-suggestions/stream', stream_suggestions)
+    app.router.add_post('/ask-question', ask_question)
+    app.router.add_post('/ask-question/stream', stream_ask_question)
+    app.router.add_post('/analyze-sentiment', analyze_sentiment)
+    app.router.add_post('/analyze-conversation', analyze_conversation)
+    app.router.add_post('/generate-summary', generate_summary)
+    app.router.add_static('/static', os.path.join(BASE_DIR, 'static'))
+    app.on_response_prepare.append(_trace_headers)
+    app.on_cleanup.append(_close_service)
+    return app
+
+
+if __name__ == '__main__':
+    web.run_app(create_app(), host='0.0.0.0', port=int(os.getenv("PORT", "8501")))
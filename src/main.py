@@ -1,10 +1,42 @@
-from flask import Flask, render_template, request, jsonify, session
+from flask import Flask, render_template, request, jsonify, session, Response, stream_with_context, g
+from flask.json.provider import DefaultJSONProvider
+from flask.sessions import SecureCookieSessionInterface
 import os
+import contextvars
+import hmac
+import json
 import logging
+import threading
+import time
 import uuid
+from contextlib import contextmanager
 from datetime import datetime
 from dotenv import load_dotenv
+from services.audio_transcription import (
+    DEFAULT_SAMPLE_RATE, AudioTranscriber, TranscriberBusyError, create_asr_backend, wav_to_pcm
+)
+from services.knowledge_index import META_FILE, KnowledgeIndex, KnowledgeRetriever
+from services.llm_backend import create_llm_backend
+from services.metrics import Metrics
 from services.openai_service import OpenAIService
+from services.response_cache import ResponseCache
+from services.rolling_summary import BackgroundSummarizer, RollingSummaries
+from services.semantic_cache import SemanticAnswerCache
+from services.sentiment_scorer import SentimentScorer, SessionSentiment
+from services.context_window import ConversationContextManager
+from services.call_search import CallSearchIndex
+from services.event_bus import BusEvent, SessionEventBus
+from services.request_coordinator import RequestCoordinator, RequestSupersededError
+from services.session_store import create_session_store
+from services.tracing import Tracer, record_span, span
+from services.transcript_log import SessionTranscripts, TranscriptLog, TranscriptSegments, parse_segments
+from services.upstream_scheduler import UpstreamScheduler, current_session
+from services.session_channel import AnalysisSchedule, ChannelMessageError, parse_message
+
+try:
+    from flask_sock import Sock
+except ImportError:  # flask-sock es opcional: sin él el navegador usa peticiones HTTP
+    Sock = None
 
 # Configurar logging
 logging.basicConfig(
@@ -16,6 +48,10 @@ logger = logging.getLogger(__name__)
 # Load environment variables
 load_dotenv()
 
+# Directorio de los datos que genera la aplicación (sesiones, llamadas, transcripciones, trazas, índice RAG)
+DATA_DIR = os.getenv("DATA_DIR", "data")
+os.makedirs(DATA_DIR, exist_ok=True)
+
 # Initialize Flask app
 app = Flask(__name__, 
     static_folder='static',
@@ -23,30 +59,389 @@ app = Flask(__name__,
 )
 app.secret_key = os.getenv("SECRET_KEY", "sandetel_rag_solution_secret")
 
-# Almacenamiento para las sesiones de conversación
-conversation_sessions = {}
+class TracedSessionInterface(SecureCookieSessionInterface):
+    """Cookie sessions whose decoding time is added to the request trace."""
+    
+    def open_session(self, app, request):
+        started = time.time()
+        try:
+            return super().open_session(app, request)
+        finally:
+            # La sesión se abre antes de before_request: la traza aún no existe
+            g.session_decoded = (started, time.time() - started)
+
+class TracedJSONProvider(DefaultJSONProvider):
+    """JSON provider timing the serialization of the responses in the request trace."""
+    
+    def dumps(self, obj, **kwargs):
+        with span('serialize'):
+            return super().dumps(obj, **kwargs)
+
+app.session_interface = TracedSessionInterface()
+app.json = TracedJSONProvider(app)
+
+# Canal WebSocket por sesión (solo si flask-sock está instalado)
+sock = Sock(app) if Sock else None
+
+# Almacenamiento para las sesiones de conversación: expiran por inactividad y
+# con un límite de memoria total. El backend 'sqlite' se comparte entre workers.
+session_store = create_session_store(
+    os.getenv("SESSION_STORE", "memory"),
+    db_path=os.getenv("SESSION_STORE_PATH", os.path.join(DATA_DIR, "sessions.db")),
+    idle_ttl=float(os.getenv("SESSION_IDLE_TTL", "3600")),
+    max_bytes=int(os.getenv("SESSION_MAX_MEMORY_MB", "256")) * 1024 * 1024
+)
+
+# Eventos en vivo de las sesiones para los paneles de supervisión (por proceso)
+event_bus = SessionEventBus(max_queue=int(os.getenv("EVENT_QUEUE_SIZE", "256")))
+
+# Índice de búsqueda de las llamadas pasadas (transcripciones y resúmenes), persistido en disco
+call_index = None
+if os.getenv("SEARCH_INDEX", "true").lower() == "true":
+    call_index = CallSearchIndex(
+        os.getenv("SEARCH_INDEX_PATH", os.path.join(DATA_DIR, "calls.db")),
+        flush_interval=float(os.getenv("SEARCH_FLUSH_INTERVAL", "2")),
+        default_language=os.getenv("SEARCH_DEFAULT_LANGUAGE", "es"),
+        max_candidates=int(os.getenv("SEARCH_MAX_CANDIDATES", "500")),
+        reindex_interval=float(os.getenv("SEARCH_REINDEX_INTERVAL", "60"))
+    )
+
+# Segmentos finalizados de la transcripción: en memoria por sesión y en un log diario en disco
+transcripts = SessionTranscripts(
+    session_store,
+    TranscriptSegments(max_sessions=int(os.getenv("TRANSCRIPT_MAX_SESSIONS", "1000"))),
+    TranscriptLog(os.getenv("TRANSCRIPT_LOG_DIR", os.path.join(DATA_DIR, "transcripts"))),
+    events=event_bus,
+    search_index=call_index
+)
+
+# Caché de respuestas del LLM (opcionalmente persistida en disco)
+response_cache = ResponseCache(
+    max_entries=int(os.getenv("RESPONSE_CACHE_SIZE", "1000")),
+    db_path=os.getenv("RESPONSE_CACHE_PATH") or None
+)
+
+# Métricas Prometheus (expuestas en /metrics si prometheus_client está instalado)
+metrics = Metrics()
+
+# Trazas por petición; las peticiones lentas se guardan con sus muestras de pila para analizarlas
+tracer = Tracer(
+    slow_ms=float(os.getenv("TRACE_SLOW_MS", "3000")),
+    profile_dir=os.getenv("TRACE_PROFILE_DIR", os.path.join(DATA_DIR, "profiles")) or None,
+    profile_rate=float(os.getenv("TRACE_PROFILE_RATE", "0")),
+    sample_interval=float(os.getenv("TRACE_SAMPLE_INTERVAL_MS", "50")) / 1000
+)
+# Conexiones que duran toda la llamada: no se trazan enteras (serían siempre "lentas"), sino mensaje a mensaje
+UNTRACED_ROUTES = {'/ws', '/supervisor/ws', '/supervisor/events'}
+
+# Base de conocimiento local para fundamentar las respuestas a preguntas (RAG)
+knowledge_retriever = None
+knowledge_index_dir = os.getenv("KNOWLEDGE_INDEX_DIR", os.path.join(DATA_DIR, "knowledge_index"))
+if os.path.exists(os.path.join(knowledge_index_dir, META_FILE)):
+    knowledge_retriever = KnowledgeRetriever(
+        KnowledgeIndex(knowledge_index_dir),
+        top_k=int(os.getenv("RAG_TOP_K", "3")),
+        min_score=float(os.getenv("RAG_MIN_SCORE")) if os.getenv("RAG_MIN_SCORE") else None
+    )
+    logger.info(f"Knowledge index loaded: {len(knowledge_retriever.index)} passages")
+
+# Caché semántica de respuestas a preguntas, compartida por todos los agentes del proceso
+answer_cache = None
+if os.getenv("SEMANTIC_CACHE", "true").lower() == "true":
+    answer_cache = SemanticAnswerCache(
+        embedder=knowledge_retriever.embedder if knowledge_retriever else None,
+        threshold=float(os.getenv("SEMANTIC_CACHE_THRESHOLD")) if os.getenv("SEMANTIC_CACHE_THRESHOLD") else None,
+        max_entries=int(os.getenv("SEMANTIC_CACHE_SIZE", "2000")),
+        ttl=float(os.getenv("SEMANTIC_CACHE_TTL", "3600"))
+    )
+
+metrics.register_stores(session_store, response_cache, answer_cache)
+
+# Admisión de las peticiones al modelo: límites de la cuenta y prioridad por tipo de petición
+upstream_scheduler = UpstreamScheduler(
+    rpm=float(os.getenv("UPSTREAM_RPM", "0")) or None,
+    tpm=float(os.getenv("UPSTREAM_TPM", "0")) or None,
+    max_retries=int(os.getenv("UPSTREAM_MAX_RETRIES", "3"))
+)
 
 # Initialize services
 openai_service = None
 try:
-    openai_service = OpenAIService()
+    # Backend de las completions: la API de OpenAI o un servidor compatible propio (LLM_BACKEND=local)
+    llm_backend = create_llm_backend(
+        os.getenv("LLM_BACKEND", "openai"),
+        base_url=os.getenv("LOCAL_LLM_URL"),
+        api_key=os.getenv("LOCAL_LLM_API_KEY"),
+        chat_template=os.getenv("LOCAL_LLM_CHAT_TEMPLATE", "chatml"),
+        batch_size=int(os.getenv("LLM_BATCH_SIZE", "8")),
+        batch_wait=float(os.getenv("LLM_BATCH_WAIT_MS", "20")) / 1000,
+        max_in_flight=int(os.getenv("LLM_BATCH_IN_FLIGHT", "2"))
+    )
+    openai_service = OpenAIService(cache=response_cache, metrics=metrics, retriever=knowledge_retriever,
+                                   answer_cache=answer_cache, scheduler=upstream_scheduler, backend=llm_backend,
+                                   models=os.getenv("LLM_MODELS").split(',') if os.getenv("LLM_MODELS") else None)
     logger.info("OpenAI service initialized successfully")
 except ValueError as e:
     logger.warning(f"OpenAI service initialization failed: {e}")
     logger.warning("The application will run without OpenAI integration")
 
+# Transcripción de audio en el servidor (VAD + ASR local en CPU)
+audio_transcriber = None
+try:
+    audio_transcriber = AudioTranscriber(
+        create_asr_backend(
+            os.getenv("ASR_BACKEND", "stub"),
+            model=os.getenv("ASR_MODEL", "base"),
+            cpu_threads=int(os.getenv("ASR_CPU_THREADS", "0"))
+        ),
+        max_workers=int(os.getenv("ASR_WORKERS", "2")),
+        max_pending=int(os.getenv("ASR_MAX_PENDING", "8"))
+    )
+except ValueError as e:
+    logger.warning(f"Audio transcription initialization failed: {e}")
+
+def _generate_context_digest(previous_digest, older_text, language, max_tokens):
+    """Summarize older turns with the LLM, or return None to use the local fallback."""
+    if not openai_service:
+        return None
+    result = openai_service.generate_context_digest(previous_digest, older_text, language, max_tokens)
+    if not result.get('success'):
+        logger.error(f"Error generating context digest: {result.get('error')}")
+        return None
+    return result.get('digest')
+
+# Ventana de contexto acotada por tokens para los prompts en tiempo real
+context_manager = ConversationContextManager(
+    token_budget=int(os.getenv("CONTEXT_TOKEN_BUDGET", "1500")),
+    digest_max_tokens=int(os.getenv("CONTEXT_DIGEST_TOKENS", "250")),
+    digest_refresh_tokens=int(os.getenv("CONTEXT_DIGEST_REFRESH_TOKENS", "400")),
+    digest_fn=_generate_context_digest
+)
+
+# Sentimiento estimado localmente por sesión; el LLM solo se consulta si cambia
+session_sentiment = SessionSentiment(
+    session_store,
+    SentimentScorer(half_life_words=int(os.getenv("SENTIMENT_HALF_LIFE_WORDS", "40"))),
+    shift=float(os.getenv("SENTIMENT_SHIFT", "0.3")),
+    cooldown=float(os.getenv("SENTIMENT_COOLDOWN", "5"))
+)
+
+# Resumen de cada llamada mantenido en segundo plano mientras dura, para que
+# al colgar solo quede por fusionar el último tramo
+rolling_summaries = None
+background_summarizer = None
+if openai_service and os.getenv("ROLLING_SUMMARY", "true").lower() == "true":
+    rolling_summaries = RollingSummaries(
+        session_store,
+        transcripts,
+        refresh_tokens=int(os.getenv("ROLLING_SUMMARY_TOKENS", "400")),
+        min_interval=float(os.getenv("ROLLING_SUMMARY_INTERVAL", "30")),
+        max_tokens=openai_service.summary_chunk_tokens()
+    )
+    background_summarizer = BackgroundSummarizer(
+        rolling_summaries,
+        openai_service.update_call_summary,
+        max_workers=int(os.getenv("ROLLING_SUMMARY_WORKERS", "1"))
+    )
+
+def _refresh_summary(session_id, final: bool = False) -> None:
+    """Queue a background update of the session's rolling summary if one is due."""
+    if background_summarizer and session_id:
+        background_summarizer.schedule(session_id, final)
+
+def _precomputed_summary(session_id, wait: bool):
+    """
+    Return the rolling summary of a session with its freshness, or None if there is none.
+    
+    If it does not cover the whole transcript the final merge is queued; with
+    wait, the merge is awaited and None is returned if it cannot be done.
+    """
+    snapshot = rolling_summaries.snapshot(session_id) if rolling_summaries and session_id else None
+    if snapshot is None or snapshot['freshness']['complete']:
+        return snapshot
+    _refresh_summary(session_id, final=True)
+    if wait:
+        if not background_summarizer.wait(session_id, timeout=float(os.getenv("ROLLING_SUMMARY_WAIT", "30"))):
+            return None
+        snapshot = rolling_summaries.snapshot(session_id)
+        return snapshot if snapshot and snapshot['freshness']['complete'] else None
+    snapshot['freshness']['updating'] = rolling_summaries.is_updating(session_id)
+    return snapshot
+
+# Una única llamada en curso por (sesión, endpoint); la más reciente gana
+request_coordinator = RequestCoordinator()
+
+SUPERSEDED_RESPONSE = {
+    'success': False,
+    'superseded': True,
+    'error': 'Solicitud reemplazada por otra más reciente'
+}
+
+def _coordinated(session_id, endpoint: str, request_key, fn) -> dict:
+    """Run an LLM call under per-session single-flight coordination."""
+    try:
+        return request_coordinator.run(session_id, endpoint, request_key, fn)
+    except RequestSupersededError:
+        logger.info(f"Discarding superseded {endpoint} result for session {session_id}")
+        return dict(SUPERSEDED_RESPONSE)
+
+def _coordinated_stream(session_id, endpoint: str, request_key, events):
+    """Relay a stream of events, aborting it when a newer request supersedes it."""
+    ticket = request_coordinator.start(session_id, endpoint, request_key)
+    try:
+        for event in events:
+            if ticket.is_cancelled:
+                logger.info(f"Aborting superseded {endpoint} stream for session {session_id}")
+                yield dict(SUPERSEDED_RESPONSE, type='superseded')
+                return
+            yield event
+    finally:
+        # Cerrar el generador detiene la lectura de la respuesta del modelo
+        events.close()
+        request_coordinator.release(session_id, endpoint, ticket)
+
+def _store_summary(session_id, summary: str) -> None:
+    """Keep the call summary in the session and queue it for indexing in the call search."""
+    session_store.update(session_id, {'summary': summary})
+    if call_index:
+        call_index.set_summary(session_id, summary)
+
+def _publish(session_id, event_type: str, result: dict) -> dict:
+    """Publish a successful result of the session to the supervisors and return it unchanged."""
+    if result.get('success'):
+        event_bus.publish(session_id, event_type, result)
+    return result
+
+def _published_stream(session_id, event_type: str, field: str, events):
+    """Relay a stream of events, publishing the full text under field once it is done."""
+    tokens = []
+    try:
+        for event in events:
+            if event.get('type') == 'token':
+                tokens.append(event['content'])
+            elif event.get('type') == 'done':
+                _publish(session_id, event_type, dict(event, **{field: ''.join(tokens)}))
+            yield event
+    finally:
+        events.close()
+
+def _prompt_context(session_id, text: str, language: str = 'es-ES') -> str:
+    """Return the conversation text to send to the LLM for the given session."""
+    with span('context'):
+        session_data = session_store.get(session_id) if session_id else None
+        if session_data is None:
+            return text
+        context = context_manager.build_context(session_data, text, language)
+        # Guardar el estado del digest para la siguiente petición de la sesión
+        session_store.update(session_id, {'context': session_data['context']})
+        return context
+
+def _request_text(session_id) -> str:
+    """
+    Return the conversation text of a request.
+    
+    Clients either send the full transcript in 'text', which replaces the
+    stored one, or only the unfinalized 'interim' tail, which is added to the
+    segments already sent to /append-transcript.
+    """
+    if 'text' in request.json:
+        text = request.json.get('text') or ''
+        if session_id:
+            # Sustituye también los segmentos ya enviados, que si no seguirían ganando en transcripts.text()
+            transcripts.replace(session_id, text)
+        return text
+    interim = (request.json.get('interim') or '').strip()
+    event_bus.publish(session_id, 'interim', {'text': interim})
+    return ' '.join(part for part in (transcripts.text(session_id), interim) if part)
+
+def _sse_event(event: dict) -> str:
+    """Format a streaming event as a Server-Sent-Events message."""
+    event_type = event.get('type', 'message')
+    return f"event: {event_type}\ndata: {json.dumps(event, ensure_ascii=False)}\n\n"
+
+def _sse_response(events) -> Response:
+    """Build a Server-Sent-Events response from an iterator of events."""
+    def generate():
+        for event in events:
+            yield _sse_event(event)
+    
+    response = Response(stream_with_context(generate()), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+def _demo_stream(field_text: str):
+    """Yield a single-token stream for demo mode (no OpenAI service)."""
+    yield {'type': 'token', 'content': field_text}
+    yield {'type': 'done', 'success': True, 'model': None, 'finish_reason': 'stop', 'usage': None}
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.time()
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    decoded = g.pop('session_decoded', None)
+    if route not in UNTRACED_ROUTES:
+        g.trace = tracer.start(route, request.headers.get('X-Request-ID'), started=decoded[0] if decoded else None)
+        if decoded:
+            record_span('session', *decoded)
+    # Las peticiones al modelo de esta ruta cuentan para la sesión del agente
+    current_session.set(session.get('session_id'))
+
+@app.after_request
+def observe_request(response):
+    """Record the latency of the request per route (time to the response headers for streams)."""
+    started = g.pop('request_started', None)
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        metrics.observe_request(route, request.method, response.status_code, time.time() - started)
+    trace = g.pop('trace', None)
+    if trace is not None:
+        response.headers['X-Request-ID'] = trace.trace_id
+        timing = trace.server_timing()
+        if timing:
+            response.headers['Server-Timing'] = timing
+        # Las respuestas en streaming terminan al cerrarse, no al devolver la vista
+        response.call_on_close(lambda: _finish_trace(trace, response.status_code))
+    return response
+
+def _finish_trace(trace, status: int) -> None:
+    duration = tracer.finish(trace, status)
+    if duration >= tracer.slow_ms:
+        client = f", client id {trace.client_id}" if trace.client_id else ""
+        logger.warning(f"Slow request {trace.root.name}: {duration:.0f} ms (trace {trace.trace_id}{client})")
+
+@contextmanager
+def _channel_trace(name: str):
+    """Trace one unit of work of a long-lived channel (e.g. a WebSocket message) as its own request."""
+    trace = tracer.start(name)
+    status = 500
+    try:
+        yield trace
+        status = 200
+    finally:
+        _finish_trace(trace, status)
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Expose the Prometheus metrics."""
+    if not metrics.enabled:
+        return jsonify({'success': False, 'error': 'Métricas no disponibles: instala prometheus_client'}), 503
+    body, content_type = metrics.exposition()
+    return Response(body, content_type=content_type)
+
 @app.route('/')
 def index():
     """Render the main page of the application."""
-    # Crear una nueva sesión si no existe
-    if 'session_id' not in session:
+    # Crear una nueva sesión si no existe o si ha expirado
+    if 'session_id' not in session or session['session_id'] not in session_store:
         session['session_id'] = str(uuid.uuid4())
         session['start_time'] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        conversation_sessions[session['session_id']] = {
+        session_store.create(session['session_id'], {
             'transcript': '',
             'start_time': session['start_time'],
             'client_info': {}
-        }
+        })
+        event_bus.publish(session['session_id'], 'session', {'start_time': session['start_time']})
     
     return render_template('index.html', 
                           session_id=session['session_id'],
@@ -60,17 +455,21 @@ def new_session():
     if old_session_id:
         logger.info(f"Storing previous session: {old_session_id}")
         # Aquí podríamos guardar la sesión en una base de datos permanente
+        if call_index:
+            # La llamada anterior ha terminado: sus últimos segmentos pasan ya al índice de búsqueda
+            call_index.finish(old_session_id)
     
     # Crear nueva sesión
     session['session_id'] = str(uuid.uuid4())
     session['start_time'] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     
-    conversation_sessions[session['session_id']] = {
+    session_store.create(session['session_id'], {
         'transcript': '',
         'start_time': session['start_time'],
         'client_info': {}
-    }
+    })
     
+    event_bus.publish(session['session_id'], 'session', {'start_time': session['start_time']})
     logger.info(f"Created new session: {session['session_id']}")
     return jsonify({
         'success': True,
@@ -78,42 +477,206 @@ def new_session():
         'start_time': session['start_time']
     })
 
+@app.route('/cache-stats', methods=['GET'])
+def cache_stats():
+    """Return hit/miss statistics of the LLM response cache and the semantic answer cache."""
+    return jsonify({
+        'success': True,
+        'cache': response_cache.get_stats(),
+        'semantic_cache': answer_cache.get_stats() if answer_cache else None
+    })
+
+@app.route('/model-stats', methods=['GET'])
+def model_stats():
+    """Return rolling latency, error rate and circuit state per model, and the backend counters."""
+    if not openai_service:
+        return jsonify({'success': False, 'error': 'Servicio de OpenAI no disponible'})
+    return jsonify({
+        'success': True,
+        'models': openai_service.router.get_stats(),
+        'backend': openai_service.backend.get_stats()
+    })
+
+@app.route('/session-stats', methods=['GET'])
+def session_stats():
+    """Return the size and eviction counters of the session store."""
+    return jsonify({
+        'success': True,
+        'sessions': session_store.get_stats()
+    })
+
+@app.route('/sentiment-stats', methods=['GET'])
+def sentiment_stats():
+    """Return how many sentiment requests were answered locally and escalated to the LLM."""
+    return jsonify({
+        'success': True,
+        'sentiment': session_sentiment.get_stats()
+    })
+
+@app.route('/upstream-stats', methods=['GET'])
+def upstream_stats():
+    """Return the admissions, sheds and queueing time per priority class of the upstream scheduler."""
+    return jsonify({
+        'success': True,
+        'upstream': upstream_scheduler.get_stats()
+    })
+
+@app.route('/summary-stats', methods=['GET'])
+def summary_stats():
+    """Return the background updates of the rolling call summaries and how often they were served complete."""
+    if not rolling_summaries:
+        return jsonify({'success': False, 'error': 'Resumen en segundo plano no disponible'})
+    return jsonify({
+        'success': True,
+        'summaries': rolling_summaries.get_stats()
+    })
+
+@app.route('/event-stats', methods=['GET'])
+def event_stats():
+    """Return the events published and delivered to the supervisors, and the subscribers dropped for lagging."""
+    return jsonify({
+        'success': True,
+        'events': event_bus.get_stats()
+    })
+
+@app.route('/trace-stats', methods=['GET'])
+def trace_stats():
+    """Return the traced and slow requests, and the latest slow ones with their trace ids."""
+    if not _supervisor_authorized():
+        return jsonify({'success': False, 'error': 'No autorizado'}), 403
+    return jsonify({
+        'success': True,
+        'tracing': tracer.get_stats()
+    })
+
+@app.route('/traces/<trace_id>', methods=['GET'])
+def get_trace(trace_id):
+    """Return the span tree of a recent request by its trace id (the X-Request-ID header of its response)."""
+    if not _supervisor_authorized():
+        return jsonify({'success': False, 'error': 'No autorizado'}), 403
+    trace = tracer.get(trace_id)
+    if trace is None:
+        return jsonify({'success': False, 'error': 'Traza no encontrada'}), 404
+    return jsonify({'success': True, 'trace': trace})
+
 @app.route('/transcribe', methods=['POST'])
 def transcribe():
-    """Endpoint to handle real-time transcription requests."""
-    # This will be implemented later to handle speech-to-text
-    # For now, we're just returning a mock response
-    return jsonify({'success': True, 'text': 'Mock transcription'})
+    """
+    Transcribe the next chunk of the session's audio on the server.
+    
+    The body is 16-bit mono PCM (sample rate in ?sample_rate=, 16000 by
+    default) or a WAV file. Chunks are sent in order; ?final=1 marks the end
+    of the audio. Recognized segments are appended to the session transcript.
+    """
+    session_id = session.get('session_id')
+    if not audio_transcriber:
+        return jsonify({'success': False, 'error': 'Transcripción de audio no disponible'})
+    if session_id not in session_store:
+        logger.warning("Session ID not found when transcribing audio")
+        return jsonify({'success': False, 'error': 'Sesión no encontrada'})
+    
+    language = request.args.get('language', 'es-ES')
+    final = request.args.get('final', '').lower() in ('1', 'true')
+    try:
+        if request.mimetype in ('audio/wav', 'audio/x-wav'):
+            pcm, sample_rate = wav_to_pcm(request.get_data())
+        else:
+            pcm, sample_rate = request.get_data(), int(request.args.get('sample_rate', DEFAULT_SAMPLE_RATE))
+        jobs = audio_transcriber.feed(session_id, pcm, sample_rate, language, final)
+    except TranscriberBusyError as e:
+        # El fragmento no se ha procesado: el cliente debe reenviarlo
+        logger.warning(f"Audio transcription busy: {e}")
+        return jsonify({'success': False, 'busy': True, 'error': str(e)}), 503
+    except ValueError as e:
+        return jsonify({'success': False, 'error': f'Audio no válido: {e}'})
+    
+    try:
+        result = jobs.result(timeout=float(os.getenv("ASR_TIMEOUT", "60")))
+    except Exception as e:
+        logger.error(f"Exception transcribing audio: {str(e)}")
+        return jsonify({'success': False, 'error': f'Error al transcribir el audio: {str(e)}'})
+    
+    return jsonify(_transcription_response(session_id, result))
+
+def _transcription_response(session_id, result: dict) -> dict:
+    """Append the recognized segments to the session and build the /transcribe response."""
+    segments = []
+    if result['segments']:
+        appended = transcripts.append_texts(session_id, result['segments'])
+        segments = [{'seq': seq, 'text': text} for seq, text in (appended or {}).get('accepted', [])]
+        logger.info(f"Transcribed {len(segments)} audio segments for session {session_id}")
+        _refresh_summary(session_id)
+    return {
+        'success': True,
+        'text': ' '.join(segment['text'] for segment in segments),
+        'segments': segments,
+        'partial': result['partial']
+    }
+
+@app.route('/transcription-stats', methods=['GET'])
+def transcription_stats():
+    """Return the ASR backend, worker pool occupancy and counters of the audio transcription."""
+    if not audio_transcriber:
+        return jsonify({'success': False, 'error': 'Transcripción de audio no disponible'})
+    return jsonify({
+        'success': True,
+        'transcription': audio_transcriber.get_stats()
+    })
 
 @app.route('/update-transcript', methods=['POST'])
 def update_transcript():
     """Update the stored transcript for the current session."""
     session_id = session.get('session_id')
-    if not session_id or session_id not in conversation_sessions:
+    text = request.json.get('text', '')
+    # El texto completo sustituye a los segmentos enviados hasta ahora
+    if not transcripts.replace(session_id, text):
         logger.warning("Session ID not found when updating transcript")
         return jsonify({
             'success': False,
             'error': 'Sesión no encontrada'
         })
-        
-    text = request.json.get('text', '')
-    conversation_sessions[session_id]['transcript'] = text
     
     logger.info(f"Updated transcript for session {session_id}")
+    _refresh_summary(session_id)
     return jsonify({
         'success': True
     })
 
+@app.route('/append-transcript', methods=['POST'])
+def append_transcript():
+    """Append new finalized transcript segments to the current session."""
+    session_id = session.get('session_id')
+    segments = parse_segments(request.json.get('segments'))
+    if segments is None:
+        logger.warning("Invalid segments received for append")
+        return jsonify({
+            'success': False,
+            'error': 'Segmentos no válidos: se esperaba una lista de {seq, text}'
+        })
+    
+    result = transcripts.append(session_id, segments, reset=bool(request.json.get('reset')))
+    if result is None:
+        logger.warning("Session ID not found when appending transcript")
+        return jsonify({
+            'success': False,
+            'error': 'Sesión no encontrada'
+        })
+    
+    logger.info(f"Appended {len(result['accepted'])} segments for session {session_id}")
+    _refresh_summary(session_id)
+    return jsonify({
+        'success': True,
+        'accepted': len(result['accepted']),
+        'duplicates': result['duplicates'],
+        'next_seq': result['next_seq']
+    })
+
 @app.route('/get-suggestions', methods=['POST'])
 def get_suggestions():
     """Endpoint to get suggestions from the LLM based on transcribed text."""
-    text = request.json.get('text', '')
-    language = request.json.get('language', 'es-ES')  # Default to Spanish if not specified
-    
-    # Actualizar la transcripción almacenada
     session_id = session.get('session_id')
-    if session_id and session_id in conversation_sessions:
-        conversation_sessions[session_id]['transcript'] = text
+    text = _request_text(session_id)
+    language = request.json.get('language', 'es-ES')  # Default to Spanish if not specified
     
     if not text:
         logger.warning("No text provided for suggestions")
@@ -124,12 +687,17 @@ def get_suggestions():
     
     if openai_service:
         logger.info(f"Getting suggestions for text: {text[:50]}... in language: {language}")
-        result = openai_service.get_suggestions(text, language)
+        result = _coordinated(
+            session_id, 'suggestions', (text, language),
+            lambda: openai_service.get_suggestions(_prompt_context(session_id, text, language), language)
+        )
+        if result.get('superseded'):
+            return jsonify(result)
         if not result.get('success'):
             logger.error(f"Error getting suggestions: {result.get('error')}")
         else:
             logger.info(f"Successfully got suggestions using model: {result.get('model')}")
-        return jsonify(result)
+        return jsonify(_publish(session_id, 'suggestions', result))
     else:
         # Fallback if OpenAI service is not available
         logger.warning("Using fallback suggestions (OpenAI service not available)")
@@ -138,6 +706,32 @@ def get_suggestions():
             'suggestions': f'⚠️ [MODO DEMO] Sugerencia basada en: {text[:50]}... Para obtener sugerencias reales, configura la API de OpenAI.'
         })
 
+@app.route('/get-suggestions/stream', methods=['POST'])
+def stream_suggestions():
+    """Stream suggestions token by token as Server-Sent Events."""
+    session_id = session.get('session_id')
+    text = _request_text(session_id)
+    language = request.json.get('language', 'es-ES')
+    
+    if not text:
+        logger.warning("No text provided for streaming suggestions")
+        return jsonify({
+            'success': False,
+            'error': 'No text provided'
+        })
+    
+    if openai_service:
+        logger.info(f"Streaming suggestions for text: {text[:50]}... in language: {language}")
+        prompt_text = _prompt_context(session_id, text, language)
+        events = _published_stream(session_id, 'suggestions', 'suggestions',
+                                   openai_service.stream_suggestions(prompt_text, language))
+        return _sse_response(_coordinated_stream(session_id, 'suggestions-stream', (text, language), events))
+    
+    logger.warning("Using fallback streaming suggestions (OpenAI service not available)")
+    return _sse_response(_demo_stream(
+        f'⚠️ [MODO DEMO] Sugerencia basada en: {text[:50]}... Para obtener sugerencias reales, configura la API de OpenAI.'
+    ))
+
 @app.route('/ask-question', methods=['POST'])
 def ask_question():
     """Endpoint to get answers to direct questions from the LLM."""
@@ -173,10 +767,40 @@ def ask_question():
             'answer': f'⚠️ [MODO DEMO] Respuesta a tu pregunta: "{question}". Para obtener respuestas reales, configura la API de OpenAI.'
         })
 
+@app.route('/ask-question/stream', methods=['POST'])
+def stream_ask_question():
+    """Stream the answer to a direct question token by token as Server-Sent Events."""
+    question = request.json.get('question', '')
+    
+    if not question:
+        logger.warning("No question provided for streaming answer")
+        return jsonify({
+            'success': False,
+            'error': 'No se ha proporcionado ninguna pregunta'
+        })
+    
+    if openai_service:
+        logger.info(f"Streaming answer for question: {question[:50]}...")
+        return _sse_response(openai_service.stream_answer_to_question(question))
+    
+    logger.warning("Using fallback streaming answer (OpenAI service not available)")
+    return _sse_response(_demo_stream(
+        f'⚠️ [MODO DEMO] Respuesta a tu pregunta: "{question}". Para obtener respuestas reales, configura la API de OpenAI.'
+    ))
+
 @app.route('/analyze-sentiment', methods=['POST'])
 def analyze_sentiment():
-    """Endpoint to analyze customer sentiment from conversation text."""
-    text = request.json.get('text', '')
+    """
+    Endpoint to analyze customer sentiment from conversation text.
+    
+    The sentiment is estimated locally on the new transcript text; the LLM
+    analysis runs only when the estimate changes significantly, or when
+    'force' is set (manual analysis). Otherwise the last LLM analysis of the
+    session is returned along with the local estimate ('local_sentiment').
+    """
+    session_id = session.get('session_id')
+    text = _request_text(session_id)
+    language = request.json.get('language', 'es-ES')
     
     if not text:
         logger.warning("No text provided for sentiment analysis")
@@ -185,38 +809,103 @@ def analyze_sentiment():
             'error': 'No se ha proporcionado texto para análisis'
         })
     
+    interim = '' if 'text' in request.json else (request.json.get('interim') or '').strip()
+    final_text = text[:len(text) - len(interim)].rstrip()
+    estimate, reason = session_sentiment.observe(session_id, final_text, interim, force=bool(request.json.get('force')))
+    
+    if not openai_service or not reason:
+        # Sin cambios significativos (o sin API): basta la estimación local
+        return jsonify(_publish(session_id, 'sentiment', session_sentiment.local_result(session_id, estimate)))
+    
+    logger.info(f"Analyzing sentiment for text: {text[:50]}... (reason: {reason})")
+    try:
+        result = _coordinated(
+            session_id, 'sentiment', (text, language),
+            lambda: openai_service.analyze_sentiment(_prompt_context(session_id, text, language))
+        )
+        if result.get('superseded'):
+            return jsonify(result)
+        if not result.get('success'):
+            logger.error(f"Error analyzing sentiment: {result.get('error')}")
+            return jsonify(dict(session_sentiment.local_result(session_id, estimate), error=result.get('error')))
+        logger.info(f"Successfully analyzed sentiment using model: {result.get('model')}")
+        session_sentiment.record_analysis(session_id, estimate, result)
+        return jsonify(_publish(session_id, 'sentiment',
+                                dict(result, local_sentiment=estimate, escalated=True, escalation_reason=reason)))
+    except Exception as e:
+        logger.error(f"Exception analyzing sentiment: {str(e)}")
+        return jsonify({
+            'success': False,
+            'error': f'Error al analizar el sentimiento: {str(e)}'
+        })
+
+@app.route('/analyze-conversation', methods=['POST'])
+def analyze_conversation():
+    """Endpoint to get suggestions and sentiment analysis from a single LLM call."""
+    session_id = session.get('session_id')
+    text = _request_text(session_id)
+    language = request.json.get('language', 'es-ES')
+    
+    if not text:
+        logger.warning("No text provided for conversation analysis")
+        return jsonify({
+            'success': False,
+            'error': 'No se ha proporcionado texto para análisis'
+        })
+    
     if openai_service:
-        logger.info(f"Analyzing sentiment for text: {text[:50]}...")
+        logger.info(f"Analyzing conversation for text: {text[:50]}... in language: {language}")
         try:
-            result = openai_service.analyze_sentiment(text)
+            result = _coordinated(
+                session_id, 'analysis', (text, language),
+                lambda: openai_service.analyze_conversation(_prompt_context(session_id, text, language), language)
+            )
+            if result.get('superseded'):
+                return jsonify(result)
             if not result.get('success'):
-                logger.error(f"Error analyzing sentiment: {result.get('error')}")
+                logger.error(f"Error analyzing conversation: {result.get('error')}")
             else:
-                logger.info(f"Successfully analyzed sentiment using model: {result.get('model')}")
-            return jsonify(result)
+                logger.info(f"Successfully analyzed conversation using model: {result.get('model')} "
+                            f"(fallback: {result.get('fallback')})")
+            return jsonify(_publish(session_id, 'analysis', result))
         except Exception as e:
-            logger.error(f"Exception analyzing sentiment: {str(e)}")
+            logger.error(f"Exception analyzing conversation: {str(e)}")
             return jsonify({
                 'success': False,
-                'error': f'Error al analizar el sentimiento: {str(e)}'
+                'error': f'Error al analizar la conversación: {str(e)}'
             })
     else:
         # Fallback if OpenAI service is not available
-        logger.warning("Using fallback sentiment analysis (OpenAI service not available)")
+        logger.warning("Using fallback conversation analysis (OpenAI service not available)")
         return jsonify({
             'success': True,
-            'sentiment_analysis': f'⚠️ [MODO DEMO] Análisis de sentimiento para el texto proporcionado. Configure la API de OpenAI para análisis real.'
+            'analysis': None,
+            'suggestions': f'⚠️ [MODO DEMO] Sugerencia basada en: {text[:50]}... Para obtener sugerencias reales, configura la API de OpenAI.',
+            'sentiment_analysis': '⚠️ [MODO DEMO] Análisis de sentimiento para el texto proporcionado. Configure la API de OpenAI para análisis real.'
         })
 
 @app.route('/generate-summary', methods=['POST'])
 def generate_summary():
-    """Endpoint to generate a call summary from conversation text."""
+    """
+    Endpoint to generate a call summary from conversation text.
+    
+    Without text, the summary kept up to date in the background during the
+    call is returned at once, with a 'freshness' marker telling whether it
+    covers the whole transcript (the remaining stretch is then being merged;
+    send 'wait': true to wait for it).
+    """
     text = request.json.get('text', '')
     session_id = session.get('session_id')
     
     # Si no se proporciona texto, usar la transcripción almacenada para la sesión
-    if not text and session_id and session_id in conversation_sessions:
-        text = conversation_sessions[session_id].get('transcript', '')
+    if not text and session_id:
+        snapshot = _precomputed_summary(session_id, wait=bool(request.json.get('wait')))
+        if snapshot is not None:
+            rolling_summaries.record_served(snapshot)
+            _store_summary(session_id, snapshot['call_summary'])
+            logger.info(f"Returning precomputed summary for session {session_id}: {snapshot['freshness']}")
+            return jsonify(_publish(session_id, 'summary', dict(snapshot, success=True, precomputed=True)))
+        text = transcripts.text(session_id)
     
     if not text:
         logger.warning("No text provided for summary generation")
@@ -235,10 +924,10 @@ def generate_summary():
                 logger.info(f"Successfully generated summary using model: {result.get('model')}")
                 
                 # Guardar el resumen en la sesión
-                if session_id and session_id in conversation_sessions:
-                    conversation_sessions[session_id]['summary'] = result.get('call_summary')
+                if session_id:
+                    _store_summary(session_id, result.get('call_summary'))
                     
-            return jsonify(result)
+            return jsonify(_publish(session_id, 'summary', result))
         except Exception as e:
             logger.error(f"Exception generating summary: {str(e)}")
             return jsonify({
@@ -253,5 +942,256 @@ def generate_summary():
             'call_summary': f'⚠️ [MODO DEMO] Resumen de la llamada. Configure la API de OpenAI para resúmenes reales.'
         })
 
+def _channel_analysis(session_id, interim: str, language: str):
+    """Run the live analysis of a session channel on the stored transcript plus the interim text."""
+    text = ' '.join(part for part in (transcripts.text(session_id), interim) if part)
+    if not text:
+        return None
+    if not openai_service:
+        return {
+            'success': True,
+            'analysis': None,
+            'suggestions': f'⚠️ [MODO DEMO] Sugerencia basada en: {text[:50]}... Para obtener sugerencias reales, configura la API de OpenAI.',
+            'sentiment_analysis': '⚠️ [MODO DEMO] Análisis de sentimiento para el texto proporcionado. Configure la API de OpenAI para análisis real.'
+        }
+    return openai_service.analyze_conversation(_prompt_context(session_id, text, language), language)
+
+def _channel_summary(session_id) -> dict:
+    """Generate and store the call summary of a session channel (the precomputed one once up to date)."""
+    snapshot = _precomputed_summary(session_id, wait=True)
+    if snapshot is not None:
+        rolling_summaries.record_served(snapshot)
+        _store_summary(session_id, snapshot['call_summary'])
+        return dict(snapshot, success=True, precomputed=True)
+    text = transcripts.text(session_id)
+    if not text:
+        return {'success': False, 'error': 'No hay texto de conversación para resumir'}
+    if not openai_service:
+        return {
+            'success': True,
+            'call_summary': '⚠️ [MODO DEMO] Resumen de la llamada. Configure la API de OpenAI para resúmenes reales.'
+        }
+    result = openai_service.generate_call_summary(text)
+    if result.get('success'):
+        _store_summary(session_id, result.get('call_summary'))
+    return result
+
+def session_channel(ws):
+    """
+    WebSocket channel of the current session.
+    
+    The browser sends transcript segments, interim text and control messages;
+    the server decides when to run the live analysis and pushes analyses and
+    summaries as they become ready. A summary is generated on its own thread
+    so that segments keep being received meanwhile; one requested while
+    another is being generated is answered by that one.
+    """
+    session_id = session.get('session_id')
+    if session_id not in session_store:
+        ws.send(json.dumps({'type': 'error', 'error': 'Sesión no encontrada'}))
+        return
+    
+    logger.info(f"Session channel opened for session {session_id}")
+    schedule = AnalysisSchedule()
+    interim = ''
+    language = 'es-ES'
+    summary = None
+    send_lock = threading.Lock()
+    
+    def send(message: dict) -> None:
+        # El resumen se envía desde su propio hilo: los mensajes no deben entrelazarse
+        with send_lock:
+            ws.send(json.dumps(message, ensure_ascii=False))
+    
+    def run_summary():
+        try:
+            with _channel_trace('/ws summary'):
+                result = _publish(session_id, 'summary', _channel_summary(session_id))
+            send(dict(result, type='summary'))
+        except Exception as e:
+            logger.error(f"Error in session channel summary: {e}")
+    
+    while True:
+        # Esperar al siguiente mensaje o a que toque analizar
+        raw = ws.receive(timeout=schedule.due_in(time.time()))
+        if raw is not None:
+            try:
+                message = parse_message(raw)
+            except ChannelMessageError as e:
+                send({'type': 'error', 'error': str(e)})
+                continue
+            
+            if message['type'] == 'segment':
+                with _channel_trace('/ws segment'):
+                    result = transcripts.append(
+                        session_id, [(message['seq'], message['text'].strip())], reset=bool(message.get('reset'))
+                    )
+                    interim = ''
+                    schedule.changed(time.time(), final=True)
+                    _refresh_summary(session_id)
+                send({
+                    'type': 'ack',
+                    'seq': message['seq'],
+                    'duplicates': result['duplicates'] if result else [],
+                    'next_seq': result['next_seq'] if result else None
+                })
+            elif message['type'] == 'interim':
+                if message['text'].strip() != interim:
+                    interim = message['text'].strip()
+                    schedule.changed(time.time(), final=False)
+                    event_bus.publish(session_id, 'interim', {'text': interim})
+            elif message['type'] == 'language':
+                language = message['language']
+            elif message['type'] == 'summary':
+                if summary is None or not summary.is_alive():
+                    # Copia del contexto: la sesión del planificador y la traza siguen al hilo
+                    summary = threading.Thread(target=contextvars.copy_context().run, args=(run_summary,),
+                                               name='session-channel-summary', daemon=True)
+                    summary.start()
+            elif message['type'] == 'ping':
+                send({'type': 'pong'})
+        
+        if schedule.due_in(time.time()) == 0:
+            schedule.start(time.time())
+            try:
+                with _channel_trace('/ws analysis'):
+                    result = _channel_analysis(session_id, interim, language)
+            finally:
+                schedule.finish()
+            if result is not None:
+                _publish(session_id, 'analysis', result)
+                send(dict(result, type='analysis'))
+
+def _supervisor_authorized() -> bool:
+    """Whether the request carries the supervisor token (without SUPERVISOR_TOKEN, only if SUPERVISOR_OPEN=true)."""
+    token = os.getenv("SUPERVISOR_TOKEN")
+    if not token:
+        # Sin token las transcripciones quedan cerradas salvo que se abran a propósito (p. ej. en desarrollo)
+        return os.getenv("SUPERVISOR_OPEN", "false").lower() == "true"
+    given = request.args.get('token') or request.headers.get('Authorization', '').replace('Bearer ', '', 1)
+    return hmac.compare_digest(given.encode(), token.encode())
+
+def _supervised_sessions():
+    """Session ids requested in ?session= (repeated or comma-separated), or None for every session."""
+    session_ids = [session_id for value in request.args.getlist('session') for session_id in value.split(',') if session_id]
+    return session_ids or None
+
+def _supervisor_snapshot(session_ids, subscription) -> list:
+    """The full transcript and latest events of the watched sessions, sent first to a supervisor connecting mid-call."""
+    return [
+        BusEvent(session_id, 'transcript', {'text': transcripts.text(session_id), 'reset': True})
+        for session_id in session_ids or () if session_id in session_store
+    ] + subscription.snapshot
+
+SUPERVISOR_DROPPED = {'type': 'dropped', 'error': 'Demasiados eventos pendientes: vuelve a conectar'}
+
+@app.route('/supervisor/events', methods=['GET'])
+def supervisor_events():
+    """
+    Stream the live events of some sessions (?session=, every session by default) as Server-Sent Events.
+    
+    A supervisor that falls too far behind receives a 'dropped' event and
+    the stream ends; it should reconnect to get the current state.
+    """
+    if not _supervisor_authorized():
+        return jsonify({'success': False, 'error': 'No autorizado'}), 403
+    session_ids = _supervised_sessions()
+    subscription = event_bus.subscribe(session_ids)
+    snapshot = _supervisor_snapshot(session_ids, subscription)
+    heartbeat = float(os.getenv("SUPERVISOR_HEARTBEAT", "15"))
+    
+    def generate():
+        try:
+            for event in snapshot:
+                yield event.sse
+            while True:
+                events = subscription.get(timeout=heartbeat)
+                if subscription.dropped:
+                    yield _sse_event(SUPERVISOR_DROPPED)
+                    return
+                # Un comentario SSE mantiene viva la conexión a través de los proxies
+                yield ''.join(event.sse for event in events) if events else ': ping\n\n'
+        finally:
+            event_bus.unsubscribe(subscription)
+    
+    response = Response(generate(), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+def supervisor_channel(ws):
+    """WebSocket version of /supervisor/events: each event is sent as a JSON message."""
+    if not _supervisor_authorized():
+        ws.send(json.dumps({'type': 'error', 'error': 'No autorizado'}))
+        return
+    session_ids = _supervised_sessions()
+    subscription = event_bus.subscribe(session_ids)
+    heartbeat = float(os.getenv("SUPERVISOR_HEARTBEAT", "15"))
+    try:
+        for event in _supervisor_snapshot(session_ids, subscription):
+            ws.send(event.data)
+        while True:
+            events = subscription.get(timeout=heartbeat)
+            if subscription.dropped:
+                ws.send(json.dumps(SUPERVISOR_DROPPED, ensure_ascii=False))
+                return
+            for event in events:
+                ws.send(event.data)
+            if not events:
+                ws.send(json.dumps({'type': 'ping'}))
+    finally:
+        event_bus.unsubscribe(subscription)
+
+@app.route('/search', methods=['GET'])
+def search_calls():
+    """
+    Search past calls by their transcript and summary.
+    
+    Query parameters: q (words to look for), lang (es, en or fr; detected
+    from q by default), field ('transcript' or 'summary'), page and per_page.
+    Calls containing every word are ranked with BM25 among the most recent
+    SEARCH_MAX_CANDIDATES matches ('truncated' tells whether there were more).
+    """
+    if not _supervisor_authorized():
+        return jsonify({'success': False, 'error': 'No autorizado'}), 403
+    if not call_index:
+        return jsonify({'success': False, 'error': 'Búsqueda de llamadas no disponible'})
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify({'success': False, 'error': 'Falta el texto a buscar (q)'}), 400
+    with span('search'):
+        result = call_index.search(
+            query,
+            language=request.args.get('lang'),
+            field=request.args.get('field'),
+            page=request.args.get('page', 1, type=int),
+            per_page=request.args.get('per_page', 20, type=int)
+        )
+    return jsonify(dict(result, success=True))
+
+@app.route('/calls/<session_id>', methods=['GET'])
+def get_call(session_id):
+    """Return the stored transcript and summary of a past call."""
+    if not _supervisor_authorized():
+        return jsonify({'success': False, 'error': 'No autorizado'}), 403
+    call = call_index.get(session_id) if call_index else None
+    if call is None:
+        return jsonify({'success': False, 'error': 'Llamada no encontrada'}), 404
+    return jsonify({'success': True, 'call': call})
+
+@app.route('/search-stats', methods=['GET'])
+def search_stats():
+    """Return the indexed calls, the indexing backlog and the search latency."""
+    if not call_index:
+        return jsonify({'success': False, 'error': 'Búsqueda de llamadas no disponible'})
+    return jsonify({
+        'success': True,
+        'search': call_index.get_stats()
+    })
+
+if sock:
+    sock.route('/ws')(session_channel)
+    sock.route('/supervisor/ws')(supervisor_channel)
+
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=8501, debug=True) 
\ No newline at end of file
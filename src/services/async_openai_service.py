@@ -0,0 +1,464 @@
+import asyncio
+import itertools
+import time
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+import aiohttp
+import openai
+
+from services.knowledge_index import KnowledgeRetriever
+from services.llm_backend import LLMBackend
+from services.metrics import Metrics
+from services.model_router import AllModelsFailedError
+from services.openai_service import HEDGED_CLASSES, OpenAIService
+from services.prompt_registry import PromptRegistry, PromptTooLargeError, RenderedPrompt
+from services.prompt_templates import SUMMARY_SECTIONS
+from services.response_cache import ResponseCache
+from services.semantic_cache import SemanticAnswerCache
+from services.tracing import span
+from services.upstream_scheduler import UpstreamOverloadedError, UpstreamScheduler, current_session, prompt_priority
+
+
+class AsyncOpenAIService(OpenAIService):
+    """
+    Asyncio-native variant of OpenAIService.
+
+    Exposes the same four methods as coroutines. All requests share one pooled
+    keep-alive aiohttp session, and a semaphore caps the number of concurrent
+    upstream calls for the whole process.
+    """
+
+    def __init__(self, cache: Optional[ResponseCache] = None, max_concurrency: int = 50,
+                 pool_size: int = 100, request_timeout: float = 60, prompts: Optional[PromptRegistry] = None,
+                 metrics: Optional[Metrics] = None, retriever: Optional[KnowledgeRetriever] = None,
+                 answer_cache: Optional[SemanticAnswerCache] = None,
+                 scheduler: Optional[UpstreamScheduler] = None, backend: Optional[LLMBackend] = None,
+                 models: Optional[List[str]] = None):
+        """
+        Initialize the async OpenAI service.
+
+        Args:
+            cache: Optional response cache placed in front of the completion calls
+            max_concurrency: Maximum number of simultaneous upstream calls
+            pool_size: Maximum number of pooled HTTP connections
+            request_timeout: Total timeout in seconds for each upstream call
+            prompts: Prompt template registry; the built-in templates are loaded by default
+            metrics: Metrics receiving upstream latency, errors, fallbacks and token usage
+            retriever: Optional knowledge base retriever used to ground the answers to questions
+            answer_cache: Optional semantic cache returning the answer of a near-identical question
+            scheduler: Upstream scheduler admitting the requests by priority (see OpenAIService)
+            backend: Chat completion backend; the OpenAI API by default
+            models: Models to try, in order of preference (the backend's model names)
+        """
+        super().__init__(cache=cache, prompts=prompts, metrics=metrics, retriever=retriever,
+                         answer_cache=answer_cache, scheduler=scheduler, backend=backend, models=models)
+        self.max_concurrency = max_concurrency
+        self.pool_size = pool_size
+        self.request_timeout = request_timeout
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+    async def start(self) -> None:
+        """Create the pooled HTTP session and the concurrency limiter (inside the event loop)."""
+        if self._session:
+            return
+        connector = aiohttp.TCPConnector(limit=self.pool_size, keepalive_timeout=30)
+        self._session = aiohttp.ClientSession(
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(total=self.request_timeout)
+        )
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+
+    async def close(self) -> None:
+        """Close the pooled HTTP session and the backend's connections."""
+        if self._session:
+            await self._session.close()
+            self._session = None
+        await self.backend.close()
+
+    async def get_suggestions(self, conversation_text: str, language: str = 'es-ES') -> Dict[str, Any]:
+        """Async version of OpenAIService.get_suggestions."""
+        if not conversation_text or conversation_text.strip() == "":
+            return {
+                "success": False,
+                "error": "No se proporcionó texto para generar sugerencias"
+            }
+
+        return await self._acomplete_with_fallback(
+            self.prompts.render("suggestions", language, conversation_text=conversation_text),
+            result_key="suggestions",
+            log_context="al generar sugerencias",
+            error_message="No se pudo generar sugerencias"
+        )
+
+    async def get_answer_to_question(self, question: str) -> Dict[str, Any]:
+        """Async version of OpenAIService.get_answer_to_question."""
+        if not question or question.strip() == "":
+            return {
+                "success": False,
+                "error": "No se proporcionó ninguna pregunta"
+            }
+
+        cached, vector = await self._alookup_answer(question)
+        if cached is not None:
+            return cached
+
+        prompt, retrieval = self._question_prompt(question, await self._aretrieve(question))
+        result = await self._acomplete_with_fallback(
+            prompt,
+            result_key="answer",
+            log_context="al responder pregunta",
+            error_message="No se pudo responder la pregunta"
+        )
+        result = dict(result, retrieval=retrieval) if retrieval else result
+        self._store_answer(question, vector, result)
+        return result
+
+    async def _alookup_answer(self, question: str):
+        """Async counterpart of OpenAIService._lookup_answer; remote question embeddings run off the event loop."""
+        if self.answer_cache and not self.answer_cache.embedder.local:
+            return await asyncio.get_running_loop().run_in_executor(None, self._lookup_answer, question)
+        return self._lookup_answer(question)
+
+    async def _aretrieve(self, question: str):
+        """Async counterpart of OpenAIService._retrieve; remote query embeddings run off the event loop."""
+        if self.retriever and not self.retriever.embedder.local:
+            return await asyncio.get_running_loop().run_in_executor(None, self._retrieve, question)
+        return self._retrieve(question)
+
+    async def analyze_sentiment(self, conversation_text: str) -> Dict[str, Any]:
+        """Async version of OpenAIService.analyze_sentiment."""
+        if not conversation_text or conversation_text.strip() == "":
+            return {
+                "success": False,
+                "error": "No hay texto de conversación para analizar"
+            }
+
+        return await self._acomplete_with_fallback(
+            self.prompts.render("sentiment", conversation_text=conversation_text),
+            result_key="sentiment_analysis",
+            log_context="al analizar sentimiento",
+            error_message="No se pudo analizar el sentimiento"
+        )
+
+    async def generate_call_summary(self, conversation_text: str, chunk_tokens: Optional[int] = None) -> Dict[str, Any]:
+        """Async version of OpenAIService.generate_call_summary (the chunks of a long call are summarized concurrently)."""
+        if not conversation_text or conversation_text.strip() == "":
+            return {
+                "success": False,
+                "error": "No hay texto de conversación para resumir"
+            }
+
+        parts, chunk_tokens = self._summary_plan(conversation_text, chunk_tokens)
+        if parts is None and self.parallel_summary:
+            result = await self._generate_sectioned_summary(conversation_text)
+            if result["success"]:
+                return result
+            return dict(await self._generate_single_summary(conversation_text), sectioned=result["sectioned"])
+        if parts is None:
+            return await self._generate_single_summary(conversation_text)
+
+        stats = {"chunks": len(parts), "levels": 0, "calls": 0}
+        while parts:
+            results = await asyncio.gather(*[
+                self._acomplete_with_fallback(
+                    prompt,
+                    result_key="notes",
+                    log_context="al resumir un fragmento de la llamada",
+                    error_message="No se pudo generar el resumen de la llamada"
+                )
+                for prompt in self._summary_chunk_prompts(parts)
+            ])
+            failed = next((result for result in results if not result.get("success")), None)
+            if failed:
+                return failed
+            notes = [result["notes"] for result in results]
+            stats["levels"] += 1
+            stats["calls"] += len(parts)
+            parts = self._summary_reduce_parts(notes, chunk_tokens, stats["levels"])
+
+        result = await self._acomplete_with_fallback(
+            self._summary_reduce_prompt(notes),
+            result_key="call_summary",
+            log_context="al combinar el resumen de la llamada",
+            error_message="No se pudo generar el resumen de la llamada"
+        )
+        stats["calls"] += 1
+        return dict(result, map_reduce=stats) if result.get("success") else result
+
+    async def _generate_single_summary(self, conversation_text: str) -> Dict[str, Any]:
+        """Async version of OpenAIService._generate_single_summary."""
+        return await self._acomplete_with_fallback(
+            self.prompts.render("summary", conversation_text=conversation_text),
+            result_key="call_summary",
+            log_context="al generar resumen",
+            error_message="No se pudo generar el resumen de la llamada"
+        )
+
+    async def _generate_sectioned_summary(self, conversation_text: str) -> Dict[str, Any]:
+        """Async version of OpenAIService._generate_sectioned_summary (the sections run as concurrent tasks)."""
+        started = time.time()
+        outcomes = await asyncio.gather(*[
+            self._timed_section(section["key"], prompt)
+            for section, prompt in zip(SUMMARY_SECTIONS, self._summary_section_prompts(conversation_text))
+        ])
+        return self._assemble_sections(outcomes, time.time() - started)
+
+    async def _timed_section(self, key: str, prompt: RenderedPrompt) -> Tuple[Dict[str, Any], float]:
+        started = time.time()
+        with span("summary_section", section=key):
+            result = await self._acomplete_with_fallback(
+                prompt,
+                result_key="section",
+                log_context="al generar una sección del resumen",
+                error_message="No se pudo generar la sección del resumen"
+            )
+        return result, time.time() - started
+
+    async def update_call_summary(self, previous_summary: str, new_text: str) -> Dict[str, Any]:
+        """Async version of OpenAIService.update_call_summary."""
+        if not new_text or new_text.strip() == "":
+            return {
+                "success": False,
+                "error": "No hay texto nuevo para resumir"
+            }
+
+        return await self._acomplete_with_fallback(
+            self._summary_update_prompt(previous_summary, new_text),
+            result_key="call_summary",
+            log_context="al actualizar el resumen",
+            error_message="No se pudo actualizar el resumen de la llamada"
+        )
+
+    async def analyze_conversation(self, conversation_text: str, language: str = 'es-ES') -> Dict[str, Any]:
+        """Async version of OpenAIService.analyze_conversation (the fallback calls run concurrently)."""
+        if not conversation_text or conversation_text.strip() == "":
+            return {
+                "success": False,
+                "error": "No hay texto de conversación para analizar"
+            }
+
+        result = await self._acomplete_with_fallback(
+            self.prompts.render(
+                "analysis", language, conversation_language=language, conversation_text=conversation_text
+            ),
+            result_key="raw_analysis",
+            log_context="al analizar la conversación",
+            error_message="No se pudo analizar la conversación"
+        )
+        if not result.get("success"):
+            return result
+        analysis = self._parse_combined_analysis(result["raw_analysis"])
+        if analysis is not None:
+            return self._combined_analysis_result(analysis, result)
+
+        self.metrics.count_fallback("analysis", "separate_calls")
+        suggestions, sentiment = await asyncio.gather(
+            self.get_suggestions(conversation_text, language),
+            self.analyze_sentiment(conversation_text)
+        )
+        return self._separate_analysis_result(suggestions, sentiment)
+
+    async def stream_suggestions(self, conversation_text: str, language: str = 'es-ES') -> AsyncIterator[Dict[str, Any]]:
+        """Async version of OpenAIService.stream_suggestions."""
+        if not conversation_text or conversation_text.strip() == "":
+            yield {
+                "type": "error",
+                "success": False,
+                "error": "No se proporcionó texto para generar sugerencias"
+            }
+            return
+
+        prompt = self.prompts.render("suggestions", language, conversation_text=conversation_text)
+        async for event in self._astream_completion(prompt, "No se pudo generar sugerencias"):
+            yield event
+
+    async def stream_answer_to_question(self, question: str) -> AsyncIterator[Dict[str, Any]]:
+        """Async version of OpenAIService.stream_answer_to_question."""
+        if not question or question.strip() == "":
+            yield {
+                "type": "error",
+                "success": False,
+                "error": "No se proporcionó ninguna pregunta"
+            }
+            return
+
+        cached, vector = await self._alookup_answer(question)
+        if cached is not None:
+            for event in self._cached_answer_events(cached):
+                yield event
+            return
+
+        prompt, retrieval = self._question_prompt(question, await self._aretrieve(question))
+        tokens = []
+        async for event in self._astream_completion(prompt, "No se pudo responder la pregunta"):
+            if event["type"] == "token":
+                tokens.append(event)
+            elif event["type"] == "done":
+                event = dict(event, retrieval=retrieval) if retrieval else event
+                self._store_answer(question, vector, self._streamed_answer(tokens, event))
+            yield event
+
+    async def _acomplete_with_fallback(self, prompt: RenderedPrompt, result_key: str, log_context: str,
+                                       error_message: str) -> Dict[str, Any]:
+        """Async counterpart of OpenAIService._complete_with_fallback."""
+        try:
+            models = self._models_for(prompt)
+        except PromptTooLargeError as e:
+            return {
+                "success": False,
+                "error": f"{error_message}. {e}"
+            }
+
+        cache_key, cached = self._lookup_cache(prompt)
+        if cached is not None:
+            return cached
+
+        priority, session_id = prompt_priority(prompt.name), current_session.get()
+        try:
+            await self.scheduler.aacquire(priority, prompt.required_tokens, session_id)
+        except UpstreamOverloadedError as e:
+            return self._shed_result(prompt, error_message, e)
+        attempts = itertools.count()
+
+        async def request_completion(model: str):
+            # El primer intento ya está admitido; las coberturas y los respaldos esperan su turno
+            if next(attempts):
+                await self.scheduler.aacquire(priority, prompt.required_tokens, session_id)
+            # Si la tarea se cancela (cobertura perdedora) se mantiene la reserva: no se sabe qué consumió
+            used = None
+            try:
+                response = await self._acreate(
+                    model=model,
+                    messages=prompt.messages,
+                    temperature=prompt.temperature,
+                    max_tokens=prompt.max_tokens
+                )
+                used = (response.get("usage") or {}).get("total_tokens")
+                return response
+            except Exception:
+                used = 0
+                raise
+            finally:
+                self.scheduler.settle(prompt.required_tokens, used)
+
+        try:
+            response, routing = await self.router.acall(request_completion, models, prompt.name,
+                                                        hedge=prompt_priority(prompt.name) in HEDGED_CLASSES)
+        except AllModelsFailedError as e:
+            # Si llegamos aquí, todos los modelos han fallado
+            self.metrics.observe_routing(prompt.name, e.routing)
+            self._log_failed_attempts(e.routing, log_context)
+            return {
+                "success": False,
+                "error": f"{error_message}. Último error: {e.last_error}",
+                "routing": e.routing
+            }
+
+        self._log_failed_attempts(routing, log_context)
+        self.metrics.observe_routing(prompt.name, routing)
+        self.metrics.count_tokens(prompt.name, response.model, response.get("usage"))
+        result = {
+            "success": True,
+            result_key: response.choices[0].message['content'],
+            "model": response.model,
+            "routing": routing
+        }
+        self._store_cache(prompt.name, cache_key, result)
+        return result
+
+    async def _astream_completion(self, prompt: RenderedPrompt, error_message: str) -> AsyncIterator[Dict[str, Any]]:
+        """Async counterpart of OpenAIService._stream_completion."""
+        try:
+            models = self._models_for(prompt)
+        except PromptTooLargeError as e:
+            yield {
+                "type": "error",
+                "success": False,
+                "error": f"{error_message}. {e}"
+            }
+            return
+
+        last_error = None
+        candidates, _ = self.router.candidates(models)
+        for model in candidates:
+            # Cada intento (también el respaldo tras un fallo) espera su admisión
+            try:
+                await self.scheduler.aacquire(prompt_priority(prompt.name), prompt.required_tokens, current_session.get())
+            except UpstreamOverloadedError as e:
+                yield dict(self._shed_result(prompt, error_message, e), type="error")
+                return
+            completion_tokens = 0
+            started = time.time()
+            sent = False
+            try:
+                response_model = model
+                finish_reason = None
+                async for chunk in self._astream_create(model, prompt):
+                    sent = True
+                    response_model = chunk.get('model', response_model)
+                    choice = chunk.choices[0]
+                    content = choice.delta.get('content')
+                    if content:
+                        completion_tokens += 1
+                        yield {"type": "token", "content": content}
+                    if choice.get('finish_reason'):
+                        finish_reason = choice['finish_reason']
+
+                self._record_stream_call(prompt, candidates, model, time.time() - started, True)
+                usage = self._estimate_stream_usage(prompt, completion_tokens)
+                self.metrics.count_tokens(prompt.name, response_model, usage)
+                yield {
+                    "type": "done",
+                    "success": True,
+                    "model": response_model,
+                    "finish_reason": finish_reason,
+                    "usage": usage
+                }
+                return
+
+            except Exception as e:
+                self._record_stream_call(prompt, candidates, model, time.time() - started, False)
+                last_error = str(e)
+                print(f"Error con el modelo {model} en modo streaming: {last_error}")
+                if completion_tokens:
+                    # Ya se enviaron tokens al cliente: no se puede cambiar de modelo
+                    break
+                continue
+            finally:
+                self._settle_stream(prompt, sent, completion_tokens)
+
+        yield {
+            "type": "error",
+            "success": False,
+            "error": f"{error_message}. Último error: {last_error}"
+        }
+
+    async def _astream_create(self, model: str, prompt: RenderedPrompt) -> AsyncIterator[Any]:
+        """Stream ChatCompletion chunks on the pooled session, within the concurrency cap."""
+        await self.start()
+        async with self._semaphore:
+            token = openai.aiosession.set(self._session)
+            try:
+                response = await self.scheduler.acall(lambda: self.backend.acreate(
+                    model=model,
+                    messages=prompt.messages,
+                    temperature=prompt.temperature,
+                    max_tokens=prompt.max_tokens,
+                    stream=True
+                ))
+                async for chunk in response:
+                    yield chunk
+            finally:
+                openai.aiosession.reset(token)
+
+    async def _acreate(self, **kwargs):
+        """Call ChatCompletion.acreate on the pooled session, within the concurrency cap (429s are retried)."""
+        await self.start()
+        async with self._semaphore:
+            # openai==0.28.1 toma la sesión HTTP de la variable de contexto aiosession
+            token = openai.aiosession.set(self._session)
+            try:
+                return await self.scheduler.acall(lambda: self.backend.acreate(**kwargs))
+            finally:
+                openai.aiosession.reset(token)
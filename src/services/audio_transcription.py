@@ -0,0 +1,445 @@
+import asyncio
+import io
+import math
+import threading
+import time
+import wave
+from abc import ABC, abstractmethod
+from array import array
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+try:
+    import numpy as np
+    from faster_whisper import WhisperModel
+except ImportError:  # faster-whisper es opcional: sin él solo está disponible el backend 'stub'
+    WhisperModel = None
+
+# Audio PCM lineal de 16 bits, mono, little endian
+SAMPLE_WIDTH = 2
+DEFAULT_SAMPLE_RATE = 16000
+
+
+class TranscriberBusyError(RuntimeError):
+    """Raised when the ASR worker pool has too many pending segments; the chunk should be resent later."""
+
+
+def wav_to_pcm(data: bytes) -> Tuple[bytes, int]:
+    """
+    Extract the PCM samples of a WAV file.
+
+    Returns:
+        Tuple (pcm, sample_rate)
+
+    Raises:
+        ValueError: If the file is not 16-bit mono PCM
+    """
+    try:
+        with wave.open(io.BytesIO(data), 'rb') as wav:
+            if wav.getnchannels() != 1 or wav.getsampwidth() != SAMPLE_WIDTH:
+                raise ValueError("Se esperaba audio WAV mono de 16 bits")
+            return wav.readframes(wav.getnframes()), wav.getframerate()
+    except (wave.Error, EOFError) as e:
+        raise ValueError("Fichero WAV no válido") from e
+
+
+class VoiceActivityDetector:
+    """
+    Energy-based voice activity detector that cuts a PCM stream into speech segments.
+
+    The stream is split in fixed frames; a frame is voiced when its RMS energy
+    is well above an adaptive estimate of the background noise. A segment
+    starts after a few voiced frames (keeping a short pre-roll so the first
+    syllable is not lost) and ends after a stretch of silence, or when it
+    reaches the maximum length.
+    """
+
+    def __init__(self, sample_rate: int = DEFAULT_SAMPLE_RATE, frame_ms: int = 30, start_frames: int = 3,
+                 end_silence_ms: int = 600, pre_roll_ms: int = 300, min_speech_ms: int = 250,
+                 max_segment_s: float = 15, threshold_ratio: float = 3.0, min_rms: float = 300):
+        """
+        Initialize the detector.
+
+        Args:
+            sample_rate: Samples per second of the stream
+            frame_ms: Length of the analysis frames
+            start_frames: Consecutive voiced frames that start a segment
+            end_silence_ms: Silence that ends a segment
+            pre_roll_ms: Audio kept before the start of a segment
+            min_speech_ms: Shorter segments (clicks, coughs) are dropped
+            max_segment_s: Segments are cut at this length
+            threshold_ratio: Energy over the noise floor that makes a frame voiced
+            min_rms: Minimum energy of a voiced frame (silence in a quiet room)
+        """
+        self.sample_rate = sample_rate
+        self.frame_bytes = sample_rate * frame_ms // 1000 * SAMPLE_WIDTH
+        self.start_frames = start_frames
+        self.end_frames = max(1, end_silence_ms // frame_ms)
+        self.pre_roll_frames = pre_roll_ms // frame_ms
+        self.min_speech_frames = max(1, min_speech_ms // frame_ms)
+        self.max_segment_frames = int(max_segment_s * 1000 // frame_ms)
+        self.threshold_ratio = threshold_ratio
+        self.min_rms = min_rms
+        self.noise_rms = min_rms / threshold_ratio
+        self._leftover = b''
+        self._recent: List[bytes] = []
+        self._segment: List[bytes] = []
+        self._voiced_run = 0
+        self._silent_run = 0
+        self._speech_frames = 0
+
+    @property
+    def in_speech(self) -> bool:
+        """Whether a segment is in progress."""
+        return bool(self._segment)
+
+    def speech(self) -> bytes:
+        """Audio of the segment in progress (used for partial transcripts)."""
+        return b''.join(self._segment)
+
+    def feed(self, pcm: bytes) -> List[bytes]:
+        """
+        Add audio to the stream.
+
+        Returns:
+            The speech segments completed by this audio
+        """
+        data = self._leftover + pcm
+        usable = len(data) - len(data) % self.frame_bytes
+        self._leftover = data[usable:]
+        segments = []
+        for offset in range(0, usable, self.frame_bytes):
+            segment = self._frame(data[offset:offset + self.frame_bytes])
+            if segment:
+                segments.append(segment)
+        return segments
+
+    def flush(self) -> Optional[bytes]:
+        """End the stream, returning the segment in progress if it is long enough."""
+        self._leftover = b''
+        self._recent = []
+        return self._end_segment()
+
+    def _frame(self, frame: bytes) -> Optional[bytes]:
+        """Process one frame. Returns a segment if this frame completed one."""
+        rms = _rms(frame)
+        voiced = rms >= max(self.min_rms, self.noise_rms * self.threshold_ratio)
+
+        if not self._segment:
+            if not voiced:
+                # El nivel de ruido de fondo solo se aprende fuera de la voz
+                self.noise_rms = 0.95 * self.noise_rms + 0.05 * rms
+                self._voiced_run = 0
+            else:
+                self._voiced_run += 1
+            self._recent.append(frame)
+            if self._voiced_run >= self.start_frames:
+                self._segment = self._recent[-(self.pre_roll_frames + self._voiced_run):]
+                self._speech_frames = self._voiced_run
+                self._silent_run = 0
+                self._recent = []
+            else:
+                del self._recent[:-(self.pre_roll_frames + self.start_frames)]
+            return None
+
+        self._segment.append(frame)
+        if voiced:
+            self._speech_frames += 1
+            self._silent_run = 0
+        else:
+            self._silent_run += 1
+        if self._silent_run >= self.end_frames or len(self._segment) >= self.max_segment_frames:
+            return self._end_segment()
+        return None
+
+    def _end_segment(self) -> Optional[bytes]:
+        segment, speech_frames = self._segment, self._speech_frames
+        self._segment = []
+        self._voiced_run = self._silent_run = self._speech_frames = 0
+        if speech_frames < self.min_speech_frames:
+            return None
+        return b''.join(segment)
+
+
+def _rms(frame: bytes) -> float:
+    """Root mean square energy of a 16-bit PCM frame."""
+    samples = array('h', frame)
+    if not samples:
+        return 0.0
+    return math.sqrt(sum(s * s for s in samples) / len(samples))
+
+
+class ASRBackend(ABC):
+    """Speech recognizer running on the server's CPU."""
+
+    name = 'base'
+
+    @abstractmethod
+    def transcribe(self, pcm: bytes, sample_rate: int, language: str = 'es-ES') -> str:
+        """
+        Transcribe one speech segment.
+
+        Args:
+            pcm: 16-bit mono PCM audio
+            sample_rate: Samples per second
+            language: The language code of the conversation (e.g., 'es-ES', 'en-US')
+
+        Returns:
+            The recognized text
+        """
+
+
+class StubASRBackend(ASRBackend):
+    """Backend for tests and development: returns canned texts, or a description of the segment."""
+
+    name = 'stub'
+
+    def __init__(self, texts: Optional[List[str]] = None, delay: float = 0.0):
+        """
+        Initialize the stub.
+
+        Args:
+            texts: Texts returned in turn; by default the segment duration is described
+            delay: Seconds each transcription takes (to simulate a real model)
+        """
+        self.texts = list(texts or [])
+        self.delay = delay
+        self._next = 0
+        self._lock = threading.Lock()
+
+    def transcribe(self, pcm: bytes, sample_rate: int, language: str = 'es-ES') -> str:
+        if self.delay:
+            time.sleep(self.delay)
+        if not self.texts:
+            return f"[voz {len(pcm) / SAMPLE_WIDTH / sample_rate:.1f} s]"
+        with self._lock:
+            text = self.texts[self._next % len(self.texts)]
+            self._next += 1
+        return text
+
+
+class FasterWhisperBackend(ASRBackend):
+    """Whisper model run on CPU with faster-whisper (CTranslate2, int8 quantized)."""
+
+    name = 'faster-whisper'
+    MODEL_SAMPLE_RATE = 16000
+
+    def __init__(self, model_size: str = 'base', compute_type: str = 'int8', cpu_threads: int = 0):
+        """
+        Load the model.
+
+        Args:
+            model_size: Whisper model name or path (tiny, base, small...)
+            compute_type: CTranslate2 compute type
+            cpu_threads: Threads per transcription (0 lets CTranslate2 decide)
+
+        Raises:
+            ValueError: If faster-whisper is not installed
+        """
+        if WhisperModel is None:
+            raise ValueError("faster-whisper is not installed")
+        self.model = WhisperModel(model_size, device='cpu', compute_type=compute_type, cpu_threads=cpu_threads)
+
+    def transcribe(self, pcm: bytes, sample_rate: int, language: str = 'es-ES') -> str:
+        audio = np.frombuffer(pcm, dtype=np.int16).astype(np.float32) / 32768.0
+        if sample_rate != self.MODEL_SAMPLE_RATE:
+            # Remuestreo lineal: suficiente para voz telefónica
+            positions = np.arange(0, len(audio), sample_rate / self.MODEL_SAMPLE_RATE)
+            audio = np.interp(positions, np.arange(len(audio)), audio).astype(np.float32)
+        segments, _ = self.model.transcribe(
+            audio, language=language.split('-')[0] if language else None, beam_size=1, vad_filter=False
+        )
+        return ' '.join(segment.text.strip() for segment in segments).strip()
+
+
+def create_asr_backend(backend: str = 'stub', model: str = 'base', cpu_threads: int = 0) -> ASRBackend:
+    """
+    Build an ASR backend.
+
+    Args:
+        backend: 'stub' or 'faster-whisper'
+        model: Model name for the faster-whisper backend
+        cpu_threads: Threads per transcription for the faster-whisper backend
+
+    Raises:
+        ValueError: If the backend is unknown or its dependencies are missing
+    """
+    if backend == 'stub':
+        return StubASRBackend()
+    if backend == 'faster-whisper':
+        return FasterWhisperBackend(model, cpu_threads=cpu_threads)
+    raise ValueError(f"Unknown ASR backend: {backend}")
+
+
+class TranscriptionJobs:
+    """ASR work submitted for one audio chunk: final segments and an optional partial."""
+
+    def __init__(self, finals: List[Future], partial: Optional[Future]):
+        self.finals = finals
+        self.partial = partial
+
+    def result(self, timeout: Optional[float] = None) -> Dict[str, Any]:
+        """
+        Wait for the transcriptions.
+
+        Returns:
+            Dictionary with the final 'segments' texts (in order, empty ones
+            dropped) and the 'partial' text of the speech in progress
+        """
+        texts = [future.result(timeout) for future in self.finals]
+        partial = self.partial.result(timeout) if self.partial else ''
+        return self._build(texts, partial)
+
+    async def aresult(self) -> Dict[str, Any]:
+        """Asyncio counterpart of result()."""
+        texts = [await asyncio.wrap_future(future) for future in self.finals]
+        partial = await asyncio.wrap_future(self.partial) if self.partial else ''
+        return self._build(texts, partial)
+
+    @staticmethod
+    def _build(texts: List[str], partial: str) -> Dict[str, Any]:
+        return {'segments': [text.strip() for text in texts if text.strip()], 'partial': partial.strip()}
+
+
+class _AudioStream:
+    """Voice activity state of one audio stream."""
+
+    def __init__(self, sample_rate: int, language: str, vad_options: Dict[str, Any]):
+        self.sample_rate = sample_rate
+        self.language = language
+        self.vad = VoiceActivityDetector(sample_rate, **vad_options)
+        self.bytes_since_partial = 0
+        self.lock = threading.Lock()
+
+
+class AudioTranscriber:
+    """
+    Server-side transcription of audio streams.
+
+    Each stream (one per conversation session) is cut into speech segments
+    by a VoiceActivityDetector; finished segments are transcribed on a
+    bounded pool of CPU workers. While a segment is in progress, a partial
+    transcript is produced from time to time when a worker is idle. When too
+    many segments are pending, new audio is refused with TranscriberBusyError
+    so that the client retries instead of growing an unbounded backlog.
+    """
+
+    def __init__(self, backend: ASRBackend, max_workers: int = 2, max_pending: int = 8,
+                 max_streams: int = 1000, partial_interval: float = 1.0,
+                 vad_options: Optional[Dict[str, Any]] = None):
+        """
+        Initialize the transcriber.
+
+        Args:
+            backend: The speech recognizer
+            max_workers: Number of concurrent transcriptions
+            max_pending: Maximum number of segments queued or running
+            max_streams: Maximum number of open streams (LRU eviction)
+            partial_interval: Seconds of new speech between two partial transcripts
+            vad_options: Keyword arguments of VoiceActivityDetector
+        """
+        self.backend = backend
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.max_streams = max_streams
+        self.partial_interval = partial_interval
+        self.vad_options = vad_options or {}
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='asr')
+        self._streams: "OrderedDict[str, _AudioStream]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._stats = {'segments': 0, 'partials': 0, 'busy_rejections': 0, 'audio_seconds': 0.0}
+
+    def feed(self, stream_id: str, pcm: bytes, sample_rate: int = DEFAULT_SAMPLE_RATE,
+             language: str = 'es-ES', final: bool = False) -> TranscriptionJobs:
+        """
+        Add a chunk of 16-bit mono PCM audio to a stream.
+
+        Voice activity detection runs in the calling thread; the
+        transcriptions are submitted to the worker pool.
+
+        Args:
+            stream_id: Identifier of the stream (e.g. the session id)
+            pcm: The audio chunk
+            sample_rate: Samples per second (a change of rate restarts the stream)
+            language: The language code of the conversation
+            final: The audio ends with this chunk: the segment in progress is closed
+
+        Returns:
+            The submitted jobs
+
+        Raises:
+            TranscriberBusyError: If too many segments are pending (the chunk was not consumed)
+        """
+        with self._lock:
+            if self._pending >= self.max_pending:
+                self._stats['busy_rejections'] += 1
+                raise TranscriberBusyError("Demasiados segmentos de audio pendientes de transcribir")
+            stream = self._stream(stream_id, sample_rate, language)
+            self._stats['audio_seconds'] += len(pcm) / SAMPLE_WIDTH / sample_rate
+
+        with stream.lock:
+            segments = stream.vad.feed(pcm)
+            if final:
+                last = stream.vad.flush()
+                if last:
+                    segments.append(last)
+            finals = [self._submit(segment, stream, 'segments') for segment in segments]
+
+            partial = None
+            stream.bytes_since_partial = 0 if segments else stream.bytes_since_partial + len(pcm)
+            partial_bytes = self.partial_interval * stream.sample_rate * SAMPLE_WIDTH
+            if stream.vad.in_speech and stream.bytes_since_partial >= partial_bytes and self._has_idle_worker():
+                stream.bytes_since_partial = 0
+                partial = self._submit(stream.vad.speech(), stream, 'partials')
+
+        if final:
+            self.close_stream(stream_id)
+        return TranscriptionJobs(finals, partial)
+
+    def close_stream(self, stream_id: str) -> None:
+        """Forget the state of a stream."""
+        with self._lock:
+            self._streams.pop(stream_id, None)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Return the backend, pool occupancy and counters."""
+        with self._lock:
+            return dict(
+                self._stats,
+                backend=self.backend.name,
+                streams=len(self._streams),
+                pending=self._pending,
+                max_pending=self.max_pending,
+                workers=self.max_workers
+            )
+
+    def _stream(self, stream_id: str, sample_rate: int, language: str) -> _AudioStream:
+        """Return (creating if needed) the state of a stream. Must hold the lock."""
+        stream = self._streams.get(stream_id)
+        if stream is None or stream.sample_rate != sample_rate:
+            stream = _AudioStream(sample_rate, language, self.vad_options)
+            self._streams[stream_id] = stream
+            while len(self._streams) > self.max_streams:
+                self._streams.popitem(last=False)
+        stream.language = language
+        self._streams.move_to_end(stream_id)
+        return stream
+
+    def _has_idle_worker(self) -> bool:
+        with self._lock:
+            return self._pending < self.max_workers
+
+    def _submit(self, pcm: bytes, stream: _AudioStream, counter: str) -> Future:
+        """Queue a transcription on the worker pool."""
+        with self._lock:
+            self._pending += 1
+            self._stats[counter] += 1
+        future = self._executor.submit(self.backend.transcribe, pcm, stream.sample_rate, stream.language)
+        future.add_done_callback(self._done)
+        return future
+
+    def _done(self, future: Future) -> None:
+        with self._lock:
+            self._pending -= 1
@@ -0,0 +1,289 @@
+"""
+Offline summarization of finished call transcripts.
+
+Transcripts are read from files (.txt/.md, .json or .jsonl) or from one day of
+the transcript log, summarized by a bounded pool of concurrent workers and
+written one JSON file per call. Calls already summarized in the output
+directory are skipped, so an interrupted run resumes where it stopped. Long
+calls are summarized by map-reduce (see OpenAIService.generate_call_summary).
+
+    cd src && python -m services.batch_summarizer ../calls --out ../summaries
+    cd src && python -m services.batch_summarizer --transcript-log ../transcripts --date 2026-10-16 --out ../summaries
+"""
+import argparse
+import asyncio
+import json
+import os
+import re
+import time
+from datetime import date, datetime
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+from services.async_openai_service import AsyncOpenAIService
+from services.token_counter import count_tokens
+from services.transcript_log import TranscriptLog
+from services.upstream_scheduler import CLASS_MAX_WAIT, UpstreamScheduler
+
+TRANSCRIPT_EXTENSIONS = ('.txt', '.md', '.json', '.jsonl')
+
+# Espera máxima en cola de una petición del lote: sin nadie esperando, no se descarta por tardar
+BATCH_MAX_WAIT = 3600.0
+
+# Caracteres no permitidos en el nombre del fichero de salida de una llamada
+UNSAFE_FILENAME = re.compile(r'[^\w.-]+')
+
+
+def _record_text(record: Dict[str, Any]) -> str:
+    """Text of a JSON transcript: 'text', 'transcript' or a list of 'segments' (strings or {seq, text})."""
+    if record.get('text') or record.get('transcript'):
+        return record.get('text') or record.get('transcript')
+    segments = record.get('segments') or []
+    if segments and isinstance(segments[0], dict):
+        segments = [segment.get('text', '') for segment in sorted(segments, key=lambda segment: segment.get('seq', 0))]
+    return ' '.join(segment.strip() for segment in segments if segment)
+
+
+def _parse_record(data: str, source: str) -> Optional[Dict[str, Any]]:
+    """Parse a JSON transcript record, or report it and return None if it is malformed."""
+    try:
+        record = json.loads(data)
+    except json.JSONDecodeError as e:
+        # Una línea dañada no debe detener el lote: se salta y se sigue con las demás
+        print(f"Transcripción no válida en {source}: {e}")
+        return None
+    if not isinstance(record, dict):
+        print(f"Transcripción no válida en {source}: se esperaba un objeto JSON")
+        return None
+    return record
+
+
+def load_transcripts(paths: Iterable[str]) -> Iterator[Tuple[str, str, str]]:
+    """
+    Read transcripts from files and directories.
+
+    Plain text files hold one call each, named after the file. JSON files hold
+    one call and .jsonl files one call per line, with an optional 'id'.
+
+    Yields:
+        Tuples (call id, source, text)
+    """
+    for path in paths:
+        if os.path.isdir(path):
+            files = sorted(
+                os.path.join(root, name)
+                for root, _, names in os.walk(path)
+                for name in names
+                if name.lower().endswith(TRANSCRIPT_EXTENSIONS)
+            )
+            base = path
+        else:
+            files, base = [path], os.path.dirname(path)
+        for file_path in files:
+            call_id = os.path.splitext(os.path.relpath(file_path, base))[0]
+            with open(file_path, encoding='utf-8') as f:
+                if file_path.endswith('.jsonl'):
+                    for number, line in enumerate(f, 1):
+                        if line.strip():
+                            record = _parse_record(line, f'{file_path}:{number}')
+                            if record is not None:
+                                yield str(record.get('id') or f'{call_id}-{number}'), f'{file_path}:{number}', _record_text(record)
+                elif file_path.endswith('.json'):
+                    record = _parse_record(f.read(), file_path)
+                    if record is not None:
+                        yield str(record.get('id') or call_id), file_path, _record_text(record)
+                else:
+                    yield call_id, file_path, f.read()
+
+
+def log_transcripts(directory: str, day: date) -> Iterator[Tuple[str, str, str]]:
+    """
+    Read the transcripts of every session logged on a day.
+
+    Yields:
+        Tuples (session id, source, text)
+    """
+    log = TranscriptLog(directory)
+    for session_id, segments in sorted(log.read_day(day).items()):
+        yield session_id, f'{directory}@{day.isoformat()}', ' '.join(text.strip() for _, text in segments)
+
+
+class BatchSummarizer:
+    """
+    Summarizes a backlog of transcripts with a bounded pool of workers.
+
+    Each summary is written atomically to <out_dir>/<call id>.json; existing
+    files are skipped unless force is set. Failed calls are retried with
+    exponential backoff and, if they still fail, left without output so the
+    next run retries them.
+    """
+
+    def __init__(self, service: AsyncOpenAIService, out_dir: str, concurrency: int = 8, retries: int = 3,
+                 retry_delay: float = 5.0, chunk_tokens: Optional[int] = None):
+        """
+        Initialize the summarizer.
+
+        Args:
+            service: Async OpenAI service used for the summaries
+            out_dir: Directory of the summary files (created if needed)
+            concurrency: Number of calls summarized at the same time
+            retries: Further attempts for a call whose summary fails
+            retry_delay: Seconds before the first retry (doubled after each one)
+            chunk_tokens: Maximum transcript tokens per model call; by default
+                chunks fit the context window of the primary model
+        """
+        self.service = service
+        self.out_dir = out_dir
+        self.concurrency = concurrency
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.chunk_tokens = chunk_tokens or service.summary_chunk_tokens()
+        os.makedirs(out_dir, exist_ok=True)
+        self.stats = {'summarized': 0, 'skipped': 0, 'empty': 0, 'failed': 0, 'map_reduce': 0, 'calls': 0}
+        self.failures: List[Tuple[str, str]] = []
+
+    def output_path(self, call_id: str) -> str:
+        """Path of the summary file of a call."""
+        return os.path.join(self.out_dir, UNSAFE_FILENAME.sub('_', call_id) + '.json')
+
+    async def run(self, transcripts: Iterable[Tuple[str, str, str]], force: bool = False) -> Dict[str, Any]:
+        """
+        Summarize every transcript not yet summarized.
+
+        Args:
+            transcripts: Tuples (call id, source, text)
+            force: Summarize again the calls that already have a summary file
+
+        Returns:
+            Counters of the run, with its duration and throughput
+        """
+        started = time.time()
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.concurrency * 2)
+        workers = [asyncio.create_task(self._worker(queue)) for _ in range(self.concurrency)]
+        try:
+            for call_id, source, text in transcripts:
+                if not force and os.path.exists(self.output_path(call_id)):
+                    self.stats['skipped'] += 1
+                    continue
+                if not text.strip():
+                    self.stats['empty'] += 1
+                    continue
+                await queue.put((call_id, source, text))
+            for _ in workers:
+                await queue.put(None)
+            await asyncio.gather(*workers)
+        finally:
+            for worker in workers:
+                worker.cancel()
+
+        elapsed = time.time() - started
+        return dict(
+            self.stats,
+            elapsed_s=round(elapsed, 1),
+            calls_per_minute=round(self.stats['summarized'] / elapsed * 60, 1) if elapsed else 0.0
+        )
+
+    async def _worker(self, queue: asyncio.Queue) -> None:
+        while True:
+            item = await queue.get()
+            if item is None:
+                return
+            await self._summarize(*item)
+
+    async def _summarize(self, call_id: str, source: str, text: str) -> None:
+        started = time.time()
+        result: Dict[str, Any] = {}
+        for attempt in range(self.retries + 1):
+            if attempt:
+                await asyncio.sleep(self.retry_delay * 2 ** (attempt - 1))
+            result = await self.service.generate_call_summary(text, chunk_tokens=self.chunk_tokens)
+            if result.get('success'):
+                break
+            print(f"Error al resumir {call_id} (intento {attempt + 1}): {result.get('error')}")
+        else:
+            self.stats['failed'] += 1
+            self.failures.append((call_id, result.get('error', '')))
+            return
+
+        map_reduce = result.get('map_reduce')
+        self.stats['summarized'] += 1
+        self.stats['calls'] += map_reduce['calls'] if map_reduce else 1
+        self.stats['map_reduce'] += 1 if map_reduce else 0
+        self._write(call_id, {
+            'id': call_id,
+            'source': source,
+            'call_summary': result['call_summary'],
+            'model': result.get('model'),
+            'map_reduce': map_reduce,
+            'transcript_tokens': count_tokens(text),
+            'elapsed_s': round(time.time() - started, 2),
+            'generated_at': datetime.now().isoformat(timespec='seconds'),
+        })
+        detail = f"{map_reduce['chunks']} fragmentos, {map_reduce['calls']} peticiones" if map_reduce else "1 petición"
+        print(f"[{self.stats['summarized']}] {call_id}: {detail}, {time.time() - started:.1f}s")
+
+    def _write(self, call_id: str, record: Dict[str, Any]) -> None:
+        """Write a summary file atomically, so an interrupted run never leaves a partial one."""
+        path = self.output_path(call_id)
+        temporary = path + '.tmp'
+        with open(temporary, 'w', encoding='utf-8') as f:
+            json.dump(record, f, ensure_ascii=False, indent=2)
+        os.replace(temporary, path)
+
+
+async def _run(args: argparse.Namespace) -> int:
+    if args.transcript_log:
+        day = date.fromisoformat(args.date) if args.date else date.today()
+        transcripts = log_transcripts(args.transcript_log, day)
+    else:
+        transcripts = load_transcripts(args.paths)
+
+    service = AsyncOpenAIService(
+        max_concurrency=args.max_upstream or args.concurrency * 2,
+        pool_size=(args.max_upstream or args.concurrency * 2) * 2,
+        request_timeout=args.timeout,
+        # Los mismos límites de la cuenta que el servidor, en peticiones y en tokens por minuto
+        scheduler=UpstreamScheduler(
+            rpm=args.rpm,
+            tpm=args.tpm,
+            max_wait={priority: BATCH_MAX_WAIT for priority in CLASS_MAX_WAIT}
+        )
+    )
+    summarizer = BatchSummarizer(service, args.out, concurrency=args.concurrency, retries=args.retries,
+                                 retry_delay=args.retry_delay, chunk_tokens=args.chunk_tokens)
+    try:
+        stats = await summarizer.run(transcripts, force=args.force)
+    finally:
+        await service.close()
+
+    print(json.dumps(stats, ensure_ascii=False))
+    for call_id, error in summarizer.failures:
+        print(f"Sin resumen: {call_id}: {error}")
+    return 1 if summarizer.failures else 0
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Summarize a backlog of finished call transcripts")
+    parser.add_argument('paths', nargs='*', help="Files or directories of .txt/.md/.json/.jsonl transcripts")
+    parser.add_argument('--transcript-log', help="Read the sessions of the transcript log directory instead")
+    parser.add_argument('--date', help="Day of the transcript log to read (YYYY-MM-DD, default today)")
+    parser.add_argument('--out', default='summaries', help="Output directory (one JSON file per call)")
+    parser.add_argument('--concurrency', type=int, default=8, help="Calls summarized at the same time")
+    parser.add_argument('--max-upstream', type=int, help="Simultaneous model requests (default 2 x concurrency)")
+    parser.add_argument('--rpm', type=float, help="Maximum model requests per minute")
+    parser.add_argument('--tpm', type=float, help="Maximum model tokens (prompt plus max_tokens) per minute")
+    parser.add_argument('--chunk-tokens', type=int, help="Transcript tokens per request (default fits the primary model)")
+    parser.add_argument('--retries', type=int, default=3)
+    parser.add_argument('--retry-delay', type=float, default=5.0)
+    parser.add_argument('--timeout', type=float, default=120, help="Timeout of each model request (seconds)")
+    parser.add_argument('--force', action='store_true', help="Summarize again the calls already summarized")
+    args = parser.parse_args()
+    if not args.paths and not args.transcript_log:
+        parser.error("indica ficheros de transcripciones o --transcript-log")
+    load_dotenv()
+    raise SystemExit(asyncio.run(_run(args)))
+
+
+if __name__ == '__main__':
+    main()
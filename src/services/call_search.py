@@ -0,0 +1,679 @@
+"""
+Persistent full-text search over past calls.
+
+Finalized transcript segments and generated summaries are queued with a
+constant-time call and written by a single indexer thread, which applies the
+updates of each flush interval in one SQLite transaction. New segments are
+appended to a side table and folded into the call's index row in batches, so
+a long call is not re-indexed whole on every flush. Every call is a row
+of a SQLite FTS5 index (BM25 ranking, postings without positions) over its
+analyzed terms: words are folded (lowercase, no accents), stripped of the
+stop words of the call's language (Spanish, English or French, detected from
+the text) and reduced by a light stemmer, so 'ofertas' finds 'oferta' and
+'facturación' finds 'factura'. The raw text is kept next to the index, so the
+calls and their summaries outlive the sessions. Index past calls from the
+transcript log and the output of the batch summarizer with:
+
+    cd src && python -m services.call_search --db ../data/calls.db --transcript-log ../data/transcripts --date 2026-10-16 --summaries ../summaries
+"""
+import argparse
+import json
+import math
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from functools import lru_cache
+from datetime import date
+from typing import Any, Dict, List, Optional, Tuple
+
+from services.knowledge_index import fold_text
+from services.transcript_log import TranscriptLog
+
+SUPPORTED_LANGUAGES = ('es', 'en', 'fr')
+
+# Campos buscables (columnas del índice) y su peso en la puntuación BM25
+SEARCH_FIELDS = ('transcript', 'summary')
+FIELD_WEIGHTS = (1.0, 2.0)
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# Segundos durante los que se reutilizan el número de llamadas, las longitudes medias
+# y las frecuencias de documento de los términos
+STATS_TTL = 60.0
+MAX_CACHED_TERMS = 10000
+
+MAX_PER_PAGE = 100
+
+# Llamadas escritas por transacción (acota lo que otros procesos esperan al escribir)
+MAX_BATCH = 500
+SUMMARY_PREVIEW_CHARS = 400
+SNIPPET_CHARS = 160
+SNIPPET_SCAN_CHARS = 20000
+
+WORD = re.compile(r'\w+', re.UNICODE)
+
+# Palabras vacías de cada idioma, ya normalizadas (sin tildes)
+STOPWORDS = {
+    'es': frozenset(fold_text(word) for word in '''
+a al algo algun alguna algunas alguno algunos ante antes aqui asi aunque bien cada como con contra cual
+cuando de del desde donde dos durante e el ella ellas ello ellos en entre era eramos eran es esa esas ese
+eso esos esta estaba estamos estan estar estas este esto estos estoy fue fueron ha habia han hasta hay la
+las le les lo los me mi mis mucho muy mas nada ni no nos nosotros o os otra otro para pero poco por porque
+pues que quien se sea ser si sin sobre solo son su sus tambien te tengo tiene tienen todo todos tu tus
+un una uno unos usted ustedes va vamos y ya yo bueno claro vale eh
+'''.split()),
+    'en': frozenset('''
+a about all also am an and any are as at be been but by can could did do does for from had has have he her
+him his how i if in into is it its just me my no not of on or our out she so some than that the their them
+then there these they this to too up us was we were what when which who will with would yes you your okay
+oh um uh well
+'''.split()),
+    'fr': frozenset(fold_text(word) for word in '''
+a ai au aux avec avez avons c ce ces cet cette d dans de des du elle elles en est et etait eu il ils j je
+l la le les leur leurs lui m ma mais me mes moi mon n ne nos notre nous on ou oui par pas pour qu que qui
+s sa sans se ses si son sont sur t ta te tes toi ton tres tu un une vos votre vous y bon bien alors donc
+'''.split()),
+}
+
+# Palabras que apenas cambian entre idiomas no cuentan para detectarlo
+_SHARED_STOPWORDS = STOPWORDS['es'] & STOPWORDS['en'] | STOPWORDS['es'] & STOPWORDS['fr'] | STOPWORDS['en'] & STOPWORDS['fr']
+
+# Palabras vacías mínimas para dar por detectado el idioma de un texto
+MIN_LANGUAGE_HITS = 3
+
+SCHEMA = (
+    '''CREATE TABLE IF NOT EXISTS calls (
+        id INTEGER PRIMARY KEY,
+        session_id TEXT NOT NULL UNIQUE,
+        language TEXT,
+        started_at REAL NOT NULL,
+        updated_at REAL NOT NULL,
+        transcript TEXT NOT NULL DEFAULT '',
+        summary TEXT NOT NULL DEFAULT '',
+        transcript_terms TEXT NOT NULL DEFAULT '',
+        summary_terms TEXT NOT NULL DEFAULT '',
+        transcript_length INTEGER NOT NULL DEFAULT 0,
+        summary_length INTEGER NOT NULL DEFAULT 0
+    )''',
+    # Segmentos recibidos que aún no están en la transcripción indexada de su llamada
+    '''CREATE TABLE IF NOT EXISTS call_segments (
+        id INTEGER PRIMARY KEY,
+        call_id INTEGER NOT NULL,
+        text TEXT NOT NULL,
+        length INTEGER NOT NULL,
+        queued_at REAL NOT NULL
+    )''',
+    'CREATE INDEX IF NOT EXISTS call_segments_call ON call_segments(call_id)',
+    # Índice de contenido externo (los términos están en calls) y sin posiciones:
+    # solo se guardan los documentos y columnas de cada término
+    '''CREATE VIRTUAL TABLE IF NOT EXISTS call_index USING fts5(
+        transcript_terms, summary_terms,
+        content='calls', content_rowid='id', detail=column,
+        tokenize='unicode61 remove_diacritics 0'
+    )''',
+)
+
+
+def _stem_es(word: str) -> str:
+    for suffix in ('amientos', 'imientos', 'amiento', 'imiento', 'aciones', 'iciones', 'acion', 'icion'):
+        if word.endswith(suffix) and len(word) - len(suffix) >= 3:
+            return word[:-len(suffix)]
+    if word.endswith('mente') and len(word) > 8:
+        word = word[:-5]
+    if word.endswith('ces') and len(word) > 4:
+        word = word[:-3] + 'z'
+    elif word.endswith('es') and len(word) > 4 and word[-3] not in 'aeiou':
+        word = word[:-2]
+    elif word.endswith('s') and len(word) > 3:
+        word = word[:-1]
+    # Sin la vocal final coinciden el singular, el plural y el género (caro, caras)
+    if word[-1] in 'aeo' and len(word) > 3:
+        word = word[:-1]
+    return word
+
+
+def _stem_en(word: str) -> str:
+    if word.endswith('ies') and len(word) > 4:
+        word = word[:-3] + 'y'
+    elif word.endswith('sses'):
+        word = word[:-2]
+    elif word.endswith('s') and not word.endswith(('ss', 'us', 'is')) and len(word) > 3:
+        word = word[:-1]
+    for suffix in ('ing', 'ed'):
+        if word.endswith(suffix) and len(word) - len(suffix) >= 3:
+            word = word[:-len(suffix)]
+            break
+    if word.endswith('e') and len(word) > 3:
+        word = word[:-1]
+    return word
+
+
+def _stem_fr(word: str) -> str:
+    for suffix in ('ations', 'ation', 'ements', 'ement'):
+        if word.endswith(suffix) and len(word) - len(suffix) >= 3:
+            return word[:-len(suffix)]
+    if word.endswith('aux') and len(word) > 4:
+        word = word[:-3] + 'al'
+    elif word.endswith(('s', 'x')) and len(word) > 3:
+        word = word[:-1]
+    if word.endswith('e') and len(word) > 3:
+        word = word[:-1]
+    return word
+
+
+STEMMERS = {'es': _stem_es, 'en': _stem_en, 'fr': _stem_fr}
+
+
+@lru_cache(maxsize=100000)
+def index_term(word: str, language: str) -> str:
+    """The index term of a word in a language ('' for stop words and single characters)."""
+    word = fold_text(word)
+    if len(word) < 2 or word in STOPWORDS[language]:
+        return ''
+    return word if word.isdigit() else STEMMERS[language](word)
+
+
+def analyze(text: str, language: str) -> List[str]:
+    """Split a text into its index terms, in order."""
+    terms = (index_term(word, language) for word in WORD.findall(text))
+    return [term for term in terms if term]
+
+
+def detect_language(text: str) -> Optional[str]:
+    """The language (es, en or fr) whose stop words a text uses most, or None if there are too few of them."""
+    hits = dict.fromkeys(SUPPORTED_LANGUAGES, 0)
+    for word in WORD.findall(text[:SNIPPET_SCAN_CHARS]):
+        word = fold_text(word)
+        if word in _SHARED_STOPWORDS:
+            continue
+        for language in SUPPORTED_LANGUAGES:
+            if word in STOPWORDS[language]:
+                hits[language] += 1
+    language = max(hits, key=hits.get)
+    return language if hits[language] >= MIN_LANGUAGE_HITS else None
+
+
+def normalize_language(language: Optional[str]) -> Optional[str]:
+    """'es-ES' -> 'es'; None for languages without an analyzer."""
+    language = (language or '').split('-')[0].lower()
+    return language if language in SUPPORTED_LANGUAGES else None
+
+
+class CallSearchIndex:
+    """
+    Persistent, incrementally updated search index of the calls.
+
+    The routes queue transcript segments and summaries without waiting; the
+    indexer thread merges the updates queued for each call and applies them
+    every flush_interval seconds. New segments are only stored: re-indexing
+    a call rewrites its whole row, so it is done when the waiting segments
+    are as long as the indexed transcript (which keeps the total cost linear
+    in the length of the call), when they have waited reindex_interval
+    seconds, and when the summary or the whole transcript changes or the call
+    finishes. Each re-index only analyzes the new text, unless the call's
+    language has just been detected, in which case the call is analyzed again
+    in that language.
+
+    A query finds the most recent max_candidates calls containing all its
+    terms by walking the postings in rowid order, and ranks only those with
+    BM25 (term presence per field, as the index keeps no positions). The call
+    count, average lengths and document frequencies come from a cache, so the
+    cost of a query does not grow with the number of calls indexed.
+    """
+
+    def __init__(self, db_path: str = 'calls.db', flush_interval: float = 2.0, default_language: str = 'es',
+                 max_candidates: int = 500, reindex_interval: float = 60.0):
+        """
+        Initialize the index.
+
+        Args:
+            db_path: SQLite file of the calls and their index (created if needed)
+            flush_interval: Seconds during which the updates are accumulated before being written
+            default_language: Language of the calls (and queries) whose language cannot be detected
+            max_candidates: Most recent matching calls ranked by a query
+            reindex_interval: Seconds new segments may wait before they are searchable (0: every flush)
+        """
+        self.db_path = db_path
+        self.flush_interval = flush_interval
+        self.default_language = normalize_language(default_language) or 'es'
+        self.max_candidates = max_candidates
+        self.reindex_interval = reindex_interval
+        self._waiting_segments = False
+        self._local = threading.local()
+        self._pending: 'OrderedDict[str, Dict[str, Any]]' = OrderedDict()
+        self._flushing = False
+        self._cond = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        self._corpus: Optional[Tuple[float, int, Tuple[float, float]]] = None
+        self._frequencies: 'OrderedDict[str, Tuple[float, int]]' = OrderedDict()
+        self._stats = {'queued': 0, 'updates': 0, 'reindexes': 0, 'flushes': 0, 'failures': 0, 'last_flush_ms': 0.0,
+                       'searches': 0, 'search_ms_total': 0.0, 'search_ms_max': 0.0}
+
+        db = self._db()
+        for statement in SCHEMA:
+            db.execute(statement)
+
+    def add_segments(self, session_id: str, texts: List[str]) -> None:
+        """Queue finalized transcript segments of a call for indexing."""
+        texts = [text for text in texts if text]
+        if texts:
+            self._queue(session_id, lambda update: update['segments'].extend(texts))
+
+    def replace_transcript(self, session_id: str, text: str, started_at: Optional[float] = None) -> None:
+        """
+        Queue a new transcript of a call that replaces the indexed one (e.g. after a reset).
+
+        Args:
+            session_id: The conversation session
+            text: The whole transcript
+            started_at: Start of the call, if it is not now (e.g. when indexing past calls)
+        """
+        def replace(update):
+            update['transcript'] = text
+            update['segments'] = []
+            update['queued_at'] = started_at or update['queued_at']
+        self._queue(session_id, replace)
+
+    def set_summary(self, session_id: str, summary: Optional[str]) -> None:
+        """Queue the summary of a call for indexing (replaces the previous one)."""
+        if summary:
+            self._queue(session_id, lambda update: update.__setitem__('summary', summary))
+
+    def finish(self, session_id: str) -> None:
+        """Queue the indexing of the segments of a call that has ended that are still waiting."""
+        self._queue(session_id, lambda update: update.__setitem__('finish', True))
+
+    def search(self, query: str, language: Optional[str] = None, field: Optional[str] = None,
+               page: int = 1, per_page: int = 20) -> Dict[str, Any]:
+        """
+        Find the calls containing every word of a query, best matches first.
+
+        Args:
+            query: Words to look for (stop words are ignored)
+            language: Language of the query; detected from it if not given. When
+                it cannot be detected (e.g. a single word), each word matches
+                its forms in every supported language
+            field: Only look in 'transcript' or 'summary' (both by default)
+            page: Page of results, from 1
+            per_page: Results per page (at most MAX_PER_PAGE)
+
+        Returns:
+            Dictionary with the 'results' of the page (session id, score, dates,
+            language, summary preview and a transcript snippet around the first
+            match), the analyzed 'terms', whether there are more pages and
+            whether only the most recent matching calls were ranked ('truncated')
+        """
+        started = time.perf_counter()
+        language = normalize_language(language) or detect_language(query)
+        groups = _query_terms(query, language)
+        terms = list(dict.fromkeys(term for group in groups for term in group))
+        page, per_page = max(1, page), min(max(1, per_page), MAX_PER_PAGE)
+        response = {'terms': terms, 'language': language, 'page': page, 'per_page': per_page,
+                    'results': [], 'has_more': False, 'truncated': False}
+
+        if groups:
+            fields = (field,) if field in SEARCH_FIELDS else SEARCH_FIELDS
+            expression = ' AND '.join('(' + ' OR '.join(f'"{term}"' for term in group) + ')' for group in groups)
+            if len(fields) == 1:
+                expression = f'{{{fields[0]}_terms}} : ({expression})'
+            db = self._db()
+            candidates = [rowid for rowid, in db.execute(
+                'SELECT rowid FROM call_index WHERE call_index MATCH ? ORDER BY rowid DESC LIMIT ?',
+                (expression, self.max_candidates)
+            )]
+            ranked = self._rank(db, candidates, terms, fields) if candidates else []
+            first = (page - 1) * per_page
+            response['has_more'] = first + per_page < len(ranked)
+            response['truncated'] = len(candidates) == self.max_candidates
+            response['results'] = self._results(db, ranked[first:first + per_page], set(terms))
+
+        elapsed = (time.perf_counter() - started) * 1000
+        with self._cond:
+            self._stats['searches'] += 1
+            self._stats['search_ms_total'] += elapsed
+            self._stats['search_ms_max'] = max(self._stats['search_ms_max'], elapsed)
+        response['took_ms'] = round(elapsed, 2)
+        return response
+
+    def get(self, session_id: str) -> Optional[Dict[str, Any]]:
+        """The stored transcript (waiting segments included) and summary of a call, or None if it was never indexed."""
+        db = self._db()
+        row = db.execute(
+            'SELECT id, session_id, language, started_at, updated_at, transcript, summary FROM calls '
+            'WHERE session_id = ?', (session_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        call = dict(zip(('session_id', 'language', 'started_at', 'updated_at', 'transcript', 'summary'), row[1:]))
+        waiting = [text for text, in db.execute('SELECT text FROM call_segments WHERE call_id = ? ORDER BY id',
+                                                (row[0],))]
+        call['transcript'] = ' '.join(part for part in (call['transcript'], *waiting) if part)
+        return call
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Return the indexed calls, the updates pending and written, and the search latency."""
+        db = self._db()
+        calls = db.execute('SELECT count(*) FROM calls').fetchone()[0]
+        waiting = db.execute('SELECT count(DISTINCT call_id) FROM call_segments').fetchone()[0]
+        try:
+            size = sum(os.path.getsize(self.db_path + suffix)
+                       for suffix in ('', '-wal') if os.path.exists(self.db_path + suffix))
+        except OSError:
+            size = None
+        with self._cond:
+            stats = dict(self._stats, calls=calls, pending=len(self._pending), waiting_calls=waiting, db_bytes=size)
+        total = stats.pop('search_ms_total')
+        stats['search_ms_avg'] = round(total / stats['searches'], 2) if stats['searches'] else 0.0
+        stats['search_ms_max'] = round(stats['search_ms_max'], 2)
+        return stats
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """Wait until every queued update has been written. Returns False on timeout."""
+        with self._cond:
+            return self._cond.wait_for(lambda: not self._pending and not self._flushing, timeout)
+
+    def _rank(self, db: sqlite3.Connection, candidates: List[int], terms: List[str],
+              fields: Tuple[str, ...]) -> List[Tuple[int, float]]:
+        """Score the candidate calls with BM25 and return (rowid, score) pairs, best (then newest) first."""
+        calls, averages = self._corpus_stats(db)
+        lengths = {row[0]: row[1:] for row in db.execute(
+            'SELECT id, transcript_length, summary_length FROM calls '
+            f'WHERE id IN ({",".join("?" * len(candidates))})', candidates
+        )}
+        scores = dict.fromkeys(candidates, 0.0)
+        for term in terms:
+            # Ambas cifras pueden venir de cachés de distinta edad
+            frequency = min(self._document_frequency(db, term), calls)
+            idf = max(math.log((calls - frequency + 0.5) / (frequency + 0.5)), 1e-6)
+            for field in fields:
+                column = SEARCH_FIELDS.index(field)
+                average = averages[column] or 1.0
+                # Solo hace falta recorrer los postings desde el candidato más antiguo
+                for rowid, in db.execute('SELECT rowid FROM call_index WHERE call_index MATCH ? AND rowid >= ?',
+                                         (f'{{{field}_terms}} : "{term}"', candidates[-1])):
+                    if rowid in scores:
+                        norm = 1 - BM25_B + BM25_B * lengths[rowid][column] / average
+                        scores[rowid] += FIELD_WEIGHTS[column] * idf * (BM25_K1 + 1) / (1 + BM25_K1 * norm)
+        return sorted(scores.items(), key=lambda item: (-item[1], -item[0]))
+
+    def _results(self, db: sqlite3.Connection, ranked: List[Tuple[int, float]], terms) -> List[Dict[str, Any]]:
+        """The stored details of a page of ranked calls, with a snippet of each transcript."""
+        if not ranked:
+            return []
+        calls = {row[0]: row for row in db.execute(
+            'SELECT id, session_id, language, started_at, updated_at, summary, transcript FROM calls '
+            f'WHERE id IN ({",".join("?" * len(ranked))})', [rowid for rowid, _ in ranked]
+        )}
+        results = []
+        for rowid, score in ranked:
+            _, session_id, language, started_at, updated_at, summary, transcript = calls[rowid]
+            results.append({
+                'session_id': session_id,
+                'score': round(score, 6),
+                'language': language,
+                'started_at': started_at,
+                'updated_at': updated_at,
+                'summary': summary[:SUMMARY_PREVIEW_CHARS],
+                'snippet': _snippet(transcript, terms, language or self.default_language),
+            })
+        return results
+
+    def _corpus_stats(self, db: sqlite3.Connection, refresh: bool = False) -> Tuple[int, Tuple[float, float]]:
+        """Number of calls and average length (in terms) of each field, recomputed at most every STATS_TTL."""
+        with self._cond:
+            corpus = self._corpus
+        if refresh or corpus is None or time.time() - corpus[0] > STATS_TTL:
+            calls, transcript, summary = db.execute(
+                'SELECT count(*), avg(transcript_length), avg(summary_length) FROM calls'
+            ).fetchone()
+            corpus = (time.time(), calls, (transcript or 0.0, summary or 0.0))
+            with self._cond:
+                self._corpus = corpus
+        return max(corpus[1], 1), corpus[2]
+
+    def _document_frequency(self, db: sqlite3.Connection, term: str) -> int:
+        """Number of calls containing a term, cached for STATS_TTL."""
+        with self._cond:
+            cached = self._frequencies.get(term)
+        if cached is not None and time.time() - cached[0] <= STATS_TTL:
+            return cached[1]
+        frequency = db.execute('SELECT count(*) FROM call_index WHERE call_index MATCH ?', (f'"{term}"',)).fetchone()[0]
+        with self._cond:
+            self._frequencies[term] = (time.time(), frequency)
+            self._frequencies.move_to_end(term)
+            while len(self._frequencies) > MAX_CACHED_TERMS:
+                self._frequencies.popitem(last=False)
+        return frequency
+
+    def _queue(self, session_id: Optional[str], change) -> None:
+        if not session_id:
+            return
+        with self._cond:
+            update = self._pending.get(session_id)
+            if update is None:
+                update = {'segments': [], 'transcript': None, 'summary': None, 'finish': False,
+                          'queued_at': time.time()}
+                self._pending[session_id] = update
+            change(update)
+            self._stats['queued'] += 1
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._index, name='call-search-indexer', daemon=True)
+                self._thread.start()
+            self._cond.notify()
+
+    def _index(self) -> None:
+        while True:
+            with self._cond:
+                if not self._pending:
+                    # Sin actualizaciones solo hay que despertar para indexar los segmentos que llevan esperando
+                    self._cond.wait(self.reindex_interval if self._waiting_segments else None)
+                waiting = bool(self._pending)
+            if waiting:
+                # Se dejan acumular las actualizaciones: cada llamada se escribe una vez por intervalo
+                time.sleep(self.flush_interval)
+            with self._cond:
+                batch = list(self._pending.items())
+                self._pending.clear()
+                self._flushing = True
+            started = time.perf_counter()
+            failed = False
+            reindexed = 0
+            try:
+                db = self._db()
+                for first in range(0, len(batch), MAX_BATCH):
+                    with db:
+                        db.execute('BEGIN IMMEDIATE')
+                        for session_id, update in batch[first:first + MAX_BATCH]:
+                            reindexed += self._apply(db, session_id, update)
+                due = [call_id for call_id, in db.execute(
+                    'SELECT call_id FROM call_segments GROUP BY call_id HAVING min(queued_at) <= ?',
+                    (time.time() - self.reindex_interval,)
+                )]
+                for first in range(0, len(due), MAX_BATCH):
+                    with db:
+                        db.execute('BEGIN IMMEDIATE')
+                        for call_id in due[first:first + MAX_BATCH]:
+                            self._reindex(db, call_id, None, None)
+                reindexed += len(due)
+                self._waiting_segments = db.execute('SELECT 1 FROM call_segments LIMIT 1').fetchone() is not None
+                # Las estadísticas del ranking se renuevan aquí, fuera de las búsquedas
+                self._corpus_stats(db)
+            except sqlite3.Error as e:
+                print(f"Error al indexar {len(batch)} llamadas: {e}")
+                failed = True
+            with self._cond:
+                if failed:
+                    self._stats['failures'] += 1
+                else:
+                    self._stats['updates'] += len(batch)
+                    self._stats['reindexes'] += reindexed
+                    self._stats['flushes'] += 1
+                    self._stats['last_flush_ms'] = round((time.perf_counter() - started) * 1000, 2)
+                self._flushing = False
+                self._cond.notify_all()
+
+    def _apply(self, db: sqlite3.Connection, session_id: str, update: Dict[str, Any]) -> bool:
+        """
+        Write the queued changes of a call (called inside the flush transaction).
+
+        The new segments are only appended to the waiting ones; the call is
+        re-indexed when that is due.
+
+        Returns:
+            True if the call was re-indexed
+        """
+        row = db.execute('SELECT id, language, transcript_length FROM calls WHERE session_id = ?',
+                         (session_id,)).fetchone()
+        if row is None:
+            call_id = db.execute('INSERT INTO calls (session_id, started_at, updated_at) VALUES (?, ?, ?)',
+                                 (session_id, update['queued_at'], update['queued_at'])).lastrowid
+            # Fila vacía en el índice, para que cada reindexación pueda borrar la anterior
+            db.execute("INSERT INTO call_index(rowid, transcript_terms, summary_terms) VALUES (?, '', '')", (call_id,))
+            row = (call_id, None, 0)
+        call_id, language, indexed_length = row
+
+        if update['transcript'] is not None:
+            # La transcripción nueva sustituye también a los segmentos que esperaban
+            db.execute('DELETE FROM call_segments WHERE call_id = ?', (call_id,))
+        new_text = ' '.join(update['segments'])
+        if new_text:
+            # Longitud en términos, como la de la transcripción indexada (en el idioma aún sin detectar, aproximada)
+            length = len(analyze(new_text, language or self.default_language))
+            db.execute('INSERT INTO call_segments (call_id, text, length, queued_at) VALUES (?, ?, ?, ?)',
+                       (call_id, new_text, length, time.time()))
+        waiting = db.execute('SELECT sum(length) FROM call_segments WHERE call_id = ?', (call_id,)).fetchone()[0] or 0
+
+        # Reindexar cuesta lo que mide la llamada: solo se hace cuando lo que espera es tan largo como lo indexado
+        if (update['transcript'] is None and update['summary'] is None and not update['finish']
+                and waiting < max(indexed_length, 1)):
+            return False
+        self._reindex(db, call_id, update['transcript'], update['summary'])
+        return True
+
+    def _reindex(self, db: sqlite3.Connection, call_id: int, replacement: Optional[str],
+                 new_summary: Optional[str]) -> None:
+        """Fold the waiting segments of a call into its transcript and index it again (inside a transaction)."""
+        row = db.execute(
+            'SELECT language, transcript, summary, transcript_terms, summary_terms, transcript_length, summary_length '
+            'FROM calls WHERE id = ?', (call_id,)
+        ).fetchone()
+        language, transcript, summary, transcript_terms, summary_terms, transcript_length, summary_length = row
+        segments = [text for text, in db.execute('SELECT text FROM call_segments WHERE call_id = ? ORDER BY id',
+                                                 (call_id,))]
+        db.execute('DELETE FROM call_segments WHERE call_id = ?', (call_id,))
+
+        if replacement is not None:
+            transcript, transcript_terms, transcript_length = '', '', 0
+        new_text = ' '.join(part for part in (replacement, *segments) if part)
+        if new_text:
+            transcript = ' '.join(part for part in (transcript, new_text) if part)
+        if new_summary is not None:
+            summary = new_summary
+
+        detected = language or detect_language(' '.join((transcript, summary)))
+        analyzer = detected or self.default_language
+        if detected != language:
+            # Idioma recién detectado: la llamada se analiza de nuevo entera
+            terms = analyze(transcript, analyzer)
+            transcript_terms, transcript_length = ' '.join(terms), len(terms)
+        elif new_text:
+            terms = analyze(new_text, analyzer)
+            transcript_terms = ' '.join(part for part in (transcript_terms, *terms) if part)
+            transcript_length += len(terms)
+        if detected != language or new_summary is not None:
+            terms = analyze(summary, analyzer)
+            summary_terms, summary_length = ' '.join(terms), len(terms)
+
+        # Con contenido externo, para borrar los términos antiguos hay que volver a darlos
+        db.execute("INSERT INTO call_index(call_index, rowid, transcript_terms, summary_terms) "
+                   "VALUES('delete', ?, ?, ?)", (call_id, row[3], row[4]))
+        db.execute('UPDATE calls SET language = ?, updated_at = ?, transcript = ?, summary = ?, transcript_terms = ?, '
+                   'summary_terms = ?, transcript_length = ?, summary_length = ? WHERE id = ?',
+                   (detected, time.time(), transcript, summary, transcript_terms, summary_terms,
+                    transcript_length, summary_length, call_id))
+        db.execute('INSERT INTO call_index(rowid, transcript_terms, summary_terms) VALUES (?, ?, ?)',
+                   (call_id, transcript_terms, summary_terms))
+
+    def _db(self) -> sqlite3.Connection:
+        """Return the connection of the current thread (sqlite3 connections are not shared)."""
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(self.db_path, timeout=10, isolation_level=None)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=NORMAL')
+            self._local.db = db
+        return db
+
+
+def _query_terms(query: str, language: Optional[str]) -> List[List[str]]:
+    """
+    The index terms of each word of a query, in a known language or else in all of them.
+
+    Without a language, a word that is a stop word in any language is ignored.
+    """
+    groups = []
+    for word in WORD.findall(query):
+        if language:
+            forms = [index_term(word, language)]
+        else:
+            forms = [index_term(word, candidate) for candidate in SUPPORTED_LANGUAGES]
+        if all(forms):
+            forms = list(dict.fromkeys(forms))
+            if forms not in groups:
+                groups.append(forms)
+    return groups
+
+
+def _snippet(text: str, terms, language: str) -> str:
+    """The stretch of text around the first word matching one of the terms (its start if none does)."""
+    for match in WORD.finditer(text, 0, SNIPPET_SCAN_CHARS):
+        if index_term(match.group(), language) in terms:
+            start = max(0, match.start() - SNIPPET_CHARS // 2)
+            if start:
+                start = text.find(' ', start, match.start()) + 1 or start
+            end = min(len(text), start + SNIPPET_CHARS)
+            return ('…' if start else '') + text[start:end].strip() + ('…' if end < len(text) else '')
+    return text[:SNIPPET_CHARS] + ('…' if len(text) > SNIPPET_CHARS else '')
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Index past calls: sessions of the transcript log and batch summaries")
+    parser.add_argument('--db', default=os.path.join('data', 'calls.db'), help="SQLite file of the call index")
+    parser.add_argument('--transcript-log', help="Directory of the transcript log")
+    parser.add_argument('--date', action='append', help="Day of the transcript log to index (YYYY-MM-DD, repeatable; default today)")
+    parser.add_argument('--summaries', help="Directory of summaries written by services.batch_summarizer")
+    parser.add_argument('--language', default='es', help="Language of the calls whose language cannot be detected")
+    args = parser.parse_args()
+    if not args.transcript_log and not args.summaries:
+        parser.error("indica --transcript-log o --summaries")
+
+    index = CallSearchIndex(args.db, flush_interval=0, default_language=args.language)
+    if args.transcript_log:
+        log = TranscriptLog(args.transcript_log)
+        # Se leen todos los días antes de indexar: una llamada puede cruzar la medianoche
+        sessions: Dict[str, Tuple[float, Dict[int, str]]] = {}
+        for day in sorted(args.date or [date.today().isoformat()]):
+            for session_id, seq, timestamp, text in log.iter_records(date.fromisoformat(day)):
+                sessions.setdefault(session_id, (timestamp, {}))[1][seq] = text.decode('utf-8')
+        for session_id, (started_at, segments) in sessions.items():
+            index.replace_transcript(session_id, ' '.join(text for _, text in sorted(segments.items())), started_at)
+        print(f"{len(sessions)} llamadas")
+    if args.summaries:
+        count = 0
+        for name in sorted(os.listdir(args.summaries)):
+            if name.endswith('.json'):
+                with open(os.path.join(args.summaries, name), encoding='utf-8') as f:
+                    record = json.load(f)
+                if record.get('id') and record.get('call_summary'):
+                    index.set_summary(str(record['id']), record['call_summary'])
+                    count += 1
+        print(f"{count} resúmenes")
+    index.wait()
+    print(json.dumps(index.get_stats(), ensure_ascii=False))
+
+
+if __name__ == '__main__':
+    main()
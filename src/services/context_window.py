@@ -0,0 +1,156 @@
+import re
+from typing import Any, Callable, Dict, List, Optional
+
+from services.token_counter import estimate_tokens, truncate_to_tokens
+
+
+# Separa el texto en enunciados por signos de puntuación final
+UTTERANCE_SPLIT = re.compile(r'(?<=[.!?¿¡…])\s+')
+
+# Longitud del fragmento usado para comprobar que la transcripción no ha cambiado
+ANCHOR_CHARS = 32
+
+SECTION_LABELS = {
+    'es': ("[Resumen de la conversación anterior]", "[Fragmento más reciente]"),
+    'en': ("[Summary of the earlier conversation]", "[Most recent fragment]"),
+    'fr': ("[Résumé de la conversation précédente]", "[Fragment le plus récent]"),
+}
+
+
+class ConversationContextManager:
+    """
+    Keep the transcript sent to the LLM under a token budget.
+
+    The most recent utterances are kept verbatim, while older turns are folded
+    into a compact running digest. The digest is only refreshed when the
+    verbatim part no longer fits, and each refresh frees enough room for the
+    next `digest_refresh_tokens` tokens of conversation, so prompt size stays
+    flat however long the call lasts.
+
+    The state is stored in the session entry under the 'context' key.
+    """
+
+    def __init__(self, token_budget: int = 1500, digest_max_tokens: int = 250,
+                 digest_refresh_tokens: int = 400,
+                 digest_fn: Optional[Callable[[str, str, str, int], Optional[str]]] = None):
+        """
+        Initialize the context manager.
+
+        Args:
+            token_budget: Maximum tokens of conversation text sent per prompt
+            digest_max_tokens: Maximum size of the running digest
+            digest_refresh_tokens: New tokens allowed before the digest is refreshed again
+            digest_fn: Callable(previous_digest, older_text, language, max_tokens)
+                returning the new digest, or None to use the extractive fallback
+        """
+        if digest_max_tokens + digest_refresh_tokens >= token_budget:
+            raise ValueError("token_budget must be larger than digest_max_tokens + digest_refresh_tokens")
+
+        self.token_budget = token_budget
+        self.digest_max_tokens = digest_max_tokens
+        self.digest_refresh_tokens = digest_refresh_tokens
+        self._digest_fn = digest_fn
+
+    def build_context(self, session_data: Dict[str, Any], transcript: str, language: str = 'es-ES') -> str:
+        """
+        Build the conversation text for a prompt within the token budget.
+
+        Args:
+            session_data: The session entry where the context state is kept
+            transcript: The full transcript received from the client
+            language: The language code of the conversation
+
+        Returns:
+            The (possibly condensed) conversation text to send to the LLM
+        """
+        state = self._get_state(session_data, transcript)
+        pending = transcript[state['digested_chars']:]
+
+        if estimate_tokens(state['digest']) + estimate_tokens(pending) > self.token_budget:
+            self._fold_older_turns(state, transcript, language)
+            pending = transcript[state['digested_chars']:]
+
+        if not state['digest']:
+            return pending
+        return self._format_context(state['digest'], pending.strip(), language)
+
+    def _get_state(self, session_data: Dict[str, Any], transcript: str) -> Dict[str, Any]:
+        """Return the context state, resetting it if the transcript no longer matches."""
+        state = session_data.get('context')
+        if state and self._matches_anchor(state, transcript):
+            return state
+
+        state = {'digest': '', 'digested_chars': 0, 'anchor': ''}
+        session_data['context'] = state
+        return state
+
+    @staticmethod
+    def _matches_anchor(state: Dict[str, Any], transcript: str) -> bool:
+        """Check that the already digested prefix is still part of the transcript."""
+        end = state['digested_chars']
+        if end > len(transcript):
+            return False
+        return transcript[max(0, end - ANCHOR_CHARS):end] == state['anchor']
+
+    def _fold_older_turns(self, state: Dict[str, Any], transcript: str, language: str) -> None:
+        """Fold everything but the most recent utterances into the digest."""
+        start = state['digested_chars']
+        recent_budget = self.token_budget - self.digest_max_tokens - self.digest_refresh_tokens
+        cut = start + self._recent_start(transcript[start:], recent_budget)
+        older_text = transcript[start:cut].strip()
+        if not older_text:
+            return
+
+        state['digest'] = self._refresh_digest(state['digest'], older_text, language)
+        state['digested_chars'] = cut
+        state['anchor'] = transcript[max(0, cut - ANCHOR_CHARS):cut]
+
+    @staticmethod
+    def _recent_start(text: str, recent_budget: int) -> int:
+        """Return the offset where the verbatim recent window starts."""
+        utterances = _split_utterances(text)
+        kept_tokens = 0
+        offset = len(text)
+        for start, utterance in reversed(utterances):
+            kept_tokens += estimate_tokens(utterance)
+            if kept_tokens > recent_budget:
+                break
+            offset = start
+
+        if offset == len(text):
+            # Sin puntuación (habitual en el dictado): se corta en el límite de palabra
+            offset = len(text) - len(truncate_to_tokens(text, recent_budget))
+            word_start = text.find(' ', offset)
+            return word_start + 1 if word_start != -1 else offset
+        return offset
+
+    def _refresh_digest(self, previous_digest: str, older_text: str, language: str) -> str:
+        """Produce the new running digest from the previous one and the folded text."""
+        digest = None
+        if self._digest_fn:
+            # Tras un reinicio del estado el tramo puede ser muy largo: se acota
+            older_text = truncate_to_tokens(older_text, self.token_budget * 2)
+            digest = self._digest_fn(previous_digest, older_text, language, self.digest_max_tokens)
+
+        if not digest:
+            # Alternativa extractiva si no hay servicio LLM disponible
+            digest = f"{previous_digest} {older_text}".strip()
+        return truncate_to_tokens(digest, self.digest_max_tokens)
+
+    @staticmethod
+    def _format_context(digest: str, recent_text: str, language: str) -> str:
+        """Lay out the digest and the recent fragment in a single prompt text."""
+        lang_code = language.split('-')[0]
+        digest_label, recent_label = SECTION_LABELS.get(lang_code, SECTION_LABELS['en'])
+        return f"{digest_label}\n{digest}\n\n{recent_label}\n{recent_text}"
+
+
+def _split_utterances(text: str) -> List[tuple]:
+    """Split a text into (offset, utterance) pairs."""
+    utterances = []
+    position = 0
+    for part in UTTERANCE_SPLIT.split(text):
+        start = text.find(part, position)
+        utterances.append((start, part))
+        position = start + len(part)
+    return utterances
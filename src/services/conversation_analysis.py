@@ -0,0 +1,114 @@
+import json
+import re
+from typing import Any, Dict
+
+# Valores permitidos en los campos enumerados del análisis combinado
+OVERALL_SENTIMENTS = ('very_negative', 'negative', 'neutral', 'positive', 'very_positive')
+INTEREST_LEVELS = ('low', 'medium', 'high')
+
+OVERALL_LABELS = {
+    'very_negative': 'muy negativo',
+    'negative': 'negativo',
+    'neutral': 'neutral',
+    'positive': 'positivo',
+    'very_positive': 'muy positivo',
+}
+INTEREST_LABELS = {'low': 'bajo', 'medium': 'medio', 'high': 'alto'}
+
+# Esquema documentado en el prompt y comprobado por validate_analysis
+ANALYSIS_SCHEMA = {
+    "interpretation": "string",
+    "suggested_response": "string",
+    "sentiment": {
+        "overall": "|".join(OVERALL_SENTIMENTS),
+        "emotions": ["string"],
+        "interest_level": "|".join(INTEREST_LEVELS),
+        "concerns": ["string"],
+        "recommendation": "string"
+    }
+}
+
+CODE_FENCE = re.compile(r'^```(?:json)?\s*|\s*```$')
+
+
+class AnalysisParseError(ValueError):
+    """Raised when the model output does not match the combined analysis schema."""
+
+
+def parse_analysis(raw_text: str) -> Dict[str, Any]:
+    """
+    Parse and validate the JSON produced by the combined analysis prompt.
+
+    Args:
+        raw_text: The raw completion text
+
+    Returns:
+        The validated analysis dictionary
+
+    Raises:
+        AnalysisParseError: If the text is not valid JSON or does not match the schema
+    """
+    text = CODE_FENCE.sub('', raw_text.strip())
+    try:
+        data = json.loads(text)
+    except json.JSONDecodeError as e:
+        raise AnalysisParseError(f"Invalid JSON: {e}") from e
+    validate_analysis(data)
+    return data
+
+
+def validate_analysis(data: Any) -> None:
+    """Check that a parsed object matches ANALYSIS_SCHEMA."""
+    if not isinstance(data, dict):
+        raise AnalysisParseError("The analysis must be a JSON object")
+    _require_string(data, 'interpretation')
+    _require_string(data, 'suggested_response')
+
+    sentiment = data.get('sentiment')
+    if not isinstance(sentiment, dict):
+        raise AnalysisParseError("'sentiment' must be an object")
+    _require_choice(sentiment, 'overall', OVERALL_SENTIMENTS)
+    _require_choice(sentiment, 'interest_level', INTEREST_LEVELS)
+    _require_string_list(sentiment, 'emotions')
+    _require_string_list(sentiment, 'concerns')
+    _require_string(sentiment, 'recommendation')
+
+
+def format_suggestions(analysis: Dict[str, Any]) -> str:
+    """Render the analysis in the two-section format of the suggestions panel."""
+    return (
+        f"1. INTERPRETACIÓN:\n{analysis['interpretation']}\n\n"
+        f"2. RESPUESTA SUGERIDA:\n{analysis['suggested_response']}"
+    )
+
+
+def format_sentiment(analysis: Dict[str, Any]) -> str:
+    """Render the sentiment part of the analysis for the sentiment panel."""
+    sentiment = analysis['sentiment']
+    concerns = ', '.join(sentiment['concerns']) or 'ninguna identificada'
+    return (
+        f"Sentimiento general: {OVERALL_LABELS[sentiment['overall']]}\n"
+        f"Emociones: {', '.join(sentiment['emotions']) or 'no detectadas'}\n"
+        f"Nivel de interés: {INTEREST_LABELS[sentiment['interest_level']]}\n"
+        f"Preocupaciones: {concerns}\n"
+        f"Recomendación: {sentiment['recommendation']}"
+    )
+
+
+def _require_string(data: Dict[str, Any], key: str) -> None:
+    """Check that data[key] is a non-empty string."""
+    if not isinstance(data.get(key), str) or not data[key].strip():
+        raise AnalysisParseError(f"'{key}' must be a non-empty string")
+
+
+def _require_choice(data: Dict[str, Any], key: str, choices: tuple) -> None:
+    """Check that data[key] is one of the allowed values."""
+    if data.get(key) not in choices:
+        raise AnalysisParseError(f"'{key}' must be one of {', '.join(choices)}")
+
+
+def _require_string_list(data: Dict[str, Any], key: str) -> None:
+    """Check that data[key] is a list of strings."""
+    value = data.get(key)
+    if not isinstance(value, list) or not all(isinstance(item, str) for item in value):
+        raise AnalysisParseError(f"'{key}' must be a list of strings")
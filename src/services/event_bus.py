@@ -0,0 +1,240 @@
+"""
+In-process bus of live session events for supervisor dashboards.
+
+The routes publish session updates (transcript segments, interim text,
+suggestions, sentiment, summaries) with a constant-time call. A single
+broadcaster thread encodes each event once and fans it out to the
+subscribers watching its session, each with its own bounded queue. Pending
+updates that a newer one supersedes (interim text, sentiment) are coalesced
+in place, and a subscriber whose queue fills up is dropped instead of
+slowing the others down.
+"""
+import asyncio
+import itertools
+import json
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Any, Dict, Iterable, List, Optional, Set
+
+# Tipos de evento de los que solo interesa el último pendiente de cada sesión
+COALESCED_TYPES = {'interim', 'sentiment'}
+
+# Tipos de evento cuyo último valor se envía a los suscriptores nuevos
+SNAPSHOT_TYPES = ('interim', 'suggestions', 'analysis', 'sentiment', 'summary')
+
+
+class BusEvent:
+    """A published event, encoded once and shared by every subscriber."""
+
+    __slots__ = ('session_id', 'type', 'data', 'sse')
+
+    def __init__(self, session_id: str, event_type: str, payload: Dict[str, Any]):
+        self.session_id = session_id
+        self.type = event_type
+        self.data = json.dumps(dict(payload, type=event_type, session_id=session_id, ts=time.time()),
+                               ensure_ascii=False)
+        self.sse = f"event: {event_type}\ndata: {self.data}\n\n"
+
+
+class Subscription:
+    """
+    Bounded queue of the events of the sessions a subscriber watches.
+
+    Consume it with get() from a thread or aget() from the event loop it was
+    created in. Once dropped (queue full) or closed, both return nothing. The
+    latest state of the watched sessions at subscription time is in snapshot,
+    outside the queue, to be sent before the queued events.
+    """
+
+    def __init__(self, sessions: Optional[Set[str]], max_queue: int, loop: Optional[asyncio.AbstractEventLoop]):
+        self.sessions = sessions
+        self.max_queue = max_queue
+        self.dropped = False
+        self.closed = False
+        self.coalesced = 0
+        self.snapshot: List[BusEvent] = []
+        self._pending: 'OrderedDict[Any, BusEvent]' = OrderedDict()
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+        self._loop = loop
+        self._ready = asyncio.Event() if loop else threading.Event()
+
+    def get(self, timeout: float) -> List[BusEvent]:
+        """Wait up to timeout seconds for events and return every pending one (empty on timeout)."""
+        self._ready.wait(timeout)
+        return self._drain()
+
+    async def aget(self, timeout: float) -> List[BusEvent]:
+        """Async version of get."""
+        try:
+            await asyncio.wait_for(self._ready.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        return self._drain()
+
+    def deliver(self, event: BusEvent) -> bool:
+        """Queue an event (called by the broadcaster). Returns False if the subscriber had to be dropped."""
+        with self._lock:
+            if self.closed:
+                return False
+            was_empty = not self._pending
+            if event.type in COALESCED_TYPES:
+                key = (event.session_id, event.type)
+                if key in self._pending:
+                    # El evento nuevo sustituye al pendiente y pasa al final de la cola
+                    del self._pending[key]
+                    self.coalesced += 1
+            else:
+                key = next(self._seq)
+            if len(self._pending) >= self.max_queue:
+                self._pending.clear()
+                self.dropped = self.closed = True
+            else:
+                self._pending[key] = event
+        if was_empty or self.closed:
+            self._wake()
+        return not self.dropped
+
+    def close(self) -> None:
+        with self._lock:
+            self.closed = True
+        self._wake()
+
+    def _drain(self) -> List[BusEvent]:
+        with self._lock:
+            events = list(self._pending.values())
+            self._pending.clear()
+            self._ready.clear()
+            return events
+
+    def _wake(self) -> None:
+        if self._loop is None:
+            self._ready.set()
+        else:
+            self._loop.call_soon_threadsafe(self._ready.set)
+
+
+class SessionEventBus:
+    """Publishes session events and fans them out to the subscriptions from one broadcaster thread."""
+
+    def __init__(self, max_queue: int = 256, max_sessions: int = 1000):
+        """
+        Initialize the bus.
+
+        Args:
+            max_queue: Pending events a subscriber may accumulate before it is dropped
+            max_sessions: Sessions whose latest events are kept for new subscribers
+        """
+        self.max_queue = max_queue
+        self.max_sessions = max_sessions
+        self._inbox: deque = deque()
+        self._cond = threading.Condition()
+        self._all: Set[Subscription] = set()
+        self._by_session: Dict[str, Set[Subscription]] = {}
+        self._latest: 'OrderedDict[str, Dict[str, BusEvent]]' = OrderedDict()
+        self._thread: Optional[threading.Thread] = None
+        self._stats = {'published': 0, 'delivered': 0, 'coalesced': 0, 'dropped_subscribers': 0}
+
+    def publish(self, session_id: Optional[str], event_type: str, payload: Dict[str, Any]) -> None:
+        """Publish an event of a session (returns at once; the broadcaster delivers it)."""
+        if not session_id:
+            return
+        with self._cond:
+            self._inbox.append((session_id, event_type, payload))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._broadcast, name='session-event-bus', daemon=True)
+                self._thread.start()
+            self._cond.notify()
+
+    def subscribe(self, sessions: Optional[Iterable[str]] = None, loop: Optional[asyncio.AbstractEventLoop] = None) -> Subscription:
+        """
+        Subscribe to the events of some sessions (all by default).
+
+        The latest interim text, suggestions, analysis, sentiment and summary
+        of the watched sessions are left in the subscription's snapshot rather
+        than in its queue: with hundreds of active sessions they would not fit
+        in max_queue and a dashboard watching them all would be dropped at once.
+
+        Args:
+            sessions: Session ids to watch; None watches every session
+            loop: Event loop of an asyncio consumer (None for a thread consumer)
+        """
+        subscription = Subscription(set(sessions) if sessions else None, self.max_queue, loop)
+        with self._cond:
+            if subscription.sessions is None:
+                self._all.add(subscription)
+                watched = list(self._latest)
+            else:
+                for session_id in subscription.sessions:
+                    self._by_session.setdefault(session_id, set()).add(subscription)
+                watched = [session_id for session_id in subscription.sessions if session_id in self._latest]
+            for session_id in watched:
+                for event_type in SNAPSHOT_TYPES:
+                    event = self._latest[session_id].get(event_type)
+                    if event is not None:
+                        subscription.snapshot.append(event)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        """Stop delivering events to a subscription."""
+        subscription.close()
+        with self._cond:
+            self._remove(subscription)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Return the events published and delivered, the subscribers and how many were dropped."""
+        with self._cond:
+            subscriptions = self._all.union(*self._by_session.values())
+            return dict(
+                self._stats,
+                subscribers=len(subscriptions),
+                pending=len(self._inbox),
+                coalesced=self._stats['coalesced'] + sum(subscription.coalesced for subscription in subscriptions),
+                sessions=len(self._latest),
+            )
+
+    def _broadcast(self) -> None:
+        while True:
+            with self._cond:
+                while not self._inbox:
+                    self._cond.wait()
+                batch = list(self._inbox)
+                self._inbox.clear()
+            for session_id, event_type, payload in batch:
+                self._fan_out(BusEvent(session_id, event_type, payload))
+
+    def _fan_out(self, event: BusEvent) -> None:
+        with self._cond:
+            self._stats['published'] += 1
+            latest = self._latest.setdefault(event.session_id, {})
+            latest[event.type] = event
+            self._latest.move_to_end(event.session_id)
+            if len(self._latest) > self.max_sessions:
+                self._latest.popitem(last=False)
+            subscriptions = list(self._all) + list(self._by_session.get(event.session_id, ()))
+
+        dropped = []
+        for subscription in subscriptions:
+            if subscription.deliver(event):
+                self._stats['delivered'] += 1
+            elif subscription.dropped:
+                dropped.append(subscription)
+        if dropped:
+            with self._cond:
+                self._stats['dropped_subscribers'] += len(dropped)
+                for subscription in dropped:
+                    self._remove(subscription)
+
+    def _remove(self, subscription: Subscription) -> None:
+        """Forget a subscription (called with the lock held)."""
+        if subscription in self._all or any(subscription in self._by_session.get(session_id, ())
+                                            for session_id in subscription.sessions or ()):
+            self._stats['coalesced'] += subscription.coalesced
+        self._all.discard(subscription)
+        for session_id in subscription.sessions or ():
+            watchers = self._by_session.get(session_id)
+            if watchers is not None:
+                watchers.discard(subscription)
+                if not watchers:
+                    del self._by_session[session_id]
@@ -0,0 +1,436 @@
+"""
+Local vector index of the knowledge base used to ground /ask-question.
+
+Documents are split into passages, embedded in batches and stored in a
+directory holding the normalized vectors as a .npy matrix (memory-mapped at
+load time), the passages as JSON lines and the index metadata. Search is a
+single matrix-vector product, or a FAISS inner-product index when faiss is
+installed. Build an index with:
+
+    cd src && python -m services.knowledge_index build ../docs --out ../knowledge_index
+"""
+import argparse
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+import unicodedata
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+import openai
+
+from services.token_counter import count_tokens
+
+try:
+    import faiss
+except ImportError:  # faiss es opcional: sin él se busca con un producto matricial de NumPy
+    faiss = None
+
+VECTORS_FILE = 'vectors.npy'
+PASSAGES_FILE = 'passages.jsonl'
+META_FILE = 'meta.json'
+FAISS_FILE = 'index.faiss'
+DOCUMENT_EXTENSIONS = ('.md', '.txt')
+
+WORD = re.compile(r'\w+', re.UNICODE)
+
+
+def fold_text(text: str) -> str:
+    """Lowercase a text and strip its accents ('¿Cuál?' and 'cual' share their words)."""
+    decomposed = unicodedata.normalize('NFKD', text.lower())
+    return ''.join(char for char in decomposed if not unicodedata.combining(char))
+
+
+# Palabras vacías que el embedder léxico ignora (solo añadirían similitud espuria)
+STOPWORDS = frozenset('''
+a al algo algunas algunos ante antes como con contra cual cuando de del desde donde durante e el ella
+ellos en entre era es esa ese eso esta estas este esto estos fue ha hay hasta la las le les lo los me
+mi muy más ni no nos o para pero por porque que qué se ser si sin sobre son su sus sí también te tiene
+todo todos tu un una uno unos y ya yo
+an and are as at be by for from in is it of on or that the this to with
+'''.split()) | frozenset(fold_text(word) for word in 'más qué sí'.split())
+
+
+def load_documents(paths: Iterable[str]) -> List[Tuple[str, str]]:
+    """
+    Read the text documents (.md, .txt) of files and directories (recursively).
+
+    Returns:
+        List of (source path, text) pairs
+    """
+    documents = []
+    for path in paths:
+        if os.path.isdir(path):
+            files = sorted(
+                os.path.join(root, name)
+                for root, _, names in os.walk(path) for name in names
+                if name.lower().endswith(DOCUMENT_EXTENSIONS)
+            )
+        else:
+            files = [path]
+        for file_path in files:
+            with open(file_path, encoding='utf-8') as f:
+                documents.append((file_path, f.read()))
+    return documents
+
+
+def chunk_document(text: str, max_tokens: int = 200, overlap_tokens: int = 40) -> List[str]:
+    """
+    Split a document into passages of about max_tokens tokens.
+
+    Paragraphs are kept together when they fit; longer ones are split by
+    sentences. Consecutive passages share about overlap_tokens tokens so that
+    an answer spanning a boundary is found in at least one of them.
+    """
+    pieces = []
+    for paragraph in re.split(r'\n\s*\n', text):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        if count_tokens(paragraph) <= max_tokens:
+            pieces.append(paragraph)
+        else:
+            pieces.extend(s for s in re.split(r'(?<=[.!?])\s+', paragraph) if s)
+
+    passages: List[str] = []
+    current: List[str] = []
+    current_tokens = 0
+    for piece in pieces:
+        tokens = count_tokens(piece)
+        if current and current_tokens + tokens > max_tokens:
+            passages.append('\n'.join(current))
+            # Solapamiento: arrastrar las últimas piezas al siguiente fragmento
+            overlap, overlap_size = [], 0
+            for previous in reversed(current):
+                overlap_size += count_tokens(previous)
+                if overlap_size > overlap_tokens:
+                    break
+                overlap.insert(0, previous)
+            current, current_tokens = overlap, sum(count_tokens(p) for p in overlap)
+        current.append(piece)
+        current_tokens += tokens
+    if current:
+        passages.append('\n'.join(current))
+    return passages
+
+
+class Embedder(ABC):
+    """Turns texts into L2-normalized float32 vectors."""
+
+    name = 'base'
+    # False si cada llamada sale de la máquina (hay que sacarla del bucle de eventos)
+    local = True
+    # Similitud por debajo de la cual un fragmento no se considera relacionado
+    default_min_score = 0.2
+    # Similitud a partir de la cual dos preguntas se consideran la misma (caché semántica)
+    default_duplicate_score = 0.92
+
+    def __init__(self, dim: int):
+        self.dim = dim
+
+    @abstractmethod
+    def embed(self, texts: List[str]) -> np.ndarray:
+        """Return a (len(texts), dim) float32 matrix of normalized vectors."""
+
+    def config(self) -> Dict[str, Any]:
+        """Parameters stored in the index metadata (queries must use the same embedder)."""
+        return {'name': self.name, 'dim': self.dim}
+
+
+class HashingEmbedder(Embedder):
+    """
+    Local embedder based on hashed words and word bigrams.
+
+    Needs no model or network: lexical similarity only, but it embeds a query
+    in microseconds. Suited to tests and to knowledge bases whose questions
+    share vocabulary with the documents. Words are accent-folded, stopwords
+    are dropped and repeated terms weigh logarithmically, so long passages
+    do not dominate.
+    """
+
+    name = 'hashing'
+    default_min_score = 0.1
+    default_duplicate_score = 0.85
+    BIGRAM_WEIGHT = 0.5
+
+    def __init__(self, dim: int = 1024):
+        super().__init__(dim)
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            words = [word for word in WORD.findall(fold_text(text)) if word not in STOPWORDS]
+            weights: Dict[str, float] = {}
+            for word in words:
+                weights[word] = weights.get(word, 0.0) + 1.0
+            for first, second in zip(words, words[1:]):
+                bigram = f'{first} {second}'
+                weights[bigram] = weights.get(bigram, 0.0) + self.BIGRAM_WEIGHT
+            for feature, weight in weights.items():
+                digest = hashlib.blake2b(feature.encode('utf-8'), digest_size=8).digest()
+                value = int.from_bytes(digest, 'little')
+                sign = 1.0 if value >> 63 else -1.0
+                vectors[row, value % self.dim] += sign * (1.0 + np.log(weight) if weight >= 1 else weight)
+        return _normalize(vectors)
+
+
+class OpenAIEmbedder(Embedder):
+    """Embeddings from the OpenAI API, requested in batches."""
+
+    name = 'openai'
+    local = False
+    default_min_score = 0.75
+    default_duplicate_score = 0.95
+
+    def __init__(self, model: str = 'text-embedding-ada-002', dim: int = 1536, batch_size: int = 100):
+        super().__init__(dim)
+        self.model = model
+        self.batch_size = batch_size
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        vectors = []
+        for start in range(0, len(texts), self.batch_size):
+            response = openai.Embedding.create(model=self.model, input=texts[start:start + self.batch_size])
+            batch = sorted(response['data'], key=lambda item: item['index'])
+            vectors.extend(item['embedding'] for item in batch)
+        return _normalize(np.array(vectors, dtype=np.float32).reshape(len(texts), -1))
+
+    def config(self) -> Dict[str, Any]:
+        return dict(super().config(), model=self.model)
+
+
+def create_embedder(config: Dict[str, Any]) -> Embedder:
+    """
+    Build the embedder described by an index's metadata (or the build options).
+
+    Raises:
+        ValueError: If the embedder is unknown
+    """
+    name = config.get('name', 'hashing')
+    if name == 'hashing':
+        return HashingEmbedder(int(config.get('dim', 1024)))
+    if name == 'openai':
+        return OpenAIEmbedder(config.get('model', 'text-embedding-ada-002'), int(config.get('dim', 1536)))
+    raise ValueError(f"Unknown embedder: {name}")
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def build_index(documents: List[Tuple[str, str]], embedder: Embedder, directory: str,
+                max_tokens: int = 200, overlap_tokens: int = 40, batch_size: int = 256) -> Dict[str, Any]:
+    """
+    Chunk, embed and write an index.
+
+    Args:
+        documents: List of (source, text) pairs
+        embedder: Embedder of the passages (stored in the metadata for the queries)
+        directory: Output directory (created if needed; previous files are replaced)
+        max_tokens: Approximate size of the passages
+        overlap_tokens: Approximate overlap between consecutive passages
+        batch_size: Passages embedded per call
+
+    Returns:
+        The index metadata
+    """
+    passages = [
+        {'source': source, 'chunk': index, 'text': passage}
+        for source, text in documents
+        for index, passage in enumerate(chunk_document(text, max_tokens, overlap_tokens))
+    ]
+    vectors = np.zeros((len(passages), embedder.dim), dtype=np.float32)
+    for start in range(0, len(passages), batch_size):
+        batch = [passage['text'] for passage in passages[start:start + batch_size]]
+        vectors[start:start + len(batch)] = embedder.embed(batch)
+
+    os.makedirs(directory, exist_ok=True)
+    np.save(os.path.join(directory, VECTORS_FILE), vectors)
+    with open(os.path.join(directory, PASSAGES_FILE), 'w', encoding='utf-8') as f:
+        for passage in passages:
+            f.write(json.dumps(passage, ensure_ascii=False) + '\n')
+    faiss_path = os.path.join(directory, FAISS_FILE)
+    if faiss is not None:
+        flat = faiss.IndexFlatIP(embedder.dim)
+        flat.add(vectors)
+        faiss.write_index(flat, faiss_path)
+    elif os.path.exists(faiss_path):
+        os.remove(faiss_path)
+
+    meta = {
+        'embedder': embedder.config(),
+        'passages': len(passages),
+        'documents': len(documents),
+        'max_tokens': max_tokens,
+        'overlap_tokens': overlap_tokens,
+        'created': time.time(),
+    }
+    with open(os.path.join(directory, META_FILE), 'w', encoding='utf-8') as f:
+        json.dump(meta, f, indent=2)
+    return meta
+
+
+class KnowledgeIndex:
+    """
+    Read-only index loaded from a directory written by build_index().
+
+    The vector matrix is memory-mapped, so loading is immediate whatever its
+    size and the pages are shared by every worker process of the host.
+    """
+
+    def __init__(self, directory: str):
+        """
+        Load the index.
+
+        Raises:
+            FileNotFoundError: If the directory does not hold an index
+        """
+        self.directory = directory
+        with open(os.path.join(directory, META_FILE), encoding='utf-8') as f:
+            self.meta = json.load(f)
+        with open(os.path.join(directory, PASSAGES_FILE), encoding='utf-8') as f:
+            self.passages = [json.loads(line) for line in f if line.strip()]
+        self.vectors = np.load(os.path.join(directory, VECTORS_FILE), mmap_mode='r')
+        self.faiss_index = None
+        faiss_path = os.path.join(directory, FAISS_FILE)
+        if faiss is not None and os.path.exists(faiss_path):
+            self.faiss_index = faiss.read_index(faiss_path, faiss.IO_FLAG_MMAP)
+
+    def __len__(self) -> int:
+        return len(self.passages)
+
+    def search(self, query: np.ndarray, k: int = 3) -> List[Tuple[int, float]]:
+        """
+        Return the k passages most similar to a normalized query vector.
+
+        Returns:
+            List of (passage position, cosine similarity), best first
+        """
+        k = min(k, len(self.passages))
+        if k <= 0:
+            return []
+        if self.faiss_index is not None:
+            scores, ids = self.faiss_index.search(query.reshape(1, -1).astype(np.float32), k)
+            return [(int(i), float(s)) for i, s in zip(ids[0], scores[0]) if i >= 0]
+        scores = self.vectors @ query
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(int(i), float(scores[i])) for i in top]
+
+
+class KnowledgeRetriever:
+    """Embeds a question and returns the passages of the index that can ground the answer."""
+
+    def __init__(self, index: KnowledgeIndex, embedder: Optional[Embedder] = None, top_k: int = 3,
+                 min_score: Optional[float] = None, query_cache_size: int = 256):
+        """
+        Initialize the retriever.
+
+        Args:
+            index: The knowledge index
+            embedder: Query embedder; by default the one the index was built with
+            top_k: Maximum number of passages returned
+            min_score: Passages less similar than this are not returned; defaults to
+                the embedder's default_min_score
+            query_cache_size: Number of recent query embeddings kept (repeated questions)
+        """
+        self.index = index
+        self.embedder = embedder or create_embedder(index.meta['embedder'])
+        self.top_k = top_k
+        self.min_score = self.embedder.default_min_score if min_score is None else min_score
+        self.query_cache_size = query_cache_size
+        self._query_cache: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def retrieve(self, question: str) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+        """
+        Find the passages related to a question.
+
+        Returns:
+            Tuple (passages, timing): passages are {'source', 'chunk', 'text',
+            'score'} dictionaries, best first; timing has the embedding and
+            search times in milliseconds
+        """
+        started = time.perf_counter()
+        query = self._embed_query(question)
+        embedded = time.perf_counter()
+        hits = self.index.search(query, self.top_k)
+        searched = time.perf_counter()
+
+        passages = [
+            dict(self.index.passages[position], score=round(score, 4))
+            for position, score in hits if score >= self.min_score
+        ]
+        timing = {
+            'embed_ms': round((embedded - started) * 1000, 2),
+            'search_ms': round((searched - embedded) * 1000, 2),
+            'passages': len(passages),
+        }
+        return passages, timing
+
+    def _embed_query(self, question: str) -> np.ndarray:
+        key = question.strip().lower()
+        with self._lock:
+            cached = self._query_cache.get(key)
+            if cached is not None:
+                self._query_cache.move_to_end(key)
+                return cached
+        vector = self.embedder.embed([question])[0]
+        with self._lock:
+            self._query_cache[key] = vector
+            while len(self._query_cache) > self.query_cache_size:
+                self._query_cache.popitem(last=False)
+        return vector
+
+
+def format_passages(passages: List[Dict[str, Any]]) -> str:
+    """Render retrieved passages for the grounded question prompt."""
+    return '\n\n'.join(
+        f"[{number}] ({os.path.basename(passage['source'])})\n{passage['text']}"
+        for number, passage in enumerate(passages, 1)
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Build the knowledge index used by /ask-question")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    build = subparsers.add_parser('build', help="Chunk and embed documents into an index")
+    build.add_argument('paths', nargs='+', help="Files or directories of .md/.txt documents")
+    build.add_argument('--out', default=os.path.join('data', 'knowledge_index'), help="Output directory")
+    build.add_argument('--embedder', choices=('hashing', 'openai'), default='hashing')
+    build.add_argument('--model', default='text-embedding-ada-002', help="Model of the openai embedder")
+    build.add_argument('--dim', type=int, help="Vector size (hashing: 1024, openai: 1536)")
+    build.add_argument('--max-tokens', type=int, default=200)
+    build.add_argument('--overlap-tokens', type=int, default=40)
+    search = subparsers.add_parser('search', help="Query an index")
+    search.add_argument('question')
+    search.add_argument('--index', default=os.path.join('data', 'knowledge_index'))
+    search.add_argument('-k', type=int, default=3)
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        config = {'name': args.embedder, 'model': args.model}
+        if args.dim:
+            config['dim'] = args.dim
+        if args.embedder == 'openai':
+            openai.api_key = os.getenv("OPENAI_API_KEY")
+        meta = build_index(load_documents(args.paths), create_embedder(config), args.out,
+                           args.max_tokens, args.overlap_tokens)
+        print(f"Indexed {meta['passages']} passages from {meta['documents']} documents into {args.out}")
+    else:
+        retriever = KnowledgeRetriever(KnowledgeIndex(args.index), top_k=args.k, min_score=0.0)
+        passages, timing = retriever.retrieve(args.question)
+        for passage in passages:
+            print(f"{passage['score']:.3f}  {passage['source']}#{passage['chunk']}: {passage['text'][:120]!r}")
+        print(timing)
+
+
+if __name__ == '__main__':
+    main()
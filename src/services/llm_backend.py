@@ -0,0 +1,461 @@
+"""
+Chat completion backends of OpenAIService.
+
+The service talks to a backend instead of the openai module, so the same
+prompts, routing and caching run against OpenAI or against an
+OpenAI-compatible server on our own hardware (vLLM, llama.cpp server, TGI...).
+Responses are openai==0.28.1 objects in every backend.
+
+For the local server, BatchingDispatcher groups the concurrent requests of
+every session into batched inference calls (several prompts per /completions
+request), which keeps the GPU/CPU busy, and hands each request its own result.
+"""
+import asyncio
+import json
+import threading
+import time
+from abc import ABC, abstractmethod
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Tuple
+
+import aiohttp
+import openai
+import requests
+from openai.openai_object import OpenAIObject
+
+from services.token_counter import count_tokens
+
+# Plantillas de chat para los prompts de las llamadas por lotes (el endpoint /completions recibe texto plano)
+CHAT_TEMPLATES = {
+    'chatml': {
+        'message': '<|im_start|>{role}\n{content}<|im_end|>\n',
+        'assistant': '<|im_start|>assistant\n',
+        'stop': ['<|im_end|>'],
+    },
+    'llama3': {
+        'message': '<|start_header_id|>{role}<|end_header_id|>\n\n{content}<|eot_id|>',
+        'assistant': '<|start_header_id|>assistant<|end_header_id|>\n\n',
+        'stop': ['<|eot_id|>'],
+    },
+}
+
+
+class LLMBackend(ABC):
+    """Chat completion API with the openai==0.28.1 ChatCompletion.create signature and response objects."""
+
+    name = 'base'
+    # True si el backend necesita OPENAI_API_KEY
+    needs_api_key = False
+
+    @abstractmethod
+    def create(self, **params) -> Any:
+        """Create a chat completion (an iterator of chunks with stream=True)."""
+
+    @abstractmethod
+    async def acreate(self, **params) -> Any:
+        """Async version of create (an async iterator of chunks with stream=True)."""
+
+    async def close(self) -> None:
+        """Release the connections of the backend."""
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Return the backend name and its counters, if any."""
+        return {'name': self.name}
+
+
+class OpenAIBackend(LLMBackend):
+    """The OpenAI API through the openai module (the async session is set by AsyncOpenAIService)."""
+
+    name = 'openai'
+    needs_api_key = True
+
+    def create(self, **params) -> Any:
+        return openai.ChatCompletion.create(**params)
+
+    async def acreate(self, **params) -> Any:
+        return await openai.ChatCompletion.acreate(**params)
+
+
+class LocalChatBackend(LLMBackend):
+    """
+    Self-hosted OpenAI-compatible server.
+
+    Single requests go to /chat/completions; batches go to /completions with
+    one prompt per request, rendered with the model's chat template. Errors
+    are raised as openai.error exceptions, so 429s are retried and failures
+    routed like those of the OpenAI API.
+    """
+
+    name = 'local'
+
+    def __init__(self, base_url: str, api_key: Optional[str] = None, timeout: float = 120,
+                 chat_template: str = 'chatml'):
+        """
+        Initialize the backend.
+
+        Args:
+            base_url: Base URL of the server API, e.g. http://gpu-1:8000/v1
+            api_key: Optional bearer token of the server
+            timeout: Timeout in seconds of each request
+            chat_template: Chat template of the model for batched prompts ('chatml' or 'llama3')
+
+        Raises:
+            ValueError: If the chat template is unknown
+        """
+        if chat_template not in CHAT_TEMPLATES:
+            raise ValueError(f"Unknown chat template: {chat_template}")
+        self.base_url = base_url.rstrip('/')
+        self.headers = {'Authorization': f'Bearer {api_key}'} if api_key else {}
+        self.timeout = timeout
+        self.template = CHAT_TEMPLATES[chat_template]
+        # Conexiones keep-alive: una sesión para los hilos de Flask y otra para el bucle de eventos
+        self._http = requests.Session()
+        self._asession: Optional[aiohttp.ClientSession] = None
+
+    def create(self, stream: bool = False, **params) -> Any:
+        response = self._http.post(f'{self.base_url}/chat/completions', json=dict(params, stream=stream),
+                                   headers=self.headers, timeout=self.timeout, stream=stream)
+        if response.status_code >= 400:
+            raise _api_error(response.status_code, response.text, response.headers)
+        if stream:
+            return self._stream(response)
+        return OpenAIObject.construct_from(response.json())
+
+    async def acreate(self, stream: bool = False, **params) -> Any:
+        response = await self._session().post(f'{self.base_url}/chat/completions',
+                                              json=dict(params, stream=stream), headers=self.headers)
+        if response.status >= 400:
+            async with response:
+                raise _api_error(response.status, await response.text(), response.headers)
+        if stream:
+            return self._astream(response)
+        async with response:
+            return OpenAIObject.construct_from(await response.json())
+
+    def create_batch(self, batch: List[Dict[str, Any]]) -> List[Any]:
+        """
+        Complete several requests in one inference call.
+
+        Every request must share model, temperature and max_tokens.
+
+        Returns:
+            One chat completion per request, in the same order
+        """
+        prompts = [self.render(params['messages']) for params in batch]
+        response = self._http.post(f'{self.base_url}/completions', json=self._batch_body(batch[0], prompts),
+                                   headers=self.headers, timeout=self.timeout)
+        if response.status_code >= 400:
+            raise _api_error(response.status_code, response.text, response.headers)
+        return self._batch_results(prompts, response.json())
+
+    async def acreate_batch(self, batch: List[Dict[str, Any]]) -> List[Any]:
+        """Async version of create_batch."""
+        prompts = [self.render(params['messages']) for params in batch]
+        async with self._session().post(f'{self.base_url}/completions', json=self._batch_body(batch[0], prompts),
+                                        headers=self.headers) as response:
+            if response.status >= 400:
+                raise _api_error(response.status, await response.text(), response.headers)
+            return self._batch_results(prompts, await response.json())
+
+    def render(self, messages: List[Dict[str, str]]) -> str:
+        """Render chat messages as a single prompt with the chat template."""
+        rendered = ''.join(self.template['message'].format(role=message['role'], content=message['content'])
+                           for message in messages)
+        return rendered + self.template['assistant']
+
+    async def close(self) -> None:
+        if self._asession:
+            await self._asession.close()
+            self._asession = None
+
+    def _session(self) -> aiohttp.ClientSession:
+        if self._asession is None:
+            self._asession = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=self.timeout))
+        return self._asession
+
+    def _batch_body(self, params: Dict[str, Any], prompts: List[str]) -> Dict[str, Any]:
+        return {
+            'model': params['model'],
+            'prompt': prompts,
+            'temperature': params.get('temperature'),
+            'max_tokens': params.get('max_tokens'),
+            'stop': self.template['stop'],
+        }
+
+    @staticmethod
+    def _batch_results(prompts: List[str], data: Dict[str, Any]) -> List[Any]:
+        """Turn the choices of a /completions response into one chat completion per prompt."""
+        choices = {choice.get('index', position): choice for position, choice in enumerate(data['choices'])}
+        results = []
+        for index, prompt in enumerate(prompts):
+            choice = choices.get(index)
+            if choice is None:
+                raise openai.error.APIError(f"La respuesta del lote no incluye el prompt {index}")
+            text = choice.get('text', '').strip()
+            prompt_tokens, completion_tokens = count_tokens(prompt), count_tokens(text)
+            results.append(OpenAIObject.construct_from({
+                'id': data.get('id'),
+                'object': 'chat.completion',
+                'model': data.get('model'),
+                'choices': [{
+                    'index': 0,
+                    'message': {'role': 'assistant', 'content': text},
+                    'finish_reason': choice.get('finish_reason'),
+                }],
+                # El servidor solo da el uso del lote entero: se estima el de cada petición
+                'usage': {
+                    'prompt_tokens': prompt_tokens,
+                    'completion_tokens': completion_tokens,
+                    'total_tokens': prompt_tokens + completion_tokens,
+                    'estimated': True,
+                },
+            }))
+        return results
+
+    @staticmethod
+    def _stream(response: requests.Response) -> Iterator[Any]:
+        with response:
+            for line in response.iter_lines():
+                chunk = _sse_data(line.decode('utf-8'))
+                if chunk is None:
+                    continue
+                if chunk == '[DONE]':
+                    return
+                yield OpenAIObject.construct_from(json.loads(chunk))
+
+    @staticmethod
+    async def _astream(response: aiohttp.ClientResponse) -> AsyncIterator[Any]:
+        async with response:
+            async for line in response.content:
+                chunk = _sse_data(line.decode('utf-8'))
+                if chunk is None:
+                    continue
+                if chunk == '[DONE]':
+                    return
+                yield OpenAIObject.construct_from(json.loads(chunk))
+
+
+class _Batch:
+    __slots__ = ('params', 'futures', 'full')
+
+    def __init__(self, full: Optional[asyncio.Event] = None):
+        self.params: List[Dict[str, Any]] = []
+        self.futures: List[Any] = []
+        self.full = full
+
+
+class BatchingDispatcher(LLMBackend):
+    """
+    Groups the concurrent non-streaming requests of every session into batched calls of a backend.
+
+    Requests with the same model, temperature and max_tokens join an open
+    batch. The first one waits up to max_wait for others and sends the batch
+    as soon as it is full or the window closes; every request then gets its
+    own result (or the batch's exception). The send runs in its own task, so
+    cancelling the first request does not strand the rest. At most max_in_flight batches run
+    at once; while they do, the next batch keeps filling. Streams go straight
+    to the backend.
+    """
+
+    name = 'batching'
+
+    def __init__(self, backend: LocalChatBackend, max_batch_size: int = 8, max_wait: float = 0.02,
+                 max_in_flight: int = 2, timeout: Optional[float] = None):
+        """
+        Initialize the dispatcher.
+
+        Args:
+            backend: Backend with create_batch/acreate_batch
+            max_batch_size: Maximum number of requests per batch
+            max_wait: Seconds the first request of a batch waits for others
+            max_in_flight: Maximum number of batches running at the same time
+            timeout: Seconds a request waits for its batch (default: twice the backend timeout, for
+                the batch ahead and its own, plus max_wait)
+        """
+        self.backend = backend
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.max_in_flight = max_in_flight
+        self.timeout = timeout if timeout is not None else 2 * getattr(backend, 'timeout', 120) + max_wait
+        self._cond = threading.Condition()
+        self._open: Dict[Tuple, _Batch] = {}
+        self._in_flight = threading.BoundedSemaphore(max_in_flight)
+        self._ain_flight: Optional[asyncio.Semaphore] = None
+        self._tasks: set = set()
+        self._stats = {'requests': 0, 'batches': 0, 'failed_batches': 0, 'max_batch': 0, 'batch_ms': 0.0}
+
+    def create(self, **params) -> Any:
+        if params.get('stream'):
+            return self.backend.create(**params)
+        future: Future = Future()
+        key = _batch_key(params)
+        with self._cond:
+            batch, leader = self._join(key, params, future, None)
+            if leader:
+                deadline = time.monotonic() + self.max_wait
+                while self._open.get(key) is batch:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        del self._open[key]
+                        break
+                    self._cond.wait(remaining)
+            elif self._open.get(key) is not batch:
+                # Esta petición ha llenado el lote: despertar al primero para que lo envíe
+                self._cond.notify_all()
+        if leader:
+            with self._in_flight:
+                started = time.perf_counter()
+                try:
+                    results = self.backend.create_batch(batch.params)
+                except Exception as e:
+                    self._finish(batch, None, e, started)
+                else:
+                    self._finish(batch, results, None, started)
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            raise openai.error.Timeout(f"El lote no ha respondido en {self.timeout:.0f} s")
+
+    async def acreate(self, **params) -> Any:
+        if params.get('stream'):
+            return await self.backend.acreate(**params)
+        future = asyncio.get_running_loop().create_future()
+        key = _batch_key(params)
+        batch, leader = self._join(key, params, future, asyncio.Event())
+        if leader:
+            # El lote se envía en su propia tarea: si se cancela la petición que lo abrió, el resto lo recibe igual
+            task = asyncio.ensure_future(self._asend(key, batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        try:
+            return await asyncio.wait_for(asyncio.shield(future), self.timeout)
+        except asyncio.TimeoutError:
+            future.cancel()
+            raise openai.error.Timeout(f"El lote no ha respondido en {self.timeout:.0f} s")
+
+    async def _asend(self, key: Tuple, batch: _Batch) -> None:
+        """Wait for the batch to fill up (or its window to close) and send it."""
+        started = time.perf_counter()
+        try:
+            try:
+                await asyncio.wait_for(batch.full.wait(), self.max_wait)
+            except asyncio.TimeoutError:
+                pass
+            finally:
+                if self._open.get(key) is batch:
+                    del self._open[key]
+            if self._ain_flight is None:
+                self._ain_flight = asyncio.Semaphore(self.max_in_flight)
+            async with self._ain_flight:
+                started = time.perf_counter()
+                results = await self.backend.acreate_batch(batch.params)
+        except asyncio.CancelledError as e:
+            # Cierre del bucle: las peticiones del lote se cancelan en vez de quedarse esperando
+            self._finish(batch, None, e, started)
+            raise
+        except Exception as e:
+            self._finish(batch, None, e, started)
+        else:
+            self._finish(batch, results, None, started)
+
+    async def close(self) -> None:
+        await self.backend.close()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Return the batches sent, their mean and maximum size and mean duration."""
+        with self._cond:
+            stats = dict(self._stats)
+        batch_ms = stats.pop('batch_ms')
+        stats.update({
+            'name': f'{self.backend.name}+{self.name}',
+            'mean_batch': round(stats['requests'] / stats['batches'], 2) if stats['batches'] else None,
+            'mean_batch_ms': round(batch_ms / stats['batches'], 1) if stats['batches'] else None,
+            'max_batch_size': self.max_batch_size,
+            'max_wait_ms': self.max_wait * 1000,
+        })
+        return stats
+
+    def _join(self, key: Tuple, params: Dict[str, Any], future, full: Optional[asyncio.Event]) -> Tuple[_Batch, bool]:
+        """Add a request to the open batch of its key (opening one if needed); True if it is the first."""
+        batch = self._open.get(key)
+        leader = batch is None
+        if leader:
+            batch = self._open[key] = _Batch(full)
+        batch.params.append(params)
+        batch.futures.append(future)
+        if len(batch.params) >= self.max_batch_size:
+            del self._open[key]
+            if batch.full is not None:
+                batch.full.set()
+        return batch, leader
+
+    def _finish(self, batch: _Batch, results: Optional[List[Any]], error: Optional[Exception],
+                started: float) -> None:
+        """Hand every request of a batch its own result, or the batch's exception."""
+        with self._cond:
+            self._stats['batches'] += 1
+            self._stats['requests'] += len(batch.futures)
+            self._stats['max_batch'] = max(self._stats['max_batch'], len(batch.futures))
+            self._stats['batch_ms'] += (time.perf_counter() - started) * 1000
+            self._stats['failed_batches'] += 1 if error is not None else 0
+        for index, future in enumerate(batch.futures):
+            # La petición pudo cancelarse o vencer mientras esperaba
+            if future.done():
+                continue
+            if isinstance(error, asyncio.CancelledError):
+                future.cancel()
+            elif error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(results[index])
+
+
+def _batch_key(params: Dict[str, Any]) -> Tuple:
+    """Requests can share a batch when they share these generation parameters."""
+    return params['model'], params.get('temperature'), params.get('max_tokens')
+
+
+def _sse_data(line: str) -> Optional[str]:
+    """Payload of a Server-Sent-Events data line, or None for any other line."""
+    line = line.strip()
+    return line[len('data:'):].strip() if line.startswith('data:') else None
+
+
+def _api_error(status: int, body: str, headers) -> openai.error.OpenAIError:
+    """openai.error exception of an HTTP error of the local server."""
+    message = f"Error {status} del servidor local: {body[:200]}"
+    if status == 429:
+        return openai.error.RateLimitError(message, body, status, headers=headers)
+    return openai.error.APIError(message, body, status, headers=headers)
+
+
+def create_llm_backend(backend: str = 'openai', base_url: Optional[str] = None, api_key: Optional[str] = None,
+                       chat_template: str = 'chatml', timeout: float = 120, batch_size: int = 1,
+                       batch_wait: float = 0.02, max_in_flight: int = 2) -> LLMBackend:
+    """
+    Build a chat completion backend.
+
+    Args:
+        backend: 'openai' or 'local'
+        base_url: Base URL of the local server API
+        api_key: Optional bearer token of the local server
+        chat_template: Chat template of the local model for batched prompts
+        timeout: Timeout in seconds of each request to the local server
+        batch_size: Maximum requests per batch for the local server (1 disables batching)
+        batch_wait: Seconds a batch waits to fill up
+        max_in_flight: Maximum number of batches running at the same time
+
+    Raises:
+        ValueError: If the backend is unknown or the local server URL is missing
+    """
+    if backend == 'openai':
+        return OpenAIBackend()
+    if backend == 'local':
+        if not base_url:
+            raise ValueError("LOCAL_LLM_URL is required for the local LLM backend")
+        local = LocalChatBackend(base_url, api_key=api_key, timeout=timeout, chat_template=chat_template)
+        if batch_size > 1:
+            return BatchingDispatcher(local, max_batch_size=batch_size, max_wait=batch_wait,
+                                      max_in_flight=max_in_flight)
+        return local
+    raise ValueError(f"Unknown LLM backend: {backend}")
@@ -0,0 +1,145 @@
+from typing import Any, Dict, Optional, Tuple
+
+try:
+    from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Histogram, generate_latest
+    from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+except ImportError:  # prometheus_client es opcional: sin él no se exponen métricas
+    CollectorRegistry = None
+
+# Límites de los histogramas de latencia (segundos)
+ROUTE_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+UPSTREAM_LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1, 2, 4, 8, 15, 30, 60)
+
+
+class Metrics:
+    """
+    Prometheus metrics of the assistant: route latency, upstream model calls,
+    token usage, active sessions and response cache hits.
+
+    Every metric lives in the instance's own registry, exposed by the /metrics
+    endpoint. Session and cache figures are read from their stores at scrape
+    time. Without prometheus_client installed every method is a no-op and
+    enabled is False.
+    """
+
+    def __init__(self):
+        self.enabled = CollectorRegistry is not None
+        if not self.enabled:
+            return
+        self.registry = CollectorRegistry()
+        self.route_latency = Histogram(
+            'assistant_request_duration_seconds', 'Latency of the HTTP routes',
+            ['route', 'method', 'status'], buckets=ROUTE_LATENCY_BUCKETS, registry=self.registry
+        )
+        self.upstream_latency = Histogram(
+            'assistant_upstream_duration_seconds', 'Latency of the upstream model calls',
+            ['model', 'method'], buckets=UPSTREAM_LATENCY_BUCKETS, registry=self.registry
+        )
+        self.upstream_errors = Counter(
+            'assistant_upstream_errors_total', 'Failed upstream model calls',
+            ['model', 'method'], registry=self.registry
+        )
+        self.fallbacks = Counter(
+            'assistant_fallbacks_total', 'Requests not answered by their primary path',
+            ['method', 'reason'], registry=self.registry
+        )
+        self.tokens = Counter(
+            'assistant_tokens_total', 'Prompt and completion tokens of the upstream calls',
+            ['method', 'model', 'kind'], registry=self.registry
+        )
+
+    def observe_request(self, route: str, method: str, status: int, seconds: float) -> None:
+        """Record the latency of an HTTP request."""
+        if self.enabled:
+            self.route_latency.labels(route, method, str(status)).observe(seconds)
+
+    def observe_upstream(self, model: str, method: str, seconds: float, ok: bool) -> None:
+        """Record an upstream model call (method is the prompt name, e.g. 'suggestions')."""
+        if not self.enabled:
+            return
+        self.upstream_latency.labels(model, method).observe(seconds)
+        if not ok:
+            self.upstream_errors.labels(model, method).inc()
+
+    def observe_routing(self, method: str, routing: Dict[str, Any]) -> None:
+        """Record every attempt of a routed call, and the fallback if the primary model did not win."""
+        if not self.enabled:
+            return
+        for attempt in routing.get('attempts', []):
+            self.observe_upstream(attempt['model'], method, attempt['latency_ms'] / 1000, attempt['ok'])
+        if routing.get('reason') in ('fallback', 'hedge'):
+            self.fallbacks.labels(method, routing['reason']).inc()
+
+    def count_fallback(self, method: str, reason: str) -> None:
+        """Count a request answered by a fallback path."""
+        if self.enabled:
+            self.fallbacks.labels(method, reason).inc()
+
+    def count_tokens(self, method: str, model: str, usage: Optional[Dict[str, Any]]) -> None:
+        """Add the prompt and completion tokens of a response's usage."""
+        if not self.enabled or not usage:
+            return
+        self.tokens.labels(method, model, 'prompt').inc(usage.get('prompt_tokens') or 0)
+        self.tokens.labels(method, model, 'completion').inc(usage.get('completion_tokens') or 0)
+
+    def register_stores(self, session_store=None, response_cache=None, answer_cache=None) -> None:
+        """Expose the session store, response cache and semantic answer cache statistics, read at scrape time."""
+        if self.enabled:
+            self.registry.register(_StoreCollector(session_store, response_cache, answer_cache))
+
+    def exposition(self) -> Tuple[bytes, str]:
+        """
+        Render the metrics in the Prometheus text format.
+
+        Returns:
+            Tuple (body, content type)
+        """
+        return generate_latest(self.registry), CONTENT_TYPE_LATEST
+
+
+class _StoreCollector:
+    """Collector reading the session store and cache statistics."""
+
+    def __init__(self, session_store, response_cache, answer_cache=None):
+        self.session_store = session_store
+        self.response_cache = response_cache
+        self.answer_cache = answer_cache
+
+    def collect(self):
+        if self.session_store is not None:
+            stats = self.session_store.get_stats()
+            yield GaugeMetricFamily('assistant_active_sessions', 'Sessions in the session store',
+                                    value=stats['sessions'])
+            yield GaugeMetricFamily('assistant_session_store_bytes', 'Total size of the stored sessions',
+                                    value=stats['bytes'])
+            evictions = CounterMetricFamily('assistant_session_evictions', 'Sessions evicted from the store',
+                                            labels=['reason'])
+            for reason, count in stats['evictions'].items():
+                evictions.add_metric([reason], count)
+            yield evictions
+
+        if self.response_cache is not None:
+            stats = self.response_cache.get_stats()
+            lookups = CounterMetricFamily('assistant_cache_lookups', 'Response cache lookups',
+                                          labels=['method', 'result'])
+            hit_rate = GaugeMetricFamily('assistant_cache_hit_ratio', 'Response cache hit rate since startup',
+                                         labels=['method'])
+            for method, counts in stats['methods'].items():
+                lookups.add_metric([method, 'hit'], counts.get('hits', 0))
+                lookups.add_metric([method, 'miss'], counts.get('misses', 0))
+                hit_rate.add_metric([method], counts.get('hit_rate', 0.0))
+            yield lookups
+            yield hit_rate
+            yield GaugeMetricFamily('assistant_cache_entries', 'Entries in the response cache', value=stats['size'])
+
+        if self.answer_cache is not None:
+            stats = self.answer_cache.get_stats()
+            lookups = CounterMetricFamily('assistant_semantic_cache_lookups', 'Semantic answer cache lookups',
+                                          labels=['result'])
+            lookups.add_metric(['hit'], stats['hits'])
+            lookups.add_metric(['miss'], stats['misses'])
+            yield lookups
+            yield CounterMetricFamily('assistant_semantic_cache_evictions', 'Answers evicted from the semantic cache',
+                                      value=stats['evictions'])
+            yield GaugeMetricFamily('assistant_semantic_cache_entries', 'Answers in the semantic cache',
+                                    value=stats['size'])
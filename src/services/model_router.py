@@ -0,0 +1,357 @@
+import asyncio
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from services.tracing import record_span
+
+# Estados del circuit breaker
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class RequestNotSentError(Exception):
+    """A call that never reached the model (e.g. not admitted): it does not count against the model's health."""
+
+
+class AllModelsFailedError(Exception):
+    """Raised when every candidate model failed for a request."""
+
+    def __init__(self, last_error: Optional[str], routing: Dict[str, Any]):
+        super().__init__(last_error)
+        self.last_error = last_error
+        self.routing = routing
+
+
+class ModelHealth:
+    """Rolling latency/error statistics and circuit breaker state of one model."""
+
+    def __init__(self, window: int = 50, failure_threshold: int = 3, cooldown: float = 30):
+        """
+        Initialize the model health tracker.
+
+        Args:
+            window: Number of recent calls kept for latency and error statistics
+            failure_threshold: Consecutive failures that open the circuit
+            cooldown: Seconds the circuit stays open before a probe is allowed
+        """
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self._calls = deque(maxlen=window)
+        self._consecutive_failures = 0
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._probe_started = 0.0
+        self._lock = threading.Lock()
+
+    def allow_request(self) -> bool:
+        """Whether a request may be sent (a single probe is allowed when half-open)."""
+        with self._lock:
+            if self._state == OPEN and time.time() - self._opened_at >= self.cooldown:
+                self._state = HALF_OPEN
+                self._probe_in_flight = False
+            if self._state == CLOSED:
+                return True
+            # Una sonda reservada que nunca se llegó a enviar caduca tras el cooldown
+            probe_expired = time.time() - self._probe_started >= self.cooldown
+            if self._state == HALF_OPEN and (not self._probe_in_flight or probe_expired):
+                self._probe_in_flight = True
+                self._probe_started = time.time()
+                return True
+            return False
+
+    def record(self, latency: float, ok: bool) -> None:
+        """Record the outcome of a call and update the circuit state."""
+        with self._lock:
+            self._calls.append((latency, ok))
+            self._probe_in_flight = False
+            if ok:
+                self._consecutive_failures = 0
+                self._state = CLOSED
+                return
+            self._consecutive_failures += 1
+            if self._state == HALF_OPEN or self._consecutive_failures >= self.failure_threshold:
+                self._state = OPEN
+                self._opened_at = time.time()
+
+    def latency_percentile(self, percentile: float) -> Optional[float]:
+        """Return a latency percentile (seconds) of recent successful calls."""
+        with self._lock:
+            latencies = sorted(latency for latency, ok in self._calls if ok)
+        if not latencies:
+            return None
+        index = min(len(latencies) - 1, int(round(percentile / 100 * (len(latencies) - 1))))
+        return latencies[index]
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Return the current statistics of the model."""
+        with self._lock:
+            calls = list(self._calls)
+            state = self._state
+        errors = sum(1 for _, ok in calls if not ok)
+        return {
+            'state': state,
+            'calls': len(calls),
+            'error_rate': round(errors / len(calls), 4) if calls else 0.0,
+            'p50_latency': self.latency_percentile(50),
+            'p95_latency': self.latency_percentile(95),
+        }
+
+
+class ModelRouter:
+    """
+    Route a request across an ordered list of models.
+
+    Models whose circuit is open are skipped. When hedging is enabled and the
+    current model has not answered within the latency budget, the next model
+    is fired in parallel and the first good answer wins. Every response
+    carries routing metadata explaining which model won and why.
+    """
+
+    def __init__(self, models: List[str], hedging: bool = True, hedge_after: Optional[float] = None,
+                 failure_threshold: int = 3, cooldown: float = 30, window: int = 50,
+                 max_workers: int = 64):
+        """
+        Initialize the router.
+
+        Args:
+            models: Models in order of preference
+            hedging: Whether to fire the next model when the current one is slow
+            hedge_after: Fixed latency budget in seconds; None adapts it to the
+                model's recent p95 latency
+            failure_threshold: Consecutive failures that open a model's circuit
+            cooldown: Seconds before an open circuit allows a probe request
+            window: Number of recent calls kept per model
+            max_workers: Size of the thread pool used for hedged calls
+        """
+        self.models = list(models)
+        self.hedging = hedging and len(self.models) > 1
+        self.hedge_after = hedge_after
+        self.window = window
+        self._health = {model: ModelHealth(window, failure_threshold, cooldown) for model in self.models}
+        # Latencias correctas por (modelo, prompt): cada tipo de petición tiene su propio presupuesto
+        self._prompt_latencies: Dict[Tuple[str, str], deque] = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers) if self.hedging else None
+
+    def candidates(self, models: Optional[List[str]] = None) -> Tuple[List[str], List[str]]:
+        """
+        Return (available, skipped) models in order of preference.
+
+        If every circuit is open, all models are returned so that the request
+        is still attempted.
+
+        Args:
+            models: Restrict routing to these models (e.g. those whose context
+                window fits the request); defaults to all models
+        """
+        eligible = [model for model in self.models if models is None or model in models]
+        available = [model for model in eligible if self._health[model].allow_request()]
+        skipped = [model for model in eligible if model not in available]
+        if not available:
+            return eligible, []
+        return available, skipped
+
+    def record(self, model: str, latency: float, ok: bool, prompt_name: Optional[str] = None) -> None:
+        """Record the outcome of a call (also used for calls made outside call(), e.g. streaming)."""
+        self._health[model].record(latency, ok)
+        if ok and prompt_name:
+            with self._lock:
+                latencies = self._prompt_latencies.get((model, prompt_name))
+                if latencies is None:
+                    latencies = self._prompt_latencies[(model, prompt_name)] = deque(maxlen=self.window)
+                latencies.append(latency)
+
+    def latency_percentile(self, model: str, prompt_name: str, percentile: float) -> Optional[float]:
+        """Return a latency percentile (seconds) of the recent successful calls of a prompt on a model."""
+        with self._lock:
+            latencies = sorted(self._prompt_latencies.get((model, prompt_name), ()))
+        if not latencies:
+            return None
+        index = min(len(latencies) - 1, int(round(percentile / 100 * (len(latencies) - 1))))
+        return latencies[index]
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Return health statistics per model."""
+        return {model: health.snapshot() for model, health in self._health.items()}
+
+    def call(self, fn: Callable[[str], Any], models: Optional[List[str]] = None,
+             prompt_name: Optional[str] = None, hedge: bool = True) -> Tuple[Any, Dict[str, Any]]:
+        """
+        Call fn(model) on the best available model, with fallback and hedging.
+
+        Args:
+            fn: Callable performing the request on the given model
+            models: Restrict routing to these models; defaults to all models
+            prompt_name: Kind of request; the hedging delay follows its own latency
+            hedge: Whether this request may be hedged (False only falls back on errors)
+
+        Returns:
+            Tuple (result, routing metadata)
+
+        Raises:
+            AllModelsFailedError: If every candidate model failed
+        """
+        candidates, skipped = self.candidates(models)
+        routing = {'skipped': skipped, 'attempts': []}
+        if not self.hedging or not hedge:
+            return self._call_sequential(fn, candidates, routing, prompt_name)
+        return self._call_hedged(fn, candidates, routing, prompt_name)
+
+    async def acall(self, fn: Callable[[str], Awaitable[Any]], models: Optional[List[str]] = None,
+                    prompt_name: Optional[str] = None, hedge: bool = True) -> Tuple[Any, Dict[str, Any]]:
+        """Asyncio counterpart of call(); attempts still running when it returns or is cancelled are cancelled."""
+        candidates, skipped = self.candidates(models)
+        routing = {'skipped': skipped, 'attempts': []}
+        pending: Dict[asyncio.Task, Tuple[str, str, float]] = {}
+        next_index = self._launch_async(fn, candidates, 0, 'primary', pending)
+        last_error = None
+
+        try:
+            while pending:
+                timeout = self._hedge_delay(candidates, next_index, prompt_name) if hedge else None
+                done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    next_index = self._launch_async(fn, candidates, next_index, 'hedge', pending)
+                    continue
+
+                for task in done:
+                    model, reason, started = pending.pop(task)
+                    latency = time.time() - started
+                    error = task.exception()
+                    self._record_outcome(model, latency, error, prompt_name)
+                    self._add_attempt(routing, model, reason, latency, error)
+                    if error is None:
+                        return task.result(), self._won(routing, model, reason)
+                    last_error = str(error)
+
+                if not pending:
+                    next_index = self._launch_async(fn, candidates, next_index, 'fallback', pending)
+        finally:
+            # Los intentos que siguen en curso (hedges perdedores o una petición cancelada) no deben seguir consumiendo
+            for task in pending:
+                task.cancel()
+
+        raise AllModelsFailedError(last_error, routing)
+
+    def _call_sequential(self, fn: Callable[[str], Any], candidates: List[str], routing: Dict[str, Any],
+                         prompt_name: Optional[str]) -> Tuple[Any, Dict[str, Any]]:
+        """Try each candidate in turn in the calling thread."""
+        last_error = None
+        for index, model in enumerate(candidates):
+            reason = 'primary' if index == 0 else 'fallback'
+            started = time.time()
+            try:
+                result = fn(model)
+            except Exception as e:
+                latency = time.time() - started
+                self._record_outcome(model, latency, e, prompt_name)
+                self._add_attempt(routing, model, reason, latency, e)
+                last_error = str(e)
+                continue
+            latency = time.time() - started
+            self.record(model, latency, True, prompt_name)
+            self._add_attempt(routing, model, reason, latency, None)
+            return result, self._won(routing, model, reason)
+        raise AllModelsFailedError(last_error, routing)
+
+    def _call_hedged(self, fn: Callable[[str], Any], candidates: List[str], routing: Dict[str, Any],
+                     prompt_name: Optional[str]) -> Tuple[Any, Dict[str, Any]]:
+        """Run candidates on the thread pool, hedging when the current one is slow."""
+        pending: Dict[Any, Tuple[str, str]] = {}
+        next_index = self._launch(fn, candidates, 0, 'primary', pending, prompt_name)
+        last_error = None
+
+        while pending:
+            timeout = self._hedge_delay(candidates, next_index, prompt_name)
+            done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            if not done:
+                next_index = self._launch(fn, candidates, next_index, 'hedge', pending, prompt_name)
+                continue
+
+            for future in done:
+                model, reason = pending.pop(future)
+                result, latency, error = future.result()
+                self._add_attempt(routing, model, reason, latency, error)
+                if error is None:
+                    # Las llamadas perdedoras terminan en segundo plano y solo actualizan estadísticas
+                    return result, self._won(routing, model, reason)
+                last_error = str(error)
+
+            if not pending:
+                next_index = self._launch(fn, candidates, next_index, 'fallback', pending, prompt_name)
+
+        raise AllModelsFailedError(last_error, routing)
+
+    def _launch(self, fn, candidates: List[str], index: int, reason: str, pending: Dict,
+                prompt_name: Optional[str]) -> int:
+        """Submit the candidate at index to the pool. Returns the next index."""
+        if index >= len(candidates):
+            return index
+        model = candidates[index]
+        pending[self._executor.submit(self._timed_call, fn, model, prompt_name)] = (model, reason)
+        return index + 1
+
+    def _launch_async(self, fn, candidates: List[str], index: int, reason: str, pending: Dict) -> int:
+        """Start the candidate at index as an asyncio task. Returns the next index."""
+        if index >= len(candidates):
+            return index
+        model = candidates[index]
+        pending[asyncio.ensure_future(fn(model))] = (model, reason, time.time())
+        return index + 1
+
+    def _timed_call(self, fn: Callable[[str], Any], model: str,
+                    prompt_name: Optional[str]) -> Tuple[Any, float, Optional[Exception]]:
+        """Run fn(model) and record its latency and outcome."""
+        started = time.time()
+        try:
+            result = fn(model)
+        except Exception as e:
+            latency = time.time() - started
+            self._record_outcome(model, latency, e, prompt_name)
+            return None, latency, e
+        latency = time.time() - started
+        self.record(model, latency, True, prompt_name)
+        return result, latency, None
+
+    def _record_outcome(self, model: str, latency: float, error: Optional[BaseException],
+                        prompt_name: Optional[str]) -> None:
+        """Record a call in the model's health, unless it never reached the model."""
+        if not isinstance(error, RequestNotSentError):
+            self.record(model, latency, error is None, prompt_name)
+
+    def _hedge_delay(self, candidates: List[str], next_index: int, prompt_name: Optional[str]) -> Optional[float]:
+        """Seconds to wait before hedging, or None if there is nothing left to hedge with."""
+        if not self.hedging or next_index >= len(candidates):
+            return None
+        if self.hedge_after is not None:
+            return self.hedge_after
+        model = candidates[next_index - 1]
+        if prompt_name:
+            p95 = self.latency_percentile(model, prompt_name, 95)
+        else:
+            p95 = self._health[model].latency_percentile(95)
+        # Sin historial del prompt se usa un presupuesto conservador; con historial, sin tope:
+        # una respuesta larga tarda lo que tarda y cubrirla siempre solo duplica el gasto
+        return max(p95, 0.5) if p95 is not None else 5.0
+
+    @staticmethod
+    def _add_attempt(routing: Dict[str, Any], model: str, reason: str, latency: float,
+                     error: Optional[BaseException]) -> None:
+        """Append an attempt to the routing metadata."""
+        attempt = {'model': model, 'reason': reason, 'latency_ms': round(latency * 1000, 1), 'ok': error is None}
+        if error is not None:
+            attempt['error'] = str(error)
+        routing['attempts'].append(attempt)
+        record_span('model', time.time() - latency, latency, **attempt)
+
+    @staticmethod
+    def _won(routing: Dict[str, Any], model: str, reason: str) -> Dict[str, Any]:
+        """Complete the routing metadata with the winning model."""
+        routing['model'] = model
+        routing['reason'] = reason
+        return routing
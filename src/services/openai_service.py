@@ -1,21 +1,100 @@
+import contextvars
+import itertools
 import os
+import time
 import openai
-from typing import Dict, Any
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, Iterator, List, Optional, Tuple
+
+from services.conversation_analysis import AnalysisParseError, format_sentiment, format_suggestions, parse_analysis
+from services.knowledge_index import KnowledgeRetriever, format_passages
+from services.llm_backend import LLMBackend, OpenAIBackend
+from services.metrics import Metrics
+from services.model_router import AllModelsFailedError, ModelRouter
+from services.prompt_registry import PromptRegistry, PromptTooLargeError, RenderedPrompt
+from services.prompt_templates import SUMMARY_SECTIONS
+from services.response_cache import ResponseCache
+from services.semantic_cache import SemanticAnswerCache
+from services.token_counter import count_tokens, split_by_tokens
+from services.tracing import record_span, span
+from services.upstream_scheduler import (
+    LIVE, QUESTION, UpstreamOverloadedError, UpstreamScheduler, current_session, prompt_priority
+)
+
+# Ventana de contexto (tokens de entrada + salida) de cada modelo
+MODEL_CONTEXT_WINDOWS = {
+    "gpt-4": 8192,
+    "gpt-4.1": 1047576
+}
+
+# Margen para el encabezado del mensaje de usuario al trocear transcripciones largas
+SUMMARY_CHUNK_MARGIN_TOKENS = 100
+
+# Niveles máximos de reducción de notas en los resúmenes por partes
+MAX_SUMMARY_LEVELS = 4
+
+# Clases cuyas peticiones se cubren con el siguiente modelo si tardan (los resúmenes
+# y las tareas de fondo son largos y no tienen a nadie esperando: solo cambian de modelo si fallan)
+HEDGED_CLASSES = (QUESTION, LIVE)
 
 class OpenAIService:
     """Service to handle interactions with OpenAI API."""
     
-    def __init__(self):
-        """Initialize the OpenAI service with API key from environment."""
+    def __init__(self, cache: Optional[ResponseCache] = None, prompts: Optional[PromptRegistry] = None,
+                 metrics: Optional[Metrics] = None, retriever: Optional[KnowledgeRetriever] = None,
+                 answer_cache: Optional[SemanticAnswerCache] = None,
+                 scheduler: Optional[UpstreamScheduler] = None, backend: Optional[LLMBackend] = None,
+                 models: Optional[List[str]] = None):
+        """
+        Initialize the OpenAI service with API key from environment.
+        
+        Args:
+            cache: Optional response cache placed in front of the completion calls
+            prompts: Prompt template registry; the built-in templates are loaded by default
+            metrics: Metrics receiving upstream latency, errors, fallbacks and token usage
+            retriever: Optional knowledge base retriever used to ground the answers to questions
+            answer_cache: Optional semantic cache returning the answer of a near-identical question
+            scheduler: Upstream scheduler admitting the requests by priority within the
+                account's rate limits; by default requests are only retried on 429s
+            backend: Chat completion backend; the OpenAI API by default
+            models: Models to try, in order of preference (the backend's model names)
+        """
+        self.backend = backend or OpenAIBackend()
+        
         self.api_key = os.getenv("OPENAI_API_KEY")
-        if not self.api_key:
+        if self.backend.needs_api_key and not self.api_key:
             raise ValueError("OpenAI API Key not found in environment variables")
         
         # Set API key directly - this works with openai 0.28.1
         openai.api_key = self.api_key
         
         # Lista de modelos a intentar, en orden de preferencia (para versión 0.28.1)
-        self.models = ["gpt-4", "gpt-4.1"]
+        self.models = models or ["gpt-4", "gpt-4.1"]
+        
+        # Enrutado entre modelos: circuit breaker y peticiones cubiertas (hedging)
+        hedge_after = os.getenv("MODEL_HEDGE_AFTER")
+        self.router = ModelRouter(
+            self.models,
+            hedging=os.getenv("MODEL_HEDGING", "true").lower() == "true",
+            hedge_after=float(hedge_after) if hedge_after else None
+        )
+        
+        self.cache = cache
+        
+        # Plantillas de prompts, cargadas una sola vez
+        self.prompts = prompts or PromptRegistry()
+        
+        self.metrics = metrics or Metrics()
+        
+        self.retriever = retriever
+        
+        self.answer_cache = answer_cache
+        
+        self.scheduler = scheduler or UpstreamScheduler()
+        
+        # Resumen final con sus secciones pedidas en paralelo (más tokens de entrada, menos latencia)
+        self.parallel_summary = os.getenv("SUMMARY_PARALLEL", "false").lower() == "true"
+        self._section_executor = None
         
     def get_suggestions(self, conversation_text: str, language: str = 'es-ES') -> Dict[str, Any]:
         """
@@ -34,164 +113,25 @@ class OpenAIService:
                 "error": "No se proporcionó texto para generar sugerencias"
             }
             
-        # Detect language from the language code
-        lang_code = language.split('-')[0] if '-' in language else language
-        
-        # Select appropriate system content based on language
-        if lang_code == 'es':
-            # Spanish system content (default)
-            system_content = """
-Eres un asistente avanzado para agentes comerciales que están en llamadas con clientes.
-IMPORTANTE: Estás recibiendo una transcripción en TIEMPO REAL de una conversación en curso. 
-El texto se está generando progresivamente mediante dictado de voz, por lo que recibirás fragmentos
-incrementales de la conversación. Cada vez, analiza SOLO lo que tienes disponible hasta ese momento.
-
-Tu respuesta DEBE estar estructurada en DOS secciones claramente diferenciadas:
-
-1. INTERPRETACIÓN:
-   En esta sección, detalla lo que entiendes del fragmento de conversación hasta ahora.
-   Resume los puntos clave, intenciones, preocupaciones o intereses del cliente que hayas identificado.
-   Esta sección ayuda al agente a confirmar que está entendiendo correctamente la situación.
-
-2. RESPUESTA SUGERIDA:
-   Proporciona una respuesta concreta que el agente comercial DEBERÍA DECIR literalmente.
-   Esta debe ser una sugerencia directa de las palabras exactas que el agente podría utilizar.
-   Debe ser natural, persuasiva y adaptada al contexto de la conversación.
-
-Tus sugerencias deben ser:
-- Breves y directas (máximo 2-3 frases por sección)
-- Relevantes para el momento actual de la conversación
-- Adaptadas al fragmento disponible, sin asumir información no proporcionada
-
-Responde SIEMPRE en español y mantén este formato de dos secciones en todas tus respuestas.
-"""
-        elif lang_code == 'en':
-            # English system content
-            system_content = """
-You are an advanced assistant for sales agents who are on calls with customers.
-IMPORTANT: You are receiving a REAL-TIME transcript of an ongoing conversation. 
-The text is being generated progressively through voice dictation, so you will receive
-incremental fragments of the conversation. Each time, analyze ONLY what you have available so far.
-
-Your response MUST be structured in TWO clearly differentiated sections:
-
-1. INTERPRETATION:
-   In this section, detail what you understand from the conversation fragment so far.
-   Summarize the key points, intentions, concerns, or interests of the customer that you have identified.
-   This section helps the agent confirm that they are correctly understanding the situation.
-
-2. SUGGESTED RESPONSE:
-   Provide a concrete response that the sales agent SHOULD SAY literally.
-   This should be a direct suggestion of the exact words the agent could use.
-   It should be natural, persuasive, and adapted to the context of the conversation.
-
-Your suggestions should be:
-- Brief and direct (maximum 2-3 sentences per section)
-- Relevant to the current moment of the conversation
-- Adapted to the available fragment, without assuming information not provided
-
-ALWAYS respond in English and maintain this two-section format in all your responses.
-"""
-        elif lang_code == 'fr':
-            # French system content
-            system_content = """
-Vous êtes un assistant avancé pour les agents commerciaux qui sont en appel avec des clients.
-IMPORTANT : Vous recevez une transcription EN TEMPS RÉEL d'une conversation en cours.
-Le texte est généré progressivement par dictée vocale, vous recevrez donc des fragments
-incrémentiels de la conversation. À chaque fois, analysez UNIQUEMENT ce dont vous disposez jusqu'à présent.
-
-Votre réponse DOIT être structurée en DEUX sections clairement différenciées :
-
-1. INTERPRÉTATION :
-   Dans cette section, détaillez ce que vous comprenez du fragment de conversation jusqu'à présent.
-   Résumez les points clés, les intentions, les préoccupations ou les intérêts du client que vous avez identifiés.
-   Cette section aide l'agent à confirmer qu'il comprend correctement la situation.
-
-2. RÉPONSE SUGGÉRÉE :
-   Fournissez une réponse concrète que l'agent commercial DEVRAIT DIRE littéralement.
-   Cela doit être une suggestion directe des mots exacts que l'agent pourrait utiliser.
-   Elle doit être naturelle, persuasive et adaptée au contexte de la conversation.
-
-Vos suggestions doivent être :
-- Brèves et directes (maximum 2-3 phrases par section)
-- Pertinentes pour le moment actuel de la conversation
-- Adaptées au fragment disponible, sans supposer des informations non fournies
-
-Répondez TOUJOURS en français et maintenez ce format à deux sections dans toutes vos réponses.
-"""
-        else:
-            # Default to English for other languages
-            system_content = """
-You are an advanced assistant for sales agents who are on calls with customers.
-IMPORTANT: You are receiving a REAL-TIME transcript of an ongoing conversation. 
-The text is being generated progressively through voice dictation, so you will receive
-incremental fragments of the conversation. Each time, analyze ONLY what you have available so far.
-
-Your response MUST be structured in TWO clearly differentiated sections:
-
-1. INTERPRETATION:
-   In this section, detail what you understand from the conversation fragment so far.
-   Summarize the key points, intentions, concerns, or interests of the customer that you have identified.
-   This section helps the agent confirm that they are correctly understanding the situation.
-
-2. SUGGESTED RESPONSE:
-   Provide a concrete response that the sales agent SHOULD SAY literally.
-   This should be a direct suggestion of the exact words the agent could use.
-   It should be natural, persuasive, and adapted to the context of the conversation.
-
-Your suggestions should be:
-- Brief and direct (maximum 2-3 sentences per section)
-- Relevant to the current moment of the conversation
-- Adapted to the available fragment, without assuming information not provided
-
-ALWAYS respond in the same language as the conversation transcript and maintain this two-section format in all your responses.
-"""
-            
-        # Determine the appropriate prompt based on language
-        if lang_code == 'es':
-            user_prompt = f"Transcripción en curso de una llamada comercial (texto parcial hasta ahora):\n\n{conversation_text}"
-        elif lang_code == 'fr':
-            user_prompt = f"Transcription en cours d'un appel commercial (texte partiel jusqu'à présent):\n\n{conversation_text}"
-        else:
-            user_prompt = f"Ongoing transcription of a sales call (partial text so far):\n\n{conversation_text}"
-            
-        # Intentar diferentes modelos en orden (sintaxis para versión 0.28.1)
-        last_error = None
-        for model in self.models:
-            try:
-                # Usar la sintaxis compatible con openai==0.28.1
-                response = openai.ChatCompletion.create(
-                    model=model,
-                    messages=[
-                        {"role": "system", "content": system_content},
-                        {"role": "user", "content": user_prompt}
-                    ],
-                    temperature=0.7,
-                    max_tokens=150
-                )
-                
-                return {
-                    "success": True, 
-                    "suggestions": response.choices[0].message['content'],
-                    "model": response.model
-                }
-                
-            except Exception as e:
-                last_error = str(e)
-                print(f"Error con el modelo {model}: {last_error}")
-                # Continuar con el siguiente modelo
-                continue
-                
-        # Si llegamos aquí, todos los modelos han fallado
-        return {
-            "success": False,
-            "error": f"No se pudo generar sugerencias. Último error: {last_error}"
-        }
+        prompt = self.prompts.render("suggestions", language, conversation_text=conversation_text)
+            
+        return self._complete_with_fallback(
+            prompt,
+            result_key="suggestions",
+            log_context="al generar sugerencias",
+            error_message="No se pudo generar sugerencias"
+        )
         
     def get_answer_to_question(self, question: str) -> Dict[str, Any]:
         """
         Get answer to a direct question.
         
+        When a knowledge retriever is configured, the passages related to the
+        question are added to the prompt and the retrieval timing and sources
+        are returned under 'retrieval'. With a semantic answer cache, the
+        answer of a near-identical question is returned without any call,
+        with its similarity under 'semantic_cache'.
+        
         Args:
             question: The question to answer
             
@@ -204,56 +144,464 @@ ALWAYS respond in the same language as the conversation transcript and maintain
                 "error": "No se proporcionó ninguna pregunta"
             }
             
-        # Sistema de contenido para el asistente
-        system_content = """
-Eres un asistente de ventas experto, especializado en responder consultas de agentes comerciales.
-Debes entender que el agente está en una llamada en vivo con un cliente en este momento, 
-por lo que necesita respuestas rápidas y accionables inmediatamente.
-
-Debes proporcionar respuestas detalladas, informativas y útiles a las preguntas sobre:
-- Técnicas de venta y negociación
-- Manejo de objeciones de clientes
-- Información sobre productos y servicios típicos
-- Estrategias para cerrar ventas
-- Servicio al cliente y fidelización
-
-Tus respuestas deben ser profesionales, precisas y orientadas a ayudar al agente comercial a tener éxito
-en la conversación que está teniendo AHORA MISMO. Prioriza la inmediatez y aplicabilidad.
-
-Incluye ejemplos prácticos cuando sea relevante y proporciona consejos accionables.
-Responde SIEMPRE en español y de forma completa y profesional.
-"""
+        cached, vector = self._lookup_answer(question)
+        if cached is not None:
+            return cached
+            
+        prompt, retrieval = self._question_prompt(question, self._retrieve(question))
+            
+        result = self._complete_with_fallback(
+            prompt,
+            result_key="answer",
+            log_context="al responder pregunta",
+            error_message="No se pudo responder la pregunta"
+        )
+        result = dict(result, retrieval=retrieval) if retrieval else result
+        self._store_answer(question, vector, result)
+        return result
+        
+    def _answer_cache_scope(self) -> str:
+        """Scope of the cached answers: a new prompt version, model list or knowledge index starts afresh."""
+        versions = [self.prompts.get(name).version for name in ("question", "question_grounded")]
+        # Las respuestas fundamentadas dependen de los pasajes: un índice reconstruido invalida la caché
+        knowledge = str(self.retriever.index.meta.get("created", "")) if self.retriever else ""
+        return "|".join(versions + self.models + [knowledge])
+        
+    def _lookup_answer(self, question: str):
+        """
+        Look up a question in the semantic answer cache.
+        
+        Returns:
+            Tuple (cached result or None, question embedding or None); a failed
+            lookup is logged and treated as a miss
+        """
+        if not self.answer_cache:
+            return None, None
+        try:
+            with span('semantic_cache'):
+                hit, vector = self.answer_cache.lookup(question, self._answer_cache_scope())
+        except Exception as e:
+            print(f"Error al consultar la caché semántica de respuestas: {e}")
+            return None, None
+        if hit is None:
+            return None, vector
+        return dict(hit["result"], cached=True, semantic_cache={
+            "similarity": hit["similarity"],
+            "question": hit["question"]
+        }), vector
+        
+    def _store_answer(self, question: str, vector, result: Dict[str, Any]) -> None:
+        """Store a successful answer in the semantic answer cache, if there is one."""
+        if self.answer_cache and vector is not None and result.get("success"):
+            self.answer_cache.store(question, self._answer_cache_scope(), result, vector)
+            
+    @staticmethod
+    def _cached_answer_events(cached: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """Stream events replaying a cached answer as a single token."""
+        done = {key: value for key, value in cached.items() if key not in ("answer", "routing")}
+        return [
+            {"type": "token", "content": cached["answer"]},
+            dict(done, type="done", finish_reason="stop")
+        ]
+        
+    @staticmethod
+    def _streamed_answer(events: List[Dict[str, Any]], done: Dict[str, Any]) -> Dict[str, Any]:
+        """Build the result of a streamed answer from its token events, to be cached."""
+        result = {
+            "success": True,
+            "answer": "".join(event["content"] for event in events),
+            "model": done["model"]
+        }
+        return dict(result, retrieval=done["retrieval"]) if done.get("retrieval") else result
+        
+    def _retrieve(self, question: str):
+        """
+        Retrieve the knowledge passages of a question.
+        
+        Returns:
+            Tuple (passages, timing), or None without a retriever; a failed
+            retrieval returns no passages so the question is still answered
+        """
+        if not self.retriever:
+            return None
+        try:
+            with span('retrieval'):
+                return self.retriever.retrieve(question)
+        except Exception as e:
+            print(f"Error al recuperar fragmentos de la base de conocimiento: {e}")
+            return [], {"error": str(e)}
+        
+    def _question_prompt(self, question: str, retrieved) -> Tuple[RenderedPrompt, Optional[Dict[str, Any]]]:
+        """
+        Render the question prompt, grounded on the retrieved passages if there are any.
+        
+        Returns:
+            Tuple (prompt, retrieval metadata or None)
+        """
+        if retrieved is None:
+            return self.prompts.render("question", question=question), None
+        passages, timing = retrieved
+        retrieval = dict(timing, sources=[
+            {"source": passage["source"], "chunk": passage["chunk"], "score": passage["score"]}
+            for passage in passages
+        ])
+        if not passages:
+            return self.prompts.render("question", question=question), retrieval
+        prompt = self.prompts.render("question_grounded", question=question, passages=format_passages(passages))
+        return prompt, retrieval
+        
+    def stream_suggestions(self, conversation_text: str, language: str = 'es-ES') -> Iterator[Dict[str, Any]]:
+        """
+        Stream suggestions token by token based on conversation text.
+        
+        Args:
+            conversation_text: The transcription text from the conversation
+            language: The language code of the conversation (e.g., 'es-ES', 'en-US')
+            
+        Yields:
+            'token' events with partial content and a final 'done' or 'error' event
+        """
+        if not conversation_text or conversation_text.strip() == "":
+            yield {
+                "type": "error",
+                "success": False,
+                "error": "No se proporcionó texto para generar sugerencias"
+            }
+            return
+            
+        prompt = self.prompts.render("suggestions", language, conversation_text=conversation_text)
+        yield from self._stream_completion(
+            prompt,
+            error_message="No se pudo generar sugerencias"
+        )
+        
+    def stream_answer_to_question(self, question: str) -> Iterator[Dict[str, Any]]:
+        """
+        Stream the answer to a direct question token by token.
+        
+        Args:
+            question: The question to answer
+            
+        Yields:
+            'token' events with partial content and a final 'done' or 'error' event
+        """
+        if not question or question.strip() == "":
+            yield {
+                "type": "error",
+                "success": False,
+                "error": "No se proporcionó ninguna pregunta"
+            }
+            return
+            
+        cached, vector = self._lookup_answer(question)
+        if cached is not None:
+            yield from self._cached_answer_events(cached)
+            return
+            
+        prompt, retrieval = self._question_prompt(question, self._retrieve(question))
+        tokens = []
+        for event in self._stream_completion(prompt, error_message="No se pudo responder la pregunta"):
+            if event["type"] == "token":
+                tokens.append(event)
+            elif event["type"] == "done":
+                event = dict(event, retrieval=retrieval) if retrieval else event
+                self._store_answer(question, vector, self._streamed_answer(tokens, event))
+            yield event
+        
+    def _complete_with_fallback(self, prompt: RenderedPrompt, result_key: str, log_context: str,
+                                error_message: str) -> Dict[str, Any]:
+        """
+        Request a chat completion, trying each model in order until one succeeds.
+        
+        Successful responses are served from and stored in the response cache
+        when one is configured. Models whose context window cannot hold the
+        prompt plus max_tokens are not tried.
+        
+        Args:
+            prompt: Rendered prompt (messages and generation parameters)
+            result_key: Key under which the generated text is returned
+            log_context: Description of the operation for error logs
+            error_message: Message prefix used when every model fails
+            
+        Returns:
+            Dictionary with the generated text and metadata
+        """
+        try:
+            models = self._models_for(prompt)
+        except PromptTooLargeError as e:
+            return {
+                "success": False,
+                "error": f"{error_message}. {e}"
+            }
+            
+        cache_key, cached = self._lookup_cache(prompt)
+        if cached is not None:
+            return cached
+            
+        priority, session_id = prompt_priority(prompt.name), current_session.get()
+        try:
+            self.scheduler.acquire(priority, prompt.required_tokens, session_id)
+        except UpstreamOverloadedError as e:
+            return self._shed_result(prompt, error_message, e)
+        attempts = itertools.count()
+            
+        def request_completion(model: str):
+            # El primer intento ya está admitido; las coberturas y los respaldos esperan su turno
+            if next(attempts):
+                self.scheduler.acquire(priority, prompt.required_tokens, session_id)
+            used = None
+            try:
+                # Usar la sintaxis compatible con openai==0.28.1
+                response = self.scheduler.call(lambda: self.backend.create(
+                    model=model,
+                    messages=prompt.messages,
+                    temperature=prompt.temperature,
+                    max_tokens=prompt.max_tokens
+                ))
+                used = (response.get("usage") or {}).get("total_tokens")
+                return response
+            except Exception:
+                # Un intento fallido no consume tokens de la cuenta
+                used = 0
+                raise
+            finally:
+                self.scheduler.settle(prompt.required_tokens, used)
+            
+        try:
+            response, routing = self.router.call(request_completion, models, prompt.name,
+                                                 hedge=prompt_priority(prompt.name) in HEDGED_CLASSES)
+        except AllModelsFailedError as e:
+            # Si llegamos aquí, todos los modelos han fallado
+            self.metrics.observe_routing(prompt.name, e.routing)
+            self._log_failed_attempts(e.routing, log_context)
+            return {
+                "success": False,
+                "error": f"{error_message}. Último error: {e.last_error}",
+                "routing": e.routing
+            }
+            
+        self._log_failed_attempts(routing, log_context)
+        self.metrics.observe_routing(prompt.name, routing)
+        self.metrics.count_tokens(prompt.name, response.model, response.get("usage"))
+        result = {
+            "success": True, 
+            result_key: response.choices[0].message['content'],
+            "model": response.model,
+            "routing": routing
+        }
+        self._store_cache(prompt.name, cache_key, result)
+        return result
+        
+    def _shed_result(self, prompt: RenderedPrompt, error_message: str, error: UpstreamOverloadedError) -> Dict[str, Any]:
+        """Result of a request the upstream scheduler did not admit in time."""
+        print(f"Petición '{prompt.name}' descartada por el planificador: {error}")
+        self.metrics.count_fallback(prompt.name, "shed")
+        return {
+            "success": False,
+            "shed": True,
+            "error": f"{error_message}. {error}"
+        }
+        
+    @staticmethod
+    def _log_failed_attempts(routing: Dict[str, Any], log_context: str) -> None:
+        """Log the models that failed while routing a request."""
+        for attempt in routing["attempts"]:
+            if not attempt["ok"]:
+                print(f"Error con el modelo {attempt['model']} {log_context}: {attempt['error']}")
+        
+    def _models_for(self, prompt: RenderedPrompt) -> List[str]:
+        """
+        Return the models whose context window fits the prompt plus max_tokens.
+        
+        Raises:
+            PromptTooLargeError: If the request does not fit in any model
+        """
+        models = [
+            model for model in self.models
+            if prompt.required_tokens <= MODEL_CONTEXT_WINDOWS.get(model, prompt.required_tokens)
+        ]
+        if not models:
+            raise PromptTooLargeError(
+                f"La petición ({prompt.prompt_tokens} tokens de entrada + {prompt.max_tokens} de salida) "
+                f"excede la ventana de contexto de todos los modelos"
+            )
+        return models
+        
+    def _lookup_cache(self, prompt: RenderedPrompt):
+        """
+        Look up a request in the response cache.
+        
+        The prompt version is part of the key, so editing a template
+        invalidates the responses cached for its previous wording.
+        
+        Returns:
+            Tuple (cache_key, cached_result); both are None when there is no cache,
+            and cached_result is None on a miss
+        """
+        if not self.cache:
+            return None, None
+            
+        with span('cache', prompt=prompt.name):
+            params = {"temperature": prompt.temperature, "max_tokens": prompt.max_tokens, "version": prompt.version}
+            cache_key = ResponseCache.make_key(prompt.name, self.models, prompt.language,
+                                               prompt.messages[-1]["content"], params)
+            cached = self.cache.get(prompt.name, cache_key)
+        return cache_key, (dict(cached, cached=True) if cached is not None else None)
+        
+    def _store_cache(self, method: str, cache_key: Optional[str], result: Dict[str, Any]) -> None:
+        """Store a successful result in the response cache, if there is one."""
+        if self.cache and cache_key:
+            self.cache.set(method, cache_key, result)
+        
+    def _stream_completion(self, prompt: RenderedPrompt, error_message: str) -> Iterator[Dict[str, Any]]:
+        """
+        Stream a chat completion, falling back to the next model only if
+        the current one fails before producing any token.
+        
+        Args:
+            prompt: Rendered prompt (messages and generation parameters)
+            error_message: Message prefix used when every model fails
+            
+        Yields:
+            'token' events with partial content and a final 'done' or 'error' event
+        """
+        try:
+            models = self._models_for(prompt)
+        except PromptTooLargeError as e:
+            yield {
+                "type": "error",
+                "success": False,
+                "error": f"{error_message}. {e}"
+            }
+            return
             
-        # Intentar diferentes modelos en orden
         last_error = None
-        for model in self.models:
+        candidates, _ = self.router.candidates(models)
+        for model in candidates:
+            # Cada intento (también el respaldo tras un fallo) espera su admisión
+            try:
+                self.scheduler.acquire(prompt_priority(prompt.name), prompt.required_tokens, current_session.get())
+            except UpstreamOverloadedError as e:
+                yield dict(self._shed_result(prompt, error_message, e), type="error")
+                return
+            completion_tokens = 0
+            started = time.time()
+            response = None
             try:
-                response = openai.ChatCompletion.create(
+                response = self.scheduler.call(lambda: self.backend.create(
                     model=model,
-                    messages=[
-                        {"role": "system", "content": system_content},
-                        {"role": "user", "content": f"Pregunta urgente durante una llamada con cliente: {question}"}
-                    ],
-                    temperature=0.7,
-                    max_tokens=500  # Permitimos respuestas más largas para preguntas directas
-                )
+                    messages=prompt.messages,
+                    temperature=prompt.temperature,
+                    max_tokens=prompt.max_tokens,
+                    stream=True
+                ))
                 
-                return {
-                    "success": True, 
-                    "answer": response.choices[0].message['content'],
-                    "model": response.model
+                response_model = model
+                finish_reason = None
+                for chunk in response:
+                    response_model = chunk.get('model', response_model)
+                    choice = chunk.choices[0]
+                    content = choice.delta.get('content')
+                    if content:
+                        completion_tokens += 1
+                        yield {"type": "token", "content": content}
+                    if choice.get('finish_reason'):
+                        finish_reason = choice['finish_reason']
+                        
+                self._record_stream_call(prompt, candidates, model, time.time() - started, True)
+                usage = self._estimate_stream_usage(prompt, completion_tokens)
+                self.metrics.count_tokens(prompt.name, response_model, usage)
+                yield {
+                    "type": "done",
+                    "success": True,
+                    "model": response_model,
+                    "finish_reason": finish_reason,
+                    "usage": usage
                 }
+                return
                 
             except Exception as e:
+                self._record_stream_call(prompt, candidates, model, time.time() - started, False)
                 last_error = str(e)
-                print(f"Error con el modelo {model} al responder pregunta: {last_error}")
+                print(f"Error con el modelo {model} en modo streaming: {last_error}")
+                if completion_tokens:
+                    # Ya se enviaron tokens al cliente: no se puede cambiar de modelo
+                    break
                 # Continuar con el siguiente modelo
                 continue
+            finally:
+                self._settle_stream(prompt, response is not None, completion_tokens)
                 
-        # Si llegamos aquí, todos los modelos han fallado
-        return {
+        yield {
+            "type": "error",
             "success": False,
-            "error": f"No se pudo responder la pregunta. Último error: {last_error}"
+            "error": f"{error_message}. Último error: {last_error}"
+        }
+        
+    def _settle_stream(self, prompt: RenderedPrompt, sent: bool, completion_tokens: int) -> None:
+        """Settle the tokens reserved for a streamed attempt: none if it was not accepted, else the estimated usage."""
+        used = self._estimate_stream_usage(prompt, completion_tokens)["total_tokens"] if sent else 0
+        self.scheduler.settle(prompt.required_tokens, used)
+        
+    def _record_stream_call(self, prompt: RenderedPrompt, candidates: List[str], model: str,
+                            latency: float, ok: bool) -> None:
+        """Record the outcome of a streamed call in the router and the metrics."""
+        self.router.record(model, latency, ok, prompt.name)
+        self.metrics.observe_upstream(model, prompt.name, latency, ok)
+        record_span('model', time.time() - latency, latency, model=model, stream=True, ok=ok)
+        if ok and model != candidates[0]:
+            self.metrics.count_fallback(prompt.name, "fallback")
+        
+    def generate_context_digest(self, previous_digest: str, new_text: str,
+                                language: str = 'es-ES', max_tokens: int = 250) -> Dict[str, Any]:
+        """
+        Fold older conversation turns into a compact running digest.
+        
+        Args:
+            previous_digest: The current digest of the conversation (may be empty)
+            new_text: Older transcript text to fold into the digest
+            language: The language code of the conversation
+            max_tokens: Maximum size of the new digest
+            
+        Returns:
+            Dictionary with the new digest and metadata
+        """
+        if not new_text or new_text.strip() == "":
+            return {
+                "success": False,
+                "error": "No hay texto para condensar"
+            }
+            
+        prompt = self.prompts.render(
+            "digest",
+            language,
+            max_tokens=max_tokens,
+            previous_digest=previous_digest or '(vacío)',
+            new_text=new_text
+        )
+        
+        return self._complete_with_fallback(
+            prompt,
+            result_key="digest",
+            log_context="al condensar el contexto",
+            error_message="No se pudo condensar el contexto"
+        )
+        
+    @staticmethod
+    def _estimate_stream_usage(prompt: RenderedPrompt, completion_tokens: int) -> Dict[str, Any]:
+        """
+        Estimate token usage for a streamed completion.
+        
+        The streaming API (openai==0.28.1) does not report usage, so the prompt
+        size is taken from the rendered prompt and each streamed content chunk
+        is counted as one completion token.
+        """
+        prompt_tokens = prompt.prompt_tokens
+        return {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+            "estimated": True
         }
         
     def analyze_sentiment(self, conversation_text: str) -> Dict[str, Any]:
@@ -272,69 +620,119 @@ Responde SIEMPRE en español y de forma completa y profesional.
                 "error": "No hay texto de conversación para analizar"
             }
             
-        # Sistema de contenido para análisis de sentimiento
-        system_content = """
-Eres un analista experto en emociones y sentimientos humanos durante conversaciones.
-
-IMPORTANTE: Estás analizando una transcripción en TIEMPO REAL que se está generando progresivamente
-por dictado de voz. Esta conversación está en curso y puede estar incompleta. Tu análisis debe
-adaptarse al fragmento disponible hasta ahora.
-
-Analiza el texto proporcionado (que es una transcripción parcial de una conversación con un cliente) 
-y determina:
-
-1. Sentimiento general del cliente hasta este momento (muy negativo, negativo, neutral, positivo, muy positivo)
-2. Emociones predominantes detectadas hasta ahora (frustración, confusión, interés, satisfacción, etc.)
-3. Nivel de interés del cliente según lo observado (bajo, medio, alto)
-4. Posibles preocupaciones o dudas identificadas en el fragmento actual
-5. Recomendaciones específicas sobre cómo el agente debería ajustar su enfoque en los próximos momentos
-
-Proporciona tu análisis en un formato estructurado, breve y directo.
-Tu respuesta debe ser útil para un agente comercial que necesita entender el estado emocional
-del cliente rápidamente para ajustar su estrategia en tiempo real.
-
-Considera que la conversación sigue en desarrollo y que tu análisis se basa en información parcial.
-Responde SIEMPRE en español.
-"""
+        prompt = self.prompts.render("sentiment", conversation_text=conversation_text)
             
-        # Intentar diferentes modelos en orden
-        last_error = None
-        for model in self.models:
-            try:
-                response = openai.ChatCompletion.create(
-                    model=model,
-                    messages=[
-                        {"role": "system", "content": system_content},
-                        {"role": "user", "content": f"Fragmento de transcripción en tiempo real de una llamada comercial:\n\n{conversation_text}"}
-                    ],
-                    temperature=0.5,
-                    max_tokens=300
-                )
-                
-                return {
-                    "success": True, 
-                    "sentiment_analysis": response.choices[0].message['content'],
-                    "model": response.model
-                }
-                
-            except Exception as e:
-                last_error = str(e)
-                print(f"Error con el modelo {model} al analizar sentimiento: {last_error}")
-                # Continuar con el siguiente modelo
-                continue
-                
-        # Si llegamos aquí, todos los modelos han fallado
+        return self._complete_with_fallback(
+            prompt,
+            result_key="sentiment_analysis",
+            log_context="al analizar sentimiento",
+            error_message="No se pudo analizar el sentimiento"
+        )
+        
+    def analyze_conversation(self, conversation_text: str, language: str = 'es-ES') -> Dict[str, Any]:
+        """
+        Get suggestions and sentiment analysis from a single completion.
+        
+        The model returns one JSON object (interpretation, suggested response
+        and sentiment fields) that is validated against ANALYSIS_SCHEMA. If the
+        output cannot be parsed, the two separate calls are used instead; if
+        the completion itself failed (shed under overload, every model down),
+        its error is returned as is rather than making two more failing calls.
+        
+        Args:
+            conversation_text: The transcription text from the conversation
+            language: The language code of the conversation (e.g., 'es-ES', 'en-US')
+            
+        Returns:
+            Dictionary with the structured analysis, the rendered 'suggestions'
+            and 'sentiment_analysis' texts and metadata
+        """
+        if not conversation_text or conversation_text.strip() == "":
+            return {
+                "success": False,
+                "error": "No hay texto de conversación para analizar"
+            }
+            
+        prompt = self.prompts.render(
+            "analysis", language, conversation_language=language, conversation_text=conversation_text
+        )
+        result = self._complete_with_fallback(
+            prompt,
+            result_key="raw_analysis",
+            log_context="al analizar la conversación",
+            error_message="No se pudo analizar la conversación"
+        )
+        if not result.get("success"):
+            return result
+        analysis = self._parse_combined_analysis(result["raw_analysis"])
+        if analysis is None:
+            self.metrics.count_fallback("analysis", "separate_calls")
+            return self._analyze_conversation_separately(conversation_text, language)
+        return self._combined_analysis_result(analysis, result)
+        
+    @staticmethod
+    def _parse_combined_analysis(raw_analysis: str) -> Optional[Dict[str, Any]]:
+        """Return the validated analysis of a combined completion, or None if it does not match the schema."""
+        try:
+            return parse_analysis(raw_analysis)
+        except AnalysisParseError as e:
+            print(f"Respuesta del análisis combinado no válida: {e}")
+            return None
+            
+    @staticmethod
+    def _combined_analysis_result(analysis: Dict[str, Any], result: Dict[str, Any]) -> Dict[str, Any]:
+        """Build the response of a successful combined analysis."""
+        combined = {
+            "success": True,
+            "analysis": analysis,
+            "suggestions": format_suggestions(analysis),
+            "sentiment_analysis": format_sentiment(analysis),
+            "model": result.get("model"),
+            "routing": result.get("routing"),
+            "fallback": False
+        }
+        if result.get("cached"):
+            combined["cached"] = True
+        return combined
+        
+    def _analyze_conversation_separately(self, conversation_text: str, language: str) -> Dict[str, Any]:
+        """Fallback for analyze_conversation: two separate completions."""
+        suggestions = self.get_suggestions(conversation_text, language)
+        sentiment = self.analyze_sentiment(conversation_text)
+        return self._separate_analysis_result(suggestions, sentiment)
+        
+    @staticmethod
+    def _separate_analysis_result(suggestions: Dict[str, Any], sentiment: Dict[str, Any]) -> Dict[str, Any]:
+        """Merge the results of the two-call fallback into one response."""
+        if not suggestions.get("success") and not sentiment.get("success"):
+            return {
+                "success": False,
+                "error": suggestions.get("error") or sentiment.get("error"),
+                "fallback": True
+            }
         return {
-            "success": False,
-            "error": f"No se pudo analizar el sentimiento. Último error: {last_error}"
+            "success": True,
+            "analysis": None,
+            "suggestions": suggestions.get("suggestions"),
+            "sentiment_analysis": sentiment.get("sentiment_analysis"),
+            "model": suggestions.get("model") or sentiment.get("model"),
+            "fallback": True
         }
         
-    def generate_call_summary(self, conversation_text: str) -> Dict[str, Any]:
+    def generate_call_summary(self, conversation_text: str, chunk_tokens: Optional[int] = None) -> Dict[str, Any]:
         """
         Generate a summary of the call with key points and follow-up tasks.
         
+        Transcripts longer than chunk_tokens, or that do not fit in any
+        model's context window, are summarized by map-reduce: every chunk is
+        condensed into notes, and the notes are combined into the usual
+        six-section summary. The number of chunks, reduction levels and
+        calls is returned under 'map_reduce'.
+        
         Args:
             conversation_text: The complete conversation text
+            chunk_tokens: Maximum transcript tokens per call; by default the
+                whole transcript is sent whenever a model can hold it
             
         Returns:
             Dictionary with call summary
@@ -345,60 +743,200 @@ Responde SIEMPRE en español.
                 "error": "No hay texto de conversación para resumir"
             }
             
-        # Sistema de contenido para resumen de llamada
-        system_content = """
-Eres un asistente especializado en analizar y resumir conversaciones de ventas.
-
-IMPORTANTE: La transcripción que recibes proviene de un dictado en tiempo real y puede estar
-incompleta o contener fragmentos parciales. Debes adaptar tu resumen al contenido disponible
-hasta este momento, reconociendo que la conversación puede estar en curso.
-
-Basándote en la transcripción de la llamada disponible hasta ahora, genera un resumen estructurado que incluya:
-
-1. RESUMEN GENERAL: Una descripción breve (2-3 frases) de la conversación según lo que se ha capturado.
-2. PUNTOS CLAVE: Lista de 3-5 puntos importantes identificados en el fragmento disponible.
-3. INTERESES DEL CLIENTE: Productos o servicios específicos que parecen interesar al cliente según lo transcrito.
-4. OBJECIONES: Cualquier duda o preocupación expresada por el cliente hasta el momento.
-5. ACCIONES DE SEGUIMIENTO: Lista de tareas concretas que el agente debería realizar como seguimiento.
-6. OPORTUNIDADES: Posibles oportunidades de venta adicionales identificadas en el texto disponible.
-
-Si alguna sección no tiene suficiente información para ser completada, indícalo explícitamente.
-
-Tu resumen debe ser claro, conciso y directamente aplicable para el agente comercial,
-teniendo en cuenta el carácter parcial o en desarrollo de la conversación.
-Debe proporcionar valor práctico para el seguimiento posterior a la llamada.
-
-Responde SIEMPRE en español y en formato estructurado.
-"""
+        parts, chunk_tokens = self._summary_plan(conversation_text, chunk_tokens)
+        if parts is None and self.parallel_summary:
+            result = self._generate_sectioned_summary(conversation_text)
+            if result["success"]:
+                return result
+            return dict(self._generate_single_summary(conversation_text), sectioned=result["sectioned"])
+        if parts is None:
+            return self._generate_single_summary(conversation_text)
             
-        # Intentar diferentes modelos en orden
-        last_error = None
-        for model in self.models:
-            try:
-                response = openai.ChatCompletion.create(
-                    model=model,
-                    messages=[
-                        {"role": "system", "content": system_content},
-                        {"role": "user", "content": f"Transcripción de llamada comercial (posiblemente en curso o incompleta):\n\n{conversation_text}"}
-                    ],
-                    temperature=0.5,
-                    max_tokens=800  # Permitimos respuestas más largas para resúmenes
+        stats = {"chunks": len(parts), "levels": 0, "calls": 0}
+        while parts:
+            notes = []
+            for prompt in self._summary_chunk_prompts(parts):
+                result = self._complete_with_fallback(
+                    prompt,
+                    result_key="notes",
+                    log_context="al resumir un fragmento de la llamada",
+                    error_message="No se pudo generar el resumen de la llamada"
                 )
-                
-                return {
-                    "success": True, 
-                    "call_summary": response.choices[0].message['content'],
-                    "model": response.model
-                }
-                
-            except Exception as e:
-                last_error = str(e)
-                print(f"Error con el modelo {model} al generar resumen: {last_error}")
-                # Continuar con el siguiente modelo
-                continue
-                
-        # Si llegamos aquí, todos los modelos han fallado
+                if not result.get("success"):
+                    return result
+                notes.append(result["notes"])
+            stats["levels"] += 1
+            stats["calls"] += len(parts)
+            parts = self._summary_reduce_parts(notes, chunk_tokens, stats["levels"])
+            
+        result = self._complete_with_fallback(
+            self._summary_reduce_prompt(notes),
+            result_key="call_summary",
+            log_context="al combinar el resumen de la llamada",
+            error_message="No se pudo generar el resumen de la llamada"
+        )
+        stats["calls"] += 1
+        return dict(result, map_reduce=stats) if result.get("success") else result
+        
+    def _generate_single_summary(self, conversation_text: str) -> Dict[str, Any]:
+        """Generate the whole six-section summary in one completion."""
+        return self._complete_with_fallback(
+            self.prompts.render("summary", conversation_text=conversation_text),
+            result_key="call_summary",
+            log_context="al generar resumen",
+            error_message="No se pudo generar el resumen de la llamada"
+        )
+        
+    def _generate_sectioned_summary(self, conversation_text: str) -> Dict[str, Any]:
+        """
+        Generate the summary sections as concurrent completions and assemble them in order.
+        
+        The wall-clock time is that of the slowest section. Per-section
+        timings are returned under 'sectioned'; if any section fails, the
+        result is unsuccessful so the caller can fall back to a single call.
+        """
+        if self._section_executor is None:
+            self._section_executor = ThreadPoolExecutor(max_workers=2 * len(SUMMARY_SECTIONS),
+                                                        thread_name_prefix="summary-section")
+        started = time.time()
+        # Cada sección hereda el contexto de la petición (sesión del planificador y traza)
+        futures = [
+            self._section_executor.submit(contextvars.copy_context().run, self._timed_section, section["key"], prompt)
+            for section, prompt in zip(SUMMARY_SECTIONS, self._summary_section_prompts(conversation_text))
+        ]
+        return self._assemble_sections([future.result() for future in futures], time.time() - started)
+        
+    def _timed_section(self, key: str, prompt: RenderedPrompt) -> Tuple[Dict[str, Any], float]:
+        started = time.time()
+        with span("summary_section", section=key):
+            result = self._complete_with_fallback(
+                prompt,
+                result_key="section",
+                log_context="al generar una sección del resumen",
+                error_message="No se pudo generar la sección del resumen"
+            )
+        return result, time.time() - started
+        
+    def _summary_section_prompts(self, conversation_text: str) -> List[RenderedPrompt]:
+        """Render the prompt of every summary section, each with its own max_tokens."""
+        return [
+            self.prompts.render("summary_section", max_tokens=section["max_tokens"], conversation_text=conversation_text,
+                                section_title=section["title"], section_instructions=section["instructions"])
+            for section in SUMMARY_SECTIONS
+        ]
+        
+    def _assemble_sections(self, outcomes: List[Tuple[Dict[str, Any], float]], wall: float) -> Dict[str, Any]:
+        """Join the section results in their fixed order, or report which sections failed."""
+        timings = []
+        for section, (result, latency) in zip(SUMMARY_SECTIONS, outcomes):
+            timing = {"section": section["key"], "latency_ms": round(latency * 1000, 1), "ok": bool(result.get("success"))}
+            if result.get("success"):
+                timing.update(model=result.get("model"), cached=bool(result.get("cached")))
+            else:
+                timing["error"] = result.get("error")
+            timings.append(timing)
+        sectioned = {"wall_ms": round(wall * 1000, 1), "sections": timings}
+        
+        failed = [timing["section"] for timing in timings if not timing["ok"]]
+        if failed:
+            print(f"Resumen por secciones incompleto (fallaron: {', '.join(failed)}); se genera en una sola llamada")
+            self.metrics.count_fallback("summary", "sections")
+            return {"success": False, "error": f"Secciones sin generar: {', '.join(failed)}", "sectioned": sectioned}
+        
+        call_summary = "\n\n".join(
+            f"{index}. {section['title']}:\n{result['section'].strip()}"
+            for index, (section, (result, _)) in enumerate(zip(SUMMARY_SECTIONS, outcomes), 1)
+        )
         return {
-            "success": False,
-            "error": f"No se pudo generar el resumen de la llamada. Último error: {last_error}"
-        } 
\ No newline at end of file
+            "success": True,
+            "call_summary": call_summary,
+            "model": outcomes[0][0].get("model"),
+            "sectioned": sectioned
+        }
+        
+    def update_call_summary(self, previous_summary: str, new_text: str) -> Dict[str, Any]:
+        """
+        Fold a new stretch of transcript into the running summary of a call in progress.
+        
+        Args:
+            previous_summary: The current structured summary (empty for the first stretch)
+            new_text: Finalized transcript text not yet covered by the summary
+            
+        Returns:
+            Dictionary with the updated call summary
+        """
+        if not new_text or new_text.strip() == "":
+            return {
+                "success": False,
+                "error": "No hay texto nuevo para resumir"
+            }
+            
+        return self._complete_with_fallback(
+            self._summary_update_prompt(previous_summary, new_text),
+            result_key="call_summary",
+            log_context="al actualizar el resumen",
+            error_message="No se pudo actualizar el resumen de la llamada"
+        )
+        
+    def _summary_update_prompt(self, previous_summary: str, new_text: str) -> RenderedPrompt:
+        """
+        The first stretch is summarized from scratch and later ones update the running summary.
+
+        Both are background prompts: the first stretch uses summary_start, the
+        summary prompt's text under its own name, so that it is not admitted in
+        the SUMMARY class of the summaries an agent is waiting for.
+        """
+        if not previous_summary:
+            return self.prompts.render("summary_start", conversation_text=new_text)
+        return self.prompts.render("summary_update", previous_summary=previous_summary, new_text=new_text)
+        
+    def summary_chunk_tokens(self) -> int:
+        """Largest chunk of text whose partial or combined summary prompt fits the primary model's context window."""
+        window = MODEL_CONTEXT_WINDOWS.get(self.models[0], MODEL_CONTEXT_WINDOWS["gpt-4"])
+        overhead = max(
+            template.system_tokens + template.max_tokens
+            for template in (self.prompts.get("summary_chunk"), self.prompts.get("summary_reduce"))
+        )
+        return window - overhead - SUMMARY_CHUNK_MARGIN_TOKENS
+        
+    def _summary_plan(self, conversation_text: str, chunk_tokens: Optional[int]) -> Tuple[Optional[List[str]], int]:
+        """
+        Decide whether a transcript is summarized in one call or by parts.
+        
+        Returns:
+            Tuple (chunks, or None for a single call; chunk size in tokens)
+        """
+        if chunk_tokens is None:
+            try:
+                self._models_for(self.prompts.render("summary", conversation_text=conversation_text))
+                return None, 0
+            except PromptTooLargeError:
+                chunk_tokens = self.summary_chunk_tokens()
+        elif count_tokens(conversation_text) <= chunk_tokens:
+            return None, chunk_tokens
+        return split_by_tokens(conversation_text, chunk_tokens), chunk_tokens
+        
+    def _summary_chunk_prompts(self, parts: List[str]) -> List[RenderedPrompt]:
+        """Render the partial summary prompt of every chunk."""
+        return [
+            self.prompts.render("summary_chunk", conversation_text=part, part=str(index + 1), parts=str(len(parts)))
+            for index, part in enumerate(parts)
+        ]
+        
+    @staticmethod
+    def _join_notes(notes: List[str]) -> str:
+        return "\n\n".join(f"[Fragmento {index + 1}]\n{note.strip()}" for index, note in enumerate(notes))
+        
+    def _summary_reduce_parts(self, notes: List[str], chunk_tokens: int, level: int) -> Optional[List[str]]:
+        """
+        Return the chunks of notes to condense again, or None when the notes fit in the combining call.
+        """
+        if len(notes) == 1 or level >= MAX_SUMMARY_LEVELS:
+            return None
+        parts = split_by_tokens(self._join_notes(notes), chunk_tokens)
+        # Si las notas no se reducen al trocearlas, se combinan tal cual
+        return parts if 1 < len(parts) < len(notes) else None
+        
+    def _summary_reduce_prompt(self, notes: List[str]) -> RenderedPrompt:
+        """Render the prompt combining the chunk notes into the final summary."""
+        return self.prompts.render("summary_reduce", notes=self._join_notes(notes), parts=str(len(notes)))
@@ -0,0 +1,123 @@
+from typing import Any, Dict, List, Optional
+
+from services.prompt_templates import PROMPT_TEMPLATES
+from services.token_counter import count_tokens
+from services.tracing import span
+
+# Tokens que añade la API por cada mensaje del chat (rol y separadores)
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+class PromptTooLargeError(ValueError):
+    """Raised when a prompt plus its max_tokens does not fit in any model context window."""
+
+
+class PromptTemplate:
+    """One language variant of a prompt, with its system prompt tokens counted once at load time."""
+
+    def __init__(self, name: str, language: str, version: str, system: str, user: str,
+                 temperature: float, max_tokens: int):
+        """
+        Initialize the template.
+
+        Args:
+            name: Prompt name (e.g. 'suggestions'), also used as the cache method
+            language: Language code of the variant ('es', 'en', ... or 'default')
+            version: Version of the variant text
+            system: Constant system prompt
+            user: str.format template of the user message
+            temperature: Sampling temperature
+            max_tokens: Default maximum number of tokens to generate
+        """
+        self.name = name
+        self.language = language
+        self.version = version
+        self.system = system
+        self.user = user
+        self.temperature = temperature
+        self.max_tokens = max_tokens
+        self.system_tokens = count_tokens(system) + MESSAGE_OVERHEAD_TOKENS
+
+
+class RenderedPrompt:
+    """Chat messages ready to send, with their generation parameters and token count."""
+
+    def __init__(self, template: PromptTemplate, user_content: str, max_tokens: int):
+        self.name = template.name
+        self.language = template.language
+        self.version = template.version
+        self.temperature = template.temperature
+        self.max_tokens = max_tokens
+        # El mensaje de sistema es siempre el mismo objeto: prefijo idéntico entre llamadas
+        self.messages: List[Dict[str, str]] = [
+            {"role": "system", "content": template.system},
+            {"role": "user", "content": user_content}
+        ]
+        self.prompt_tokens = template.system_tokens + count_tokens(user_content) + MESSAGE_OVERHEAD_TOKENS
+
+    @property
+    def required_tokens(self) -> int:
+        """Context window needed for the prompt and the longest possible completion."""
+        return self.prompt_tokens + self.max_tokens
+
+
+class PromptRegistry:
+    """
+    Registry of the prompt templates, loaded once at startup.
+
+    Templates are resolved by name and language code ('es-ES' -> 'es' ->
+    'default') and rendered into chat messages with a precomputed token count.
+    """
+
+    def __init__(self, templates: Optional[Dict[str, Dict[str, Any]]] = None):
+        """
+        Load the templates.
+
+        Args:
+            templates: Template definitions; defaults to PROMPT_TEMPLATES
+        """
+        self._templates: Dict[str, Dict[str, PromptTemplate]] = {}
+        for name, definition in (templates or PROMPT_TEMPLATES).items():
+            self._templates[name] = {
+                language: PromptTemplate(
+                    name, language, variant["version"], variant["system"], variant["user"],
+                    definition["temperature"], definition["max_tokens"]
+                )
+                for language, variant in definition["languages"].items()
+            }
+
+    def get(self, name: str, language: str = 'es-ES') -> PromptTemplate:
+        """
+        Return the template variant for a language.
+
+        Raises:
+            KeyError: If there is no template with that name
+        """
+        variants = self._templates[name]
+        lang_code = language.split('-')[0] if language else 'default'
+        return variants.get(lang_code) or variants['default']
+
+    def render(self, name: str, language: str = 'es-ES', max_tokens: Optional[int] = None,
+               **fields: str) -> RenderedPrompt:
+        """
+        Render a template into chat messages.
+
+        Args:
+            name: Prompt name
+            language: The language code of the conversation (e.g., 'es-ES', 'en-US')
+            max_tokens: Override of the template's maximum completion tokens
+            **fields: Values of the user message template fields
+
+        Returns:
+            The rendered prompt
+        """
+        with span('prompt', prompt=name):
+            template = self.get(name, language)
+            return RenderedPrompt(template, template.user.format(**fields), max_tokens or template.max_tokens)
+
+    def versions(self) -> Dict[str, Dict[str, str]]:
+        """Return the loaded version of every template variant."""
+        return {
+            name: {language: template.version for language, template in variants.items()}
+            for name, variants in self._templates.items()
+        }
@@ -0,0 +1,181 @@
+import asyncio
+import functools
+import threading
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+
+
+class RequestSupersededError(Exception):
+    """Raised when a request was made obsolete by a newer one for the same session."""
+
+
+class RequestTicket:
+    """An in-flight call for a (session, endpoint) slot."""
+
+    def __init__(self, request_key: Hashable):
+        self.request_key = request_key
+        self.done = threading.Event()
+        self.cancelled = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+        # Tarea de la llamada cuando se coordina desde asyncio (arun)
+        self.task: Optional[asyncio.Future] = None
+
+    @property
+    def is_cancelled(self) -> bool:
+        """Whether a newer request has superseded this one."""
+        return self.cancelled.is_set()
+
+
+class RequestCoordinator:
+    """
+    Keep at most one in-flight LLM call per (session, endpoint).
+
+    - A request with the same key as the in-flight call attaches to it and
+      receives the same result instead of issuing a new upstream call.
+    - A request with a different key supersedes the in-flight call: the old
+      call is cancelled (streams stop consuming the upstream response) or its
+      result is discarded, and its callers get RequestSupersededError.
+    """
+
+    def __init__(self):
+        """Initialize the coordinator with no in-flight calls."""
+        self._lock = threading.Lock()
+        self._tickets: Dict[Tuple[str, str], RequestTicket] = {}
+        self._stats = {'started': 0, 'joined': 0, 'superseded': 0}
+
+    def run(self, session_id: Optional[str], endpoint: str, request_key: Hashable,
+            fn: Callable[[], Any]) -> Any:
+        """
+        Run fn under single-flight, latest-wins coordination.
+
+        Args:
+            session_id: The session issuing the request (None disables coordination)
+            endpoint: Logical endpoint name (e.g. 'suggestions')
+            request_key: Identifies duplicate requests (e.g. the text and language)
+            fn: The upstream call to perform
+
+        Returns:
+            The result of fn, possibly shared with duplicate requests
+
+        Raises:
+            RequestSupersededError: If a newer request replaced this one
+        """
+        if not session_id:
+            return fn()
+
+        ticket, joined = self._acquire(session_id, endpoint, request_key)
+        if joined:
+            ticket.done.wait()
+            return self._outcome(ticket)
+
+        try:
+            ticket.result = fn()
+        except Exception as e:
+            ticket.error = e
+        finally:
+            self.release(session_id, endpoint, ticket)
+        return self._outcome(ticket)
+
+    async def arun(self, session_id: Optional[str], endpoint: str, request_key: Hashable,
+                   fn: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Async version of run: the call runs as a task that a newer request cancels.
+
+        Args:
+            session_id: The session issuing the request (None disables coordination)
+            endpoint: Logical endpoint name (e.g. 'suggestions')
+            request_key: Identifies duplicate requests (e.g. the text and language)
+            fn: Coroutine function performing the upstream call
+
+        Returns:
+            The result of fn, possibly shared with duplicate requests
+
+        Raises:
+            RequestSupersededError: If a newer request replaced this one
+        """
+        if not session_id:
+            return await fn()
+
+        ticket, joined = self._acquire(session_id, endpoint, request_key)
+        if not joined:
+            ticket.task = asyncio.ensure_future(fn())
+            ticket.task.add_done_callback(functools.partial(self._finished, session_id, endpoint, ticket))
+        try:
+            # Si se cancela este llamante, la llamada sigue para las peticiones que la comparten
+            await asyncio.shield(ticket.task)
+        except asyncio.CancelledError:
+            if not ticket.task.cancelled():
+                raise
+        except Exception:
+            pass
+        return self._outcome(ticket)
+
+    def start(self, session_id: Optional[str], endpoint: str, request_key: Hashable) -> RequestTicket:
+        """
+        Register a new call that supersedes any in-flight one (used for streams).
+
+        The caller must check ticket.is_cancelled while it works and call
+        release() when it finishes.
+        """
+        ticket = RequestTicket(request_key)
+        if session_id:
+            with self._lock:
+                self._supersede(session_id, endpoint)
+                self._tickets[(session_id, endpoint)] = ticket
+                self._stats['started'] += 1
+        return ticket
+
+    def release(self, session_id: Optional[str], endpoint: str, ticket: RequestTicket) -> None:
+        """Mark a call as finished and free its slot."""
+        ticket.done.set()
+        if not session_id:
+            return
+        with self._lock:
+            if self._tickets.get((session_id, endpoint)) is ticket:
+                del self._tickets[(session_id, endpoint)]
+
+    def get_stats(self) -> Dict[str, int]:
+        """Return counters of started, joined and superseded calls."""
+        with self._lock:
+            return dict(self._stats, in_flight=len(self._tickets))
+
+    def _finished(self, session_id: str, endpoint: str, ticket: RequestTicket, task: asyncio.Future) -> None:
+        """Store the outcome of an async call and free its slot."""
+        if not task.cancelled():
+            ticket.error = task.exception()
+            if ticket.error is None:
+                ticket.result = task.result()
+        self.release(session_id, endpoint, ticket)
+
+    def _acquire(self, session_id: str, endpoint: str, request_key: Hashable) -> Tuple[RequestTicket, bool]:
+        """Join the in-flight call for the same key, or start a new one."""
+        slot = (session_id, endpoint)
+        with self._lock:
+            ticket = self._tickets.get(slot)
+            if ticket and ticket.request_key == request_key and not ticket.is_cancelled:
+                self._stats['joined'] += 1
+                return ticket, True
+
+            self._supersede(session_id, endpoint)
+            ticket = RequestTicket(request_key)
+            self._tickets[slot] = ticket
+            self._stats['started'] += 1
+            return ticket, False
+
+    def _supersede(self, session_id: str, endpoint: str) -> None:
+        """Cancel the in-flight call of a slot, if any. Must hold the lock."""
+        ticket = self._tickets.pop((session_id, endpoint), None)
+        if ticket and not ticket.done.is_set():
+            ticket.cancelled.set()
+            self._stats['superseded'] += 1
+            if ticket.task is not None:
+                ticket.task.cancel()
+
+    @staticmethod
+    def _outcome(ticket: RequestTicket) -> Any:
+        """Return the result of a finished call, or raise if it was superseded."""
+        if ticket.is_cancelled:
+            raise RequestSupersededError("Request superseded by a newer one")
+        if ticket.error:
+            raise ticket.error
+        return ticket.result
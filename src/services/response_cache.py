@@ -0,0 +1,164 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, Optional
+
+# TTL por defecto (segundos) de cada método cacheado
+DEFAULT_TTLS = {
+    'suggestions': 120,
+    'sentiment': 120,
+    'summary': 3600,
+    'question': 86400,
+}
+
+
+def normalize_text(text: str) -> str:
+    """Normalize a prompt text so trivially different inputs share a cache entry."""
+    return ' '.join(text.split()).casefold()
+
+
+class ResponseCache:
+    """
+    Bounded in-process LRU cache for LLM responses with a per-method TTL.
+
+    Entries can optionally be written through to a SQLite file, so a restarted
+    process starts with a warm cache.
+    """
+
+    def __init__(self, max_entries: int = 1000, ttls: Optional[Dict[str, float]] = None,
+                 default_ttl: float = 300, db_path: Optional[str] = None):
+        """
+        Initialize the cache.
+
+        Args:
+            max_entries: Maximum number of cached responses (LRU eviction)
+            ttls: Time-to-live in seconds per method name
+            default_ttl: TTL for methods not listed in ttls
+            db_path: Optional SQLite file used as on-disk backing
+        """
+        self.max_entries = max_entries
+        self.ttls = dict(DEFAULT_TTLS, **(ttls or {}))
+        self.default_ttl = default_ttl
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats: Dict[str, Dict[str, int]] = {}
+        self._db = self._open_db(db_path) if db_path else None
+        if self._db:
+            self._load_from_disk()
+
+    @staticmethod
+    def make_key(method: str, models: Iterable[str], language: Optional[str], text: str,
+                 params: Dict[str, Any]) -> str:
+        """
+        Build the cache key for a request.
+
+        Args:
+            method: The service method (e.g. 'suggestions')
+            models: The model list used for the request
+            language: The language code of the request, if relevant
+            text: The prompt text (normalized before hashing)
+            params: Sampling parameters (temperature, max_tokens...)
+
+        Returns:
+            A hex digest identifying the request
+        """
+        payload = json.dumps(
+            [method, list(models), language, normalize_text(text), params],
+            sort_keys=True, ensure_ascii=False
+        )
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def get(self, method: str, key: str) -> Optional[Dict[str, Any]]:
+        """Return the cached response for a key, or None on miss or expiry."""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[1] > now:
+                self._entries.move_to_end(key)
+                self._count(method, 'hits')
+                return entry[2]
+
+            if entry:
+                del self._entries[key]
+                self._count(method, 'expirations')
+            self._count(method, 'misses')
+            return None
+
+    def set(self, method: str, key: str, value: Dict[str, Any]) -> None:
+        """Store a response, evicting the least recently used entries if full."""
+        expires_at = time.time() + self.ttls.get(method, self.default_ttl)
+        with self._lock:
+            self._entries[key] = (method, expires_at, value)
+            self._entries.move_to_end(key)
+            evicted = []
+            while len(self._entries) > self.max_entries:
+                evicted_key, (evicted_method, _, _) = self._entries.popitem(last=False)
+                evicted.append(evicted_key)
+                self._count(evicted_method, 'evictions')
+            if self._db:
+                self._write_through(key, method, expires_at, value, evicted)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Return hit/miss statistics per method and overall."""
+        with self._lock:
+            methods = {method: dict(counts) for method, counts in self._stats.items()}
+            size = len(self._entries)
+
+        hits = sum(counts.get('hits', 0) for counts in methods.values())
+        misses = sum(counts.get('misses', 0) for counts in methods.values())
+        for counts in methods.values():
+            lookups = counts.get('hits', 0) + counts.get('misses', 0)
+            counts['hit_rate'] = round(counts.get('hits', 0) / lookups, 4) if lookups else 0.0
+        return {
+            'size': size,
+            'max_entries': self.max_entries,
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': round(hits / (hits + misses), 4) if hits + misses else 0.0,
+            'methods': methods,
+        }
+
+    def _count(self, method: str, counter: str) -> None:
+        """Increment a statistics counter. Must hold the lock."""
+        counts = self._stats.setdefault(method, {'hits': 0, 'misses': 0, 'evictions': 0, 'expirations': 0})
+        counts[counter] += 1
+
+    @staticmethod
+    def _open_db(db_path: str) -> sqlite3.Connection:
+        """Open (and create if needed) the on-disk backing store."""
+        db = sqlite3.connect(db_path, check_same_thread=False)
+        db.execute('PRAGMA journal_mode=WAL')
+        db.execute(
+            'CREATE TABLE IF NOT EXISTS responses ('
+            'key TEXT PRIMARY KEY, method TEXT, expires_at REAL, value TEXT)'
+        )
+        db.commit()
+        return db
+
+    def _load_from_disk(self) -> None:
+        """Warm the in-memory cache with the non-expired entries on disk."""
+        now = time.time()
+        self._db.execute('DELETE FROM responses WHERE expires_at <= ?', (now,))
+        rows = self._db.execute(
+            'SELECT key, method, expires_at, value FROM responses ORDER BY rowid DESC LIMIT ?',
+            (self.max_entries,)
+        ).fetchall()
+        self._db.commit()
+        for key, method, expires_at, value in reversed(rows):
+            self._entries[key] = (method, expires_at, json.loads(value))
+
+    def _write_through(self, key: str, method: str, expires_at: float, value: Dict[str, Any],
+                       evicted: list) -> None:
+        """Persist a new entry and drop evicted ones. Must hold the lock."""
+        try:
+            self._db.execute(
+                'INSERT OR REPLACE INTO responses (key, method, expires_at, value) VALUES (?, ?, ?, ?)',
+                (key, method, expires_at, json.dumps(value, ensure_ascii=False))
+            )
+            self._db.executemany('DELETE FROM responses WHERE key = ?', [(k,) for k in evicted])
+            self._db.commit()
+        except sqlite3.Error as e:
+            print(f"Error al persistir la caché de respuestas: {e}")
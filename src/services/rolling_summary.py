@@ -0,0 +1,319 @@
+"""
+Call summary kept up to date in the background while the call is in progress.
+
+Every time finalized transcript segments are added, the session is checked:
+once enough new text has accumulated (and the previous update is old enough),
+a background job folds it into the session's running structured summary. At
+call end only the last stretch is left to merge, and the precomputed summary
+can be returned immediately with a freshness marker.
+"""
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+from services.token_counter import count_tokens
+
+
+def _fitting_prefix(text: str, max_tokens: int) -> str:
+    """Longest prefix of a text of at most max_tokens tokens, cut at a sentence (or else word) boundary."""
+    end = len(text)
+    while end > 0:
+        tokens = count_tokens(text[:end])
+        if tokens <= max_tokens:
+            break
+        # Recortar en proporción al exceso y retroceder hasta el último espacio
+        end = min(end - 1, int(end * max_tokens / tokens))
+        space = text.rfind(' ', 0, end)
+        end = space if space > 0 else end
+    sentence = max(text.rfind(mark, 0, end + 1) for mark in ('. ', '? ', '! ', '\n'))
+    if sentence >= end // 2:
+        end = sentence + 1
+    return text[:end]
+
+
+class RollingSummaries:
+    """
+    Running summary of each session and the decision of when to update it.
+
+    The summary, the length of the transcript it covers and the time of the
+    last update are kept in the session store under 'rolling_summary'. At most
+    one update per session is in flight in this process.
+    """
+
+    def __init__(self, session_store, transcripts, refresh_tokens: int = 400, min_interval: float = 30.0,
+                 max_tokens: Optional[int] = None):
+        """
+        Initialize the rolling summaries.
+
+        Args:
+            session_store: The SessionStore holding the conversation sessions
+            transcripts: The SessionTranscripts with the finalized segments
+            refresh_tokens: New transcript tokens that trigger an update
+            min_interval: Minimum seconds between two updates of a session
+            max_tokens: Largest stretch of new text a single update can take; a
+                longer backlog is folded in consecutive updates, oldest text first
+        """
+        self.session_store = session_store
+        self.transcripts = transcripts
+        self.refresh_tokens = refresh_tokens
+        self.min_interval = min_interval
+        self.max_tokens = max_tokens
+        self._in_flight: Dict[str, float] = {}
+        self._lock = threading.Lock()
+        # Avisa a quien espera el fin de una actualización (wait_idle)
+        self._released = threading.Condition(self._lock)
+        self._stats = {'updates': 0, 'final_merges': 0, 'failures': 0, 'served': 0, 'served_complete': 0}
+
+    def plan(self, session_id: str, final: bool = False) -> Optional[Dict[str, Any]]:
+        """
+        Return the update job of a session if one is due, marking it in flight.
+
+        Args:
+            session_id: The conversation session
+            final: Merge whatever text is left, ignoring the size and interval thresholds
+
+        Returns:
+            Job with the 'previous' summary and the 'new_text' to fold in, or None
+        """
+        with self._lock:
+            if session_id in self._in_flight:
+                return None
+            self._in_flight[session_id] = time.time()
+        job = None
+        try:
+            job = self._job(session_id, final)
+        finally:
+            if job is None:
+                self._release(session_id)
+        return job
+
+    def _job(self, session_id: str, final: bool, continued: bool = False) -> Optional[Dict[str, Any]]:
+        """Build the update job of a session, or None if none is due (see plan)."""
+        session_data = self.session_store.get(session_id) if session_id else None
+        if session_data is None:
+            return None
+        text = self.transcripts.text(session_id)
+        state = self._current_state(session_data, text)
+        covered = state.get('covered_chars', 0)
+        start = len(text) - len(text[covered:].lstrip())
+        new_text = text[start:].rstrip()
+        if not new_text:
+            return None
+        tokens = count_tokens(new_text)
+        # Un tramo pendiente de una actualización partida no espera al intervalo mínimo
+        if not final and (tokens < self.refresh_tokens
+                          or (not continued and time.time() - state.get('updated_at', 0) < self.min_interval)):
+            return None
+
+        end = len(text)
+        if self.max_tokens and tokens > self.max_tokens:
+            # Demasiado texto para una actualización: se incorpora el tramo más antiguo que cabe
+            new_text = _fitting_prefix(new_text, self.max_tokens)
+            end = start + len(new_text)
+        return {
+            'session_id': session_id,
+            'previous': state.get('summary', ''),
+            'new_text': new_text.strip(),
+            'covered_chars': end,
+            'tail': text[max(end - 32, 0):end],
+            'final': final,
+            'partial': end < len(text) and bool(text[end:].strip()),
+        }
+
+    def complete(self, job: Dict[str, Any], result: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """
+        Store the result of an update job and release the session.
+
+        Returns:
+            The job folding the rest of the text when this one only took part
+            of it (the session stays in flight), or None
+        """
+        next_job = None
+        try:
+            if result.get('success'):
+                self.session_store.update(job['session_id'], {'rolling_summary': {
+                    'summary': result['call_summary'],
+                    'covered_chars': job['covered_chars'],
+                    'tail': job['tail'],
+                    'updated_at': time.time(),
+                    'model': result.get('model'),
+                }})
+                self._stats['final_merges' if job['final'] else 'updates'] += 1
+                if job.get('partial'):
+                    next_job = self._job(job['session_id'], job['final'], continued=True)
+            else:
+                self._stats['failures'] += 1
+                print(f"Error al actualizar el resumen de la sesión {job['session_id']}: {result.get('error')}")
+        finally:
+            if next_job is None:
+                self._release(job['session_id'])
+        return next_job
+
+    def snapshot(self, session_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Return the precomputed summary of a session with its freshness, or None if there is none.
+
+        The freshness tells whether the summary covers the whole finalized
+        transcript, how many tokens are not covered yet, its age and whether an
+        update is in progress.
+        """
+        session_data = self.session_store.get(session_id) if session_id else None
+        if session_data is None:
+            return None
+        text = self.transcripts.text(session_id)
+        state = self._current_state(session_data, text)
+        if not state.get('summary'):
+            return None
+        uncovered = count_tokens(text[state['covered_chars']:].strip())
+        return {
+            'call_summary': state['summary'],
+            'model': state.get('model'),
+            'freshness': {
+                'complete': uncovered == 0,
+                'uncovered_tokens': uncovered,
+                'age_s': round(time.time() - state['updated_at'], 1),
+                'updating': self.is_updating(session_id),
+            },
+        }
+
+    def record_served(self, snapshot: Dict[str, Any]) -> None:
+        """Count a precomputed summary returned at call end, and whether it was complete."""
+        self._stats['served'] += 1
+        self._stats['served_complete'] += 1 if snapshot['freshness']['complete'] else 0
+
+    def is_updating(self, session_id: str) -> bool:
+        """Whether an update of the session is in flight."""
+        with self._lock:
+            return session_id in self._in_flight
+
+    def wait_idle(self, session_id: str, timeout: float) -> bool:
+        """Block until no update of the session is in flight. Returns False on timeout."""
+        with self._released:
+            return self._released.wait_for(lambda: session_id not in self._in_flight, timeout)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Return the update counters, the summaries served and the updates in flight."""
+        with self._lock:
+            return dict(self._stats, in_flight=len(self._in_flight))
+
+    def _release(self, session_id: str) -> None:
+        with self._released:
+            self._in_flight.pop(session_id, None)
+            self._released.notify_all()
+
+    @staticmethod
+    def _current_state(session_data: Dict[str, Any], text: str) -> Dict[str, Any]:
+        """The stored summary state, or an empty one if the transcript no longer extends it (e.g. reset)."""
+        state = session_data.get('rolling_summary') or {}
+        covered, tail = state.get('covered_chars', 0), state.get('tail', '')
+        if covered > len(text) or text[covered - len(tail):covered] != tail:
+            return {}
+        return state
+
+
+class BackgroundSummarizer:
+    """Runs the rolling summary updates on a small dedicated thread pool, away from the request threads."""
+
+    def __init__(self, summaries: RollingSummaries, update_fn: Callable[[str, str], Dict[str, Any]],
+                 max_workers: int = 1):
+        """
+        Initialize the background summarizer.
+
+        Args:
+            summaries: The rolling summaries to keep up to date
+            update_fn: Function (previous summary, new text) -> result with 'call_summary'
+            max_workers: Number of updates running at the same time in this process
+        """
+        self.summaries = summaries
+        self.update_fn = update_fn
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='rolling-summary')
+
+    def schedule(self, session_id: str, final: bool = False) -> bool:
+        """Queue an update of the session if one is due. Returns True if one was queued."""
+        job = self.summaries.plan(session_id, final)
+        if job is None:
+            return False
+        self._executor.submit(self._run, job)
+        return True
+
+    def wait(self, session_id: str, timeout: float) -> bool:
+        """Wait until no update of the session is in flight. Returns False on timeout."""
+        return self.summaries.wait_idle(session_id, timeout)
+
+    def _run(self, job: Dict[str, Any]) -> None:
+        while job is not None:
+            try:
+                result = self.update_fn(job['previous'], job['new_text'])
+            except Exception as e:
+                result = {'success': False, 'error': str(e)}
+            job = self.summaries.complete(job, result)
+
+
+class AsyncBackgroundSummarizer:
+    """Asyncio counterpart of BackgroundSummarizer: updates run as tasks, at most max_workers at a time."""
+
+    def __init__(self, summaries: RollingSummaries, update_fn, max_workers: int = 1):
+        """
+        Initialize the background summarizer.
+
+        Args:
+            summaries: The rolling summaries to keep up to date
+            update_fn: Coroutine function (previous summary, new text) -> result with 'call_summary'
+            max_workers: Number of updates running at the same time in this process
+        """
+        self.summaries = summaries
+        self.update_fn = update_fn
+        self.max_workers = max_workers
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._released: Optional[asyncio.Condition] = None
+        self._tasks = set()
+
+    async def schedule(self, session_id: str, final: bool = False) -> bool:
+        """Start an update of the session if one is due (inside the event loop). Returns True if one was started."""
+        loop = asyncio.get_running_loop()
+        # plan() lee la sesión y la transcripción del almacén: fuera del bucle de eventos
+        job = await loop.run_in_executor(None, self.summaries.plan, session_id, final)
+        if job is None:
+            # plan() puede haber marcado y liberado la sesión mientras alguien esperaba
+            await self._notify()
+            return False
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_workers)
+        task = loop.create_task(self._run(job))
+        # Mantener una referencia: el bucle de eventos solo guarda referencias débiles a las tareas
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return True
+
+    async def wait(self, session_id: str, timeout: float) -> bool:
+        """Wait until no update of the session is in flight. Returns False on timeout."""
+        if self._released is None:
+            self._released = asyncio.Condition()
+        async with self._released:
+            try:
+                await asyncio.wait_for(
+                    self._released.wait_for(lambda: not self.summaries.is_updating(session_id)), timeout
+                )
+            except asyncio.TimeoutError:
+                return False
+        return True
+
+    async def _run(self, job: Dict[str, Any]) -> None:
+        try:
+            while job is not None:
+                try:
+                    async with self._semaphore:
+                        result = await self.update_fn(job['previous'], job['new_text'])
+                except Exception as e:
+                    result = {'success': False, 'error': str(e)}
+                job = await asyncio.get_running_loop().run_in_executor(None, self.summaries.complete, job, result)
+        finally:
+            await self._notify()
+
+    async def _notify(self) -> None:
+        """Wake the waiters so they check whether their session is still being updated."""
+        if self._released is not None:
+            async with self._released:
+                self._released.notify_all()
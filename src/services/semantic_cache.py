@@ -0,0 +1,180 @@
+"""
+Semantic cache of the answers to /ask-question, shared by every agent served
+by the process.
+
+Questions are embedded and their normalized vectors kept in a preallocated
+matrix, so finding the closest stored question is a single matrix-vector
+product. A stored answer is returned when its question is at least as
+similar as the threshold, was asked under the same scope (prompt versions
+and models) and has not expired.
+"""
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from services.knowledge_index import Embedder, HashingEmbedder
+
+
+class SemanticAnswerCache:
+    """
+    Bounded cache of answers keyed by question similarity, with a per-entry TTL.
+
+    When full, an expired entry is reused first and otherwise the least
+    recently used one is evicted.
+    """
+
+    def __init__(self, embedder: Optional[Embedder] = None, threshold: Optional[float] = None,
+                 max_entries: int = 2000, ttl: float = 3600):
+        """
+        Initialize the cache.
+
+        Args:
+            embedder: Embedder of the questions; the local hashing embedder by default
+            threshold: Minimum cosine similarity of a hit; by default the
+                embedder's default_duplicate_score
+            max_entries: Maximum number of stored answers
+            ttl: Lifetime in seconds of each stored answer
+        """
+        self.embedder = embedder or HashingEmbedder()
+        self.threshold = self.embedder.default_duplicate_score if threshold is None else threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = threading.Lock()
+
+        # Una fila por entrada; expires_at == 0 marca un hueco libre
+        self._vectors = np.zeros((max_entries, self.embedder.dim), dtype=np.float32)
+        self._expires_at = np.zeros(max_entries, dtype=np.float64)
+        self._last_used = np.zeros(max_entries, dtype=np.float64)
+        self._scopes = np.full(max_entries, -1, dtype=np.int32)
+        self._entries: List[Optional[Dict[str, Any]]] = [None] * max_entries
+        self._scope_ids: Dict[str, int] = {}
+
+        self._stats = {'hits': 0, 'misses': 0, 'stores': 0, 'evictions': 0, 'expirations': 0}
+        self._hit_similarity = 0.0
+        self._lookup_ms = 0.0
+
+    def embed(self, question: str) -> np.ndarray:
+        """Embed a question (call it off the event loop when the embedder is not local)."""
+        return self.embedder.embed([question])[0]
+
+    def lookup(self, question: str, scope: str,
+               vector: Optional[np.ndarray] = None) -> Tuple[Optional[Dict[str, Any]], np.ndarray]:
+        """
+        Find the stored answer of the most similar question.
+
+        Args:
+            question: The incoming question
+            scope: Scope the answer must have been stored under
+            vector: The question embedding, if already computed
+
+        Returns:
+            Tuple (hit, vector); hit is None on a miss, otherwise a dict with
+            the stored 'result', the 'similarity' and the matched 'question'.
+            The vector can be passed to store() to avoid embedding twice.
+        """
+        if vector is None:
+            vector = self.embed(question)
+        started = time.perf_counter()
+        now = time.time()
+        with self._lock:
+            self._expire(now)
+            scope_id = self._scope_ids.get(scope)
+            best = None
+            if scope_id is not None:
+                scores = self._vectors @ vector
+                scores[self._scopes != scope_id] = -np.inf
+                position = int(np.argmax(scores))
+                if scores[position] >= self.threshold:
+                    best = position, float(scores[position])
+
+            self._lookup_ms += (time.perf_counter() - started) * 1000
+            if best is None:
+                self._stats['misses'] += 1
+                return None, vector
+
+            position, similarity = best
+            entry = self._entries[position]
+            entry['hits'] += 1
+            self._last_used[position] = now
+            self._stats['hits'] += 1
+            self._hit_similarity += similarity
+            return {
+                'result': entry['result'],
+                'similarity': round(similarity, 4),
+                'question': entry['question'],
+            }, vector
+
+    def store(self, question: str, scope: str, result: Dict[str, Any],
+              vector: Optional[np.ndarray] = None) -> None:
+        """
+        Store the answer to a question.
+
+        A near-duplicate already stored under the same scope is replaced
+        instead of adding a second entry.
+        """
+        if vector is None:
+            vector = self.embed(question)
+        now = time.time()
+        with self._lock:
+            self._expire(now)
+            scope_id = self._scope_ids.setdefault(scope, len(self._scope_ids))
+            same_scope = self._scopes == scope_id
+            position = None
+            if same_scope.any():
+                scores = np.where(same_scope, self._vectors @ vector, -np.inf)
+                closest = int(np.argmax(scores))
+                if scores[closest] >= self.threshold:
+                    position = closest
+            if position is None:
+                free = np.flatnonzero(self._expires_at == 0)
+                if len(free):
+                    position = int(free[0])
+                else:
+                    position = int(np.argmin(self._last_used))
+                    self._stats['evictions'] += 1
+
+            self._vectors[position] = vector
+            self._expires_at[position] = now + self.ttl
+            self._last_used[position] = now
+            self._scopes[position] = scope_id
+            self._entries[position] = {'question': question, 'result': result, 'hits': 0, 'created': now}
+            self._stats['stores'] += 1
+
+    def clear(self) -> None:
+        """Drop every stored answer."""
+        with self._lock:
+            self._release(np.flatnonzero(self._expires_at))
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Return hit/miss counts, the hit rate, the size and the mean lookup time."""
+        with self._lock:
+            stats = dict(self._stats)
+            lookups = stats['hits'] + stats['misses']
+            stats.update({
+                'hit_rate': round(stats['hits'] / lookups, 4) if lookups else 0.0,
+                'mean_hit_similarity': round(self._hit_similarity / stats['hits'], 4) if stats['hits'] else None,
+                'mean_lookup_ms': round(self._lookup_ms / lookups, 3) if lookups else None,
+                'size': int(np.count_nonzero(self._expires_at)),
+                'max_entries': self.max_entries,
+                'threshold': self.threshold,
+                'ttl': self.ttl,
+                'embedder': self.embedder.name,
+            })
+            return stats
+
+    def _expire(self, now: float) -> None:
+        """Free the slots whose TTL has passed (called with the lock held)."""
+        expired = np.flatnonzero((self._expires_at > 0) & (self._expires_at <= now))
+        if len(expired):
+            self._stats['expirations'] += len(expired)
+            self._release(expired)
+
+    def _release(self, positions: np.ndarray) -> None:
+        self._vectors[positions] = 0
+        self._expires_at[positions] = 0
+        self._last_used[positions] = 0
+        self._scopes[positions] = -1
+        for position in positions:
+            self._entries[int(position)] = None
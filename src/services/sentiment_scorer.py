@@ -0,0 +1,374 @@
+"""
+Local incremental sentiment scoring of the live transcript.
+
+A small es/en/fr lexicon gives each word a valence and, optionally, an
+emotion. Every session keeps a running state in the session store: only the
+transcript text added since the previous request is scored, and older text
+fades out with a half-life measured in words. The full LLM sentiment analysis
+is requested only when the local estimate crosses a sentiment band, shifts
+sharply or shows a new negative emotion.
+"""
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from services.conversation_analysis import OVERALL_LABELS
+from services.knowledge_index import WORD, fold_text
+
+EMOTIONS = ('enfado', 'frustración', 'duda', 'interés', 'satisfacción')
+NEGATIVE_EMOTIONS = ('enfado', 'frustración')
+
+# Palabra (sin tildes) -> (valencia entre -1 y 1, emoción o None)
+LEXICON = {
+    'es': {
+        'bien': (0.4, None), 'bueno': (0.5, None), 'buena': (0.5, None), 'genial': (0.8, 'satisfacción'),
+        'excelente': (0.9, 'satisfacción'), 'perfecto': (0.8, 'satisfacción'), 'perfecta': (0.8, 'satisfacción'),
+        'estupendo': (0.8, 'satisfacción'), 'fantastico': (0.9, 'satisfacción'), 'gracias': (0.4, 'satisfacción'),
+        'contento': (0.7, 'satisfacción'), 'contenta': (0.7, 'satisfacción'), 'satisfecho': (0.7, 'satisfacción'),
+        'satisfecha': (0.7, 'satisfacción'), 'encanta': (0.8, 'interés'), 'gusta': (0.5, 'interés'),
+        'interesa': (0.6, 'interés'), 'interesante': (0.6, 'interés'), 'interesado': (0.6, 'interés'),
+        'interesada': (0.6, 'interés'), 'util': (0.5, None), 'facil': (0.4, None), 'rapido': (0.3, None),
+        'ventaja': (0.4, 'interés'), 'ahorro': (0.4, 'interés'), 'quiero': (0.3, 'interés'),
+        'comprar': (0.4, 'interés'), 'contratar': (0.5, 'interés'), 'acuerdo': (0.4, None), 'vale': (0.2, None),
+        'mal': (-0.5, None), 'malo': (-0.6, None), 'mala': (-0.6, None), 'pesimo': (-0.9, 'enfado'),
+        'horrible': (-0.9, 'enfado'), 'terrible': (-0.9, 'enfado'), 'queja': (-0.6, 'enfado'),
+        'reclamacion': (-0.6, 'enfado'), 'enfadado': (-0.8, 'enfado'), 'enfadada': (-0.8, 'enfado'),
+        'molesto': (-0.6, 'enfado'), 'molesta': (-0.6, 'enfado'), 'inaceptable': (-0.9, 'enfado'),
+        'ridiculo': (-0.7, 'enfado'), 'cancelar': (-0.6, 'enfado'), 'problema': (-0.5, 'frustración'),
+        'problemas': (-0.5, 'frustración'), 'harto': (-0.8, 'frustración'), 'harta': (-0.8, 'frustración'),
+        'cansado': (-0.4, 'frustración'), 'frustrado': (-0.8, 'frustración'), 'frustrada': (-0.8, 'frustración'),
+        'decepcionado': (-0.7, 'frustración'), 'decepcion': (-0.7, 'frustración'), 'lento': (-0.4, 'frustración'),
+        'error': (-0.5, 'frustración'), 'fallo': (-0.5, 'frustración'), 'esperando': (-0.3, 'frustración'),
+        'caro': (-0.5, 'duda'), 'costoso': (-0.5, 'duda'), 'duda': (-0.3, 'duda'), 'dudas': (-0.3, 'duda'),
+        'preocupa': (-0.5, 'duda'), 'preocupado': (-0.5, 'duda'), 'complicado': (-0.4, 'duda'),
+        'dificil': (-0.4, 'duda'), 'pensarlo': (-0.2, 'duda'), 'competencia': (-0.2, 'duda'),
+    },
+    'en': {
+        'good': (0.5, None), 'great': (0.8, 'satisfacción'), 'excellent': (0.9, 'satisfacción'),
+        'perfect': (0.8, 'satisfacción'), 'awesome': (0.8, 'satisfacción'), 'nice': (0.5, None),
+        'thanks': (0.4, 'satisfacción'), 'thank': (0.4, 'satisfacción'), 'happy': (0.7, 'satisfacción'),
+        'satisfied': (0.7, 'satisfacción'), 'love': (0.8, 'interés'), 'like': (0.3, 'interés'),
+        'interested': (0.6, 'interés'), 'interesting': (0.6, 'interés'), 'useful': (0.5, None),
+        'easy': (0.4, None), 'fast': (0.3, None), 'benefit': (0.4, 'interés'), 'save': (0.3, 'interés'),
+        'want': (0.3, 'interés'), 'buy': (0.4, 'interés'), 'agree': (0.4, None),
+        'bad': (-0.6, None), 'awful': (-0.9, 'enfado'), 'complaint': (-0.6, 'enfado'),
+        'angry': (-0.8, 'enfado'), 'upset': (-0.7, 'enfado'), 'annoyed': (-0.6, 'enfado'),
+        'unacceptable': (-0.9, 'enfado'), 'ridiculous': (-0.7, 'enfado'), 'cancel': (-0.6, 'enfado'),
+        'problem': (-0.5, 'frustración'), 'problems': (-0.5, 'frustración'), 'issue': (-0.4, 'frustración'),
+        'frustrated': (-0.8, 'frustración'), 'tired': (-0.4, 'frustración'), 'slow': (-0.4, 'frustración'),
+        'broken': (-0.6, 'frustración'), 'disappointed': (-0.7, 'frustración'), 'waiting': (-0.3, 'frustración'),
+        'expensive': (-0.5, 'duda'), 'worried': (-0.5, 'duda'), 'concern': (-0.4, 'duda'),
+        'concerned': (-0.5, 'duda'), 'unsure': (-0.4, 'duda'), 'complicated': (-0.4, 'duda'),
+        'difficult': (-0.4, 'duda'), 'competitor': (-0.2, 'duda'),
+    },
+    'fr': {
+        'bon': (0.5, None), 'bonne': (0.5, None), 'parfait': (0.8, 'satisfacción'),
+        'merci': (0.4, 'satisfacción'), 'satisfait': (0.7, 'satisfacción'), 'content': (0.7, 'satisfacción'),
+        'adore': (0.8, 'interés'), 'aime': (0.5, 'interés'), 'interesse': (0.6, 'interés'),
+        'interessant': (0.6, 'interés'), 'utile': (0.5, None), 'facile': (0.4, None), 'rapide': (0.3, None),
+        'avantage': (0.4, 'interés'), 'veux': (0.3, 'interés'), 'acheter': (0.4, 'interés'),
+        'mauvais': (-0.6, None), 'nul': (-0.7, 'enfado'), 'plainte': (-0.6, 'enfado'),
+        'fache': (-0.8, 'enfado'), 'enerve': (-0.7, 'enfado'), 'inacceptable': (-0.9, 'enfado'),
+        'ridicule': (-0.7, 'enfado'), 'annuler': (-0.6, 'enfado'), 'probleme': (-0.5, 'frustración'),
+        'frustre': (-0.8, 'frustración'), 'fatigue': (-0.4, 'frustración'), 'lent': (-0.4, 'frustración'),
+        'erreur': (-0.5, 'frustración'), 'panne': (-0.6, 'frustración'), 'decu': (-0.7, 'frustración'),
+        'attendre': (-0.3, 'frustración'), 'cher': (-0.5, 'duda'), 'chere': (-0.5, 'duda'),
+        'doute': (-0.3, 'duda'), 'inquiet': (-0.5, 'duda'), 'complique': (-0.4, 'duda'),
+        'difficile': (-0.4, 'duda'), 'concurrent': (-0.2, 'duda'),
+    },
+}
+
+# Palabras que invierten la valencia de las siguientes (y anulan su emoción)
+NEGATORS = frozenset('''
+no nunca jamas tampoco ni sin
+not never nothing don doesn didn isn wasn won cannot
+ne pas jamais rien sans
+'''.split())
+NEGATION_SCOPE = 3
+
+# Palabras que refuerzan la siguiente
+INTENSIFIERS = frozenset('''
+muy mucho muchisimo bastante demasiado totalmente
+very really so extremely totally
+tres vraiment tellement trop
+'''.split())
+INTENSIFIER_WEIGHT = 1.5
+
+# Umbrales de valencia de cada banda de OVERALL_SENTIMENTS (de menor a mayor)
+OVERALL_BANDS = ((-0.5, 'very_negative'), (-0.15, 'negative'), (0.15, 'neutral'), (0.5, 'positive'))
+
+
+def _build_lexicon() -> Tuple[Dict[str, int], np.ndarray]:
+    """Merge the per-language lexicons into a word index and a (words, 1 + emotions) matrix."""
+    vocabulary: Dict[str, int] = {}
+    rows: List[List[float]] = []
+    for entries in LEXICON.values():
+        for word, (valence, emotion) in entries.items():
+            if word in vocabulary:
+                continue
+            vocabulary[word] = len(rows)
+            rows.append([valence] + [1.0 if emotion == name else 0.0 for name in EMOTIONS])
+    return vocabulary, np.array(rows, dtype=np.float32)
+
+
+VOCABULARY, LEXICON_MATRIX = _build_lexicon()
+
+
+def overall_sentiment(score: float) -> str:
+    """Map a valence score in [-1, 1] to one of OVERALL_SENTIMENTS."""
+    for upper, label in OVERALL_BANDS:
+        if score <= upper:
+            return label
+    return 'very_positive'
+
+
+class SentimentScorer:
+    """
+    Lexicon-based sentiment scorer with a running, JSON-serializable state.
+
+    The state holds decayed sums of the valence and emotion evidence; each
+    update decays them by the number of new words before adding the new text.
+    """
+
+    def __init__(self, half_life_words: int = 40):
+        """
+        Initialize the scorer.
+
+        Args:
+            half_life_words: Number of words after which the weight of older text halves
+        """
+        self.decay = 0.5 ** (1.0 / half_life_words)
+
+    @staticmethod
+    def new_state() -> Dict[str, Any]:
+        """Return the state of a conversation with no text scored yet."""
+        return {'offset': 0, 'tail': '', 'words': 0, 'valence': 0.0, 'evidence': 0.0,
+                'emotions': [0.0] * len(EMOTIONS)}
+
+    def score(self, text: str) -> Tuple[np.ndarray, float, int]:
+        """
+        Score a piece of text.
+
+        Returns:
+            Tuple (summed valence and emotion features, weight of the lexicon
+            words found, number of words)
+        """
+        words = WORD.findall(fold_text(text))
+        rows, weights, negated = [], [], []
+        scope, boost = 0, 1.0
+        for word in words:
+            if word in NEGATORS:
+                scope = NEGATION_SCOPE
+                continue
+            if word in INTENSIFIERS:
+                boost = INTENSIFIER_WEIGHT
+                continue
+            row = VOCABULARY.get(word)
+            if row is not None:
+                rows.append(row)
+                weights.append(boost)
+                negated.append(scope > 0)
+            scope = max(scope - 1, 0)
+            boost = 1.0
+
+        features = np.zeros(1 + len(EMOTIONS), dtype=np.float32)
+        if rows:
+            weights = np.array(weights, dtype=np.float32)
+            negated = np.array(negated)
+            # Valencia invertida y emoción anulada en las palabras negadas
+            column_weights = np.empty((len(rows), 1 + len(EMOTIONS)), dtype=np.float32)
+            column_weights[:, 0] = np.where(negated, -weights, weights)
+            column_weights[:, 1:] = np.where(negated, 0.0, weights)[:, None]
+            features = (LEXICON_MATRIX[rows] * column_weights).sum(axis=0)
+        return features, float(len(rows)), len(words)
+
+    def update(self, state: Dict[str, Any], final_text: str, interim: str = '') -> Dict[str, Any]:
+        """
+        Score the final text added since the previous update and return the current estimate.
+
+        The state is updated in place with the final text only; the interim
+        text counts towards the returned estimate but is scored again on the
+        next update. If the final text no longer extends the text already
+        scored (e.g. the transcript was reset), scoring starts over.
+
+        Args:
+            state: Running state of the conversation (see new_state)
+            final_text: The whole finalized transcript
+            interim: Unfinalized text following it
+
+        Returns:
+            Estimate with the 'score', the 'overall' band, the 'emotions'
+            intensities and the 'evidence' behind it
+        """
+        offset, tail = state['offset'], state['tail']
+        if offset > len(final_text) or final_text[offset - len(tail):offset] != tail:
+            state.update(self.new_state())
+            offset = 0
+
+        new_text = final_text[offset:]
+        if new_text.strip():
+            self._add(state, *self.score(new_text))
+        state['offset'] = len(final_text)
+        state['tail'] = final_text[-32:]
+
+        if not interim.strip():
+            return self._estimate(state)
+        preview = dict(state, emotions=list(state['emotions']))
+        self._add(preview, *self.score(interim))
+        return self._estimate(preview)
+
+    def _add(self, state: Dict[str, Any], features: np.ndarray, evidence: float, words: int) -> None:
+        factor = self.decay ** words
+        state['valence'] = state['valence'] * factor + float(features[0])
+        state['evidence'] = state['evidence'] * factor + evidence
+        state['emotions'] = [value * factor + float(added) for value, added in zip(state['emotions'], features[1:])]
+        state['words'] += words
+
+    @staticmethod
+    def _estimate(state: Dict[str, Any]) -> Dict[str, Any]:
+        # El +1 evita que una sola palabra mueva el indicador a un extremo
+        norm = state['evidence'] + 1.0
+        score = max(-1.0, min(1.0, state['valence'] / norm))
+        emotions = {
+            name: round(value / norm, 2)
+            for name, value in zip(EMOTIONS, state['emotions'])
+            if value / norm >= 0.1
+        }
+        return {
+            'score': round(score, 3),
+            'overall': overall_sentiment(score),
+            'emotions': dict(sorted(emotions.items(), key=lambda item: -item[1])),
+            'evidence': round(state['evidence'], 2),
+            'words': state['words'],
+        }
+
+
+def format_local_sentiment(estimate: Dict[str, Any]) -> str:
+    """Render a local estimate for the sentiment panel."""
+    emotions = ', '.join(estimate['emotions']) or 'no detectadas'
+    return (
+        f"Sentimiento general: {OVERALL_LABELS[estimate['overall']]} ({estimate['score']:+.2f})\n"
+        f"Emociones: {emotions}\n"
+        f"(Estimación local; el análisis completo se actualizará si el sentimiento cambia)"
+    )
+
+
+class SessionSentiment:
+    """
+    Local sentiment of each conversation session, deciding when to escalate to the LLM.
+
+    The scorer state, the estimate behind the last LLM analysis and the text
+    of that analysis are kept in the session store under 'sentiment'.
+    """
+
+    def __init__(self, session_store, scorer: Optional[SentimentScorer] = None, shift: float = 0.3,
+                 min_evidence: float = 1.5, cooldown: float = 5.0):
+        """
+        Initialize the session sentiment.
+
+        Args:
+            session_store: The SessionStore holding the conversation sessions
+            scorer: Local scorer; one with the default half-life by default
+            shift: Change of the score since the last LLM analysis that triggers a new one
+            min_evidence: Lexicon evidence needed before the first LLM analysis
+            cooldown: Minimum seconds between two automatic LLM analyses
+        """
+        self.session_store = session_store
+        self.scorer = scorer or SentimentScorer()
+        self.shift = shift
+        self.min_evidence = min_evidence
+        self.cooldown = cooldown
+        self._stats = {'local': 0, 'escalated': {}}
+
+    def observe(self, session_id: Optional[str], final_text: str, interim: str = '',
+                force: bool = False) -> Tuple[Dict[str, Any], Optional[str]]:
+        """
+        Update the local estimate of a session with its latest transcript.
+
+        Args:
+            session_id: The conversation session (None scores the text from scratch)
+            final_text: The whole finalized transcript
+            interim: Unfinalized text following it
+            force: Always escalate (manual analysis)
+
+        Returns:
+            Tuple (estimate, escalation reason or None if the local estimate suffices)
+        """
+        session_data = self.session_store.get(session_id) if session_id else None
+        sentiment = (session_data or {}).get('sentiment') or {'state': self.scorer.new_state()}
+        estimate = self.scorer.update(sentiment['state'], final_text, interim)
+        reason = self._escalation_reason(sentiment.get('escalated'), estimate, force)
+        if session_data is not None:
+            self.session_store.update(session_id, {'sentiment': sentiment})
+
+        if reason:
+            self._stats['escalated'][reason] = self._stats['escalated'].get(reason, 0) + 1
+        else:
+            self._stats['local'] += 1
+        return estimate, reason
+
+    def record_analysis(self, session_id: Optional[str], estimate: Dict[str, Any], result: Dict[str, Any]) -> None:
+        """Keep a successful LLM analysis and the estimate it was requested for as the new baseline."""
+        session_data = self.session_store.get(session_id) if session_id else None
+        if session_data is None or not result.get('success'):
+            return
+        sentiment = session_data.get('sentiment') or {'state': self.scorer.new_state()}
+        sentiment['escalated'] = {
+            'score': estimate['score'],
+            'overall': estimate['overall'],
+            'emotions': list(estimate['emotions']),
+            'at': time.time(),
+        }
+        sentiment['analysis'] = result.get('sentiment_analysis')
+        sentiment['model'] = result.get('model')
+        self.session_store.update(session_id, {'sentiment': sentiment})
+
+    def local_result(self, session_id: Optional[str], estimate: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Build the response of a request answered locally.
+
+        The panel keeps showing the last LLM analysis of the session, if any;
+        the local estimate is returned under 'local_sentiment'.
+        """
+        session_data = self.session_store.get(session_id) if session_id else None
+        sentiment = (session_data or {}).get('sentiment') or {}
+        result = {
+            'success': True,
+            'sentiment_analysis': sentiment.get('analysis') or format_local_sentiment(estimate),
+            'local_sentiment': estimate,
+            'escalated': False,
+        }
+        if sentiment.get('analysis'):
+            result['model'] = sentiment.get('model')
+        return result
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Return how many requests were answered locally and escalated, per reason."""
+        escalated = sum(self._stats['escalated'].values())
+        total = self._stats['local'] + escalated
+        return {
+            'local': self._stats['local'],
+            'escalated': dict(self._stats['escalated']),
+            'local_rate': round(self._stats['local'] / total, 4) if total else 0.0,
+        }
+
+    def _escalation_reason(self, escalated: Optional[Dict[str, Any]], estimate: Dict[str, Any],
+                           force: bool) -> Optional[str]:
+        if force:
+            return 'manual'
+        if estimate['evidence'] < self.min_evidence:
+            return None
+        if escalated is None:
+            return 'initial'
+        if time.time() - escalated['at'] < self.cooldown:
+            return None
+        change = abs(estimate['score'] - escalated['score'])
+        # Histéresis: un cambio de banda por unas centésimas no justifica otra llamada
+        if estimate['overall'] != escalated['overall'] and change >= self.shift / 2:
+            return 'threshold'
+        if change >= self.shift:
+            return 'shift'
+        if any(name in estimate['emotions'] and name not in escalated['emotions'] for name in NEGATIVE_EMOTIONS):
+            return 'emotion'
+        return None
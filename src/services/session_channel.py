@@ -0,0 +1,100 @@
+import json
+from typing import Any, Dict, Optional
+
+# Mensajes que el navegador puede enviar por el canal de sesión
+CLIENT_MESSAGE_TYPES = ('segment', 'interim', 'language', 'summary', 'ping')
+
+
+class ChannelMessageError(ValueError):
+    """Raised when a message received on the session channel is not valid."""
+
+
+def parse_message(raw: str) -> Dict[str, Any]:
+    """
+    Parse and validate a message sent by the browser on the session channel.
+
+    Messages are JSON objects with a 'type':
+        segment:  {"seq": int, "text": str, "reset": bool} a finalized transcript segment
+        interim:  {"text": str} the current unfinalized text
+        language: {"language": str} the conversation language
+        summary:  request a call summary
+        ping:     keep-alive
+
+    Raises:
+        ChannelMessageError: If the message is not valid
+    """
+    try:
+        message = json.loads(raw)
+    except (TypeError, json.JSONDecodeError) as e:
+        raise ChannelMessageError(f"Mensaje no válido: {e}") from e
+    if not isinstance(message, dict) or message.get('type') not in CLIENT_MESSAGE_TYPES:
+        raise ChannelMessageError("Tipo de mensaje desconocido")
+
+    message_type = message['type']
+    if message_type == 'segment':
+        seq = message.get('seq')
+        if isinstance(seq, bool) or not isinstance(seq, int) or not 0 <= seq < 2 ** 32:
+            raise ChannelMessageError("'seq' debe ser un entero no negativo")
+        if not isinstance(message.get('text'), str):
+            raise ChannelMessageError("'text' debe ser un texto")
+    elif message_type == 'interim' and not isinstance(message.get('text'), str):
+        raise ChannelMessageError("'text' debe ser un texto")
+    elif message_type == 'language' and not isinstance(message.get('language'), str):
+        raise ChannelMessageError("'language' debe ser un texto")
+    return message
+
+
+class AnalysisSchedule:
+    """
+    Decide when the server runs the live analysis of a session channel.
+
+    Instead of reacting to client timers, the server analyzes the transcript
+    shortly after a finalized segment, or once interim text has been stable
+    for a while, never more often than min_interval and with a single analysis
+    in flight. Changes that arrive during an analysis trigger a new one with
+    the latest text when it finishes.
+    """
+
+    def __init__(self, final_delay: float = 0.3, interim_delay: float = 1.0, min_interval: float = 2.0):
+        """
+        Initialize the schedule.
+
+        Args:
+            final_delay: Seconds to wait after a finalized segment (lets close segments coalesce)
+            interim_delay: Seconds of stable interim text before analyzing it
+            min_interval: Minimum seconds between the start of two analyses
+        """
+        self.final_delay = final_delay
+        self.interim_delay = interim_delay
+        self.min_interval = min_interval
+        self._due_at: Optional[float] = None
+        self._last_start = float('-inf')
+        self._in_flight = False
+        self._final_pending = False
+
+    def changed(self, now: float, final: bool) -> None:
+        """Record a transcript change (finalized segment or new interim text)."""
+        if final:
+            due_at = now + self.final_delay
+            self._due_at = due_at if self._due_at is None else min(self._due_at, due_at)
+            self._final_pending = True
+        elif not self._final_pending:
+            # El texto provisional solo se analiza cuando deja de cambiar
+            self._due_at = now + self.interim_delay
+
+    def due_in(self, now: float) -> Optional[float]:
+        """Seconds until the next analysis should start (0 if due now), or None if nothing is pending."""
+        if self._due_at is None or self._in_flight:
+            return None
+        return max(0.0, max(self._due_at, self._last_start + self.min_interval) - now)
+
+    def start(self, now: float) -> None:
+        """Record that an analysis of the current text started."""
+        self._due_at = None
+        self._final_pending = False
+        self._last_start = now
+        self._in_flight = True
+
+    def finish(self) -> None:
+        """Record that the running analysis finished."""
+        self._in_flight = False
@@ -0,0 +1,288 @@
+import copy
+import json
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+
+def session_size(data: Dict[str, Any]) -> int:
+    """Approximate memory footprint of a session (size of its JSON encoding, in bytes)."""
+    return len(json.dumps(data, ensure_ascii=False).encode('utf-8'))
+
+
+class SessionStore(ABC):
+    """
+    Storage for conversation sessions (transcript, summary, context state...).
+
+    Sessions idle for longer than idle_ttl are dropped, and the least recently
+    used sessions are evicted when the total size exceeds max_bytes. Sessions
+    are returned as copies: changes must be saved back with update().
+    """
+
+    def __init__(self, idle_ttl: float = 3600, max_bytes: int = 256 * 1024 * 1024):
+        """
+        Initialize the store.
+
+        Args:
+            idle_ttl: Seconds without access after which a session expires
+            max_bytes: Maximum total size of the stored sessions
+        """
+        self.idle_ttl = idle_ttl
+        self.max_bytes = max_bytes
+        self._evictions = {'idle': 0, 'memory': 0}
+
+    @abstractmethod
+    def create(self, session_id: str, data: Dict[str, Any]) -> None:
+        """Store a new session, replacing any session with the same id."""
+
+    @abstractmethod
+    def get(self, session_id: str) -> Optional[Dict[str, Any]]:
+        """Return a copy of the session data (refreshing its idle timer), or None if unknown or expired."""
+
+    @abstractmethod
+    def update(self, session_id: str, fields: Dict[str, Any]) -> bool:
+        """Merge fields into a session. Returns False if the session does not exist."""
+
+    @abstractmethod
+    def delete(self, session_id: str) -> None:
+        """Remove a session."""
+
+    @abstractmethod
+    def get_stats(self) -> Dict[str, Any]:
+        """Return the number of sessions, their total size and eviction counters."""
+
+    def __contains__(self, session_id: str) -> bool:
+        return bool(session_id) and self.get(session_id) is not None
+
+
+class InMemorySessionStore(SessionStore):
+    """Session store kept in the memory of the current process (single worker)."""
+
+    def __init__(self, idle_ttl: float = 3600, max_bytes: int = 256 * 1024 * 1024):
+        super().__init__(idle_ttl, max_bytes)
+        # session_id -> (last_access, size, data), del menos al más recientemente usado
+        self._sessions: "OrderedDict[str, tuple]" = OrderedDict()
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+
+    def create(self, session_id: str, data: Dict[str, Any]) -> None:
+        with self._lock:
+            self._put(session_id, copy.deepcopy(data))
+
+    def get(self, session_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            self._evict_idle()
+            entry = self._sessions.get(session_id)
+            if entry is None:
+                return None
+            self._sessions[session_id] = (time.time(), entry[1], entry[2])
+            self._sessions.move_to_end(session_id)
+            return copy.deepcopy(entry[2])
+
+    def update(self, session_id: str, fields: Dict[str, Any]) -> bool:
+        with self._lock:
+            self._evict_idle()
+            entry = self._sessions.get(session_id)
+            if entry is None:
+                return False
+            self._put(session_id, dict(entry[2], **copy.deepcopy(fields)))
+            return True
+
+    def delete(self, session_id: str) -> None:
+        with self._lock:
+            entry = self._sessions.pop(session_id, None)
+            if entry is not None:
+                self._total_bytes -= entry[1]
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            self._evict_idle()
+            return {
+                'backend': 'memory',
+                'sessions': len(self._sessions),
+                'bytes': self._total_bytes,
+                'max_bytes': self.max_bytes,
+                'idle_ttl': self.idle_ttl,
+                'evictions': dict(self._evictions),
+            }
+
+    def _put(self, session_id: str, data: Dict[str, Any]) -> None:
+        """Store a session as the most recently used one. Must hold the lock."""
+        previous = self._sessions.pop(session_id, None)
+        if previous is not None:
+            self._total_bytes -= previous[1]
+        size = session_size(data)
+        self._sessions[session_id] = (time.time(), size, data)
+        self._total_bytes += size
+        self._evict_idle()
+        # Nunca se expulsa la sesión que se acaba de escribir
+        while self._total_bytes > self.max_bytes and len(self._sessions) > 1:
+            _, (_, evicted_size, _) = self._sessions.popitem(last=False)
+            self._total_bytes -= evicted_size
+            self._evictions['memory'] += 1
+
+    def _evict_idle(self) -> None:
+        """Drop the sessions idle for longer than idle_ttl. Must hold the lock."""
+        deadline = time.time() - self.idle_ttl
+        while self._sessions:
+            session_id, (last_access, size, _) = next(iter(self._sessions.items()))
+            if last_access > deadline:
+                break
+            del self._sessions[session_id]
+            self._total_bytes -= size
+            self._evictions['idle'] += 1
+
+
+class SQLiteSessionStore(SessionStore):
+    """
+    Session store in a local SQLite file (WAL mode).
+
+    Several worker processes (e.g. gunicorn workers) on the same host can
+    share it, so every worker sees the same transcript and summary.
+    Eviction counters are per process.
+    """
+
+    def __init__(self, db_path: str, idle_ttl: float = 3600, max_bytes: int = 256 * 1024 * 1024,
+                 sweep_interval: float = 30):
+        """
+        Initialize the store.
+
+        Args:
+            db_path: Path of the SQLite file (created if needed)
+            idle_ttl: Seconds without access after which a session expires
+            max_bytes: Maximum total size of the stored sessions
+            sweep_interval: Minimum seconds between two eviction sweeps of this process
+        """
+        super().__init__(idle_ttl, max_bytes)
+        self.db_path = db_path
+        self.sweep_interval = sweep_interval
+        self._local = threading.local()
+        self._last_sweep = 0.0
+        self._sweep_lock = threading.Lock()
+        db = self._db()
+        db.execute(
+            'CREATE TABLE IF NOT EXISTS sessions ('
+            'id TEXT PRIMARY KEY, data TEXT NOT NULL, size INTEGER NOT NULL, last_access REAL NOT NULL)'
+        )
+        db.execute('CREATE INDEX IF NOT EXISTS sessions_last_access ON sessions (last_access)')
+        db.commit()
+
+    def create(self, session_id: str, data: Dict[str, Any]) -> None:
+        encoded = json.dumps(data, ensure_ascii=False)
+        db = self._db()
+        with db:
+            db.execute(
+                'INSERT OR REPLACE INTO sessions (id, data, size, last_access) VALUES (?, ?, ?, ?)',
+                (session_id, encoded, len(encoded.encode('utf-8')), time.time())
+            )
+        self._maybe_sweep()
+
+    def get(self, session_id: str) -> Optional[Dict[str, Any]]:
+        now = time.time()
+        db = self._db()
+        with db:
+            row = db.execute(
+                'SELECT data FROM sessions WHERE id = ? AND last_access > ?',
+                (session_id, now - self.idle_ttl)
+            ).fetchone()
+            if row is None:
+                return None
+            db.execute('UPDATE sessions SET last_access = ? WHERE id = ?', (now, session_id))
+        return json.loads(row[0])
+
+    def update(self, session_id: str, fields: Dict[str, Any]) -> bool:
+        now = time.time()
+        db = self._db()
+        with db:
+            # BEGIN IMMEDIATE serializa la lectura-modificación-escritura entre procesos
+            db.execute('BEGIN IMMEDIATE')
+            row = db.execute(
+                'SELECT data FROM sessions WHERE id = ? AND last_access > ?',
+                (session_id, now - self.idle_ttl)
+            ).fetchone()
+            if row is None:
+                return False
+            encoded = json.dumps(dict(json.loads(row[0]), **fields), ensure_ascii=False)
+            db.execute(
+                'UPDATE sessions SET data = ?, size = ?, last_access = ? WHERE id = ?',
+                (encoded, len(encoded.encode('utf-8')), now, session_id)
+            )
+        self._maybe_sweep()
+        return True
+
+    def delete(self, session_id: str) -> None:
+        db = self._db()
+        with db:
+            db.execute('DELETE FROM sessions WHERE id = ?', (session_id,))
+
+    def get_stats(self) -> Dict[str, Any]:
+        count, total = self._db().execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM sessions').fetchone()
+        return {
+            'backend': 'sqlite',
+            'sessions': count,
+            'bytes': total,
+            'max_bytes': self.max_bytes,
+            'idle_ttl': self.idle_ttl,
+            'evictions': dict(self._evictions),
+        }
+
+    def _db(self) -> sqlite3.Connection:
+        """Return the connection of the current thread (sqlite3 connections are not shared)."""
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(self.db_path, timeout=10)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=NORMAL')
+            self._local.db = db
+        return db
+
+    def _maybe_sweep(self) -> None:
+        """Evict idle sessions and enforce max_bytes, at most once per sweep_interval."""
+        now = time.time()
+        with self._sweep_lock:
+            if now - self._last_sweep < self.sweep_interval:
+                return
+            self._last_sweep = now
+
+        db = self._db()
+        with db:
+            deleted = db.execute('DELETE FROM sessions WHERE last_access <= ?', (now - self.idle_ttl,)).rowcount
+            self._evictions['idle'] += max(deleted, 0)
+
+            total = db.execute('SELECT COALESCE(SUM(size), 0) FROM sessions').fetchone()[0]
+            if total <= self.max_bytes:
+                return
+            evicted = []
+            for session_id, size in db.execute('SELECT id, size FROM sessions ORDER BY last_access'):
+                if total <= self.max_bytes:
+                    break
+                evicted.append((session_id,))
+                total -= size
+            db.executemany('DELETE FROM sessions WHERE id = ?', evicted)
+            self._evictions['memory'] += len(evicted)
+
+
+def create_session_store(backend: str = 'memory', db_path: Optional[str] = None, idle_ttl: float = 3600,
+                         max_bytes: int = 256 * 1024 * 1024) -> SessionStore:
+    """
+    Build a session store.
+
+    Args:
+        backend: 'memory' (single process) or 'sqlite' (shared by the workers of a host)
+        db_path: SQLite file for the 'sqlite' backend
+        idle_ttl: Seconds without access after which a session expires
+        max_bytes: Maximum total size of the stored sessions
+
+    Raises:
+        ValueError: If the backend is unknown or db_path is missing
+    """
+    if backend == 'memory':
+        return InMemorySessionStore(idle_ttl, max_bytes)
+    if backend == 'sqlite':
+        if not db_path:
+            raise ValueError("The sqlite session store requires a db_path")
+        return SQLiteSessionStore(db_path, idle_ttl, max_bytes)
+    raise ValueError(f"Unknown session store backend: {backend}")
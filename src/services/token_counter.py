@@ -0,0 +1,125 @@
+import math
+import re
+from typing import Iterator, List
+
+try:
+    import tiktoken
+except ImportError:  # tiktoken es opcional: sin él se usa la estimación por caracteres
+    tiktoken = None
+
+
+# Aproximación habitual para modelos GPT: ~4 caracteres por token
+CHARS_PER_TOKEN = 4
+
+# Codificación de los modelos gpt-4 / gpt-4.1
+TIKTOKEN_ENCODING = "cl100k_base"
+
+# Cortes preferidos al dividir un texto largo: saltos de línea y finales de frase
+SENTENCE_BREAK = re.compile(r'\n+|(?<=[.!?…])\s+')
+
+_encoding = None
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Estimate the number of tokens in a text.
+    
+    Args:
+        text: The text to measure
+        
+    Returns:
+        Approximate token count (~4 characters per token)
+    """
+    if not text:
+        return 0
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def truncate_to_tokens(text: str, max_tokens: int, keep_end: bool = True) -> str:
+    """
+    Truncate a text so that it fits in approximately max_tokens tokens.
+    
+    Args:
+        text: The text to truncate
+        max_tokens: Maximum number of tokens to keep
+        keep_end: Keep the end of the text (most recent content) instead of the start
+        
+    Returns:
+        The truncated text
+    """
+    max_chars = max_tokens * CHARS_PER_TOKEN
+    if len(text) <= max_chars:
+        return text
+    return text[-max_chars:] if keep_end else text[:max_chars]
+
+
+def count_tokens(text: str) -> int:
+    """
+    Count the tokens of a text exactly when tiktoken is installed.
+    
+    Args:
+        text: The text to measure
+        
+    Returns:
+        Token count, or the character-based estimate without tiktoken
+    """
+    global _encoding
+    if not text:
+        return 0
+    if tiktoken is None:
+        return estimate_tokens(text)
+    if _encoding is None:
+        _encoding = tiktoken.get_encoding(TIKTOKEN_ENCODING)
+    return len(_encoding.encode(text))
+
+
+def split_by_tokens(text: str, max_tokens: int) -> List[str]:
+    """
+    Split a text into consecutive chunks of at most ~max_tokens tokens.
+    
+    Chunks break at line or sentence boundaries when possible; a sentence
+    longer than max_tokens is cut between words.
+    
+    Args:
+        text: The text to split
+        max_tokens: Maximum number of tokens of each chunk
+        
+    Returns:
+        The chunks, in order (empty for an empty text)
+    """
+    chunks: List[str] = []
+    current: List[str] = []
+    current_tokens = 0
+    for unit in _split_units(text, max_tokens):
+        tokens = count_tokens(unit)
+        if current and current_tokens + tokens > max_tokens:
+            chunks.append(' '.join(current))
+            current, current_tokens = [], 0
+        current.append(unit)
+        current_tokens += tokens
+    if current:
+        chunks.append(' '.join(current))
+    return chunks
+
+
+def _split_units(text: str, max_tokens: int) -> Iterator[str]:
+    """Yield the sentences of a text, cutting those longer than max_tokens between words."""
+    for sentence in SENTENCE_BREAK.split(text):
+        sentence = sentence.strip()
+        if not sentence:
+            continue
+        if count_tokens(sentence) <= max_tokens:
+            yield sentence
+            continue
+        words = sentence.split()
+        max_chars = max_tokens * CHARS_PER_TOKEN
+        piece: List[str] = []
+        length = 0
+        for word in words:
+            if piece and length + len(word) + 1 > max_chars:
+                yield ' '.join(piece)
+                piece, length = [], 0
+            piece.append(word)
+            length += len(word) + 1
+        if piece:
+            yield ' '.join(piece)
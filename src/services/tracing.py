@@ -0,0 +1,340 @@
+"""
+Lightweight per-request tracing and capture of slow requests.
+
+Every request gets a trace identified by a server-generated id (returned to
+the browser in the X-Request-ID header) holding a tree of timed spans: session
+decoding, context and prompt building, cache lookups, upstream admission,
+each model attempt and serialization. Code opens spans with span() or records
+finished ones with record_span(); both do nothing outside a traced request.
+
+While a request runs past the slow threshold, a watchdog thread samples its
+stack; a sampled fraction of requests is also run under cProfile. When a slow
+request finishes, its span tree, stack samples and profile are written to a
+local directory by that same thread, away from the request path.
+"""
+import asyncio
+import cProfile
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import Counter, OrderedDict, deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional
+
+# Identificadores de correlación aceptados del cliente (solo se guardan como atributo)
+TRACE_ID_PATTERN = re.compile(r'^[A-Za-z0-9._-]{1,64}$')
+
+# Máximo de muestras de pila por petición lenta
+MAX_STACK_SAMPLES = 200
+
+# Profundidad máxima de las pilas muestreadas
+MAX_STACK_DEPTH = 40
+
+# Span abierto en el contexto actual (petición HTTP o tarea)
+_current_span: ContextVar[Optional['Span']] = ContextVar('trace_span', default=None)
+
+
+class Span:
+    """A timed operation within a trace."""
+
+    __slots__ = ('name', 'start', 'end', 'attrs', 'children')
+
+    def __init__(self, name: str, start: float, attrs: Optional[Dict[str, Any]] = None):
+        self.name = name
+        self.start = start
+        self.end: Optional[float] = None
+        self.attrs = attrs or {}
+        self.children: List['Span'] = []
+
+    def to_dict(self, origin: float) -> Dict[str, Any]:
+        """The span and its children, with times in milliseconds relative to origin."""
+        data = {
+            'name': self.name,
+            'start_ms': round((self.start - origin) * 1000, 1),
+            'duration_ms': round((self.end - self.start) * 1000, 1) if self.end is not None else None,
+        }
+        if self.attrs:
+            data['attrs'] = self.attrs
+        if self.children:
+            data['children'] = [child.to_dict(origin) for child in self.children]
+        return data
+
+
+class Trace:
+    """The span tree of a request, plus what the slow-request capture collected for it."""
+
+    def __init__(self, trace_id: str, name: str, started: float, thread_id: Optional[int], task, profiler,
+                 client_id: Optional[str] = None):
+        self.trace_id = trace_id
+        self.client_id = client_id
+        self.root = Span(name, started)
+        self.thread_id = thread_id
+        self.task = task
+        self.profiler = profiler
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self.status: Optional[int] = None
+
+    @property
+    def duration_ms(self) -> float:
+        return ((self.root.end or time.time()) - self.root.start) * 1000
+
+    def server_timing(self) -> str:
+        """The finished top-level spans in the Server-Timing header format (shown by the browser's dev tools)."""
+        parts = []
+        for index, child in enumerate(self.root.children):
+            if child.end is not None:
+                parts.append(f"{index}-{child.name};dur={(child.end - child.start) * 1000:.1f}")
+        return ', '.join(parts)
+
+    def to_dict(self) -> Dict[str, Any]:
+        data = {
+            'trace_id': self.trace_id,
+            'client_id': self.client_id,
+            'route': self.root.name,
+            'status': self.status,
+            'started_at': self.root.start,
+            'duration_ms': round(self.duration_ms, 1),
+            'spans': self.root.to_dict(self.root.start),
+        }
+        if self.stacks:
+            # Formato "collapsed" (funciones separadas por ';'), legible por las herramientas de flame graphs
+            data['stack_samples'] = {stack: count for stack, count in self.stacks.most_common()}
+        return data
+
+
+@contextmanager
+def span(name: str, **attrs):
+    """Time a block as a child span of the current one (does nothing outside a traced request)."""
+    parent = _current_span.get()
+    if parent is None or parent.end is not None:
+        # Fuera de una petición, o en una tarea que ha sobrevivido a la suya
+        yield None
+        return
+    child = Span(name, time.time(), attrs)
+    parent.children.append(child)
+    token = _current_span.set(child)
+    try:
+        yield child
+    finally:
+        child.end = time.time()
+        _current_span.reset(token)
+
+
+def record_span(name: str, started: float, duration: float, **attrs) -> None:
+    """Add an already finished operation (e.g. one run on another thread) as a child of the current span."""
+    parent = _current_span.get()
+    if parent is not None and parent.end is None:
+        child = Span(name, started, attrs)
+        child.end = started + duration
+        parent.children.append(child)
+
+
+class Tracer:
+    """
+    Starts and finishes the request traces and captures the slow ones.
+
+    The last traces are kept in memory to be looked up by trace id.
+    Slow ones are written as <trace_id>.json (span tree and stack samples)
+    and, when the request was profiled, <trace_id>.prof (open it with pstats
+    or snakeviz), keeping at most max_files of each in the directory.
+    """
+
+    def __init__(self, slow_ms: float = 1000.0, profile_dir: Optional[str] = 'profiles', profile_rate: float = 0.0,
+                 sample_interval: float = 0.05, keep: int = 500, max_files: int = 200):
+        """
+        Initialize the tracer.
+
+        Args:
+            slow_ms: Latency from which a request is slow and captured
+            profile_dir: Directory of the captures of slow requests (None to keep them only in memory)
+            profile_rate: Fraction of requests run under cProfile (thread-based servers only)
+            sample_interval: Seconds between two stack samples of a running slow request
+            keep: Recent traces kept in memory
+            max_files: Slow requests whose captures are kept in profile_dir
+        """
+        self.slow_ms = slow_ms
+        self.profile_dir = profile_dir
+        self.profile_rate = profile_rate
+        self.sample_interval = sample_interval
+        self.max_files = max_files
+        self._recent: 'OrderedDict[str, Trace]' = OrderedDict()
+        self._keep = keep
+        self._active: Dict[int, Trace] = {}
+        self._writes: deque = deque()
+        self._written: deque = deque()
+        self._lock = threading.Lock()
+        self._watchdog: Optional[threading.Thread] = None
+        self._stats = {'traces': 0, 'slow': 0, 'profiled': 0, 'written': 0}
+        self._recent_slow: deque = deque(maxlen=50)
+
+    def start(self, name: str, client_id: Optional[str] = None, started: Optional[float] = None) -> Trace:
+        """
+        Start the trace of the current request and make its root span current.
+
+        The trace id is always generated here: an id chosen by the client could
+        collide with (and replace) another request's trace or name the files of
+        the slow-request capture. The client's own id is kept as client_id.
+
+        Args:
+            name: Route of the request
+            client_id: Correlation id sent by the client (ignored if malformed)
+            started: Start time, if the request began before the trace (e.g. session decoding)
+        """
+        if client_id and not TRACE_ID_PATTERN.match(client_id):
+            client_id = None
+        try:
+            task, thread_id = asyncio.current_task(), None
+        except RuntimeError:
+            task, thread_id = None, threading.get_ident()
+
+        profiler = None
+        if task is None and self.profile_rate and random.random() < self.profile_rate:
+            profiler = cProfile.Profile()
+            try:
+                profiler.enable()
+            except ValueError:
+                # Otro perfilador ya está activo en este hilo
+                profiler = None
+
+        trace = Trace(uuid.uuid4().hex, name, started or time.time(), thread_id, task, profiler, client_id)
+        _current_span.set(trace.root)
+        with self._lock:
+            self._active[id(trace)] = trace
+            if self._watchdog is None:
+                self._watchdog = threading.Thread(target=self._watch, name='trace-watchdog', daemon=True)
+                self._watchdog.start()
+        return trace
+
+    def finish(self, trace: Trace, status: Optional[int] = None) -> float:
+        """Finish a trace, queueing its capture if it was slow. Returns its duration in milliseconds."""
+        if trace.root.end is not None:
+            return trace.duration_ms
+        trace.root.end = time.time()
+        trace.status = status
+        if trace.profiler is not None:
+            trace.profiler.disable()
+        if _current_span.get() is trace.root:
+            _current_span.set(None)
+
+        duration = trace.duration_ms
+        slow = duration >= self.slow_ms
+        with self._lock:
+            self._active.pop(id(trace), None)
+            self._stats['traces'] += 1
+            self._stats['profiled'] += 1 if trace.profiler is not None else 0
+            self._recent[trace.trace_id] = trace
+            if len(self._recent) > self._keep:
+                self._recent.popitem(last=False)
+            if slow:
+                self._stats['slow'] += 1
+                self._recent_slow.append({'trace_id': trace.trace_id, 'route': trace.root.name,
+                                          'duration_ms': round(duration, 1), 'at': trace.root.start})
+                self._writes.append(trace)
+        if not slow:
+            # Solo se conservan los perfiles de las peticiones lentas
+            trace.profiler = None
+        return duration
+
+    def get(self, trace_id: str) -> Optional[Dict[str, Any]]:
+        """The span tree of a recent request, by trace id."""
+        with self._lock:
+            trace = self._recent.get(trace_id)
+        return trace.to_dict() if trace is not None else None
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Return the traced, slow, profiled and written requests and the latest slow ones."""
+        with self._lock:
+            return dict(
+                self._stats,
+                active=len(self._active),
+                slow_ms=self.slow_ms,
+                profile_dir=self.profile_dir,
+                recent_slow=list(self._recent_slow),
+            )
+
+    def _watch(self) -> None:
+        while True:
+            time.sleep(self.sample_interval)
+            now = time.time()
+            with self._lock:
+                running = [trace for trace in self._active.values()
+                           if (now - trace.root.start) * 1000 >= self.slow_ms and trace.samples < MAX_STACK_SAMPLES]
+                writes = list(self._writes)
+                self._writes.clear()
+            if running:
+                frames = sys._current_frames()
+                for trace in running:
+                    self._sample(trace, frames)
+            for trace in writes:
+                self._write(trace)
+
+    @staticmethod
+    def _sample(trace: Trace, frames: Dict[int, Any]) -> None:
+        """Add a sample of the stack where a running request currently is."""
+        try:
+            if trace.task is not None:
+                stack = _await_chain(trace.task)
+            else:
+                frame = frames.get(trace.thread_id)
+                stack = []
+                while frame is not None and len(stack) < MAX_STACK_DEPTH:
+                    stack.append(frame)
+                    frame = frame.f_back
+                stack.reverse()
+        except Exception:
+            # La pila puede cambiar mientras se recorre
+            return
+        if stack:
+            trace.stacks[';'.join(_frame_label(frame) for frame in stack)] += 1
+            trace.samples += 1
+
+    def _write(self, trace: Trace) -> None:
+        """Write the capture of a slow request, removing the oldest ones beyond max_files."""
+        if not self.profile_dir:
+            return
+        try:
+            os.makedirs(self.profile_dir, exist_ok=True)
+            path = os.path.join(self.profile_dir, trace.trace_id)
+            with open(path + '.json', 'w', encoding='utf-8') as f:
+                json.dump(trace.to_dict(), f, ensure_ascii=False, indent=1, default=str)
+            if trace.profiler is not None:
+                trace.profiler.dump_stats(path + '.prof')
+                trace.profiler = None
+        except OSError as e:
+            print(f"Error al guardar la traza {trace.trace_id}: {e}")
+            return
+        self._written.append(path)
+        with self._lock:
+            self._stats['written'] += 1
+        while len(self._written) > self.max_files:
+            old = self._written.popleft()
+            for suffix in ('.json', '.prof'):
+                try:
+                    os.remove(old + suffix)
+                except OSError:
+                    pass
+
+
+def _await_chain(task) -> List[Any]:
+    """Frames of the coroutines a task is awaiting, outermost first."""
+    stack = []
+    coro = task.get_coro()
+    while coro is not None and len(stack) < MAX_STACK_DEPTH:
+        frame = getattr(coro, 'cr_frame', None) or getattr(coro, 'gi_frame', None) or getattr(coro, 'ag_frame', None)
+        if frame is None:
+            break
+        stack.append(frame)
+        coro = getattr(coro, 'cr_await', None) or getattr(coro, 'gi_yieldfrom', None) or getattr(coro, 'ag_await', None)
+    return stack
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})"
@@ -0,0 +1,382 @@
+import bisect
+import mmap
+import os
+import struct
+import threading
+import time
+from collections import OrderedDict
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+# Cabecera de cada registro: magia, longitud del id de sesión, seq, timestamp, longitud del texto
+RECORD_HEADER = struct.Struct('<4sHIdI')
+RECORD_MAGIC = b'TSG1'
+LOG_FILE_FORMAT = 'transcript-%Y%m%d.log'
+
+
+class TranscriptLog:
+    """
+    Append-only log of finalized transcript segments, one file per day.
+
+    Each record is a fixed binary header followed by the UTF-8 session id and
+    segment text, written with a single O_APPEND write so that several worker
+    processes can share the files. Files are read back through mmap: only the
+    headers are parsed while scanning, and only the text of the requested
+    session is decoded.
+    """
+
+    def __init__(self, directory: str):
+        """
+        Initialize the log.
+
+        Args:
+            directory: Directory of the daily log files (created if needed)
+        """
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def append(self, session_id: str, segments: List[Tuple[int, str]], timestamp: Optional[float] = None) -> None:
+        """
+        Append segments of a session to today's log file.
+
+        Args:
+            session_id: The conversation session
+            segments: List of (seq, text) pairs
+            timestamp: Time of the segments; defaults to now
+        """
+        if not segments:
+            return
+        timestamp = timestamp or time.time()
+        sid = session_id.encode('utf-8')
+        records = []
+        for seq, text in segments:
+            body = text.encode('utf-8')
+            records.append(RECORD_HEADER.pack(RECORD_MAGIC, len(sid), seq, timestamp, len(body)) + sid + body)
+
+        path = self._path(datetime.fromtimestamp(timestamp).date())
+        fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o640)
+        try:
+            os.write(fd, b''.join(records))
+        finally:
+            os.close(fd)
+
+    def iter_records(self, day: date, session_id: Optional[str] = None) -> Iterator[Tuple[str, int, float, bytes]]:
+        """
+        Iterate over the records of one day without loading the file in memory.
+
+        Args:
+            day: The day to read
+            session_id: Only yield records of this session
+
+        Yields:
+            Tuples (session_id, seq, timestamp, text) where text is the UTF-8
+            encoded segment; only the records yielded are copied out of the map
+        """
+        path = self._path(day)
+        if not os.path.exists(path) or os.path.getsize(path) == 0:
+            return
+        wanted = session_id.encode('utf-8') if session_id is not None else None
+
+        with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            offset = 0
+            size = len(mapped)
+            while offset + RECORD_HEADER.size <= size:
+                magic, sid_len, seq, timestamp, text_len = RECORD_HEADER.unpack_from(mapped, offset)
+                start = offset + RECORD_HEADER.size
+                end = start + sid_len + text_len
+                if magic != RECORD_MAGIC or end > size:
+                    # Registro truncado (escritura en curso) o fichero corrupto
+                    break
+                sid = mapped[start:start + sid_len]
+                if wanted is None or sid == wanted:
+                    yield sid.decode('utf-8'), seq, timestamp, mapped[start + sid_len:end]
+                offset = end
+
+    def read_segments(self, session_id: str, since: Optional[float] = None) -> List[Tuple[int, str]]:
+        """
+        Read back the segments of a session, ordered by seq.
+
+        Args:
+            session_id: The conversation session
+            since: Ignore segments written before this timestamp (e.g. before a reset);
+                defaults to today's file only
+
+        Returns:
+            List of (seq, text) pairs; the latest copy of a repeated seq wins
+        """
+        first_day = datetime.fromtimestamp(since).date() if since else date.today()
+        segments: Dict[int, str] = {}
+        day = first_day
+        while day <= date.today():
+            for _, seq, timestamp, text in self.iter_records(day, session_id):
+                if since is None or timestamp >= since:
+                    segments[seq] = text.decode('utf-8')
+            day += timedelta(days=1)
+        return sorted(segments.items())
+
+    def read_day(self, day: date) -> Dict[str, List[Tuple[int, str]]]:
+        """
+        Read back every session logged on a day in a single pass.
+
+        Returns:
+            Dict session_id -> list of (seq, text) pairs ordered by seq; the
+            latest copy of a repeated seq wins
+        """
+        sessions: Dict[str, Dict[int, str]] = {}
+        for session_id, seq, _, text in self.iter_records(day):
+            sessions.setdefault(session_id, {})[seq] = text.decode('utf-8')
+        return {session_id: sorted(segments.items()) for session_id, segments in sessions.items()}
+
+    def _path(self, day: date) -> str:
+        """Path of the log file of a day."""
+        return os.path.join(self.directory, day.strftime(LOG_FILE_FORMAT))
+
+
+class TranscriptSegments:
+    """
+    Finalized transcript segments of the active sessions, kept in memory.
+
+    Segments are identified by their sequence number: repeated ones are
+    ignored (so clients can retry) and out-of-order ones are inserted in
+    place. Only the most recently used sessions are kept; the others can be
+    reloaded from the TranscriptLog.
+    """
+
+    def __init__(self, max_sessions: int = 1000):
+        """
+        Initialize the segment lists.
+
+        Args:
+            max_sessions: Maximum number of sessions kept in memory (LRU eviction)
+        """
+        self.max_sessions = max_sessions
+        self._sessions: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def append(self, session_id: str, segments: List[Tuple[int, str]], since: Optional[float] = None) -> Dict[str, Any]:
+        """
+        Add segments to a session.
+
+        Args:
+            session_id: The conversation session
+            segments: List of (seq, text) pairs
+            since: Start of the transcript the segments belong to (see since())
+
+        Returns:
+            Dictionary with the 'accepted' (seq, text) pairs, the 'duplicates'
+            seqs, the highest seq received ('last_seq') and the first missing
+            seq ('next_seq') so the client can resend gaps
+        """
+        with self._lock:
+            state = self._state(session_id)
+            if since is not None:
+                state['since'] = since
+            accepted, duplicates = [], []
+            for seq, text in segments:
+                if seq in state['seqs']:
+                    duplicates.append(seq)
+                    continue
+                index = bisect.bisect(state['order'], seq)
+                state['order'].insert(index, seq)
+                state['texts'].insert(index, text)
+                state['seqs'].add(seq)
+                accepted.append((seq, text))
+            if accepted:
+                state['text'] = None
+                while state['next_seq'] in state['seqs']:
+                    state['next_seq'] += 1
+            return {
+                'accepted': accepted,
+                'duplicates': duplicates,
+                'last_seq': state['order'][-1] if state['order'] else None,
+                'next_seq': state['next_seq'],
+            }
+
+    def load(self, session_id: str, segments: List[Tuple[int, str]], since: Optional[float] = None) -> None:
+        """Replace the segments of a session (e.g. with those read back from the log)."""
+        with self._lock:
+            self._sessions.pop(session_id, None)
+        self.append(session_id, segments, since)
+
+    def discard(self, session_id: str) -> None:
+        """Forget the segments of a session."""
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def last_seq(self, session_id: str) -> Optional[int]:
+        """Highest seq received for a session, or None if it is not in memory."""
+        with self._lock:
+            state = self._sessions.get(session_id)
+            return state['order'][-1] if state and state['order'] else None
+
+    def since(self, session_id: str) -> Optional[float]:
+        """Start of the transcript the session's segments in memory belong to, or None if unknown."""
+        with self._lock:
+            state = self._sessions.get(session_id)
+            return state['since'] if state else None
+
+    def text(self, session_id: str) -> str:
+        """Return the transcript of a session (segments joined in seq order)."""
+        with self._lock:
+            state = self._sessions.get(session_id)
+            if state is None:
+                return ''
+            self._sessions.move_to_end(session_id)
+            if state['text'] is None:
+                state['text'] = ' '.join(state['texts'])
+            return state['text']
+
+    def _state(self, session_id: str) -> Dict[str, Any]:
+        """Return (creating if needed) the state of a session. Must hold the lock."""
+        state = self._sessions.get(session_id)
+        if state is None:
+            state = {'order': [], 'texts': [], 'seqs': set(), 'next_seq': 0, 'text': '', 'since': None}
+            self._sessions[session_id] = state
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+        self._sessions.move_to_end(session_id)
+        return state
+
+
+def parse_segments(raw: Any) -> Optional[List[Tuple[int, str]]]:
+    """
+    Validate the segments of an append request.
+
+    Args:
+        raw: The decoded JSON value, expected to be a list of {seq, text} objects
+
+    Returns:
+        List of (seq, text) pairs, or None if the value is not valid
+    """
+    if not isinstance(raw, list):
+        return None
+    segments = []
+    for item in raw:
+        if not isinstance(item, dict):
+            return None
+        seq, text = item.get('seq'), item.get('text')
+        if isinstance(seq, bool) or not isinstance(seq, int) or not 0 <= seq < 2 ** 32 or not isinstance(text, str):
+            return None
+        segments.append((seq, text.strip()))
+    return segments
+
+
+class SessionTranscripts:
+    """
+    Transcript of each conversation session, built from appended segments.
+
+    Ties the session store (which records the highest seq and the start of the
+    current transcript, shared by all workers), the in-memory segment lists of
+    this process and the on-disk log together. A process whose segment list is
+    missing or behind the session store reloads it from the log. With an event
+    bus, every change is published as a 'transcript' event; with a call search
+    index, it is queued for indexing.
+    """
+
+    def __init__(self, session_store, segments: TranscriptSegments, log: TranscriptLog, events=None,
+                 search_index=None):
+        """
+        Initialize the transcripts.
+
+        Args:
+            session_store: The SessionStore holding the conversation sessions
+            segments: In-memory segment lists
+            log: Append-only log of the segments
+            events: Optional SessionEventBus to publish the changes to
+            search_index: Optional CallSearchIndex to index the finalized segments in
+        """
+        self.session_store = session_store
+        self.segments = segments
+        self.log = log
+        self.events = events
+        self.search_index = search_index
+
+    def append(self, session_id: str, segments: List[Tuple[int, str]], reset: bool = False) -> Optional[Dict[str, Any]]:
+        """
+        Append finalized segments to a session.
+
+        Args:
+            session_id: The conversation session
+            segments: List of (seq, text) pairs
+            reset: Start a new transcript (previous segments no longer count)
+
+        Returns:
+            The result of TranscriptSegments.append, or None if the session does not exist
+        """
+        session_data = self.session_store.get(session_id) if session_id else None
+        if session_data is None:
+            return None
+
+        fields = {}
+        if reset or 'segments_since' not in session_data:
+            self.segments.discard(session_id)
+            since = fields['segments_since'] = time.time()
+        else:
+            since = session_data['segments_since']
+            self._sync(session_id, session_data)
+
+        result = self.segments.append(session_id, segments, since)
+        self.log.append(session_id, result['accepted'])
+        fields['last_seq'] = result['last_seq']
+        self.session_store.update(session_id, fields)
+        if self.events and (result['accepted'] or reset):
+            self.events.publish(session_id, 'transcript', {
+                'segments': [{'seq': seq, 'text': text} for seq, text in result['accepted']],
+                'reset': reset,
+            })
+        if self.search_index:
+            if reset:
+                self.search_index.replace_transcript(session_id, '')
+            self.search_index.add_segments(session_id, [text for _, text in result['accepted']])
+        return result
+
+    def append_texts(self, session_id: str, texts: List[str]) -> Optional[Dict[str, Any]]:
+        """
+        Append segments numbered by the server, after the highest seq of the session
+        (e.g. segments recognized from the session's audio).
+
+        Returns:
+            The result of TranscriptSegments.append, or None if the session does not exist
+        """
+        session_data = self.session_store.get(session_id) if session_id else None
+        if session_data is None:
+            return None
+        last_seq = session_data.get('last_seq')
+        first_seq = last_seq + 1 if last_seq is not None else 0
+        return self.append(session_id, list(enumerate(texts, first_seq)))
+
+    def replace(self, session_id: str, text: str) -> bool:
+        """
+        Replace the whole transcript of a session (legacy full-text updates).
+
+        Returns:
+            False if the session does not exist
+        """
+        fields = {'transcript': text, 'last_seq': None, 'segments_since': time.time()}
+        if not session_id or not self.session_store.update(session_id, fields):
+            return False
+        self.segments.discard(session_id)
+        if self.events:
+            self.events.publish(session_id, 'transcript', {'text': text, 'reset': True})
+        if self.search_index:
+            self.search_index.replace_transcript(session_id, text)
+        return True
+
+    def text(self, session_id: str) -> str:
+        """Return the transcript of a session, preferring its appended segments."""
+        session_data = self.session_store.get(session_id) if session_id else None
+        if not session_data:
+            return ''
+        if session_data.get('last_seq') is None:
+            return session_data.get('transcript', '')
+        self._sync(session_id, session_data)
+        return self.segments.text(session_id)
+
+    def _sync(self, session_id: str, session_data: Dict[str, Any]) -> None:
+        """Reload the session's segments from the log if this process's copy is missing or stale."""
+        last_seq = session_data.get('last_seq')
+        local_seq = self.segments.last_seq(session_id)
+        since = session_data.get('segments_since')
+        if last_seq is not None and (local_seq is None or local_seq < last_seq or self.segments.since(session_id) != since):
+            # Expulsados de memoria, recibidos por otro worker o de una transcripción que otro worker reinició
+            self.segments.load(session_id, self.log.read_segments(session_id, since), since)
@@ -0,0 +1,324 @@
+"""
+Central admission of the requests to the model API.
+
+Every completion request is admitted here before reaching the API. Two token
+buckets pace the account's requests per minute and tokens per minute. When
+they run short, the waiting requests are admitted by priority class
+(questions, then live suggestions, then summaries, then background work such
+as sentiment), and within a class the sessions take turns. Lower classes may
+not drain the buckets below a reserve kept for the classes above, and are
+shed if they wait too long. A 429 from the API pauses every admission and the
+request is retried with jittered exponential backoff.
+"""
+import asyncio
+import itertools
+import random
+import threading
+import time
+from collections import OrderedDict
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from openai.error import RateLimitError
+
+from services.model_router import RequestNotSentError
+from services.tracing import span
+
+# Clases de prioridad, de más a menos urgente
+QUESTION, LIVE, SUMMARY, BACKGROUND = range(4)
+CLASS_NAMES = ('question', 'live', 'summary', 'background')
+
+# Clase de cada prompt (los no listados van como LIVE)
+PROMPT_PRIORITIES = {
+    'question': QUESTION,
+    'question_grounded': QUESTION,
+    'suggestions': LIVE,
+    'analysis': LIVE,
+    'digest': LIVE,
+    'summary': SUMMARY,
+    'summary_chunk': SUMMARY,
+    'summary_reduce': SUMMARY,
+    'summary_section': SUMMARY,
+    'summary_start': BACKGROUND,
+    'summary_update': BACKGROUND,
+    'sentiment': BACKGROUND,
+}
+
+# Fracción de cada cubo que una clase no puede consumir (queda para las clases superiores)
+CLASS_RESERVE = {QUESTION: 0.0, LIVE: 0.1, SUMMARY: 0.25, BACKGROUND: 0.4}
+
+# Espera máxima en cola de cada clase antes de descartar la petición (segundos)
+CLASS_MAX_WAIT = {QUESTION: 30.0, LIVE: 10.0, SUMMARY: 60.0, BACKGROUND: 5.0}
+
+# Sesiones recordadas para repartir los turnos
+MAX_TRACKED_SESSIONS = 10000
+
+# Sesión a la que se atribuyen las peticiones del contexto actual (petición HTTP o tarea)
+current_session: ContextVar[Optional[str]] = ContextVar('upstream_session', default=None)
+
+
+def prompt_priority(prompt_name: str) -> int:
+    """Priority class of the requests of a prompt."""
+    return PROMPT_PRIORITIES.get(prompt_name, LIVE)
+
+
+class UpstreamOverloadedError(RequestNotSentError):
+    """The request waited longer than its class allows and was not sent."""
+    pass
+
+
+class TokenBucket:
+    """Bucket refilled continuously at per_minute units per minute, holding at most one minute's worth."""
+
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.rate = self.capacity / 60
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def delay(self, amount: float, reserve: float, now: float) -> float:
+        """Seconds until amount can be taken leaving reserve (a fraction of the capacity) in the bucket."""
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+        # Una petición mayor que lo que la clase puede usar pasa cuando el cubo está lleno
+        amount = min(amount, self.capacity * (1 - reserve))
+        return max(0.0, amount + reserve * self.capacity - self.level) / self.rate
+
+    def take(self, amount: float) -> None:
+        # El nivel puede quedar negativo: la deuda retrasa las peticiones siguientes
+        self.level -= amount
+
+    def give_back(self, amount: float) -> None:
+        self.level = min(self.capacity, self.level + amount)
+
+
+class _Waiter:
+    __slots__ = ('priority', 'session_id', 'tokens', 'seq', 'enqueued', 'event', 'admitted')
+
+    def __init__(self, priority: int, session_id: Optional[str], tokens: int, seq: int, event):
+        self.priority = priority
+        self.session_id = session_id
+        self.tokens = tokens
+        self.seq = seq
+        self.enqueued = time.monotonic()
+        self.event = event
+        self.admitted = False
+
+
+class UpstreamScheduler:
+    """
+    Admits the upstream requests of the process within the account's rate limits.
+
+    acquire()/aacquire() wait for admission (raising UpstreamOverloadedError
+    when the request is shed) and call()/acall() run the request retrying
+    429s. Without rpm and tpm every request is admitted at once and only the
+    429 backoff applies. Use the sync or the async methods, not both on the
+    same instance.
+    """
+
+    def __init__(self, rpm: Optional[float] = None, tpm: Optional[float] = None, max_retries: int = 3,
+                 backoff: float = 1.0, max_backoff: float = 30.0, max_wait: Optional[Dict[int, float]] = None):
+        """
+        Initialize the scheduler.
+
+        Args:
+            rpm: Requests per minute of the account (no limit by default)
+            tpm: Tokens per minute of the account (no limit by default)
+            max_retries: Retries of a request answered with a 429
+            backoff: Delay in seconds of the first retry (doubled after each one)
+            max_backoff: Maximum delay of a retry
+            max_wait: Maximum queueing time per priority class, overriding CLASS_MAX_WAIT
+        """
+        self._requests = TokenBucket(rpm) if rpm else None
+        self._tokens = TokenBucket(tpm) if tpm else None
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.max_wait = {**CLASS_MAX_WAIT, **(max_wait or {})}
+        self._lock = threading.Lock()
+        self._waiting: List[_Waiter] = []
+        self._seq = itertools.count()
+        self._turns = itertools.count()
+        self._last_turn: 'OrderedDict[Optional[str], int]' = OrderedDict()
+        self._paused_until = 0.0
+        self._stats = {name: {'admitted': 0, 'shed': 0, 'wait_ms': 0.0} for name in CLASS_NAMES}
+        self._throttled = 0
+
+    def acquire(self, priority: int, tokens: int = 0, session_id: Optional[str] = None) -> None:
+        """
+        Wait until a request is admitted.
+
+        Args:
+            priority: Priority class (QUESTION, LIVE, SUMMARY or BACKGROUND)
+            tokens: Tokens the request may use (prompt plus max_tokens)
+            session_id: Session the request belongs to
+
+        Raises:
+            UpstreamOverloadedError: If the request waited longer than its class allows
+        """
+        waiter = self._enqueue(priority, tokens, session_id, threading.Event())
+        with span('admission', priority=CLASS_NAMES[priority]):
+            while True:
+                timeout = self._poll(waiter)
+                if timeout is None:
+                    return
+                waiter.event.wait(timeout)
+
+    async def aacquire(self, priority: int, tokens: int = 0, session_id: Optional[str] = None) -> None:
+        """Async version of acquire."""
+        waiter = self._enqueue(priority, tokens, session_id, asyncio.Event())
+        with span('admission', priority=CLASS_NAMES[priority]):
+            try:
+                while True:
+                    timeout = self._poll(waiter)
+                    if timeout is None:
+                        return
+                    try:
+                        await asyncio.wait_for(waiter.event.wait(), timeout)
+                    except asyncio.TimeoutError:
+                        pass
+            except asyncio.CancelledError:
+                # Una petición cancelada en la cola (p. ej. la perdedora de una cobertura) no debe gastar cupo
+                self._withdraw(waiter)
+                raise
+
+    def call(self, fn: Callable[[], Any]) -> Any:
+        """Run an upstream call, retrying it with jittered exponential backoff while the API answers 429."""
+        for attempt in itertools.count():
+            try:
+                return fn()
+            except RateLimitError as e:
+                if attempt >= self.max_retries:
+                    raise
+                time.sleep(self._throttle(attempt, e))
+
+    async def acall(self, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """Async version of call."""
+        for attempt in itertools.count():
+            try:
+                return await fn()
+            except RateLimitError as e:
+                if attempt >= self.max_retries:
+                    raise
+                await asyncio.sleep(self._throttle(attempt, e))
+
+    def settle(self, reserved: int, used: Optional[int]) -> None:
+        """Return to the token bucket what an admitted request reserved but did not use."""
+        if self._tokens and used is not None:
+            with self._lock:
+                if used < reserved:
+                    self._tokens.give_back(reserved - used)
+                else:
+                    self._tokens.take(used - reserved)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Return admissions, sheds and mean queueing time per class, the 429s and the bucket levels."""
+        with self._lock:
+            now = time.monotonic()
+            classes = {}
+            for priority, name in enumerate(CLASS_NAMES):
+                stats = self._stats[name]
+                classes[name] = {
+                    'admitted': stats['admitted'],
+                    'shed': stats['shed'],
+                    'waiting': sum(1 for waiter in self._waiting if waiter.priority == priority),
+                    'mean_wait_ms': round(stats['wait_ms'] / stats['admitted'], 1) if stats['admitted'] else None,
+                }
+            return {
+                'classes': classes,
+                'throttled': self._throttled,
+                'paused_for_s': round(max(0.0, self._paused_until - now), 1),
+                'rpm': self._requests.capacity if self._requests else None,
+                'tpm': self._tokens.capacity if self._tokens else None,
+                'requests_available': int(self._requests.level) if self._requests else None,
+                'tokens_available': int(self._tokens.level) if self._tokens else None,
+            }
+
+    def _withdraw(self, waiter: _Waiter) -> None:
+        """Take a cancelled request out of the queue, or give back what its admission took."""
+        with self._lock:
+            if not waiter.admitted:
+                if waiter in self._waiting:
+                    self._waiting.remove(waiter)
+                return
+            if self._requests:
+                self._requests.give_back(1)
+            if self._tokens:
+                self._tokens.give_back(waiter.tokens)
+
+    def _enqueue(self, priority: int, tokens: int, session_id: Optional[str], event) -> _Waiter:
+        waiter = _Waiter(priority, session_id, tokens, next(self._seq), event)
+        with self._lock:
+            self._waiting.append(waiter)
+        return waiter
+
+    def _poll(self, waiter: _Waiter) -> Optional[float]:
+        """Admit every request that can go; None if waiter was admitted, else how long it should wait."""
+        with self._lock:
+            now = time.monotonic()
+            delay = self._dispatch(now)
+            if waiter.admitted:
+                return None
+            remaining = waiter.enqueued + self.max_wait[waiter.priority] - now
+            if remaining <= 0:
+                self._waiting.remove(waiter)
+                self._stats[CLASS_NAMES[waiter.priority]]['shed'] += 1
+                raise UpstreamOverloadedError(
+                    f"Límite de peticiones al modelo alcanzado: petición descartada tras "
+                    f"{self.max_wait[waiter.priority]:.0f}s en cola"
+                )
+            return min(delay, remaining)
+
+    def _dispatch(self, now: float) -> float:
+        """Admit waiting requests in order while the buckets allow; return the delay of the next one."""
+        while self._waiting:
+            # Por clase, después la sesión que lleva más tiempo sin turno y, dentro de ella, por orden de llegada
+            waiter = min(self._waiting, key=lambda w: (w.priority, self._last_turn.get(w.session_id, -1), w.seq))
+            delay = self._admission_delay(waiter, now)
+            if delay > 0:
+                return delay
+            self._admit(waiter, now)
+        return 0.0
+
+    def _admission_delay(self, waiter: _Waiter, now: float) -> float:
+        reserve = CLASS_RESERVE[waiter.priority]
+        delays = [self._paused_until - now]
+        if self._requests:
+            delays.append(self._requests.delay(1, reserve, now))
+        if self._tokens:
+            delays.append(self._tokens.delay(waiter.tokens, reserve, now))
+        return max(delays)
+
+    def _admit(self, waiter: _Waiter, now: float) -> None:
+        if self._requests:
+            self._requests.take(1)
+        if self._tokens:
+            self._tokens.take(waiter.tokens)
+        self._waiting.remove(waiter)
+        self._last_turn[waiter.session_id] = next(self._turns)
+        self._last_turn.move_to_end(waiter.session_id)
+        if len(self._last_turn) > MAX_TRACKED_SESSIONS:
+            self._last_turn.popitem(last=False)
+        stats = self._stats[CLASS_NAMES[waiter.priority]]
+        stats['admitted'] += 1
+        stats['wait_ms'] += (now - waiter.enqueued) * 1000
+        waiter.admitted = True
+        waiter.event.set()
+
+    def _throttle(self, attempt: int, error: RateLimitError) -> float:
+        """Pause every admission after a 429 and return the jittered delay before the retry."""
+        retry_after = _retry_after(error)
+        delay = retry_after or min(self.max_backoff, self.backoff * 2 ** attempt)
+        delay *= random.uniform(0.5, 1.5)
+        with self._lock:
+            self._throttled += 1
+            self._paused_until = max(self._paused_until, time.monotonic() + delay)
+        return delay
+
+
+def _retry_after(error: RateLimitError) -> Optional[float]:
+    """Seconds requested by the Retry-After header of a 429, if any."""
+    try:
+        return float((getattr(error, 'headers', None) or {}).get('retry-after'))
+    except (TypeError, ValueError):
+        return None
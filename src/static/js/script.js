@@ -4,7 +4,21 @@ let recognitionActive = false;
 let transcriptionText = '';
 let suggestionsDebounceTimer;
 let sentimentDebounceTimer;
+let suggestionsController = null; // Cancels the previous suggestions request
+let sentimentController = null; // Cancels the previous sentiment request
 let currentLanguage = 'es-ES'; // Default language
+let analysisController = null; // Cancels the previous combined analysis request
+let transcriptSeq = 0; // Sequence number of the next finalized segment
+let transcriptReset = true; // The next append starts a new transcript on the server
+let appendQueue = Promise.resolve(); // Keeps segment appends in order
+
+// Get suggestions and sentiment from a single LLM call instead of two
+const USE_COMBINED_ANALYSIS = true;
+
+// Persistent WebSocket channel to the server (HTTP requests are used while it is not open)
+const USE_SESSION_CHANNEL = true;
+let sessionChannel = null;
+let channelRetryDelay = 1000;
 
 // DOM elements for speech recognition
 const startButton = document.getElementById('startButton');
@@ -27,6 +41,7 @@ const questionLoadingSpinner = document.getElementById('questionLoadingSpinner')
 const analyzeSentimentBtn = document.getElementById('analyzeSentimentBtn');
 const sentimentAnalysis = document.getElementById('sentimentAnalysis');
 const sentimentLoadingSpinner = document.getElementById('sentimentLoadingSpinner');
+const sentimentMood = document.getElementById('sentimentMood');
 const generateSummaryBtn = document.getElementById('generateSummaryBtn');
 const callSummary = document.getElementById('callSummary');
 const summaryLoadingSpinner = document.getElementById('summaryLoadingSpinner');
@@ -90,14 +105,34 @@ function initSpeechRecognition() {
         if (result.isFinal) {
             transcriptionText += ' ' + transcript;
             liveTranscription.textContent = transcriptionText;
-            updateTranscript(transcriptionText);
-            getSuggestions(transcriptionText);
-            getStreamingSentimentAnalysis(transcriptionText);
+            // Over the session channel the server schedules the analysis itself
+            if (sendChannelSegment(transcript)) return;
+            
+            // Only the new segment is sent; the server keeps the rest of the transcript
+            const appended = appendTranscript(transcript);
+            if (USE_COMBINED_ANALYSIS) {
+                clearTimeout(suggestionsDebounceTimer);
+                appended.then(() => getLiveAnalysis(''));
+            } else {
+                getSuggestions(transcriptionText);
+                appended.then(() => getStreamingSentimentAnalysis(''));
+            }
         } else {
             // Show interim results in real-time
             const interimText = transcriptionText + ' ' + transcript;
             liveTranscription.textContent = interimText;
             
+            if (sendChannelMessage({ type: 'interim', text: transcript })) return;
+            
+            if (USE_COMBINED_ANALYSIS) {
+                // One debounced request fills both the suggestions and sentiment panels
+                clearTimeout(suggestionsDebounceTimer);
+                suggestionsDebounceTimer = setTimeout(() => {
+                    getLiveAnalysis(transcript);
+                }, 1000);
+                return;
+            }
+            
             // Debounce suggestions requests for interim results
             clearTimeout(suggestionsDebounceTimer);
             suggestionsDebounceTimer = setTimeout(() => {
@@ -107,7 +142,7 @@ function initSpeechRecognition() {
             // Debounce sentiment analysis for interim results
             clearTimeout(sentimentDebounceTimer);
             sentimentDebounceTimer = setTimeout(() => {
-                getStreamingSentimentAnalysis(interimText);
+                getStreamingSentimentAnalysis(transcript);
             }, 1500); // Slightly longer debounce for sentiment to avoid too many calls
         }
     };
@@ -127,6 +162,7 @@ function setupLanguageSelector() {
                 // Get the language code
                 const lang = this.getAttribute('data-lang');
                 currentLanguage = lang;
+                sendChannelMessage({ type: 'language', language: currentLanguage });
                 
                 // Update the button text
                 languageSelector.innerHTML = `<i class="bi bi-globe"></i> ${this.textContent}`;
@@ -178,9 +214,12 @@ function stopRecognition() {
 // Reset transcription and suggestions
 function resetAll() {
     transcriptionText = '';
+    transcriptSeq = 0;
+    transcriptReset = true;
     liveTranscription.textContent = 'La transcripción aparecerá aquí en tiempo real...';
     liveSuggestions.textContent = 'Las sugerencias aparecerán aquí mientras hablas...';
     sentimentAnalysis.textContent = 'El análisis de sentimiento aparecerá aquí...';
+    sentimentMood.className = 'badge ms-2 d-none';
     callSummary.textContent = 'El resumen de la llamada aparecerá aquí...';
     
     updateTranscript('');
@@ -205,6 +244,31 @@ function updateTranscript(text) {
     });
 }
 
+// Append a finalized segment to the server transcript (in order, one request at a time)
+function appendTranscript(text) {
+    const segment = { seq: transcriptSeq++, text: text };
+    const reset = transcriptReset;
+    transcriptReset = false;
+    
+    appendQueue = appendQueue.then(() => fetch('/append-transcript', {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json',
+        },
+        body: JSON.stringify({ segments: [segment], reset: reset })
+    })
+    .then(response => response.json())
+    .then(data => {
+        if (!data.success) {
+            console.error('Error appending transcript:', data.error);
+        }
+    })
+    .catch(error => {
+        console.error('Error appending transcript:', error);
+    }));
+    return appendQueue;
+}
+
 // Update UI based on recognition state
 function updateUI(isRecording) {
     if (isRecording) {
@@ -218,15 +282,71 @@ function updateUI(isRecording) {
     }
 }
 
-// Get suggestions from the server based on transcription
+// Read a Server-Sent-Events response and call onEvent for each parsed event.
+// Returns a promise that resolves with the final 'done' or 'error' event.
+function readEventStream(response, onEvent) {
+    const contentType = response.headers.get('Content-Type') || '';
+    if (!contentType.includes('text/event-stream')) {
+        // Errores de validación se devuelven como JSON normal
+        return response.json().then(data => {
+            const event = Object.assign({ type: data.success ? 'done' : 'error' }, data);
+            onEvent(event);
+            return event;
+        });
+    }
+    
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    let lastEvent = null;
+    
+    function processBuffer() {
+        let boundary = buffer.indexOf('\n\n');
+        while (boundary !== -1) {
+            const rawEvent = buffer.slice(0, boundary);
+            buffer = buffer.slice(boundary + 2);
+            const dataLines = rawEvent.split('\n')
+                .filter(line => line.startsWith('data:'))
+                .map(line => line.slice(5).trim());
+            if (dataLines.length) {
+                lastEvent = JSON.parse(dataLines.join('\n'));
+                onEvent(lastEvent);
+            }
+            boundary = buffer.indexOf('\n\n');
+        }
+    }
+    
+    function pump() {
+        return reader.read().then(({ done, value }) => {
+            if (done) {
+                processBuffer();
+                return lastEvent;
+            }
+            buffer += decoder.decode(value, { stream: true });
+            processBuffer();
+            return pump();
+        });
+    }
+    
+    return pump();
+}
+
+// Get suggestions from the server based on transcription (streamed token by token)
 function getSuggestions(text) {
     if (!text || text.trim() === '') return;
     
     // Show loading spinner
     loadingSpinner.classList.remove('d-none');
     
-    fetch('/get-suggestions', {
+    let suggestionsText = '';
+    
+    // Only the latest transcript matters: abort the request in flight
+    if (suggestionsController) suggestionsController.abort();
+    suggestionsController = new AbortController();
+    
+    fetch('/get-suggestions/stream', {
         method: 'POST',
+        signal: suggestionsController.signal,
         headers: {
             'Content-Type': 'application/json',
         },
@@ -235,26 +355,148 @@ function getSuggestions(text) {
             language: currentLanguage 
         })
     })
-    .then(response => response.json())
-    .then(data => {
-        // Hide loading spinner
-        loadingSpinner.classList.add('d-none');
-        
-        if (data.success) {
-            // Format the suggestions content
-            liveSuggestions.innerHTML = data.suggestions.replace(/\n/g, '<br>');
-        } else {
-            liveSuggestions.textContent = `Error: ${data.error || 'No se pudieron obtener sugerencias.'}`;
+    .then(response => readEventStream(response, event => {
+        if (event.type === 'token') {
+            // Hide loading spinner as soon as the first token arrives
+            loadingSpinner.classList.add('d-none');
+            suggestionsText += event.content;
+            liveSuggestions.innerHTML = suggestionsText.replace(/\n/g, '<br>');
+        } else if (event.type === 'done' && event.suggestions) {
+            liveSuggestions.innerHTML = event.suggestions.replace(/\n/g, '<br>');
+        } else if (event.type === 'error') {
+            liveSuggestions.textContent = `Error: ${event.error || 'No se pudieron obtener sugerencias.'}`;
         }
+    }))
+    .then(() => {
+        loadingSpinner.classList.add('d-none');
     })
     .catch(error => {
+        if (error.name === 'AbortError') return; // Superseded by a newer request
         console.error('Error getting suggestions:', error);
         loadingSpinner.classList.add('d-none');
         liveSuggestions.textContent = 'Error de conexión al obtener sugerencias.';
     });
 }
 
-// Get answer for a direct question
+// Get suggestions and sentiment analysis from a single combined request.
+// The server uses the segments already appended plus the interim (not yet final) text.
+function getLiveAnalysis(interim) {
+    if (transcriptionText.trim() === '' && (!interim || interim.trim() === '')) return;
+    
+    // Show loading spinners
+    loadingSpinner.classList.remove('d-none');
+    sentimentLoadingSpinner.classList.remove('d-none');
+    
+    // Only the latest transcript matters: abort the request in flight
+    if (analysisController) analysisController.abort();
+    analysisController = new AbortController();
+    
+    fetch('/analyze-conversation', {
+        method: 'POST',
+        signal: analysisController.signal,
+        headers: {
+            'Content-Type': 'application/json',
+        },
+        body: JSON.stringify({ 
+            interim: interim || '',
+            language: currentLanguage 
+        })
+    })
+    .then(response => response.json())
+    .then(data => {
+        // A newer request replaced this one on the server: keep the current panels
+        if (data.superseded) return;
+        showLiveAnalysis(data);
+    })
+    .catch(error => {
+        if (error.name === 'AbortError') return; // Superseded by a newer request
+        console.error('Error analyzing conversation:', error);
+        loadingSpinner.classList.add('d-none');
+        sentimentLoadingSpinner.classList.add('d-none');
+        liveSuggestions.textContent = 'Error de conexión al obtener sugerencias.';
+    });
+}
+
+// Show the result of a combined analysis in the suggestions and sentiment panels
+function showLiveAnalysis(data) {
+    // Hide loading spinners
+    loadingSpinner.classList.add('d-none');
+    sentimentLoadingSpinner.classList.add('d-none');
+    
+    if (data.success) {
+        if (data.suggestions) {
+            liveSuggestions.innerHTML = data.suggestions.replace(/\n/g, '<br>');
+        }
+        if (data.sentiment_analysis) {
+            sentimentAnalysis.textContent = data.sentiment_analysis;
+        }
+    } else {
+        console.error('Error analyzing conversation:', data.error);
+        liveSuggestions.textContent = `Error: ${data.error || 'No se pudieron obtener sugerencias.'}`;
+    }
+}
+
+// Open the WebSocket channel of the session, reconnecting with backoff
+function openSessionChannel() {
+    if (!USE_SESSION_CHANNEL || !('WebSocket' in window)) return;
+    
+    const protocol = window.location.protocol === 'https:' ? 'wss:' : 'ws:';
+    const channel = new WebSocket(`${protocol}//${window.location.host}/ws`);
+    
+    channel.onopen = function() {
+        sessionChannel = channel;
+        channelRetryDelay = 1000;
+        channel.send(JSON.stringify({ type: 'language', language: currentLanguage }));
+    };
+    
+    channel.onmessage = function(event) {
+        handleChannelMessage(JSON.parse(event.data));
+    };
+    
+    channel.onclose = function() {
+        const wasOpen = sessionChannel === channel;
+        if (wasOpen) sessionChannel = null;
+        // Stop retrying if the server never accepted the channel (e.g. no WebSocket support)
+        if (wasOpen || channelRetryDelay < 30000) {
+            setTimeout(openSessionChannel, channelRetryDelay);
+            channelRetryDelay = Math.min(channelRetryDelay * 2, 30000);
+        }
+    };
+}
+
+// Send a message over the session channel. Returns false if the channel is not open.
+function sendChannelMessage(message) {
+    if (!sessionChannel || sessionChannel.readyState !== WebSocket.OPEN) return false;
+    sessionChannel.send(JSON.stringify(message));
+    return true;
+}
+
+// Send a finalized segment over the session channel. Returns false if the channel is not open.
+function sendChannelSegment(text) {
+    const sent = sendChannelMessage({ type: 'segment', seq: transcriptSeq, text: text, reset: transcriptReset });
+    if (sent) {
+        transcriptSeq++;
+        transcriptReset = false;
+    }
+    return sent;
+}
+
+// Handle a message pushed by the server on the session channel
+function handleChannelMessage(data) {
+    switch (data.type) {
+        case 'analysis':
+            showLiveAnalysis(data);
+            break;
+        case 'summary':
+            showSummary(data);
+            break;
+        case 'error':
+            console.error('Session channel error:', data.error);
+            break;
+    }
+}
+
+// Get answer for a direct question (streamed token by token)
 function askQuestion(question) {
     if (!question || question.trim() === '') {
         assistantAnswer.textContent = 'Por favor, escribe una pregunta.';
@@ -267,27 +509,35 @@ function askQuestion(question) {
     // Disable form while processing
     questionInput.disabled = true;
     
-    fetch('/ask-question', {
+    let answerText = '';
+    
+    fetch('/ask-question/stream', {
         method: 'POST',
         headers: {
             'Content-Type': 'application/json',
         },
         body: JSON.stringify({ question: question })
     })
-    .then(response => response.json())
-    .then(data => {
+    .then(response => readEventStream(response, event => {
+        if (event.type === 'token') {
+            questionLoadingSpinner.classList.add('d-none');
+            answerText += event.content;
+            assistantAnswer.textContent = answerText;
+        } else if (event.type === 'done' && event.answer) {
+            assistantAnswer.textContent = event.answer;
+        } else if (event.type === 'error') {
+            console.error('Error getting answer:', event.error);
+            assistantAnswer.textContent = `Error: ${event.error}`;
+        }
+    }))
+    .then(lastEvent => {
         // Hide loading spinner and enable form
         questionLoadingSpinner.classList.add('d-none');
         questionInput.disabled = false;
         questionInput.focus();
         
-        if (data.success && data.answer) {
-            assistantAnswer.textContent = data.answer;
-        } else if (data.error) {
-            console.error('Error getting answer:', data.error);
-            assistantAnswer.textContent = `Error: ${data.error}`;
-        } else {
-            console.error('Unknown error getting answer:', data);
+        if (!lastEvent) {
+            console.error('Empty answer stream');
             assistantAnswer.textContent = 'No se pudo obtener una respuesta. Verifica la configuración de la API.';
         }
     })
@@ -302,25 +552,38 @@ function askQuestion(question) {
     });
 }
 
-// Get streaming sentiment analysis
-function getStreamingSentimentAnalysis(text) {
-    if (!text || text.trim() === '') return;
-    
+// Get sentiment analysis of the stored transcript plus the interim text.
+// The server estimates it locally and only asks the LLM when it changes (or when forced).
+function getStreamingSentimentAnalysis(interim, force = false) {
     // Show loading spinner
     sentimentLoadingSpinner.classList.remove('d-none');
     
+    // Only the latest transcript matters: abort the request in flight
+    if (sentimentController) sentimentController.abort();
+    sentimentController = new AbortController();
+    
     fetch('/analyze-sentiment', {
         method: 'POST',
+        signal: sentimentController.signal,
         headers: {
             'Content-Type': 'application/json',
         },
-        body: JSON.stringify({ text: text })
+        body: JSON.stringify({ 
+            interim: interim,
+            language: currentLanguage,
+            force: force
+        })
     })
     .then(response => response.json())
     .then(data => {
+        // A newer request replaced this one on the server: keep the current panel
+        if (data.superseded) return;
+        
         // Hide loading spinner
         sentimentLoadingSpinner.classList.add('d-none');
         
+        if (data.local_sentiment) showSentimentMood(data.local_sentiment);
+        
         if (data.success && data.sentiment_analysis) {
             sentimentAnalysis.textContent = data.sentiment_analysis;
         } else if (data.error) {
@@ -332,6 +595,7 @@ function getStreamingSentimentAnalysis(text) {
         }
     })
     .catch(error => {
+        if (error.name === 'AbortError') return; // Superseded by a newer request
         // Hide loading spinner
         sentimentLoadingSpinner.classList.add('d-none');
         console.error('Error:', error);
@@ -339,6 +603,26 @@ function getStreamingSentimentAnalysis(text) {
     });
 }
 
+// Show the local sentiment estimate in the mood badge of the sentiment panel
+function showSentimentMood(estimate) {
+    const labels = {
+        very_negative: 'Muy negativo',
+        negative: 'Negativo',
+        neutral: 'Neutral',
+        positive: 'Positivo',
+        very_positive: 'Muy positivo'
+    };
+    const colors = {
+        very_negative: 'bg-danger',
+        negative: 'bg-warning',
+        neutral: 'bg-secondary',
+        positive: 'bg-success',
+        very_positive: 'bg-success'
+    };
+    sentimentMood.className = `badge ms-2 ${colors[estimate.overall]}`;
+    sentimentMood.textContent = `${labels[estimate.overall]} (${estimate.score.toFixed(2)})`;
+}
+
 // Analyze sentiment from the conversation (manual trigger)
 function analyzeSentiment() {
     if (!transcriptionText || transcriptionText.trim() === '') {
@@ -346,7 +630,7 @@ function analyzeSentiment() {
         return;
     }
     
-    getStreamingSentimentAnalysis(transcriptionText);
+    getStreamingSentimentAnalysis('', true);
 }
 
 // Generate call summary
@@ -359,26 +643,29 @@ function generateSummary() {
     // Show loading spinner
     summaryLoadingSpinner.classList.remove('d-none');
     
+    // The summary is pushed back on the session channel when it is ready
+    if (sendChannelMessage({ type: 'summary' })) return;
+    
+    requestSummary(false);
+}
+
+// Request the call summary; the precomputed one may arrive before the last stretch is merged
+function requestSummary(wait) {
     fetch('/generate-summary', {
         method: 'POST',
         headers: {
             'Content-Type': 'application/json',
         },
-        body: JSON.stringify({ text: transcriptionText })
+        // No text: the server summarizes the transcript stored for the session
+        body: JSON.stringify({ wait: wait })
     })
     .then(response => response.json())
     .then(data => {
-        // Hide loading spinner
-        summaryLoadingSpinner.classList.add('d-none');
-        
-        if (data.success && data.call_summary) {
-            callSummary.textContent = data.call_summary;
-        } else if (data.error) {
-            console.error('Error generating summary:', data.error);
-            callSummary.textContent = `Error: ${data.error}`;
-        } else {
-            console.error('Unknown error generating summary:', data);
-            callSummary.textContent = 'No se pudo generar el resumen. Verifica la configuración de la API.';
+        showSummary(data);
+        if (!wait && data.freshness && !data.freshness.complete) {
+            // Show it at once and replace it when the rest of the call has been merged
+            summaryLoadingSpinner.classList.remove('d-none');
+            requestSummary(true);
         }
     })
     .catch(error => {
@@ -389,6 +676,22 @@ function generateSummary() {
     });
 }
 
+// Show a generated call summary
+function showSummary(data) {
+    // Hide loading spinner
+    summaryLoadingSpinner.classList.add('d-none');
+    
+    if (data.success && data.call_summary) {
+        callSummary.textContent = data.call_summary;
+    } else if (data.error) {
+        console.error('Error generating summary:', data.error);
+        callSummary.textContent = `Error: ${data.error}`;
+    } else {
+        console.error('Unknown error generating summary:', data);
+        callSummary.textContent = 'No se pudo generar el resumen. Verifica la configuración de la API.';
+    }
+}
+
 // Start new session
 function startNewSession() {
     fetch('/new-session', {
@@ -425,6 +728,9 @@ document.addEventListener('DOMContentLoaded', function() {
     // Initialize speech recognition
     initSpeechRecognition();
     
+    // Open the WebSocket channel of the session
+    openSessionChannel();
+    
     // Button event listeners for speech recognition
     startButton.addEventListener('click', startRecognition);
     stopButton.addEventListener('click', stopRecognition);
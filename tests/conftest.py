@@ -0,0 +1,8 @@
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Los servicios se importan como en la aplicación: desde src/ (from services.x import ...)
+sys.path.insert(0, os.path.join(ROOT, 'src'))
+# El servidor simulado de OpenAI de los benchmarks sirve también a las pruebas del backend local
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
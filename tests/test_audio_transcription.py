@@ -0,0 +1,147 @@
+"""Tests of the voice activity detector and the server-side audio transcriber."""
+import io
+import math
+import threading
+import time
+import wave
+from array import array
+
+import pytest
+
+from services.audio_transcription import (
+    DEFAULT_SAMPLE_RATE, SAMPLE_WIDTH, ASRBackend, AudioTranscriber, StubASRBackend, TranscriberBusyError,
+    VoiceActivityDetector, wav_to_pcm
+)
+
+
+def tone(seconds: float, amplitude: int = 8000, sample_rate: int = DEFAULT_SAMPLE_RATE) -> bytes:
+    """A 440 Hz tone as 16-bit mono PCM (loud enough to count as speech)."""
+    count = int(seconds * sample_rate)
+    return array('h', (int(amplitude * math.sin(2 * math.pi * 440 * i / sample_rate)) for i in range(count))).tobytes()
+
+
+def silence(seconds: float, sample_rate: int = DEFAULT_SAMPLE_RATE) -> bytes:
+    return b'\x00' * (int(seconds * sample_rate) * SAMPLE_WIDTH)
+
+
+def duration(pcm: bytes) -> float:
+    return len(pcm) / SAMPLE_WIDTH / DEFAULT_SAMPLE_RATE
+
+
+class BlockingBackend(ASRBackend):
+    """Backend whose transcriptions wait until the test releases them."""
+
+    name = 'blocking'
+
+    def __init__(self):
+        self.release = threading.Event()
+
+    def transcribe(self, pcm: bytes, sample_rate: int, language: str = 'es-ES') -> str:
+        self.release.wait(5)
+        return 'texto'
+
+
+def test_vad_ignores_silence():
+    vad = VoiceActivityDetector()
+    assert vad.feed(silence(2)) == []
+    assert not vad.in_speech
+    assert vad.flush() is None
+
+
+def test_vad_cuts_a_segment_after_the_silence():
+    vad = VoiceActivityDetector(end_silence_ms=600, pre_roll_ms=300)
+    segments = vad.feed(silence(0.5) + tone(1.0) + silence(1.0))
+    assert len(segments) == 1
+    # El segmento incluye la voz, el pre-roll y el silencio que lo cierra
+    assert 1.0 <= duration(segments[0]) <= 1.0 + 0.3 + 0.6 + 0.03
+    assert not vad.in_speech
+
+
+def test_vad_drops_clicks_shorter_than_min_speech():
+    vad = VoiceActivityDetector(min_speech_ms=250)
+    assert vad.feed(silence(0.3) + tone(0.12) + silence(1.0)) == []
+
+
+def test_vad_result_does_not_depend_on_chunk_boundaries():
+    audio = silence(0.3) + tone(0.8) + silence(0.8) + tone(0.5) + silence(0.8)
+    whole = VoiceActivityDetector().feed(audio)
+    chunked_vad = VoiceActivityDetector()
+    chunked = []
+    for offset in range(0, len(audio), 1234):
+        chunked += chunked_vad.feed(audio[offset:offset + 1234])
+    assert len(whole) == 2
+    assert chunked == whole
+
+
+def test_vad_flush_returns_the_segment_in_progress():
+    vad = VoiceActivityDetector()
+    assert vad.feed(tone(0.6)) == []
+    assert vad.in_speech
+    assert duration(vad.speech()) > 0.5
+    assert duration(vad.flush()) > 0.5
+    assert not vad.in_speech
+
+
+def test_vad_cuts_long_segments_at_max_length():
+    vad = VoiceActivityDetector(max_segment_s=1)
+    segments = vad.feed(tone(2.5))
+    assert len(segments) == 2
+    assert all(duration(segment) <= 1.0 for segment in segments)
+
+
+def test_wav_to_pcm_returns_the_frames_and_rate():
+    pcm = tone(0.1, sample_rate=8000)
+    buffer = io.BytesIO()
+    with wave.open(buffer, 'wb') as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(SAMPLE_WIDTH)
+        wav.setframerate(8000)
+        wav.writeframes(pcm)
+    assert wav_to_pcm(buffer.getvalue()) == (pcm, 8000)
+
+
+def test_stub_backend_describes_the_segment_or_returns_texts_in_turn():
+    assert StubASRBackend().transcribe(silence(1.5), DEFAULT_SAMPLE_RATE) == '[voz 1.5 s]'
+    backend = StubASRBackend(['uno', 'dos'])
+    assert [backend.transcribe(b'', DEFAULT_SAMPLE_RATE) for _ in range(3)] == ['uno', 'dos', 'uno']
+
+
+def test_transcriber_returns_the_final_segments_in_order():
+    transcriber = AudioTranscriber(StubASRBackend(['hola', 'quiero darme de baja']))
+    jobs = transcriber.feed('s1', tone(0.8) + silence(0.8) + tone(0.6), final=True)
+    assert jobs.result(timeout=5) == {'segments': ['hola', 'quiero darme de baja'], 'partial': ''}
+    stats = transcriber.get_stats()
+    assert stats['segments'] == 2
+    assert stats['backend'] == 'stub'
+    # El fragmento final cierra el flujo
+    assert stats['streams'] == 0
+
+
+def test_transcriber_keeps_state_between_chunks_of_a_stream():
+    transcriber = AudioTranscriber(StubASRBackend(['frase completa']), partial_interval=100)
+    assert transcriber.feed('s1', tone(0.5)).result(timeout=5) == {'segments': [], 'partial': ''}
+    assert transcriber.feed('s1', tone(0.5) + silence(0.8)).result(timeout=5)['segments'] == ['frase completa']
+
+
+def test_transcriber_sends_partials_of_the_speech_in_progress():
+    transcriber = AudioTranscriber(StubASRBackend(['parcial']), partial_interval=0.5)
+    result = transcriber.feed('s1', tone(1.0)).result(timeout=5)
+    assert result == {'segments': [], 'partial': 'parcial'}
+    assert transcriber.get_stats()['partials'] == 1
+
+
+def test_transcriber_refuses_audio_when_too_many_segments_are_pending():
+    backend = BlockingBackend()
+    transcriber = AudioTranscriber(backend, max_workers=1, max_pending=1)
+    jobs = transcriber.feed('s1', tone(0.6), final=True)
+    with pytest.raises(TranscriberBusyError):
+        transcriber.feed('s2', tone(0.6), final=True)
+    assert transcriber.get_stats()['busy_rejections'] == 1
+
+    backend.release.set()
+    assert jobs.result(timeout=5)['segments'] == ['texto']
+    # Con el segmento transcrito vuelve a aceptar audio (el contador baja en el callback del futuro)
+    deadline = time.time() + 5
+    while transcriber.get_stats()['pending'] and time.time() < deadline:
+        time.sleep(0.01)
+    assert transcriber.feed('s2', tone(0.6), final=True).result(timeout=5)['segments'] == ['texto']
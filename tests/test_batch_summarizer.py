@@ -0,0 +1,130 @@
+"""Tests of the offline batch summarizer: reading transcripts, resuming runs and retrying failed calls."""
+import asyncio
+import json
+import os
+
+import pytest
+from openai.openai_object import OpenAIObject
+
+from services.async_openai_service import AsyncOpenAIService
+from services.batch_summarizer import BatchSummarizer, load_transcripts
+from services.llm_backend import LLMBackend
+from services.upstream_scheduler import UpstreamScheduler
+
+
+class FakeBackend(LLMBackend):
+    """Answers every prompt with a summary; prompts containing 'FALLA' fail the first `failures` times."""
+
+    name = 'fake'
+
+    def __init__(self, failures=0):
+        self.failures = failures
+        self.calls = 0
+
+    def create(self, **params):
+        self.calls += 1
+        if 'FALLA' in params['messages'][-1]['content'] and self.failures:
+            self.failures -= 1
+            raise RuntimeError('caído')
+        return OpenAIObject.construct_from({
+            'model': params['model'],
+            'choices': [{'message': {'role': 'assistant', 'content': 'resumen'}, 'finish_reason': 'stop'}],
+            'usage': {'prompt_tokens': 40, 'completion_tokens': 10, 'total_tokens': 50},
+        })
+
+    async def acreate(self, **params):
+        return self.create(**params)
+
+
+@pytest.fixture(autouse=True)
+def single_summary(monkeypatch):
+    monkeypatch.setenv('MODEL_HEDGING', 'false')
+    monkeypatch.setenv('SUMMARY_PARALLEL', 'false')
+
+
+def run_batch(backend, out_dir, transcripts, force=False, **kwargs):
+    """Run a batch over the transcripts and return its stats and the summarizer."""
+    async def scenario():
+        service = AsyncOpenAIService(scheduler=UpstreamScheduler(rpm=1000, tpm=100000), backend=backend,
+                                     models=['a'])
+        try:
+            summarizer = BatchSummarizer(service, str(out_dir), concurrency=2, retry_delay=0, **kwargs)
+            return await summarizer.run(transcripts, force=force), summarizer
+        finally:
+            await service.close()
+
+    return asyncio.run(scenario())
+
+
+def test_load_transcripts_reads_text_json_and_jsonl(tmp_path):
+    (tmp_path / 'uno.txt').write_text('Hola, quiero darme de baja.', encoding='utf-8')
+    (tmp_path / 'dos.json').write_text(json.dumps({
+        'segments': [{'seq': 2, 'text': 'mundo'}, {'seq': 1, 'text': 'hola'}],
+    }), encoding='utf-8')
+    (tmp_path / 'lote.jsonl').write_text('\n'.join([
+        json.dumps({'id': 'c-1', 'text': 'primera llamada'}),
+        '{dañada',
+        json.dumps({'transcript': 'segunda llamada'}),
+    ]), encoding='utf-8')
+    (tmp_path / 'notas.csv').write_text('ignorado', encoding='utf-8')
+
+    calls = {call_id: text for call_id, _, text in load_transcripts([str(tmp_path)])}
+
+    # La línea dañada se salta y las demás conservan su número de línea
+    assert calls == {
+        'uno': 'Hola, quiero darme de baja.',
+        'dos': 'hola mundo',
+        'c-1': 'primera llamada',
+        'lote-3': 'segunda llamada',
+    }
+
+
+def test_run_writes_one_file_per_call_and_skips_empty_ones(tmp_path):
+    backend = FakeBackend()
+    stats, summarizer = run_batch(backend, tmp_path / 'out', [
+        ('a/1', 'origen', 'El cliente pide una demostración.'),
+        ('2', 'origen', 'Pregunta por la factura.'),
+        ('3', 'origen', '   '),
+    ])
+
+    assert stats['summarized'] == 2 and stats['empty'] == 1 and stats['failed'] == 0
+    with open(summarizer.output_path('a/1'), encoding='utf-8') as f:
+        record = json.load(f)
+    assert record['id'] == 'a/1' and record['call_summary'] == 'resumen' and record['map_reduce'] is None
+    # El identificador se sanea para el nombre del fichero
+    assert os.path.basename(summarizer.output_path('a/1')) == 'a_1.json'
+    assert sorted(os.listdir(tmp_path / 'out')) == ['2.json', 'a_1.json']
+
+
+def test_a_rerun_skips_summarized_calls_unless_forced(tmp_path):
+    transcripts = [('1', 'origen', 'El cliente pide una demostración.')]
+    run_batch(FakeBackend(), tmp_path, transcripts)
+
+    backend = FakeBackend()
+    stats, _ = run_batch(backend, tmp_path, transcripts)
+    assert stats['skipped'] == 1 and stats['summarized'] == 0 and backend.calls == 0
+
+    stats, _ = run_batch(backend, tmp_path, transcripts, force=True)
+    assert stats['summarized'] == 1 and backend.calls == 1
+
+
+def test_failed_calls_are_retried_and_left_without_output(tmp_path):
+    transcripts = [('1', 'origen', 'FALLA una vez')]
+    stats, _ = run_batch(FakeBackend(failures=1), tmp_path, transcripts, retries=1)
+    assert stats['summarized'] == 1 and stats['failed'] == 0
+
+    stats, summarizer = run_batch(FakeBackend(failures=5), tmp_path, [('2', 'origen', 'FALLA siempre')], retries=1)
+    assert stats['failed'] == 1
+    assert summarizer.failures[0][0] == '2'
+    # Sin fichero de salida: la próxima ejecución vuelve a intentarlo
+    assert not os.path.exists(summarizer.output_path('2'))
+
+
+def test_long_calls_are_summarized_by_map_reduce(tmp_path):
+    text = ' '.join(f'El cliente menciona el punto número {i} de su contrato.' for i in range(60))
+    stats, summarizer = run_batch(FakeBackend(), tmp_path, [('larga', 'origen', text)], chunk_tokens=200)
+
+    assert stats['map_reduce'] == 1 and stats['calls'] > 1
+    with open(summarizer.output_path('larga'), encoding='utf-8') as f:
+        record = json.load(f)
+    assert record['map_reduce']['chunks'] > 1
@@ -0,0 +1,118 @@
+"""Tests of the benchmark harness: the mock OpenAI server and the load driver's latency report."""
+import asyncio
+import json
+import random
+
+import pytest
+from aiohttp.test_utils import TestClient, TestServer
+
+from load_test import Recorder, percentile
+from mock_openai_server import MockOpenAI, create_app, parse_distribution
+
+
+def make_mock(**kwargs):
+    options = dict(latency={'*': parse_distribution('fixed:0')}, token_interval=0, rate_429=0.0, rate_5xx=0.0,
+                   embedding_dim=8)
+    options.update(kwargs)
+    return MockOpenAI(**options)
+
+
+def with_client(mock, scenario):
+    """Run a scenario against the mock server and return its result."""
+    async def run():
+        async with TestClient(TestServer(create_app(mock))) as client:
+            return await scenario(client)
+
+    return asyncio.run(run())
+
+
+def test_parse_distribution():
+    rng = random.Random(0)
+    assert parse_distribution('fixed:250')(rng) == 0.25
+    assert all(0.1 <= parse_distribution('uniform:100,200')(rng) <= 0.2 for _ in range(50))
+    assert all(parse_distribution('normal:10,50')(rng) >= 0 for _ in range(50))
+    assert parse_distribution('lognormal:600,0.4')(rng) > 0
+    for spec in ('fixed', 'uniform:1', 'lognormal:0,1', 'gamma:1,2', 'fixed:abc'):
+        with pytest.raises(ValueError):
+            parse_distribution(spec)
+
+
+def test_chat_completion_and_counters():
+    mock = make_mock()
+
+    async def scenario(client):
+        response = await client.post('/v1/chat/completions', json={
+            'model': 'gpt-4', 'messages': [{'role': 'user', 'content': 'hola'}], 'max_tokens': 20,
+        })
+        body = await response.json()
+        stats = await (await client.get('/stats')).json()
+        await client.post('/stats/reset')
+        reset = await (await client.get('/stats')).json()
+        return response.status, body, stats, reset
+
+    status, body, stats, reset = with_client(mock, scenario)
+    assert status == 200
+    assert body['choices'][0]['message']['content']
+    assert body['usage']['total_tokens'] == body['usage']['prompt_tokens'] + body['usage']['completion_tokens']
+    assert stats['calls'] == 1 and stats['by_endpoint_model'] == {'chat:gpt-4': 1}
+    assert stats['by_status'] == {'200': 1}
+    assert reset['calls'] == 0
+
+
+def test_combined_analysis_prompt_gets_schema_json():
+    mock = make_mock()
+
+    async def scenario(client):
+        response = await client.post('/v1/chat/completions', json={'model': 'gpt-4', 'messages': [
+            {'role': 'system', 'content': 'Responde con JSON con "suggested_response".'},
+            {'role': 'user', 'content': 'hola'},
+        ]})
+        return await response.json()
+
+    analysis = json.loads(with_client(mock, scenario)['choices'][0]['message']['content'])
+    assert set(analysis) == {'interpretation', 'suggested_response', 'sentiment'}
+
+
+def test_streaming_sends_chunks_and_done():
+    mock = make_mock()
+
+    async def scenario(client):
+        response = await client.post('/v1/chat/completions', json={
+            'model': 'gpt-4', 'messages': [{'role': 'user', 'content': 'hola'}], 'stream': True, 'max_tokens': 8,
+        })
+        return await response.text()
+
+    events = [line[len('data: '):] for line in with_client(mock, scenario).splitlines() if line.startswith('data: ')]
+    assert events[-1] == '[DONE]'
+    chunks = [json.loads(event) for event in events[:-1]]
+    assert chunks[-1]['choices'][0]['finish_reason'] == 'stop'
+    assert ''.join(chunk['choices'][0]['delta'].get('content', '') for chunk in chunks).strip()
+
+
+def test_injected_errors():
+    async def scenario(client):
+        response = await client.post('/v1/embeddings', json={'input': ['uno', 'dos']})
+        return response.status, response.headers.get('Retry-After'), await (await client.get('/stats')).json()
+
+    status, retry_after, stats = with_client(make_mock(rate_429=1.0), scenario)
+    assert status == 429 and retry_after == '1'
+    assert stats['by_status'] == {'429': 1}
+
+    status, _, _ = with_client(make_mock(rate_5xx=1.0), scenario)
+    assert status in (500, 502, 503)
+
+
+def test_percentiles_and_report():
+    values = sorted(i / 1000 for i in range(1, 101))
+    assert percentile(values, 50) == 0.05
+    assert percentile(values, 99) == 0.099
+    assert percentile([], 95) == 0.0
+
+    recorder = Recorder()
+    for value in values:
+        recorder.record('/ask', value, ok=True)
+    recorder.record('/ask', 0.2, ok=False)
+    recorder.record('/ask', 0.01, ok=False, superseded=True)
+    report = recorder.report(elapsed=10)['/ask']
+    assert report['requests'] == 102 and report['errors'] == 1 and report['superseded'] == 1
+    assert report['max_ms'] == 200
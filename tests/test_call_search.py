@@ -0,0 +1,84 @@
+"""Tests of the call search index: analysis, incremental indexing of long calls and search."""
+import time
+
+import pytest
+
+from services.call_search import CallSearchIndex, analyze, detect_language
+
+SEGMENT = 'El cliente dice que la factura de este mes tiene un cargo que no reconoce'
+
+
+@pytest.fixture
+def index(tmp_path):
+    return CallSearchIndex(str(tmp_path / 'calls.db'), flush_interval=0, reindex_interval=3600)
+
+
+def session_ids(result):
+    return [call['session_id'] for call in result['results']]
+
+
+def test_words_are_folded_stemmed_and_stop_words_dropped():
+    assert analyze('Las ofertas de facturación', 'es') == analyze('oferta factura', 'es')
+    assert detect_language(SEGMENT) == 'es'
+    assert detect_language('hola') is None
+
+
+def test_a_new_call_is_searchable_after_its_first_flush(index):
+    index.add_segments('s1', [SEGMENT])
+    assert index.wait(5)
+    assert session_ids(index.search('factura')) == ['s1']
+    assert index.search('oferta')['results'] == []
+
+
+def test_a_long_call_is_not_reindexed_on_every_flush(index):
+    flushes = 64
+    for seq in range(flushes):
+        index.add_segments('s1', [f'{SEGMENT} {seq}'])
+        assert index.wait(5)
+    stats = index.get_stats()
+    assert stats['updates'] == flushes
+    # Solo se reindexa cuando lo que espera duplica lo indexado: unas pocas veces, no una por escritura
+    assert stats['reindexes'] <= 8
+    assert index.get('s1')['transcript'].count(SEGMENT) == flushes
+
+
+def test_finishing_a_call_indexes_its_waiting_segments(index):
+    for seq in range(4):
+        index.add_segments('s1', [SEGMENT])
+        assert index.wait(5)
+    index.add_segments('s1', ['y pregunta por la portabilidad'])
+    assert index.wait(5)
+    assert index.search('portabilidad')['results'] == []
+    assert index.get_stats()['waiting_calls'] == 1
+
+    index.finish('s1')
+    assert index.wait(5)
+    assert session_ids(index.search('portabilidad')) == ['s1']
+    assert index.get_stats()['waiting_calls'] == 0
+
+
+def test_waiting_segments_are_indexed_after_the_reindex_interval(tmp_path):
+    index = CallSearchIndex(str(tmp_path / 'calls.db'), flush_interval=0, reindex_interval=0.2)
+    index.add_segments('s1', [SEGMENT, SEGMENT])
+    assert index.wait(5)
+    index.add_segments('s1', ['y pregunta por la portabilidad'])
+    deadline = time.time() + 5
+    while not index.search('portabilidad')['results']:
+        assert time.time() < deadline, "los segmentos no se han indexado"
+        time.sleep(0.05)
+
+
+def test_summary_and_replaced_transcript_are_indexed_at_once(index):
+    index.add_segments('s1', [SEGMENT, SEGMENT])
+    assert index.wait(5)
+    index.add_segments('s1', ['y quiere la portabilidad'])
+    index.set_summary('s1', 'Reclamación por un cargo desconocido en la factura')
+    assert index.wait(5)
+    assert session_ids(index.search('reclamación', field='summary')) == ['s1']
+    assert session_ids(index.search('portabilidad')) == ['s1']
+
+    index.replace_transcript('s1', 'El cliente quiere darse de baja del servicio')
+    assert index.wait(5)
+    assert index.search('portabilidad')['results'] == []
+    assert session_ids(index.search('baja')) == ['s1']
+    assert index.get('s1')['transcript'] == 'El cliente quiere darse de baja del servicio'
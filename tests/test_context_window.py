@@ -0,0 +1,59 @@
+"""Tests of the token-budgeted conversation context: digest folding, budget and resets."""
+import pytest
+
+from services.context_window import ConversationContextManager
+from services.token_counter import estimate_tokens
+
+SENTENCE = 'El cliente pregunta otra vez por las condiciones del contrato anual. '
+
+
+def test_short_transcripts_are_sent_verbatim():
+    manager = ConversationContextManager(token_budget=300, digest_max_tokens=50, digest_refresh_tokens=100)
+    session = {}
+    assert manager.build_context(session, SENTENCE * 2) == SENTENCE * 2
+    assert session['context']['digest'] == ''
+
+
+def test_long_transcripts_stay_within_the_budget_and_keep_the_latest_text():
+    manager = ConversationContextManager(token_budget=300, digest_max_tokens=50, digest_refresh_tokens=100)
+    session = {}
+    transcript = ''
+    for turn in range(60):
+        transcript += f'Turno {turn}. {SENTENCE}'
+        context = manager.build_context(session, transcript)
+        assert estimate_tokens(context) <= 300 + 20
+    assert context.startswith('[Resumen de la conversación anterior]')
+    assert context.rstrip().endswith(SENTENCE.strip())
+    assert 'Turno 59.' in context
+
+
+def test_the_digest_is_only_refreshed_when_the_recent_text_no_longer_fits():
+    calls = []
+
+    def digest_fn(previous, older_text, language, max_tokens):
+        calls.append(older_text)
+        return 'Resumen breve.'
+
+    manager = ConversationContextManager(token_budget=300, digest_max_tokens=50, digest_refresh_tokens=100,
+                                         digest_fn=digest_fn)
+    session = {}
+    transcript = ''
+    for turn in range(60):
+        transcript += f'Turno {turn}. {SENTENCE}'
+        manager.build_context(session, transcript)
+    # Cada actualización deja sitio para unos 100 tokens de conversación nueva
+    assert 0 < len(calls) <= estimate_tokens(transcript) // 100 + 1
+    assert 'Resumen breve.' in manager.build_context(session, transcript)
+
+
+def test_a_changed_transcript_resets_the_state():
+    manager = ConversationContextManager(token_budget=300, digest_max_tokens=50, digest_refresh_tokens=100)
+    session = {}
+    manager.build_context(session, SENTENCE * 40)
+    assert session['context']['digested_chars'] > 0
+    assert manager.build_context(session, 'Empezamos de nuevo.') == 'Empezamos de nuevo.'
+
+
+def test_the_budget_must_leave_room_for_the_recent_text():
+    with pytest.raises(ValueError):
+        ConversationContextManager(token_budget=300, digest_max_tokens=200, digest_refresh_tokens=100)
@@ -0,0 +1,93 @@
+"""Tests of the combined conversation analysis and its fallback to separate calls."""
+import asyncio
+import json
+
+import pytest
+from openai.openai_object import OpenAIObject
+
+from services.async_openai_service import AsyncOpenAIService
+from services.conversation_analysis import AnalysisParseError, parse_analysis
+from services.llm_backend import LLMBackend
+from services.openai_service import OpenAIService
+from services.upstream_scheduler import UpstreamScheduler
+
+ANALYSIS = {
+    'interpretation': 'El cliente pregunta por el precio.',
+    'suggested_response': 'Explicarle las tarifas disponibles.',
+    'sentiment': {
+        'overall': 'positive',
+        'emotions': ['curiosidad'],
+        'interest_level': 'high',
+        'concerns': ['precio'],
+        'recommendation': 'Ofrecer una demostración.',
+    },
+}
+
+
+class FakeBackend(LLMBackend):
+    """Answers every call with content, failing on the models listed in failing."""
+
+    name = 'fake'
+
+    def __init__(self, content, failing=()):
+        self.content = content
+        self.failing = set(failing)
+        self.calls = []
+
+    def create(self, **params):
+        self.calls.append(params['model'])
+        if params['model'] in self.failing:
+            raise RuntimeError(f"{params['model']} caído")
+        return OpenAIObject.construct_from({
+            'model': params['model'],
+            'choices': [{'message': {'role': 'assistant', 'content': self.content}, 'finish_reason': 'stop'}],
+            'usage': {'prompt_tokens': 40, 'completion_tokens': 10, 'total_tokens': 50},
+        })
+
+    async def acreate(self, **params):
+        return self.create(**params)
+
+
+@pytest.fixture(autouse=True)
+def no_hedging(monkeypatch):
+    monkeypatch.setenv('MODEL_HEDGING', 'false')
+
+
+def make_service(backend, service_class=OpenAIService):
+    return service_class(scheduler=UpstreamScheduler(rpm=1000, tpm=100000), backend=backend, models=['a', 'b'])
+
+
+def test_parse_analysis_accepts_fenced_json_and_rejects_schema_errors():
+    assert parse_analysis('```json\n' + json.dumps(ANALYSIS) + '\n```') == ANALYSIS
+    with pytest.raises(AnalysisParseError):
+        parse_analysis(json.dumps(dict(ANALYSIS, sentiment=dict(ANALYSIS['sentiment'], overall='feliz'))))
+
+
+def test_a_valid_combined_analysis_takes_one_call():
+    backend = FakeBackend(json.dumps(ANALYSIS))
+    result = make_service(backend).analyze_conversation('¿Cuánto cuesta?')
+    assert result['success'] and not result['fallback']
+    assert backend.calls == ['a']
+
+
+def test_unparseable_output_falls_back_to_separate_calls():
+    backend = FakeBackend('esto no es JSON')
+    result = make_service(backend).analyze_conversation('¿Cuánto cuesta?')
+    assert result['success'] and result['fallback']
+    assert backend.calls == ['a', 'a', 'a']
+
+
+def test_a_failed_completion_is_returned_without_more_calls():
+    backend = FakeBackend(json.dumps(ANALYSIS), failing={'a', 'b'})
+    result = make_service(backend).analyze_conversation('¿Cuánto cuesta?')
+    assert not result['success']
+    # Ni sugerencias ni sentimiento: los dos modelos ya han fallado
+    assert backend.calls == ['a', 'b']
+
+
+def test_async_failed_completion_is_returned_without_more_calls():
+    backend = FakeBackend(json.dumps(ANALYSIS), failing={'a', 'b'})
+    service = make_service(backend, AsyncOpenAIService)
+    result = asyncio.run(service.analyze_conversation('¿Cuánto cuesta?'))
+    assert not result['success']
+    assert backend.calls == ['a', 'b']
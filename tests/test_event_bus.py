@@ -0,0 +1,109 @@
+"""Tests of the live session event bus: coalescing, dropping slow subscribers and snapshots."""
+import asyncio
+import json
+import time
+
+from services.event_bus import BusEvent, SessionEventBus, Subscription
+
+
+def payloads(events):
+    return [(event.type, json.loads(event.data).get('text')) for event in events]
+
+
+def wait_for(condition, timeout: float = 5):
+    deadline = time.time() + timeout
+    while not condition():
+        assert time.time() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def test_pending_interim_events_are_coalesced():
+    subscription = Subscription(None, max_queue=10, loop=None)
+    subscription.deliver(BusEvent('s1', 'interim', {'text': 'ho'}))
+    subscription.deliver(BusEvent('s1', 'transcript', {'text': 'hola'}))
+    subscription.deliver(BusEvent('s1', 'interim', {'text': 'hola que'}))
+    subscription.deliver(BusEvent('s2', 'interim', {'text': 'otra sesión'}))
+    # El último interim de cada sesión sustituye al pendiente y pasa al final
+    assert payloads(subscription.get(timeout=0)) == [
+        ('transcript', 'hola'), ('interim', 'hola que'), ('interim', 'otra sesión')
+    ]
+    assert subscription.coalesced == 1
+
+
+def test_other_events_are_never_coalesced():
+    subscription = Subscription(None, max_queue=10, loop=None)
+    for text in ('uno', 'dos'):
+        subscription.deliver(BusEvent('s1', 'transcript', {'text': text}))
+    assert payloads(subscription.get(timeout=0)) == [('transcript', 'uno'), ('transcript', 'dos')]
+
+
+def test_a_full_queue_drops_the_subscriber():
+    subscription = Subscription(None, max_queue=2, loop=None)
+    assert subscription.deliver(BusEvent('s1', 'transcript', {'text': 'uno'}))
+    assert subscription.deliver(BusEvent('s1', 'transcript', {'text': 'dos'}))
+    assert not subscription.deliver(BusEvent('s1', 'transcript', {'text': 'tres'}))
+    assert subscription.dropped and subscription.closed
+    assert subscription.get(timeout=0) == []
+    assert not subscription.deliver(BusEvent('s1', 'transcript', {'text': 'cuatro'}))
+
+
+def test_subscribers_only_receive_the_sessions_they_watch():
+    bus = SessionEventBus()
+    watching = bus.subscribe(['s1'])
+    everything = bus.subscribe()
+    bus.publish('s2', 'transcript', {'text': 'de s2'})
+    bus.publish('s1', 'transcript', {'text': 'de s1'})
+    bus.publish(None, 'transcript', {'text': 'sin sesión'})
+    wait_for(lambda: bus.get_stats()['published'] == 2)
+    assert payloads(watching.get(timeout=1)) == [('transcript', 'de s1')]
+    assert payloads(everything.get(timeout=1)) == [('transcript', 'de s2'), ('transcript', 'de s1')]
+
+
+def test_new_subscribers_receive_the_latest_state_of_the_session():
+    bus = SessionEventBus()
+    bus.publish('s1', 'interim', {'text': 'primero'})
+    bus.publish('s1', 'interim', {'text': 'último'})
+    bus.publish('s1', 'transcript', {'text': 'no se repite'})
+    wait_for(lambda: bus.get_stats()['published'] == 3)
+    subscription = bus.subscribe(['s1'])
+    assert payloads(subscription.snapshot) == [('interim', 'último')]
+    assert subscription.get(timeout=0) == []
+
+
+def test_watching_more_sessions_than_max_queue_does_not_drop_a_new_subscriber():
+    bus = SessionEventBus(max_queue=10)
+    for seq in range(70):
+        for event_type in ('interim', 'suggestions', 'sentiment', 'summary'):
+            bus.publish(f's{seq}', event_type, {'text': str(seq)})
+    wait_for(lambda: bus.get_stats()['published'] == 280)
+    everything = bus.subscribe()
+    assert not everything.dropped
+    assert len(everything.snapshot) == 280
+    bus.publish('s0', 'transcript', {'text': 'nuevo'})
+    assert payloads(everything.get(timeout=1)) == [('transcript', 'nuevo')]
+
+
+def test_the_bus_drops_a_lagging_subscriber_without_affecting_the_others():
+    bus = SessionEventBus(max_queue=3)
+    slow = bus.subscribe(['s1'])
+    fast = bus.subscribe(['s1'])
+    received = []
+    for seq in range(5):
+        bus.publish('s1', 'transcript', {'text': str(seq)})
+        wait_for(lambda: bus.get_stats()['published'] == seq + 1)
+        received += payloads(fast.get(timeout=1))
+    assert received == [('transcript', str(seq)) for seq in range(5)]
+    assert slow.dropped
+    stats = bus.get_stats()
+    assert stats['dropped_subscribers'] == 1
+    assert stats['subscribers'] == 1
+
+
+def test_async_subscribers_are_woken_from_the_broadcaster_thread():
+    async def scenario():
+        bus = SessionEventBus()
+        subscription = bus.subscribe(['s1'], loop=asyncio.get_running_loop())
+        bus.publish('s1', 'summary', {'text': 'resumen'})
+        return await subscription.aget(timeout=5)
+
+    assert payloads(asyncio.run(scenario())) == [('summary', 'resumen')]
@@ -0,0 +1,60 @@
+"""Tests of the local knowledge index: chunking, building, loading and retrieval."""
+from services.knowledge_index import (
+    HashingEmbedder, KnowledgeIndex, KnowledgeRetriever, build_index, chunk_document, format_passages,
+    load_documents
+)
+from services.token_counter import count_tokens
+
+DOCUMENTS = [
+    ('docs/tarifas.md', 'La tarifa básica cuesta 20 euros al mes e incluye soporte por correo.\n\n'
+                        'La tarifa premium cuesta 50 euros al mes e incluye soporte telefónico.'),
+    ('docs/devoluciones.md', 'Las devoluciones se aceptan durante los 30 días siguientes a la compra.\n\n'
+                             'El reembolso se hace en la misma tarjeta en un plazo de cinco días.'),
+]
+
+
+def test_long_documents_are_chunked_with_overlap():
+    sentences = [f'La frase número {n} describe una condición del contrato.' for n in range(40)]
+    passages = chunk_document(' '.join(sentences), max_tokens=60, overlap_tokens=15)
+    assert len(passages) > 1
+    assert all(count_tokens(passage) <= 60 + 15 for passage in passages)
+    # La última frase de un fragmento se repite al comienzo del siguiente
+    assert passages[0].split('\n')[-1] in passages[1]
+
+
+def test_documents_are_loaded_from_directories(tmp_path):
+    (tmp_path / 'a.md').write_text('Uno', encoding='utf-8')
+    (tmp_path / 'sub').mkdir()
+    (tmp_path / 'sub' / 'b.txt').write_text('Dos', encoding='utf-8')
+    (tmp_path / 'c.pdf').write_bytes(b'%PDF')
+    assert [text for _, text in load_documents([str(tmp_path)])] == ['Uno', 'Dos']
+
+
+def test_questions_retrieve_the_passage_that_answers_them(tmp_path):
+    meta = build_index(DOCUMENTS, HashingEmbedder(dim=256), str(tmp_path), max_tokens=30, overlap_tokens=0)
+    assert meta['passages'] == 4 and meta['documents'] == 2
+
+    retriever = KnowledgeRetriever(KnowledgeIndex(str(tmp_path)), top_k=2, min_score=0.0)
+    passages, timing = retriever.retrieve('¿Cuánto cuesta la tarifa premium?')
+    assert 'premium' in passages[0]['text']
+    assert passages[0]['score'] >= passages[-1]['score']
+    assert timing['passages'] == len(passages)
+    assert format_passages(passages[:1]).startswith('[1] (tarifas.md)')
+
+
+def test_unrelated_questions_return_no_passages(tmp_path):
+    build_index(DOCUMENTS, HashingEmbedder(dim=256), str(tmp_path), max_tokens=30, overlap_tokens=0)
+    retriever = KnowledgeRetriever(KnowledgeIndex(str(tmp_path)), min_score=0.5)
+    assert retriever.retrieve('meteorología marciana')[0] == []
+
+
+def test_repeated_questions_reuse_their_embedding(tmp_path):
+    build_index(DOCUMENTS, HashingEmbedder(dim=256), str(tmp_path))
+    embedder = HashingEmbedder(dim=256)
+    calls = []
+    original = embedder.embed
+    embedder.embed = lambda texts: calls.append(texts) or original(texts)
+    retriever = KnowledgeRetriever(KnowledgeIndex(str(tmp_path)), embedder=embedder)
+    retriever.retrieve('¿Plazo de reembolso?')
+    retriever.retrieve('  ¿plazo de reembolso?')
+    assert len(calls) == 1
@@ -0,0 +1,108 @@
+"""Tests of the batching dispatcher of the local LLM backend."""
+import asyncio
+
+import openai
+import pytest
+from aiohttp.test_utils import TestServer
+from mock_openai_server import MockOpenAI, create_app, parse_distribution
+from openai.openai_object import OpenAIObject
+
+from services.llm_backend import BatchingDispatcher, LocalChatBackend
+
+
+def completion(params):
+    content = params['messages'][-1]['content']
+    return OpenAIObject.construct_from({
+        'model': params['model'],
+        'choices': [{'message': {'role': 'assistant', 'content': content.upper()}, 'finish_reason': 'stop'}],
+    })
+
+
+class FakeBatchBackend:
+    """Answers each prompt with its text in capitals after delay seconds, recording the batch sizes."""
+
+    name = 'fake'
+    timeout = 5
+
+    def __init__(self, delay: float = 0.0):
+        self.delay = delay
+        self.batches = []
+
+    def create_batch(self, batch):
+        self.batches.append(len(batch))
+        return [completion(params) for params in batch]
+
+    async def acreate_batch(self, batch):
+        self.batches.append(len(batch))
+        await asyncio.sleep(self.delay)
+        return [completion(params) for params in batch]
+
+
+def request(text: str):
+    return {'model': 'm', 'messages': [{'role': 'user', 'content': text}]}
+
+
+def answer(response) -> str:
+    return response.choices[0].message.content
+
+
+def test_concurrent_requests_share_a_batch_and_get_their_own_result():
+    backend = FakeBatchBackend()
+    dispatcher = BatchingDispatcher(backend, max_batch_size=3, max_wait=0.5)
+
+    async def scenario():
+        return await asyncio.gather(*(dispatcher.acreate(**request(text)) for text in ('uno', 'dos', 'tres')))
+
+    assert [answer(response) for response in asyncio.run(scenario())] == ['UNO', 'DOS', 'TRES']
+    assert backend.batches == [3]
+    assert dispatcher.get_stats()['mean_batch'] == 3
+
+
+def test_cancelling_the_first_request_does_not_strand_the_rest():
+    backend = FakeBatchBackend(delay=0.05)
+    dispatcher = BatchingDispatcher(backend, max_batch_size=8, max_wait=0.1)
+
+    async def scenario():
+        first = asyncio.ensure_future(dispatcher.acreate(**request('uno')))
+        await asyncio.sleep(0)
+        second = asyncio.ensure_future(dispatcher.acreate(**request('dos')))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        # Una petición posterior con la misma clave no se queda colgada en el lote abandonado
+        third = await asyncio.wait_for(dispatcher.acreate(**request('tres')), 2)
+        return await asyncio.wait_for(second, 2), third
+
+    second, third = asyncio.run(scenario())
+    assert answer(second) == 'DOS'
+    assert answer(third) == 'TRES'
+    assert dispatcher._open == {}
+
+
+def test_requests_give_up_on_a_batch_that_does_not_answer():
+    dispatcher = BatchingDispatcher(FakeBatchBackend(delay=1), max_batch_size=2, max_wait=0.01, timeout=0.1)
+
+    with pytest.raises(openai.error.Timeout):
+        asyncio.run(dispatcher.acreate(**request('uno')))
+
+
+def test_batches_against_the_mock_server():
+    mock = MockOpenAI({'*': parse_distribution('fixed:10')}, token_interval=0, rate_429=0, rate_5xx=0,
+                      embedding_dim=8)
+
+    async def scenario():
+        server = TestServer(create_app(mock))
+        await server.start_server()
+        dispatcher = BatchingDispatcher(LocalChatBackend(str(server.make_url('/v1'))), max_batch_size=4,
+                                        max_wait=0.5)
+        try:
+            return await asyncio.gather(*(dispatcher.acreate(**request(text)) for text in ('a', 'b', 'c', 'd')))
+        finally:
+            await dispatcher.close()
+            await server.close()
+
+    responses = asyncio.run(scenario())
+    assert all(answer(response) for response in responses)
+    assert responses[0].usage.estimated
+    assert mock.stats()['by_endpoint_model'] == {'completions:m': 1}
@@ -0,0 +1,45 @@
+"""Tests of the Prometheus metrics: route and upstream observations, tokens and store statistics."""
+import pytest
+
+from services.metrics import Metrics
+from services.response_cache import ResponseCache
+from services.session_store import create_session_store
+
+pytest.importorskip('prometheus_client')
+
+
+def sample(metrics, name, **labels):
+    return metrics.registry.get_sample_value(name, labels)
+
+
+def test_routes_upstream_calls_and_tokens_are_recorded():
+    metrics = Metrics()
+    metrics.observe_request('/get-suggestions', 'POST', 200, 0.12)
+    metrics.observe_routing('suggestions', {
+        'reason': 'fallback',
+        'attempts': [{'model': 'a', 'latency_ms': 50, 'ok': False}, {'model': 'b', 'latency_ms': 400, 'ok': True}],
+    })
+    metrics.count_tokens('suggestions', 'b', {'prompt_tokens': 40, 'completion_tokens': 10})
+
+    assert sample(metrics, 'assistant_request_duration_seconds_count',
+                  route='/get-suggestions', method='POST', status='200') == 1
+    assert sample(metrics, 'assistant_upstream_errors_total', model='a', method='suggestions') == 1
+    assert sample(metrics, 'assistant_upstream_duration_seconds_sum', model='b', method='suggestions') == 0.4
+    assert sample(metrics, 'assistant_fallbacks_total', method='suggestions', reason='fallback') == 1
+    assert sample(metrics, 'assistant_tokens_total', method='suggestions', model='b', kind='completion') == 10
+
+
+def test_store_statistics_are_read_at_scrape_time():
+    metrics = Metrics()
+    store = create_session_store('memory')
+    cache = ResponseCache()
+    metrics.register_stores(session_store=store, response_cache=cache)
+
+    store.create('s1', {'transcript': ''})
+    cache.get('suggestions', 'clave')
+    assert sample(metrics, 'assistant_active_sessions') == 1
+    assert sample(metrics, 'assistant_cache_lookups_total', method='suggestions', result='miss') == 1
+
+    body, content_type = metrics.exposition()
+    assert b'assistant_active_sessions 1.0' in body
+    assert content_type.startswith('text/plain')
@@ -0,0 +1,132 @@
+"""Tests of the model router: fallback, hedging, circuit breaking and cancellation."""
+import asyncio
+import time
+
+import pytest
+
+from services.model_router import OPEN, AllModelsFailedError, ModelRouter, RequestNotSentError
+
+
+def test_falls_back_to_the_next_model_on_error():
+    def fn(model):
+        if model == 'a':
+            raise RuntimeError('caído')
+        return model
+
+    result, routing = ModelRouter(['a', 'b'], hedging=False).call(fn)
+    assert result == 'b'
+    assert routing['reason'] == 'fallback'
+    assert [attempt['ok'] for attempt in routing['attempts']] == [False, True]
+
+
+def test_raises_when_every_model_fails():
+    def fn(model):
+        raise RuntimeError(f'{model} caído')
+
+    with pytest.raises(AllModelsFailedError) as info:
+        ModelRouter(['a', 'b'], hedging=False).call(fn)
+    assert info.value.last_error == 'b caído'
+    assert len(info.value.routing['attempts']) == 2
+
+
+def test_a_slow_model_is_hedged_and_the_fastest_answer_wins():
+    def fn(model):
+        time.sleep(1.0 if model == 'a' else 0.01)
+        return model
+
+    router = ModelRouter(['a', 'b'], hedge_after=0.05)
+    started = time.time()
+    result, routing = router.call(fn)
+    assert result == 'b' and routing['reason'] == 'hedge'
+    assert time.time() - started < 0.5
+
+
+def test_requests_that_may_not_be_hedged_wait_for_the_primary():
+    def fn(model):
+        time.sleep(0.2 if model == 'a' else 0.01)
+        return model
+
+    result, routing = ModelRouter(['a', 'b'], hedge_after=0.05).call(fn, hedge=False)
+    assert result == 'a' and routing['reason'] == 'primary'
+
+
+def test_consecutive_failures_open_the_circuit_until_the_cooldown():
+    router = ModelRouter(['a', 'b'], hedging=False, failure_threshold=2, cooldown=0.2)
+    calls = []
+
+    def fn(model):
+        calls.append(model)
+        if model == 'a':
+            raise RuntimeError('caído')
+        return model
+
+    router.call(fn)
+    router.call(fn)
+    assert router.get_stats()['a']['state'] == OPEN
+    calls.clear()
+    _, routing = router.call(fn)
+    assert calls == ['b'] and routing['skipped'] == ['a']
+
+    # Pasado el cooldown se deja pasar una sonda; si responde, el circuito se cierra
+    time.sleep(0.25)
+    _, routing = router.call(lambda model: model)
+    assert routing['model'] == 'a'
+    assert router.get_stats()['a']['state'] == 'closed'
+
+
+def test_requests_never_sent_do_not_open_the_circuit():
+    router = ModelRouter(['a', 'b'], hedging=False, failure_threshold=1)
+
+    def fn(model):
+        if model == 'a':
+            raise RequestNotSentError('no admitida')
+        return model
+
+    assert router.call(fn)[0] == 'b'
+    assert router.get_stats()['a']['state'] == 'closed'
+
+
+def test_async_hedging_cancels_the_losing_call():
+    cancelled = []
+
+    async def fn(model):
+        try:
+            await asyncio.sleep(1.0 if model == 'a' else 0.01)
+        except asyncio.CancelledError:
+            cancelled.append(model)
+            raise
+        return model
+
+    async def scenario():
+        result = await ModelRouter(['a', 'b'], hedge_after=0.05).acall(fn)
+        await asyncio.sleep(0)
+        return result, list(cancelled)
+
+    (result, routing), cancelled_before_exit = asyncio.run(scenario())
+    assert result == 'b' and routing['reason'] == 'hedge'
+    assert cancelled_before_exit == ['a']
+
+
+def test_cancelling_an_async_call_cancels_every_attempt():
+    started, cancelled = [], []
+
+    async def fn(model):
+        started.append(model)
+        try:
+            await asyncio.sleep(5)
+        except asyncio.CancelledError:
+            cancelled.append(model)
+            raise
+
+    async def scenario():
+        call = asyncio.ensure_future(ModelRouter(['a', 'b'], hedge_after=0.02).acall(fn))
+        await asyncio.sleep(0.1)
+        call.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await call
+        await asyncio.sleep(0)
+        # Antes de que el cierre del bucle cancele lo que quede
+        return sorted(cancelled)
+
+    assert asyncio.run(scenario()) == ['a', 'b']
+    assert started == ['a', 'b']
@@ -0,0 +1,42 @@
+"""Tests of the prompt registry: language resolution, stable prefixes and token accounting."""
+import pytest
+
+from services.prompt_registry import MESSAGE_OVERHEAD_TOKENS, PromptRegistry
+from services.prompt_templates import PROMPT_TEMPLATES
+from services.token_counter import count_tokens
+
+
+def test_variants_resolve_by_language_code_then_default():
+    registry = PromptRegistry()
+    assert registry.get('suggestions', 'es-ES').language == 'es'
+    assert registry.get('suggestions', 'fr-CA').language == 'fr'
+    assert registry.get('suggestions', 'de-DE').language == 'default'
+    with pytest.raises(KeyError):
+        registry.get('inexistente')
+
+
+def test_the_system_message_is_a_stable_prefix_across_calls():
+    registry = PromptRegistry()
+    first = registry.render('suggestions', 'es-ES', conversation_text='hola')
+    second = registry.render('suggestions', 'es-ES', conversation_text='hola, quería información')
+    assert first.messages[0]['content'] is second.messages[0]['content']
+    assert first.messages[1]['content'].endswith('hola')
+
+
+def test_token_counts_cover_the_messages_and_the_completion():
+    registry = PromptRegistry()
+    prompt = registry.render('summary', conversation_text='El cliente pide una demostración.', max_tokens=300)
+    template = registry.get('summary')
+    expected = (count_tokens(template.system) + count_tokens(prompt.messages[1]['content'])
+                + 2 * MESSAGE_OVERHEAD_TOKENS)
+    assert prompt.prompt_tokens == expected
+    assert prompt.required_tokens == expected + 300
+
+
+def test_every_template_renders_and_reports_its_version():
+    registry = PromptRegistry()
+    versions = registry.versions()
+    assert set(versions) == set(PROMPT_TEMPLATES)
+    for name, definition in PROMPT_TEMPLATES.items():
+        for language, variant in definition['languages'].items():
+            assert versions[name][language] == variant['version']
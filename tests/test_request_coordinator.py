@@ -0,0 +1,131 @@
+"""Tests of the per-session request coordinator: single-flight joins and latest-wins supersession."""
+import asyncio
+import threading
+import time
+
+import pytest
+
+from services.model_router import ModelRouter
+from services.request_coordinator import RequestCoordinator, RequestSupersededError
+
+
+def test_without_a_session_every_call_runs():
+    coordinator = RequestCoordinator()
+    assert coordinator.run(None, 'suggestions', 'hola', lambda: 1) == 1
+    assert coordinator.get_stats()['started'] == 0
+
+
+def test_duplicate_requests_share_the_in_flight_call():
+    coordinator = RequestCoordinator()
+    release = threading.Event()
+    calls = []
+
+    def fn():
+        calls.append(1)
+        release.wait(5)
+        return 'respuesta'
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(coordinator.run('s1', 'suggestions', 'hola', fn)))
+               for _ in range(3)]
+    for thread in threads:
+        thread.start()
+        time.sleep(0.05)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert results == ['respuesta'] * 3
+    assert len(calls) == 1
+    assert coordinator.get_stats() == {'started': 1, 'joined': 2, 'superseded': 0, 'in_flight': 0}
+
+
+def test_a_newer_request_supersedes_the_in_flight_one():
+    coordinator = RequestCoordinator()
+    release = threading.Event()
+    outcome = {}
+
+    def old():
+        try:
+            outcome['old'] = coordinator.run('s1', 'suggestions', 'hola', lambda: release.wait(5) and 'vieja')
+        except RequestSupersededError as e:
+            outcome['old'] = e
+
+    thread = threading.Thread(target=old)
+    thread.start()
+    time.sleep(0.05)
+    assert coordinator.run('s1', 'suggestions', 'hola, quiero', lambda: 'nueva') == 'nueva'
+    release.set()
+    thread.join(5)
+
+    # La respuesta antigua se descarta aunque la llamada terminase bien
+    assert isinstance(outcome['old'], RequestSupersededError)
+    assert coordinator.get_stats()['superseded'] == 1
+
+
+def test_other_endpoints_and_sessions_are_independent():
+    coordinator = RequestCoordinator()
+    ticket = coordinator.start('s1', 'suggestions', 'hola')
+    coordinator.start('s1', 'sentiment', 'hola')
+    coordinator.start('s2', 'suggestions', 'hola')
+    assert not ticket.is_cancelled
+    assert coordinator.get_stats()['in_flight'] == 3
+
+
+def test_a_new_stream_cancels_the_previous_one():
+    coordinator = RequestCoordinator()
+    first = coordinator.start('s1', 'suggestions', 'hola')
+    second = coordinator.start('s1', 'suggestions', 'hola')
+    assert first.is_cancelled and not second.is_cancelled
+    coordinator.release('s1', 'suggestions', first)
+    # Liberar el ticket antiguo no libera el hueco del nuevo
+    assert coordinator.get_stats()['in_flight'] == 1
+    coordinator.release('s1', 'suggestions', second)
+    assert coordinator.get_stats()['in_flight'] == 0
+
+
+def test_an_error_is_raised_and_frees_the_slot():
+    coordinator = RequestCoordinator()
+
+    def fn():
+        raise RuntimeError('caído')
+
+    with pytest.raises(RuntimeError):
+        coordinator.run('s1', 'suggestions', 'hola', fn)
+    assert coordinator.get_stats()['in_flight'] == 0
+
+
+def test_async_duplicates_share_the_call_and_a_newer_request_cancels_it_upstream():
+    coordinator = RequestCoordinator()
+    router = ModelRouter(['a', 'b'], hedge_after=0.02)
+    started, cancelled = [], []
+
+    async def request(text):
+        async def call_model(model):
+            started.append(text)
+            try:
+                await asyncio.sleep(0.3)
+            except asyncio.CancelledError:
+                cancelled.append(text)
+                raise
+            return model
+
+        result, _ = await router.acall(call_model)
+        return f'{text}:{result}'
+
+    async def scenario():
+        old = [asyncio.ensure_future(coordinator.arun('s1', 'suggestions', 'hola', lambda: request('hola')))
+               for _ in range(2)]
+        await asyncio.sleep(0.1)
+        # Petición primaria y hedge en curso cuando llega la nueva
+        assert started == ['hola', 'hola']
+        new = await coordinator.arun('s1', 'suggestions', 'hola, quiero', lambda: request('hola, quiero'))
+        outcomes = await asyncio.gather(*old, return_exceptions=True)
+        return new, outcomes, list(cancelled)
+
+    new, outcomes, cancelled_before_exit = asyncio.run(scenario())
+    assert new.startswith('hola, quiero:')
+    assert all(isinstance(outcome, RequestSupersededError) for outcome in outcomes)
+    # Las llamadas al modelo de la petición sustituida se cancelan en vez de terminar en segundo plano
+    assert cancelled_before_exit.count('hola') == 2
+    assert coordinator.get_stats()['joined'] == 1
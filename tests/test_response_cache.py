@@ -0,0 +1,76 @@
+"""Tests of the LRU/TTL response cache and its use in front of the completion calls."""
+import time
+
+from openai.openai_object import OpenAIObject
+
+from services.llm_backend import LLMBackend
+from services.openai_service import OpenAIService
+from services.response_cache import ResponseCache
+from services.upstream_scheduler import UpstreamScheduler
+
+
+class FakeBackend(LLMBackend):
+    """Answers every call with the same suggestion, counting the calls."""
+
+    name = 'fake'
+
+    def __init__(self):
+        self.calls = 0
+
+    def create(self, **params):
+        self.calls += 1
+        return OpenAIObject.construct_from({
+            'model': params['model'],
+            'choices': [{'message': {'role': 'assistant', 'content': 'Sugerencia'}, 'finish_reason': 'stop'}],
+            'usage': {'prompt_tokens': 40, 'completion_tokens': 10, 'total_tokens': 50},
+        })
+
+    async def acreate(self, **params):
+        return self.create(**params)
+
+
+def key(text, method='suggestions'):
+    return ResponseCache.make_key(method, ['a'], 'es-ES', text, {'temperature': 0.7})
+
+
+def test_keys_ignore_case_and_whitespace_but_not_the_models():
+    assert key('Hola,  ¿qué tal?') == key('hola, ¿qué tal? ')
+    assert key('hola') != ResponseCache.make_key('suggestions', ['b'], 'es-ES', 'hola', {'temperature': 0.7})
+
+
+def test_least_recently_used_entries_are_evicted():
+    cache = ResponseCache(max_entries=2)
+    cache.set('suggestions', key('uno'), {'n': 1})
+    cache.set('suggestions', key('dos'), {'n': 2})
+    assert cache.get('suggestions', key('uno')) == {'n': 1}
+    cache.set('suggestions', key('tres'), {'n': 3})
+    assert cache.get('suggestions', key('dos')) is None
+    assert cache.get_stats()['methods']['suggestions']['evictions'] == 1
+
+
+def test_entries_expire_after_the_ttl_of_their_method():
+    cache = ResponseCache(ttls={'suggestions': 0.05})
+    cache.set('suggestions', key('hola'), {'n': 1})
+    time.sleep(0.1)
+    assert cache.get('suggestions', key('hola')) is None
+    assert cache.get_stats()['methods']['suggestions']['expirations'] == 1
+
+
+def test_entries_survive_a_restart_with_a_db_path(tmp_path):
+    path = str(tmp_path / 'cache.db')
+    ResponseCache(db_path=path).set('question', key('hola', 'question'), {'answer': 'sí'})
+    assert ResponseCache(db_path=path).get('question', key('hola', 'question')) == {'answer': 'sí'}
+
+
+def test_the_service_answers_repeated_requests_from_the_cache(monkeypatch):
+    monkeypatch.setenv('MODEL_HEDGING', 'false')
+    backend = FakeBackend()
+    cache = ResponseCache()
+    service = OpenAIService(cache=cache, scheduler=UpstreamScheduler(rpm=1000, tpm=100000),
+                            backend=backend, models=['a'])
+
+    first = service.get_suggestions('Hola, quería información')
+    second = service.get_suggestions('hola,   quería información')
+    assert first['success'] and second['suggestions'] == first['suggestions']
+    assert backend.calls == 1
+    assert cache.get_stats()['hits'] == 1
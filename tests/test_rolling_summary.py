@@ -0,0 +1,139 @@
+"""Tests of the rolling call summary: when updates are due and how long backlogs are folded."""
+import asyncio
+import threading
+import time
+
+from openai.openai_object import OpenAIObject
+
+from services.llm_backend import LLMBackend
+from services.openai_service import OpenAIService
+from services.prompt_registry import PromptRegistry
+from services.rolling_summary import AsyncBackgroundSummarizer, BackgroundSummarizer, RollingSummaries
+from services.session_store import create_session_store
+from services.token_counter import count_tokens
+from services.transcript_log import SessionTranscripts, TranscriptLog, TranscriptSegments
+from services.upstream_scheduler import UpstreamScheduler
+
+SENTENCE = 'El cliente explica que la factura de este mes incluye un cargo que no reconoce.'
+
+
+def make_summaries(tmp_path, **options):
+    store = create_session_store('memory')
+    store.create('s1', {'transcript': '', 'start_time': '', 'client_info': {}})
+    transcripts = SessionTranscripts(store, TranscriptSegments(), TranscriptLog(str(tmp_path)))
+    return RollingSummaries(store, transcripts, **options), transcripts
+
+
+def fake_update(previous: str, new_text: str) -> dict:
+    return {'success': True, 'call_summary': previous + f'[{count_tokens(new_text)}]', 'model': 'fake'}
+
+
+def test_no_update_until_enough_new_text(tmp_path):
+    summaries, transcripts = make_summaries(tmp_path, refresh_tokens=50, min_interval=0)
+    transcripts.append('s1', [(0, SENTENCE)])
+    assert summaries.plan('s1') is None
+    job = summaries.plan('s1', final=True)
+    assert job['new_text'] == SENTENCE
+    assert summaries.is_updating('s1')
+
+
+def test_a_backlog_longer_than_max_tokens_is_folded_oldest_first(tmp_path):
+    summaries, transcripts = make_summaries(tmp_path, refresh_tokens=10, min_interval=0, max_tokens=60)
+    transcripts.append('s1', [(seq, SENTENCE) for seq in range(10)])
+    text = transcripts.text('s1')
+
+    job = summaries.plan('s1')
+    assert job is not None and job['partial']
+    assert count_tokens(job['new_text']) <= 60
+    assert text.startswith(job['new_text'])
+    assert job['new_text'].endswith('.')
+
+    # El resto se planifica al completar, sin liberar la sesión entre medias
+    next_job = summaries.complete(job, fake_update(job['previous'], job['new_text']))
+    assert next_job is not None
+    assert summaries.is_updating('s1')
+    assert text[job['covered_chars']:].strip().startswith(next_job['new_text'])
+
+
+def test_background_summarizer_catches_up_with_the_whole_backlog(tmp_path):
+    summaries, transcripts = make_summaries(tmp_path, refresh_tokens=10, min_interval=0, max_tokens=60)
+    transcripts.append('s1', [(seq, SENTENCE) for seq in range(10)])
+    background = BackgroundSummarizer(summaries, fake_update)
+    assert background.schedule('s1', final=True)
+    assert background.wait('s1', timeout=5)
+
+    snapshot = summaries.snapshot('s1')
+    assert snapshot['freshness']['complete']
+    assert snapshot['call_summary'].count('[') > 1
+    assert summaries.get_stats()['final_merges'] == snapshot['call_summary'].count('[')
+
+
+def test_wait_returns_as_soon_as_the_update_completes(tmp_path):
+    summaries, transcripts = make_summaries(tmp_path, refresh_tokens=10, min_interval=0)
+    transcripts.append('s1', [(0, SENTENCE)])
+    release = threading.Event()
+
+    def slow_update(previous, new_text):
+        release.wait(5)
+        return fake_update(previous, new_text)
+
+    background = BackgroundSummarizer(summaries, slow_update)
+    assert background.schedule('s1', final=True)
+    assert not background.wait('s1', timeout=0.05)
+    threading.Timer(0.02, release.set).start()
+    started = time.time()
+    assert background.wait('s1', timeout=5)
+    # Despierta al completarse la actualización, sin esperar a un sondeo periódico
+    assert time.time() - started < 0.09
+
+
+def test_async_wait_returns_when_the_update_completes(tmp_path):
+    summaries, transcripts = make_summaries(tmp_path, refresh_tokens=10, min_interval=0)
+    transcripts.append('s1', [(0, SENTENCE)])
+
+    async def update(previous, new_text):
+        await asyncio.sleep(0.05)
+        return fake_update(previous, new_text)
+
+    async def scenario():
+        background = AsyncBackgroundSummarizer(summaries, update)
+        assert await background.schedule('s1', final=True)
+        assert not await background.wait('s1', timeout=0.01)
+        return await background.wait('s1', timeout=5)
+
+    assert asyncio.run(scenario())
+    assert summaries.snapshot('s1')['freshness']['complete']
+
+
+class RecordingBackend(LLMBackend):
+    """Answers every call with a fixed summary, keeping the messages it was sent."""
+
+    name = 'fake'
+
+    def __init__(self):
+        self.messages = []
+
+    def create(self, **params):
+        self.messages.append(params['messages'])
+        return OpenAIObject.construct_from({
+            'model': params['model'],
+            'choices': [{'message': {'role': 'assistant', 'content': 'Resumen'}, 'finish_reason': 'stop'}],
+            'usage': {'prompt_tokens': 40, 'completion_tokens': 10, 'total_tokens': 50},
+        })
+
+    async def acreate(self, **params):
+        return self.create(**params)
+
+
+def test_every_background_update_runs_in_the_background_class(monkeypatch):
+    monkeypatch.setenv('MODEL_HEDGING', 'false')
+    scheduler = UpstreamScheduler(rpm=1000, tpm=100000)
+    backend = RecordingBackend()
+    service = OpenAIService(scheduler=scheduler, backend=backend, models=['a'])
+
+    assert service.update_call_summary('', SENTENCE)['success']
+    assert service.update_call_summary('Resumen', SENTENCE)['success']
+    classes = scheduler.get_stats()['classes']
+    assert classes['background']['admitted'] == 2 and classes['summary']['admitted'] == 0
+    # El primer tramo se resume con el mismo texto que el resumen normal
+    assert backend.messages[0] == PromptRegistry().render('summary', conversation_text=SENTENCE).messages
@@ -0,0 +1,77 @@
+"""Tests of the call summary generated as parallel sections, and its fallback to a single call."""
+import threading
+import time
+
+import pytest
+from openai.openai_object import OpenAIObject
+
+from services.llm_backend import LLMBackend
+from services.openai_service import OpenAIService
+from services.prompt_templates import SUMMARY_SECTIONS
+from services.upstream_scheduler import UpstreamScheduler
+
+TRANSCRIPT = 'El cliente quiere la tarifa premium pero le preocupa el precio. Pide una demostración.'
+
+
+class SectionBackend(LLMBackend):
+    """Answers each section prompt with its title after a delay; failing_section always fails."""
+
+    name = 'fake'
+
+    def __init__(self, delay=0.1, failing_section=None):
+        self.delay = delay
+        self.failing_section = failing_section
+        self.prompts = []
+        self._lock = threading.Lock()
+
+    def create(self, **params):
+        content = params['messages'][-1]['content']
+        with self._lock:
+            self.prompts.append(content)
+        time.sleep(self.delay)
+        section = next((s['title'] for s in SUMMARY_SECTIONS if f"Sección a redactar: {s['title']}." in content), None)
+        if section is not None and section == self.failing_section:
+            raise RuntimeError('caído')
+        return OpenAIObject.construct_from({
+            'model': params['model'],
+            'choices': [{'message': {'role': 'assistant', 'content': f'texto de {section or "todo"}'},
+                         'finish_reason': 'stop'}],
+            'usage': {'prompt_tokens': 40, 'completion_tokens': 10, 'total_tokens': 50},
+        })
+
+    async def acreate(self, **params):
+        return self.create(**params)
+
+
+@pytest.fixture(autouse=True)
+def parallel_summary(monkeypatch):
+    monkeypatch.setenv('MODEL_HEDGING', 'false')
+    monkeypatch.setenv('SUMMARY_PARALLEL', 'true')
+
+
+def make_service(backend):
+    return OpenAIService(scheduler=UpstreamScheduler(rpm=1000, tpm=100000), backend=backend, models=['a', 'b'])
+
+
+def test_sections_run_in_parallel_and_are_assembled_in_order():
+    backend = SectionBackend(delay=0.2)
+    started = time.time()
+    result = make_service(backend).generate_call_summary(TRANSCRIPT)
+
+    assert result['success']
+    assert time.time() - started < 0.2 * 3
+    assert result['call_summary'] == '\n\n'.join(
+        f"{index}. {section['title']}:\ntexto de {section['title']}" for index, section in enumerate(SUMMARY_SECTIONS, 1)
+    )
+    assert [timing['section'] for timing in result['sectioned']['sections']] == [s['key'] for s in SUMMARY_SECTIONS]
+    # Todas las secciones comparten el prefijo con la transcripción
+    assert len({prompt.split('Sección a redactar')[0] for prompt in backend.prompts}) == 1
+
+
+def test_a_failed_section_falls_back_to_a_single_summary():
+    backend = SectionBackend(delay=0, failing_section='OBJECIONES')
+    result = make_service(backend).generate_call_summary(TRANSCRIPT)
+
+    assert result['success'] and result['call_summary'] == 'texto de todo'
+    failed = [timing for timing in result['sectioned']['sections'] if not timing['ok']]
+    assert [timing['section'] for timing in failed] == ['objections']
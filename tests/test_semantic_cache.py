@@ -0,0 +1,51 @@
+"""Tests of the semantic answer cache: similarity hits, scopes, replacement, eviction and expiry."""
+import time
+
+from services.semantic_cache import SemanticAnswerCache
+
+QUESTION = '¿Cuál es el horario de atención al cliente?'
+
+
+def test_a_near_identical_question_gets_the_stored_answer():
+    cache = SemanticAnswerCache()
+    cache.store(QUESTION, 'v1', {'answer': 'De 9 a 18'})
+    hit, _ = cache.lookup('¿cuál es el horario de atención al cliente', 'v1')
+    assert hit['result'] == {'answer': 'De 9 a 18'} and hit['question'] == QUESTION
+    assert cache.lookup('¿Cómo cancelo mi suscripción?', 'v1')[0] is None
+    assert cache.get_stats()['hits'] == 1 and cache.get_stats()['misses'] == 1
+
+
+def test_answers_are_only_shared_within_their_scope():
+    cache = SemanticAnswerCache()
+    cache.store(QUESTION, 'v1', {'answer': 'De 9 a 18'})
+    assert cache.lookup(QUESTION, 'v2')[0] is None
+
+
+def test_a_near_duplicate_replaces_the_stored_entry():
+    cache = SemanticAnswerCache()
+    cache.store(QUESTION, 'v1', {'answer': 'De 9 a 18'})
+    cache.store(QUESTION + ' ', 'v1', {'answer': 'De 8 a 20'})
+    assert cache.get_stats()['size'] == 1
+    assert cache.lookup(QUESTION, 'v1')[0]['result'] == {'answer': 'De 8 a 20'}
+
+
+def test_the_least_recently_used_answer_is_evicted_when_full():
+    cache = SemanticAnswerCache(max_entries=2)
+    cache.store('¿Cuánto cuesta la tarifa básica?', 'v1', {'answer': '20'})
+    time.sleep(0.01)
+    cache.store('¿Cómo cancelo mi suscripción?', 'v1', {'answer': 'En la web'})
+    time.sleep(0.01)
+    cache.lookup('¿Cuánto cuesta la tarifa básica?', 'v1')
+    cache.store(QUESTION, 'v1', {'answer': 'De 9 a 18'})
+
+    assert cache.get_stats()['evictions'] == 1
+    assert cache.lookup('¿Cómo cancelo mi suscripción?', 'v1')[0] is None
+    assert cache.lookup('¿Cuánto cuesta la tarifa básica?', 'v1')[0] is not None
+
+
+def test_answers_expire_after_the_ttl():
+    cache = SemanticAnswerCache(ttl=0.05)
+    cache.store(QUESTION, 'v1', {'answer': 'De 9 a 18'})
+    time.sleep(0.1)
+    assert cache.lookup(QUESTION, 'v1')[0] is None
+    assert cache.get_stats()['expirations'] == 1 and cache.get_stats()['size'] == 0
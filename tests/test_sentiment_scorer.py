@@ -0,0 +1,64 @@
+"""Tests of the local sentiment scorer and its incremental state."""
+import pytest
+
+from services.sentiment_scorer import SentimentScorer
+
+
+@pytest.fixture
+def scorer():
+    return SentimentScorer(half_life_words=40)
+
+
+def test_positive_and_negative_texts(scorer):
+    positive = scorer.update(scorer.new_state(), 'estoy muy contento y satisfecho, gracias')
+    negative = scorer.update(scorer.new_state(), 'estoy furioso, es un desastre horrible')
+    assert positive['score'] > 0.3 and positive['overall'] in ('positive', 'very_positive')
+    assert negative['score'] < -0.3 and negative['overall'] in ('negative', 'very_negative')
+    assert 'enfado' in negative['emotions']
+
+
+def test_negation_flips_the_valence(scorer):
+    assert scorer.update(scorer.new_state(), 'no estoy contento')['score'] < 0
+
+
+def test_text_without_lexicon_words_is_neutral(scorer):
+    estimate = scorer.update(scorer.new_state(), 'hola buenos días')
+    assert estimate['score'] == 0.0
+    assert estimate['overall'] == 'neutral'
+    assert estimate['evidence'] == 0.0
+
+
+def test_text_already_scored_is_not_scored_again(scorer):
+    text = 'buenos días, estoy contento con el servicio pero la factura es un desastre'
+    state = scorer.new_state()
+    cut = text.index(' pero')
+    first = scorer.update(state, text[:cut])
+    assert scorer.update(state, text[:cut]) == first
+    incremental = scorer.update(state, text)
+    assert incremental['words'] == len(text.split())
+    assert incremental['score'] < first['score']
+    assert scorer.update(state, text) == incremental
+    assert state['offset'] == len(text)
+
+
+def test_interim_text_counts_but_is_not_kept(scorer):
+    state = scorer.new_state()
+    with_interim = scorer.update(state, 'estoy contento', interim='pero esto es un desastre horrible')
+    assert with_interim['score'] < scorer.update(scorer.new_state(), 'estoy contento')['score']
+    # El estado solo guarda el texto final: sin el interim vuelve a la estimación anterior
+    assert scorer.update(state, 'estoy contento') == scorer.update(scorer.new_state(), 'estoy contento')
+
+
+def test_a_reset_transcript_starts_over(scorer):
+    state = scorer.new_state()
+    scorer.update(state, 'estoy furioso, es un desastre horrible')
+    estimate = scorer.update(state, 'estoy muy contento')
+    assert estimate == scorer.update(scorer.new_state(), 'estoy muy contento')
+
+
+def test_older_text_weighs_less(scorer):
+    state = scorer.new_state()
+    angry = 'estoy furioso, es un desastre horrible'
+    scorer.update(state, angry)
+    later = angry + ' ' + ' '.join(['bueno'] * 80) + ' estoy contento'
+    assert scorer.update(state, later)['score'] > 0
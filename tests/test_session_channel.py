@@ -0,0 +1,85 @@
+"""Tests of the session channel: message validation, analysis scheduling and the aiohttp WebSocket route."""
+import asyncio
+import importlib
+import json
+
+import pytest
+
+from services.session_channel import AnalysisSchedule, ChannelMessageError, parse_message
+
+
+def test_parse_message_validates_each_type():
+    assert parse_message(json.dumps({'type': 'segment', 'seq': 3, 'text': 'hola'}))['seq'] == 3
+    assert parse_message('{"type": "ping"}') == {'type': 'ping'}
+    for raw in ('no es JSON', '{"type": "otro"}', '{"type": "segment", "seq": -1, "text": "hola"}',
+                '{"type": "segment", "seq": true, "text": "hola"}', '{"type": "interim", "text": 3}',
+                '{"type": "language"}'):
+        with pytest.raises(ChannelMessageError):
+            parse_message(raw)
+
+
+def test_a_final_segment_is_analyzed_shortly_after():
+    schedule = AnalysisSchedule(final_delay=0.3, interim_delay=1.0, min_interval=2.0)
+    assert schedule.due_in(0) is None
+    schedule.changed(10.0, final=True)
+    assert schedule.due_in(10.0) == pytest.approx(0.3)
+    # El texto provisional no retrasa un análisis ya pedido por un segmento final
+    schedule.changed(10.1, final=False)
+    assert schedule.due_in(10.1) == pytest.approx(0.2)
+
+
+def test_interim_text_is_analyzed_once_it_stops_changing():
+    schedule = AnalysisSchedule(final_delay=0.3, interim_delay=1.0, min_interval=0)
+    schedule.changed(0.0, final=False)
+    schedule.changed(0.5, final=False)
+    assert schedule.due_in(1.0) == pytest.approx(0.5)
+    assert schedule.due_in(1.5) == 0
+
+
+def test_a_single_analysis_runs_at_a_time_and_changes_meanwhile_run_next():
+    schedule = AnalysisSchedule(final_delay=0.3, interim_delay=1.0, min_interval=2.0)
+    schedule.changed(0.0, final=True)
+    schedule.start(0.3)
+    schedule.changed(0.5, final=True)
+    assert schedule.due_in(1.0) is None
+    schedule.finish()
+    # Respeta el intervalo mínimo desde el inicio del análisis anterior
+    assert schedule.due_in(1.0) == pytest.approx(1.3)
+
+
+@pytest.fixture(scope='module')
+def async_app(tmp_path_factory):
+    patch = pytest.MonkeyPatch()
+    patch.setenv('DATA_DIR', str(tmp_path_factory.mktemp('data')))
+    patch.setenv('TRACE_PROFILE_DIR', '')
+    patch.delenv('OPENAI_API_KEY', raising=False)
+    try:
+        yield importlib.import_module('async_main')
+    finally:
+        patch.undo()
+
+
+def test_a_summary_does_not_block_the_channel(async_app, monkeypatch):
+    from aiohttp import CookieJar
+    from aiohttp.test_utils import TestClient, TestServer
+
+    async def slow_summary(session_id):
+        await asyncio.sleep(0.3)
+        return {'success': True, 'call_summary': 'Resumen'}
+
+    monkeypatch.setattr(async_app, '_channel_summary', slow_summary)
+
+    async def scenario():
+        async with TestClient(TestServer(async_app.create_app()), cookie_jar=CookieJar(unsafe=True)) as client:
+            await client.post('/new-session')
+            ws = await client.ws_connect('/ws')
+            await ws.send_json({'type': 'summary'})
+            await ws.send_json({'type': 'segment', 'seq': 0, 'text': 'Hola, quería información.'})
+            received = [(await ws.receive_json(timeout=3))['type']]
+            while received[-1] != 'summary':
+                received.append((await ws.receive_json(timeout=3))['type'])
+            await ws.close()
+            return received
+
+    # El segmento se confirma mientras el resumen sigue generándose
+    assert asyncio.run(scenario())[0] == 'ack'
@@ -0,0 +1,75 @@
+"""Tests of the session stores: copies, idle expiry and eviction of the least recently used sessions."""
+import time
+
+import pytest
+
+from services.session_store import SQLiteSessionStore, create_session_store, session_size
+
+SESSION = {'transcript': 'hola ' * 20, 'start_time': '', 'client_info': {}}
+
+
+def test_sessions_are_returned_as_copies():
+    store = create_session_store('memory')
+    store.create('s1', SESSION)
+    store.get('s1')['transcript'] = 'cambiado'
+    assert store.get('s1')['transcript'] == SESSION['transcript']
+    assert store.update('s1', {'summary': 'resumen'})
+    assert store.get('s1')['summary'] == 'resumen'
+    assert not store.update('otra', {'summary': 'resumen'})
+
+
+def test_memory_store_evicts_the_least_recently_used_beyond_max_bytes():
+    store = create_session_store('memory', max_bytes=int(session_size(SESSION) * 2.5))
+    store.create('s1', SESSION)
+    store.create('s2', SESSION)
+    # Leer s1 la convierte en la más reciente: la expulsada es s2
+    assert store.get('s1') is not None
+    store.create('s3', SESSION)
+
+    assert 's1' in store and 's3' in store and 's2' not in store
+    stats = store.get_stats()
+    assert stats['evictions']['memory'] == 1
+    assert stats['bytes'] == session_size(SESSION) * 2
+
+
+def test_memory_store_expires_idle_sessions():
+    store = create_session_store('memory', idle_ttl=0.05)
+    store.create('s1', SESSION)
+    time.sleep(0.1)
+    assert store.get('s1') is None
+    assert store.get_stats()['evictions']['idle'] == 1
+    assert store.get_stats()['bytes'] == 0
+
+
+def test_sqlite_store_is_shared_and_evicts_beyond_max_bytes(tmp_path):
+    path = str(tmp_path / 'sessions.db')
+    size = session_size(SESSION)
+    writer = SQLiteSessionStore(path, max_bytes=int(size * 2.5), sweep_interval=0)
+    reader = SQLiteSessionStore(path, max_bytes=int(size * 2.5), sweep_interval=0)
+
+    writer.create('s1', SESSION)
+    assert reader.update('s1', {'summary': 'resumen'})
+    assert writer.get('s1')['summary'] == 'resumen'
+
+    time.sleep(0.01)
+    writer.create('s2', SESSION)
+    time.sleep(0.01)
+    writer.create('s3', SESSION)
+    assert reader.get('s1') is None and 's2' in reader and 's3' in reader
+    assert writer.get_stats()['evictions']['memory'] == 1
+
+
+def test_sqlite_store_expires_idle_sessions(tmp_path):
+    store = SQLiteSessionStore(str(tmp_path / 'sessions.db'), idle_ttl=0.05, sweep_interval=0)
+    store.create('s1', SESSION)
+    time.sleep(0.1)
+    assert store.get('s1') is None
+    store.create('s2', SESSION)
+    assert store.get_stats()['sessions'] == 1 and store.get_stats()['evictions']['idle'] == 1
+
+
+def test_unknown_backends_and_missing_paths_are_rejected():
+    with pytest.raises(ValueError):
+        create_session_store('redis')
+    with pytest.raises(ValueError):
+        create_session_store('sqlite')
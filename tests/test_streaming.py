@@ -0,0 +1,83 @@
+"""Tests of the token streaming of suggestions and answers, and its fallback between models."""
+import pytest
+from openai.openai_object import OpenAIObject
+
+from services.llm_backend import LLMBackend
+from services.openai_service import OpenAIService
+from services.upstream_scheduler import UpstreamScheduler
+
+
+def chunk(model, content=None, finish_reason=None):
+    return OpenAIObject.construct_from({
+        'model': model,
+        'choices': [{'delta': {'content': content} if content else {}, 'finish_reason': finish_reason}],
+    })
+
+
+class StreamingBackend(LLMBackend):
+    """Streams three tokens; models in failing fail at once, those in broken fail after the first token."""
+
+    name = 'fake'
+
+    def __init__(self, failing=(), broken=()):
+        self.failing = set(failing)
+        self.broken = set(broken)
+        self.calls = []
+
+    def create(self, **params):
+        model = params['model']
+        self.calls.append(model)
+        assert params['stream']
+        if model in self.failing:
+            raise RuntimeError(f'{model} caído')
+        return self._chunks(model)
+
+    def _chunks(self, model):
+        yield chunk(model, 'Pregunte ')
+        if model in self.broken:
+            raise RuntimeError('conexión cortada')
+        yield chunk(model, 'por el ')
+        yield chunk(model, 'presupuesto', finish_reason='stop')
+
+    async def acreate(self, **params):
+        raise NotImplementedError
+
+
+@pytest.fixture(autouse=True)
+def no_hedging(monkeypatch):
+    monkeypatch.setenv('MODEL_HEDGING', 'false')
+
+
+def make_service(backend):
+    return OpenAIService(scheduler=UpstreamScheduler(rpm=1000, tpm=100000), backend=backend, models=['a', 'b'])
+
+
+def test_tokens_are_streamed_and_end_with_a_done_event():
+    events = list(make_service(StreamingBackend()).stream_suggestions('Hola, quería información'))
+    assert ''.join(event['content'] for event in events if event['type'] == 'token') == 'Pregunte por el presupuesto'
+    done = events[-1]
+    assert done['type'] == 'done' and done['model'] == 'a' and done['finish_reason'] == 'stop'
+    assert done['usage']['completion_tokens'] == 3
+
+
+def test_a_model_failing_before_any_token_falls_back_to_the_next():
+    backend = StreamingBackend(failing={'a'})
+    events = list(make_service(backend).stream_answer_to_question('¿Cuál es el horario?'))
+    assert backend.calls == ['a', 'b']
+    assert events[-1]['type'] == 'done' and events[-1]['model'] == 'b'
+
+
+def test_a_stream_cut_after_its_first_token_is_not_retried():
+    backend = StreamingBackend(broken={'a'})
+    events = list(make_service(backend).stream_suggestions('Hola, quería información'))
+    # Ya se envió un token al cliente: otro modelo no puede continuar la respuesta
+    assert backend.calls == ['a']
+    assert [event['type'] for event in events] == ['token', 'error']
+    assert 'conexión cortada' in events[-1]['error']
+
+
+def test_empty_text_is_rejected_without_calling_a_model():
+    backend = StreamingBackend()
+    events = list(make_service(backend).stream_suggestions('   '))
+    assert events == [{'type': 'error', 'success': False, 'error': 'No se proporcionó texto para generar sugerencias'}]
+    assert backend.calls == []
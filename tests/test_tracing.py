@@ -0,0 +1,62 @@
+"""Tests of the request tracer: trace ids, span trees and the capture of slow requests."""
+import json
+import os
+import time
+
+from services.tracing import Tracer, record_span, span
+
+
+def test_the_trace_id_is_generated_by_the_server_and_the_client_id_kept_apart():
+    tracer = Tracer(profile_dir=None)
+    first = tracer.start('/suggestions', 'id-del-cliente')
+    tracer.finish(first, 200)
+    second = tracer.start('/suggestions', 'id-del-cliente')
+    tracer.finish(second, 200)
+
+    assert first.trace_id != 'id-del-cliente' and first.trace_id != second.trace_id
+    # Reenviar el mismo id no sustituye la traza de otra petición
+    assert tracer.get(first.trace_id)['client_id'] == 'id-del-cliente'
+    assert tracer.get('id-del-cliente') is None
+
+
+def test_a_malformed_client_id_is_dropped():
+    tracer = Tracer(profile_dir=None)
+    trace = tracer.start('/suggestions', '../../etc/passwd')
+    tracer.finish(trace, 200)
+    assert trace.client_id is None
+
+
+def test_spans_nest_under_the_request_and_show_in_server_timing():
+    tracer = Tracer(profile_dir=None)
+    trace = tracer.start('/suggestions')
+    with span('context'):
+        with span('prompt', template='suggestions'):
+            pass
+    record_span('model', time.time(), 0.01, model='a')
+    tracer.finish(trace, 200)
+
+    spans = tracer.get(trace.trace_id)['spans']
+    assert [child['name'] for child in spans['children']] == ['context', 'model']
+    assert spans['children'][0]['children'][0]['attrs'] == {'template': 'suggestions'}
+    assert trace.server_timing().startswith('0-context;dur=')
+
+
+def test_spans_outside_a_request_do_nothing():
+    with span('context') as current:
+        assert current is None
+
+
+def test_slow_requests_are_written_to_the_profile_dir(tmp_path):
+    tracer = Tracer(slow_ms=10, profile_dir=str(tmp_path), sample_interval=0.01)
+    trace = tracer.start('/summary')
+    time.sleep(0.05)
+    tracer.finish(trace, 200)
+
+    path = tmp_path / f'{trace.trace_id}.json'
+    deadline = time.time() + 2
+    while not path.exists() and time.time() < deadline:
+        time.sleep(0.01)
+    assert json.loads(path.read_text())['route'] == '/summary'
+    stats = tracer.get_stats()
+    assert stats['slow'] == 1 and stats['recent_slow'][0]['trace_id'] == trace.trace_id
+    assert os.listdir(tmp_path) == [path.name]
@@ -0,0 +1,73 @@
+"""Tests of the transcript segments: the on-disk log, deduplication and reloading by another worker."""
+import os
+from datetime import date
+
+from services.session_store import create_session_store
+from services.transcript_log import (
+    RECORD_HEADER, SessionTranscripts, TranscriptLog, TranscriptSegments, parse_segments
+)
+
+
+def test_log_round_trips_segments_per_session(tmp_path):
+    log = TranscriptLog(str(tmp_path))
+    log.append('s1', [(0, 'hola'), (1, '¿qué tal?')])
+    log.append('s2', [(0, 'buenos días')])
+    log.append('s1', [(1, '¿qué tal está?')])
+
+    assert log.read_segments('s1') == [(0, 'hola'), (1, '¿qué tal está?')]
+    assert log.read_day(date.today()) == {
+        's1': [(0, 'hola'), (1, '¿qué tal está?')],
+        's2': [(0, 'buenos días')],
+    }
+    assert [record[0] for record in log.iter_records(date.today(), 's2')] == ['s2']
+
+
+def test_a_truncated_record_ends_the_scan(tmp_path):
+    log = TranscriptLog(str(tmp_path))
+    log.append('s1', [(0, 'hola'), (1, 'adiós')])
+    path = os.path.join(str(tmp_path), os.listdir(str(tmp_path))[0])
+    # Simula una escritura a medias del último registro
+    os.truncate(path, os.path.getsize(path) - 2)
+    assert log.read_segments('s1') == [(0, 'hola')]
+    assert RECORD_HEADER.size < os.path.getsize(path)
+
+
+def test_segments_are_deduplicated_and_ordered_by_seq():
+    segments = TranscriptSegments()
+    first = segments.append('s1', [(0, 'hola'), (2, 'tres')])
+    assert first['next_seq'] == 1 and first['last_seq'] == 2
+    second = segments.append('s1', [(1, 'dos'), (2, 'tres otra vez')])
+    assert second['accepted'] == [(1, 'dos')] and second['duplicates'] == [2]
+    assert second['next_seq'] == 3
+    assert segments.text('s1') == 'hola dos tres'
+
+
+def test_only_the_most_recent_sessions_are_kept_in_memory():
+    segments = TranscriptSegments(max_sessions=2)
+    for session_id in ('s1', 's2', 's3'):
+        segments.append(session_id, [(0, session_id)])
+    assert segments.last_seq('s1') is None and segments.text('s3') == 's3'
+
+
+def test_parse_segments_rejects_malformed_values():
+    assert parse_segments([{'seq': 0, 'text': ' hola '}]) == [(0, 'hola')]
+    assert parse_segments({'seq': 0, 'text': 'hola'}) is None
+    assert parse_segments([{'seq': True, 'text': 'hola'}]) is None
+    assert parse_segments([{'seq': -1, 'text': 'hola'}]) is None
+    assert parse_segments([{'seq': 0, 'text': 3}]) is None
+
+
+def test_another_worker_reloads_the_transcript_from_the_log(tmp_path):
+    store = create_session_store('sqlite', db_path=str(tmp_path / 'sessions.db'))
+    store.create('s1', {'transcript': '', 'start_time': '', 'client_info': {}})
+    log = TranscriptLog(str(tmp_path / 'transcripts'))
+    worker_a = SessionTranscripts(store, TranscriptSegments(), log)
+    worker_b = SessionTranscripts(store, TranscriptSegments(), log)
+
+    worker_a.append('s1', [(0, 'hola')])
+    worker_b.append('s1', [(1, 'quería información')])
+    assert worker_a.text('s1') == 'hola quería información'
+
+    # Tras un reinicio de la transcripción, lo anterior deja de contar
+    worker_b.append('s1', [(0, 'empezamos de nuevo')], reset=True)
+    assert worker_a.text('s1') == 'empezamos de nuevo'
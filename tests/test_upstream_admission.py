@@ -0,0 +1,95 @@
+"""Tests of the admission of every upstream attempt (fallbacks included) and the settling of its tokens."""
+import asyncio
+
+import pytest
+from openai.openai_object import OpenAIObject
+
+from services.async_openai_service import AsyncOpenAIService
+from services.llm_backend import LLMBackend
+from services.openai_service import OpenAIService
+from services.upstream_scheduler import UpstreamScheduler
+
+TPM = 100000
+
+
+class FakeBackend(LLMBackend):
+    """Fails on the models listed in failing and answers on the others, reporting 50 tokens used."""
+
+    name = 'fake'
+
+    def __init__(self, failing=()):
+        self.failing = set(failing)
+        self.calls = []
+
+    def create(self, **params):
+        self.calls.append(params['model'])
+        if params['model'] in self.failing:
+            raise RuntimeError(f"{params['model']} caído")
+        return OpenAIObject.construct_from({
+            'model': params['model'],
+            'choices': [{'message': {'role': 'assistant', 'content': 'respuesta'}, 'finish_reason': 'stop'}],
+            'usage': {'prompt_tokens': 40, 'completion_tokens': 10, 'total_tokens': 50},
+        })
+
+    async def acreate(self, **params):
+        return self.create(**params)
+
+
+@pytest.fixture(autouse=True)
+def no_hedging(monkeypatch):
+    monkeypatch.setenv('MODEL_HEDGING', 'false')
+
+
+def test_every_attempt_is_admitted_and_settled(monkeypatch):
+    scheduler = UpstreamScheduler(rpm=1000, tpm=TPM)
+    backend = FakeBackend(failing={'a'})
+    service = OpenAIService(scheduler=scheduler, backend=backend, models=['a', 'b'])
+
+    result = service.get_answer_to_question('¿Cuál es el horario de atención?')
+    assert result['success'] and result['model'] == 'b'
+    assert backend.calls == ['a', 'b']
+    assert scheduler.get_stats()['classes']['question']['admitted'] == 2
+    # El intento fallido devuelve su reserva y el correcto solo cuenta lo que usó
+    assert scheduler._tokens.level == pytest.approx(TPM - 50, abs=5)
+
+
+def test_reserved_tokens_are_returned_when_every_model_fails():
+    scheduler = UpstreamScheduler(rpm=1000, tpm=TPM)
+    service = OpenAIService(scheduler=scheduler, backend=FakeBackend(failing={'a', 'b'}), models=['a', 'b'])
+
+    result = service.get_answer_to_question('¿Cuál es el horario de atención?')
+    assert not result['success']
+    assert scheduler.get_stats()['classes']['question']['admitted'] == 2
+    assert scheduler._tokens.level == pytest.approx(TPM, abs=5)
+
+
+def test_async_attempts_are_admitted_and_settled():
+    scheduler = UpstreamScheduler(rpm=1000, tpm=TPM)
+    backend = FakeBackend(failing={'a'})
+
+    async def scenario():
+        service = AsyncOpenAIService(scheduler=scheduler, backend=backend, models=['a', 'b'])
+        try:
+            return await service.get_answer_to_question('¿Cuál es el horario de atención?')
+        finally:
+            await service.close()
+
+    result = asyncio.run(scenario())
+    assert result['success'] and result['model'] == 'b'
+    assert scheduler.get_stats()['classes']['question']['admitted'] == 2
+    assert scheduler._tokens.level == pytest.approx(TPM - 50, abs=5)
+
+
+def test_a_cancelled_request_leaves_the_queue():
+    scheduler = UpstreamScheduler(rpm=1)
+
+    async def scenario():
+        await scheduler.aacquire(0)
+        waiting = asyncio.ensure_future(scheduler.aacquire(0))
+        await asyncio.sleep(0.05)
+        waiting.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiting
+
+    asyncio.run(scenario())
+    assert scheduler.get_stats()['classes']['question']['waiting'] == 0